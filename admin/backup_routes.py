@@ -3,7 +3,7 @@ import pathlib
 import subprocess
 from datetime import datetime
 
-from flask import jsonify, send_file
+from flask import jsonify, request, send_file
 from auth import permission_required
 from utils.backup_safety import resolve_safe_backup_path
 from utils.mysql_auth import mysqldump_credentials
@@ -18,14 +18,48 @@ from services.members_service import (
 _BACKUPS_DIR = pathlib.Path(__file__).resolve().parent.parent / 'backups'
 
 
+def _create_incremental_backup():
+    """Backup tăng dần vào _BACKUPS_DIR (base + các file chỉ chứa dòng đổi)."""
+    from scripts.backup_database import create_backup as _create_backup
+
+    result = _create_backup(backup_dir=str(_BACKUPS_DIR), mode='incremental')
+    if not result['success']:
+        return jsonify({
+            'success': False,
+            'error': f"Lỗi tạo backup: {result.get('error')}"
+        }), 500
+    backup_filename = result['backup_filename']
+    download_url = f'/admin/api/backup/download/{backup_filename}'
+    log_activity(
+        'BACKUP_CREATE_ADMIN',
+        target_type='Backup',
+        target_id=backup_filename,
+        after_data={'download_url': download_url, 'mode': result['mode'], 'file_size': result['file_size']},
+    )
+    return jsonify({
+        'success': True,
+        'message': 'Backup thành công',
+        'filename': backup_filename,
+        'download_url': download_url,
+        'mode': result['mode'],
+        'chain': result['chain'],
+    })
+
+
 def register_admin_backup_create_route(app):
     """create_backup — từ admin_routes.py (url_map #94)"""
 
     @app.route('/admin/api/backup', methods=['POST'])
     @permission_required('canViewDashboard')
     def create_backup():
-        """API: Tạo backup database"""
+        """API: Tạo backup database (mode=incremental: file tăng dần qua engine Python)"""
         try:
+            mode = (request.get_json(silent=True) or {}).get('mode') or request.args.get('mode') or 'full'
+            if mode == 'incremental':
+                return _create_incremental_backup()
+            if mode != 'full':
+                return jsonify({'success': False, 'error': 'mode phải là full hoặc incremental'}), 400
+
             db_host = os.getenv('DB_HOST', 'localhost')
             db_user = os.getenv('DB_USER', 'root')
             db_password = os.getenv('DB_PASSWORD', '')
@@ -106,7 +140,7 @@ def register_admin_backup_admin_route(app):
 
         Chống path traversal qua helper `resolve_safe_backup_path` (allowlist
         regex + secure_filename + realpath/commonpath check). Mọi input không
-        phải `tbqc_backup_YYYYMMDD_HHMMSS.sql` → 400, không đụng filesystem.
+        phải `tbqc_backup_YYYYMMDD_HHMMSS[_incNNN].sql[.gz|.zst]` → 400, không đụng filesystem.
         """
         candidate = resolve_safe_backup_path(filename, str(_BACKUPS_DIR))
         if candidate is None:
@@ -1,7 +1,7 @@
-import csv
 import pathlib
 from flask import request, jsonify
 from auth import permission_required
+from services.sheet_store import get_sheet_store
 
 # Repo root — tính từ admin/ lên một cấp để định vị CSV files tại root
 _BASE_DIR = pathlib.Path(__file__).resolve().parent.parent
@@ -17,41 +17,32 @@ def _get_csv_filename(sheet_name):
 
 
 def _read_csv_file(sheet_name):
-    """Đọc dữ liệu từ file CSV"""
+    """Đọc dữ liệu từ file CSV (qua SheetStore: chỉ parse lại khi file đổi)"""
     filename = _get_csv_filename(sheet_name)
     if not filename:
         return None, 'Sheet không hợp lệ'
 
-    filepath = _BASE_DIR / filename
-    if not filepath.exists():
+    store = get_sheet_store(_BASE_DIR / filename)
+    if not store.exists():
         return None, f'File {filename} không tồn tại'
 
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            data = list(reader)
-        return data, None
+        return store.rows(), None
     except Exception as e:
         return None, f'Lỗi đọc file: {str(e)}'
 
 
 def _write_csv_file(sheet_name, data):
-    """Ghi dữ liệu vào file CSV"""
+    """Ghi dữ liệu vào file CSV (append nếu chỉ thêm dòng cuối, ngược lại ghi lại nguyên tử)"""
     filename = _get_csv_filename(sheet_name)
     if not filename:
         return 'Sheet không hợp lệ'
 
-    filepath = _BASE_DIR / filename
-
     if not data:
         return 'Dữ liệu rỗng'
 
     try:
-        headers = list(data[0].keys())
-        with open(filepath, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(data)
+        get_sheet_store(_BASE_DIR / filename).write_rows(data)
         return None
     except Exception as e:
         return f'Lỗi ghi file: {str(e)}'
@@ -7,13 +7,15 @@ Two register functions are intentionally separate to preserve url_map order:
   register_admin_data_management_api   -> called after  register_admin_logs_routes
 """
 
+import os
 from datetime import datetime
 from flask import jsonify, render_template, request
 from flask_login import current_user
 from mysql.connector import Error
 
 from auth import permission_required, admin_required
-from folder_py.db_config import get_db_connection
+from folder_py.db_config import get_db_connection, get_pool_metrics
+from services.schema_registry import refresh_schema_registry
 
 
 def register_admin_data_management_page(app):
@@ -27,7 +29,7 @@ def register_admin_data_management_page(app):
 
 
 def register_admin_data_management_api(app):
-    """Register admin data management API routes (db-info, schema, table-stats)."""
+    """Register admin data management API routes (db-info, db-pool, schema, table-stats)."""
 
     @app.route("/admin/api/db-info")
     @admin_required
@@ -60,16 +62,26 @@ def register_admin_data_management_api(app):
                 cursor.close()
                 connection.close()
 
+    @app.route("/admin/api/db-pool")
+    @admin_required
+    def admin_api_db_pool():
+        """API số liệu connection pool của worker hiện tại (cỡ pool, in-use, chờ, hết pool, overflow)."""
+        return jsonify({"success": True, "pid": os.getpid(), "pool": get_pool_metrics()})
+
     @app.route("/admin/api/schema")
     @admin_required
     def admin_api_schema():
-        """API lấy toàn bộ schema database (bảng, cột, khóa ngoại) cho developer."""
+        """API lấy toàn bộ schema database (bảng, cột, khóa ngoại) cho developer.
+
+        Đồng thời nạp lại schema registry của worker (sau migration chạy ngoài process).
+        """
         connection = get_db_connection()
         if not connection:
             return jsonify({"success": False, "error": "Không thể kết nối database"}), 500
 
         try:
             cursor = connection.cursor(dictionary=True)
+            refresh_schema_registry(cursor)
 
             cursor.execute("SELECT DATABASE() as db_name")
             db_row = cursor.fetchone()
@@ -413,3 +425,23 @@ def register_admin_data_management_api(app):
             if connection.is_connected():
                 cursor.close()
                 connection.close()
+
+    @app.route("/admin/api/thumbnails", methods=["GET"])
+    @admin_required
+    def admin_api_thumbnails_status():
+        """Trạng thái pool tạo thumbnail nền (số worker, job đang chờ / đã xong / lỗi)."""
+        from services.thumbnail_jobs import thumbnail_status
+
+        return jsonify({"success": True, **thumbnail_status()})
+
+    @app.route("/admin/api/thumbnails/backfill", methods=["POST"])
+    @admin_required
+    def admin_api_thumbnails_backfill():
+        """Quét toàn bộ thư mục ảnh, xếp job tạo thumbnail cho mọi ảnh còn thiếu."""
+        from services.thumbnail_jobs import backfill_thumbnails, thumbnail_status
+
+        try:
+            result = backfill_thumbnails()
+        except OSError as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+        return jsonify({"success": True, **result, "status": thumbnail_status()})
@@ -12,6 +12,7 @@ from mysql.connector import Error
 
 from db import get_db_connection
 from auth import admin_required
+from services.schema_registry import has_column, has_table
 
 
 logger = logging.getLogger(__name__)
@@ -32,9 +33,7 @@ def register_admin_logs_api_routes(app):
         cursor = None
         try:
             cursor = connection.cursor(dictionary=True)
-            cursor.execute("SHOW TABLES LIKE 'activity_logs'")
-            table_exists = cursor.fetchone()
-            if not table_exists:
+            if not has_table("activity_logs", cursor=cursor):
                 logger.error("Activity logs API: Table 'activity_logs' does not exist.")
                 return (
                     jsonify(
@@ -52,10 +51,8 @@ def register_admin_logs_api_routes(app):
             target_type_filter = request.args.get("target_type", default=None, type=str)
             user_id_filter = request.args.get("user_id", default=None, type=int)
 
-            cursor.execute("SHOW COLUMNS FROM activity_logs LIKE 'log_id'")
-            id_column = "log_id" if cursor.fetchone() else "id"
-            cursor.execute("SHOW COLUMNS FROM activity_logs LIKE 'created_at'")
-            time_column = "created_at" if cursor.fetchone() else "timestamp"
+            id_column = "log_id" if has_column("activity_logs", "log_id", cursor=cursor) else "id"
+            time_column = "created_at" if has_column("activity_logs", "created_at", cursor=cursor) else "timestamp"
 
             query = f"""
                 SELECT
@@ -5,6 +5,7 @@ from auth import permission_required
 from audit_log import log_person_create, log_person_update, log_activity
 from folder_py.db_config import get_db_connection
 from mysql.connector import Error
+from services.genealogy_graph import invalidate_genealogy_snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -275,6 +276,7 @@ def register_admin_members_routes(app):
             _process_children_spouse_siblings(cursor, person_id, data)
 
             connection.commit()
+            invalidate_genealogy_snapshot()
 
             try:
                 cursor.execute("""
@@ -414,6 +416,7 @@ def register_admin_members_routes(app):
             _process_children_spouse_siblings(cursor, person_id, data)
 
             connection.commit()
+            invalidate_genealogy_snapshot()
 
             try:
                 cursor.execute("""
@@ -474,6 +477,7 @@ def register_admin_members_routes(app):
 
             cursor.execute("DELETE FROM persons WHERE person_id = %s", (person_id,))
             connection.commit()
+            invalidate_genealogy_snapshot()
 
             try:
                 if before_data:
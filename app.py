@@ -92,6 +92,9 @@ try:
         except Exception:
             _static_ver = 'dev'
     app.jinja_env.globals['static_ver'] = _static_ver
+    # srcset cho ảnh render phía server (activity_detail); chưa có các bậc thì xếp job nền
+    from services.thumbnail_jobs import image_srcset_or_enqueue
+    app.jinja_env.globals['image_srcset'] = image_srcset_or_enqueue
 
     def _normalize_phone_href(phone_number: str) -> str:
         phone_number = (phone_number or '').strip()
@@ -225,6 +228,11 @@ if register_admin_routes:
     except Exception as e:
         print(f'WARNING: Loi khi dang ky admin routes: {e}')
 
+from db import init_request_connection
+
+# Connection dùng chung trong request (page_views, handler, audit log), đóng ở teardown_request
+init_request_connection(app)
+
 try:
     from services.page_views import register_page_views
 
@@ -18,7 +18,8 @@ except ImportError:
 from flask_login import current_user
 from mysql.connector import Error
 
-from folder_py.db_config import get_db_connection
+from db import get_db_connection
+from services.schema_registry import has_table
 
 def _audit_json_default(value):
     """Serialize common DB/runtime types for audit payloads."""
@@ -48,6 +49,22 @@ def log_activity(action, target_type=None, target_id=None, before_data=None, aft
         before_data: Dữ liệu trước khi thay đổi (dict, sẽ convert sang JSON)
         after_data: Dữ liệu sau khi thay đổi (dict, sẽ convert sang JSON)
     """
+    log_activities([{
+        'action': action,
+        'target_type': target_type,
+        'target_id': target_id,
+        'before_data': before_data,
+        'after_data': after_data,
+    }])
+
+def log_activities(entries):
+    """
+    Ghi nhiều dòng activity_logs trong một kết nối + một executemany (bulk update: một bộ log cho
+    cả lô thay vì mỗi người một kết nối). Mỗi entry là dict các tham số của log_activity.
+    """
+    entries = list(entries or [])
+    if not entries:
+        return
     connection = get_db_connection()
     if not connection:
         return
@@ -58,26 +75,29 @@ def log_activity(action, target_type=None, target_id=None, before_data=None, aft
         ip_address = request.remote_addr if request else None
         user_agent = request.headers.get('User-Agent') if request else None
         
-        # Không lưu mật khẩu / token vào activity_logs (bản sao đã redact)
-        safe_before = redact_for_audit(before_data) if before_data else None
-        safe_after = redact_for_audit(after_data) if after_data else None
-        before_json = _to_audit_json(safe_before)
-        after_json = _to_audit_json(safe_after)
+        rows = []
+        for entry in entries:
+            # Không lưu mật khẩu / token vào activity_logs (bản sao đã redact)
+            before_data = entry.get('before_data')
+            after_data = entry.get('after_data')
+            safe_before = redact_for_audit(before_data) if before_data else None
+            safe_after = redact_for_audit(after_data) if after_data else None
+            rows.append((
+                user_id, entry['action'], entry.get('target_type'), entry.get('target_id'),
+                _to_audit_json(safe_before), _to_audit_json(safe_after), ip_address, user_agent,
+            ))
         
         # Kiểm tra xem bảng activity_logs có tồn tại không
         cursor = connection.cursor()
-        cursor.execute("SHOW TABLES LIKE 'activity_logs'")
-        table_exists = cursor.fetchone()
-        
-        if not table_exists:
+        if not has_table('activity_logs', cursor=cursor):
             # Bảng không tồn tại, bỏ qua việc ghi log (không crash)
             return
         
-        cursor.execute("""
+        cursor.executemany("""
             INSERT INTO activity_logs 
             (user_id, action, target_type, target_id, before_data, after_data, ip_address, user_agent)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (user_id, action, target_type, target_id, before_json, after_json, ip_address, user_agent))
+        """, rows)
         connection.commit()
     except Error as e:
         # Log lỗi nhưng không crash ứng dụng
@@ -11,7 +11,8 @@ from flask import Blueprint, render_template, request, jsonify, session, redirec
 from flask_login import current_user
 
 from utils.html_sanitize import sanitize_activity_html
-from utils.image_thumbnails import get_thumbnail_url, image_reference_exists, normalize_public_image_url
+from services.thumbnail_jobs import image_srcset_or_enqueue, thumbnail_url_or_enqueue
+from utils.image_thumbnails import image_reference_exists, normalize_public_image_url
 
 logger = logging.getLogger(__name__)
 activities_bp = Blueprint('activities', __name__)
@@ -47,11 +48,14 @@ def _activity_to_json(row):
     raw_thumbnail = row.get('thumbnail')
     fallback_image = next((img for img in images if image_reference_exists(img)), None)
     thumbnail_url = None
+    thumbnail_srcset = None
 
     if raw_thumbnail and image_reference_exists(raw_thumbnail):
-        thumbnail_url = get_thumbnail_url(raw_thumbnail, create_if_missing=True, fallback_to_original=True)
+        thumbnail_url = thumbnail_url_or_enqueue(raw_thumbnail)
+        thumbnail_srcset = image_srcset_or_enqueue(raw_thumbnail)
     elif fallback_image:
-        thumbnail_url = get_thumbnail_url(fallback_image, create_if_missing=True, fallback_to_original=True)
+        thumbnail_url = thumbnail_url_or_enqueue(fallback_image)
+        thumbnail_srcset = image_srcset_or_enqueue(fallback_image)
 
     if not thumbnail_url and (raw_thumbnail or images):
         thumbnail_url = DEFAULT_ACTIVITY_FALLBACK_URL
@@ -67,6 +71,7 @@ def _activity_to_json(row):
         'status': row.get('status'),
         'thumbnail': raw_thumbnail,
         'thumbnail_url': thumbnail_url,
+        'thumbnail_srcset': thumbnail_srcset,
         'images': images,
         'created_at': row['created_at'].isoformat() if row.get('created_at') else None,
         'updated_at': row['updated_at'].isoformat() if row.get('updated_at') else None,
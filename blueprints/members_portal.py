@@ -4,16 +4,26 @@ Cổng nội bộ Members - /members, /members/verify, /members/logout, /api/mem
 """
 import logging
 import os
-import re
+import time
 from datetime import date, datetime
-from io import BytesIO
 from pathlib import Path
-from flask import Blueprint, redirect, render_template, request, jsonify, session, send_file
+from flask import Blueprint, Response, redirect, render_template, request, jsonify, session, send_file, stream_with_context
 
 from audit_log import log_activity
 from extensions import rate_limit
 from services.person_helpers import get_preferred_spouse_names
-from services.members_service import fetch_members_list
+from services.members_export import (
+    CSV_MIMETYPE,
+    EXPORT_CHUNK_SIZE,
+    EXPORT_COLUMNS as _EXCEL_COLUMNS,
+    XLSX_MIMETYPE,
+    build_xlsx_file,
+    iter_csv,
+    select_columns,
+)
+from services.members_service import iter_members_chunks
+from services.genealogy_graph import invalidate_genealogy_snapshot
+from services.schema_registry import has_column, has_table, table_columns
 from services.members_helpers import (
     normalize_excel_header as _normalize_excel_header,
     normalize_sll_row_id as _normalize_sll_row_id,
@@ -125,7 +135,9 @@ def get_members():
         from extensions import cache
     except Exception:
         cache = None
-    cache_key = 'api_members_data'
+    from services.shared_cache import versioned_key
+    # Gắn token version dùng chung: ghi ở worker nào cũng làm mọi worker bỏ payload cũ
+    cache_key = versioned_key('api_members_data')
     if cache:
         try:
             cached_data = cache.get(cache_key)
@@ -134,7 +146,7 @@ def get_members():
         except Exception as e:
             logger.warning(f'Cache get error: {e}')
     from db import get_db_connection
-    from services.person_service import load_relationship_data
+    from services.genealogy_graph import get_relationship_data
     connection = None
     cursor = None
     try:
@@ -142,41 +154,20 @@ def get_members():
         if not connection:
             return (jsonify({'success': False, 'error': 'Không thể kết nối database'}), 500)
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT COLUMN_NAME FROM information_schema.COLUMNS
-            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'persons'
-            AND COLUMN_NAME IN ('csv_id', 'personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email', 'place_of_death', 'occupation')
-        """)
-        _col_rows = cursor.fetchall()
-        available_columns = set()
-        for row in _col_rows:
-            col = row.get('COLUMN_NAME') or row.get('column_name') or ''
-            if col:
-                available_columns.add(str(col).strip())
+        available_columns = table_columns(
+            'persons',
+            ('csv_id', 'personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email', 'place_of_death', 'occupation'),
+            cursor=cursor,
+        )
 
         # Nhánh: ưu tiên persons.branch_name nếu có; nếu không thì join branches qua branch_id
         has_branch_name_col = False
         has_branch_id = False
         has_branches_table = False
         try:
-            cursor.execute("""
-                SELECT COLUMN_NAME FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'persons' AND COLUMN_NAME = 'branch_name'
-                LIMIT 1
-            """)
-            has_branch_name_col = bool(cursor.fetchone())
-            cursor.execute("""
-                SELECT COLUMN_NAME FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'persons' AND COLUMN_NAME = 'branch_id'
-                LIMIT 1
-            """)
-            has_branch_id = bool(cursor.fetchone())
-            cursor.execute("""
-                SELECT TABLE_NAME FROM information_schema.TABLES
-                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'branches'
-                LIMIT 1
-            """)
-            has_branches_table = bool(cursor.fetchone())
+            has_branch_name_col = has_column('persons', 'branch_name', cursor=cursor)
+            has_branch_id = has_column('persons', 'branch_id', cursor=cursor)
+            has_branches_table = has_table('branches', cursor=cursor)
         except Exception as e:
             logger.warning(f'Could not detect branch schema: {e}')
             has_branch_name_col = False
@@ -213,7 +204,7 @@ def get_members():
                 p.person_id ASC, p.full_name ASC
         """)
         persons = cursor.fetchall()
-        relationship_data = load_relationship_data(cursor)
+        relationship_data = get_relationship_data(cursor)
         parent_data = relationship_data['parent_data']
         children_map = relationship_data['children_map']
         siblings_map = relationship_data['siblings_map']
@@ -270,18 +261,23 @@ def get_members():
                 pass
 
 
-# Cột xuất Excel: (key trong dict, tiêu đề tiếng Việt)
-_EXCEL_COLUMNS = [
-    ('person_id', 'ID'), ('fm_id', 'FM_ID'), ('branch_name', 'Nhánh'), ('full_name', 'Họ và tên'), ('alias', 'Tên gọi khác'),
-    ('gender', 'Giới tính'), ('status', 'Trạng thái'), ('generation_number', 'Đời'),
-    ('birth_date_solar', 'Ngày sinh (dương lịch)'), ('birth_date_lunar', 'Ngày sinh (âm lịch)'),
-    ('death_date_solar', 'Ngày mất (dương lịch)'), ('death_date_lunar', 'Ngày mất (âm lịch)'),
-    ('grave', 'Mộ'), ('place_of_death', 'Nơi mất'),
-    ('father_name', 'Cha'), ('mother_name', 'Mẹ'),
-    ('spouses', 'Vợ/Chồng'), ('siblings', 'Anh chị em'), ('children', 'Con'),
-    ('occupation', 'Nghề nghiệp'), ('academic_rank', 'Học hàm'), ('academic_degree', 'Học vị'),
-    ('phone', 'Điện thoại'), ('email', 'Email'), ('biography', 'Tiểu sử'), ('personal_image_url', 'URL ảnh'),
-]
+def _export_response(export_format, columns):
+    """Response xuất thành viên: CSV stream theo chunk, XLSX write-only qua file tạm."""
+    from db import get_db_connection
+
+    # Chỉ mở kết nối trước để DB không kết nối được còn trả 500; snapshot quan hệ + query
+    # chạy trong generator, sau khi header CSV đã gửi đi
+    connection = get_db_connection()
+    if not connection:
+        raise RuntimeError('Không thể kết nối database')
+    chunks = iter_members_chunks(EXPORT_CHUNK_SIZE, connection=connection)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M')
+    if export_format == 'csv':
+        response = Response(stream_with_context(iter_csv(chunks, columns)), mimetype=CSV_MIMETYPE)
+        response.headers['Content-Disposition'] = f'attachment; filename=danh_sach_thanh_vien_{stamp}.csv'
+        return response
+    xlsx_file = build_xlsx_file(chunks, columns)
+    return send_file(xlsx_file, mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=f'danh_sach_thanh_vien_{stamp}.xlsx')
 
 
 @members_portal_bp.route('/members/export/excel')
@@ -291,36 +287,8 @@ def export_members_excel():
     if not session.get('members_gate_ok'):
         from flask import redirect
         return redirect('/members')
-    members, err = fetch_members_list()
-    if err:
-        return (jsonify({'success': False, 'error': err}), 500)
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment
-        from datetime import datetime
-        wb = Workbook()
-        ws = wb.active
-        ws.title = 'Danh sách thành viên'
-        # Header
-        for col, (_, header) in enumerate(_EXCEL_COLUMNS, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center', wrap_text=True)
-        # Data rows
-        for row_idx, member in enumerate(members, 2):
-            for col_idx, (key, _) in enumerate(_EXCEL_COLUMNS, 1):
-                val = member.get(key)
-                if val is not None:
-                    ws.cell(row=row_idx, column=col_idx, value=str(val) if not isinstance(val, (int, float)) else val)
-        # Auto-fit column widths (approximate)
-        from openpyxl.utils import get_column_letter
-        for col_idx in range(1, len(_EXCEL_COLUMNS) + 1):
-            ws.column_dimensions[get_column_letter(col_idx)].width = 16
-        buf = BytesIO()
-        wb.save(buf)
-        buf.seek(0)
-        filename = 'danh_sach_thanh_vien_{}.xlsx'.format(datetime.now().strftime('%Y%m%d_%H%M'))
-        return send_file(buf, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name=filename)
+        return _export_response('xlsx', _EXCEL_COLUMNS)
     except ImportError:
         logger.error('openpyxl not installed')
         return (jsonify({'success': False, 'error': 'Thư viện xuất Excel chưa được cài đặt.'}), 500)
@@ -329,6 +297,33 @@ def export_members_excel():
         return (jsonify({'success': False, 'error': str(e)}), 500)
 
 
+@members_portal_bp.route('/api/members/export')
+@rate_limit("20 per hour")
+def export_members():
+    """
+    Xuất danh sách thành viên: ?format=xlsx (mặc định) | csv, ?columns=person_id,full_name,...
+    (key trong services.members_export.EXPORT_COLUMNS; bỏ trống = tất cả).
+    """
+    if not session.get('members_gate_ok'):
+        logger.warning('Unauthorized access to /api/members/export')
+        return (jsonify({'success': False, 'error': 'Chưa đăng nhập. Vui lòng đăng nhập lại.'}), 401)
+    export_format = (request.args.get('format') or 'xlsx').strip().lower()
+    if export_format not in ('xlsx', 'csv'):
+        return (jsonify({'success': False, 'error': 'format phải là xlsx hoặc csv'}), 400)
+    try:
+        columns = select_columns(request.args.get('columns'))
+    except ValueError as e:
+        return (jsonify({'success': False, 'error': str(e)}), 400)
+    try:
+        return _export_response(export_format, columns)
+    except ImportError:
+        logger.error('openpyxl not installed')
+        return (jsonify({'success': False, 'error': 'Thư viện xuất Excel chưa được cài đặt.'}), 500)
+    except Exception as e:
+        logger.error(f'Error exporting members ({export_format}): {e}', exc_info=True)
+        return (jsonify({'success': False, 'error': str(e)}), 500)
+
+
 @members_portal_bp.route('/api/members/bulk-update-branch', methods=['POST'])
 @rate_limit("30 per hour")
 def bulk_update_members_branch():
@@ -342,7 +337,7 @@ def bulk_update_members_branch():
     Rule:
     - Nếu Nhánh sai hoặc ID sai format => error_count++ và bỏ qua dòng
     - Nếu ID hợp lệ nhưng không tồn tại trong DB => silent (không update, không tính lỗi)
-    - Trả về số dòng cập nhật thành công và số dòng lỗi.
+    - Trả về số dòng cập nhật thành công, số dòng lỗi và stats (số người / nhánh, thời gian từng bước, ms).
     """
     import io
     import os
@@ -350,7 +345,7 @@ def bulk_update_members_branch():
     import csv
 
     from db import get_db_connection
-    from services.person_service import get_or_create_branch
+    from services.members_branch_update import assign_branches
     from services.members_service import get_members_password
     from utils.validation import secure_compare
 
@@ -397,6 +392,7 @@ def bulk_update_members_branch():
     valid_to_update = {}
     error_count = 0
 
+    started = time.perf_counter()
     file_bytes = uploaded_file.read()
     if not file_bytes:
         return (jsonify({'success': False, 'error': 'File rỗng'}), 400)
@@ -486,6 +482,7 @@ def bulk_update_members_branch():
     except Exception as e:
         logger.error(f'Failed to parse uploaded branch file: {e}', exc_info=True)
         return (jsonify({'success': False, 'error': f'Lỗi đọc file: {str(e)}'}), 400)
+    parse_ms = round((time.perf_counter() - started) * 1000, 1)
 
     connection = get_db_connection()
     if not connection:
@@ -499,79 +496,21 @@ def bulk_update_members_branch():
             log_activity('BULK_UPDATE_BRANCH', target_type='Members', after_data={'updated_count': 0, 'error_count': error_count})
             return jsonify({'success': True, 'updated_count': 0, 'error_count': error_count})
 
-        ids = list(valid_to_update.keys())
-        placeholders = ','.join(['%s'] * len(ids))
-        cursor.execute(f'SELECT person_id FROM persons WHERE person_id IN ({placeholders})', tuple(ids))
-        existing_set = {r['person_id'] for r in cursor.fetchall() if r.get('person_id')}
-
-        # Silent: only update if exists
-        existing_map = {pid: valid_to_update[pid] for pid in ids if pid in existing_set}
-        updated_count = len(existing_map)
-
-        if updated_count == 0:
-            return jsonify({'success': True, 'updated_count': 0, 'error_count': error_count})
-
-        # Detect schema for branch_name / branch_id
-        cursor.execute("""
-            SELECT COLUMN_NAME
-            FROM information_schema.COLUMNS
-            WHERE TABLE_SCHEMA = DATABASE()
-              AND TABLE_NAME = 'persons'
-              AND COLUMN_NAME IN ('branch_name', 'branch_id')
-        """)
-        cols = {r.get('COLUMN_NAME') for r in cursor.fetchall() if r.get('COLUMN_NAME')}
-
-        cursor.execute("""
-            SELECT TABLE_NAME
-            FROM information_schema.TABLES
-            WHERE TABLE_SCHEMA = DATABASE()
-              AND TABLE_NAME = 'branches'
-            LIMIT 1
-        """)
-        has_branches_table = bool(cursor.fetchone())
-
-        if 'branch_name' in cols:
-            update_rows = [(branch, pid) for pid, branch in existing_map.items()]
-            cursor.executemany(
-                'UPDATE persons SET branch_name = %s WHERE person_id = %s',
-                update_rows
-            )
-        elif 'branch_id' in cols and has_branches_table:
-            # Map branch_name -> branch_id and update branch_id
-            unique_branch_names = set(existing_map.values())
-            branch_name_to_id = {}
-            # get_or_create_branch() trong app.py kỳ vọng fetchone() trả về tuple
-            # nên dùng cursor thường (không dictionary=True) để tránh KeyError.
-            cursor_for_branch = connection.cursor()
-            try:
-                for bn in unique_branch_names:
-                    branch_name_to_id[bn] = get_or_create_branch(cursor_for_branch, bn)
-            finally:
-                try:
-                    cursor_for_branch.close()
-                except Exception:
-                    pass
-
-            update_rows = [(branch_name_to_id[bn], pid) for pid, bn in existing_map.items()]
-            cursor.executemany(
-                'UPDATE persons SET branch_id = %s WHERE person_id = %s',
-                update_rows
-            )
-        else:
-            return (jsonify({'success': False, 'error': 'Không tìm thấy cột branch_name hoặc branch_id trong persons'}), 500)
-
+        # Tên nhánh resolve một lần, ghi theo tập trong một transaction
+        stats = assign_branches(cursor, valid_to_update)
+        commit_started = time.perf_counter()
         connection.commit()
+        stats['commit_ms'] = round((time.perf_counter() - commit_started) * 1000, 1)
+        stats['parse_ms'] = parse_ms
+        stats['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        updated_count = stats['matched']
 
-        # Invalidate members cache
-        try:
-            from extensions import cache
-            if cache:
-                cache.delete('api_members_data')
-        except Exception as e:
-            logger.warning(f'Cache invalidation error (continuing): {e}')
+        if updated_count:
+            # Invalidate snapshot + members cache (mọi worker)
+            invalidate_genealogy_snapshot()
 
-        log_activity('BULK_UPDATE_BRANCH', target_type='Members', after_data={'updated_count': updated_count, 'error_count': error_count})
-        return jsonify({'success': True, 'updated_count': updated_count, 'error_count': error_count})
+        log_activity('BULK_UPDATE_BRANCH', target_type='Members', after_data={'updated_count': updated_count, 'error_count': error_count, 'stats': stats})
+        return jsonify({'success': True, 'updated_count': updated_count, 'error_count': error_count, 'stats': stats})
 
     except Exception as e:
         connection.rollback()
@@ -653,8 +592,8 @@ def bulk_update_members_sll():
     import io
 
     from db import get_db_connection
+    from services.members_bulk_update import apply_bulk_update, plan_bulk_update
     from services.members_service import get_members_password
-    from services.person_service import apply_person_members_update_core, load_relationship_data
     from utils.validation import secure_compare
 
     if not session.get('members_gate_ok'):
@@ -695,7 +634,6 @@ def bulk_update_members_sll():
     if not file_bytes:
         return (jsonify({'success': False, 'error': 'File rỗng'}), 400)
 
-    id_regex = re.compile(r'^P-\d+-\d+$')
     rows_to_process = []
 
     try:
@@ -758,95 +696,25 @@ def bulk_update_members_sll():
         return (jsonify({'success': False, 'error': 'Không thể kết nối database'}), 500)
 
     cursor = None
-    updated_count = 0
-    error_count = 0
-    skipped_count = 0
 
     try:
         cursor = connection.cursor(dictionary=True)
-        rel_data = load_relationship_data(cursor)
-        has_csv_id_col = False
-        try:
-            cursor.execute(
-                """
-                SELECT COLUMN_NAME
-                FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE()
-                  AND TABLE_NAME = 'persons'
-                  AND COLUMN_NAME = 'csv_id'
-                LIMIT 1
-                """
-            )
-            has_csv_id_col = bool(cursor.fetchone())
-        except Exception as schema_err:
-            logger.warning(f'bulk-update-sll: could not detect csv_id column: {schema_err}')
-            has_csv_id_col = False
-
-        for id_str, excel_dict in rows_to_process:
-            target_person_id = None
-
-            if id_regex.match(id_str):
-                cursor.execute('SELECT person_id FROM persons WHERE person_id = %s', (id_str,))
-                found = cursor.fetchone()
-                if found:
-                    target_person_id = found.get('person_id')
-
-            # Fallback theo csv_id để hỗ trợ file có ID hiển thị khác person_id.
-            if not target_person_id and has_csv_id_col:
-                cursor.execute('SELECT person_id FROM persons WHERE csv_id = %s LIMIT 1', (id_str,))
-                found = cursor.fetchone()
-                if found:
-                    target_person_id = found.get('person_id')
-
-            if not target_person_id:
-                if id_regex.match(id_str) or has_csv_id_col:
-                    skipped_count += 1
-                else:
-                    error_count += 1
-                continue
-
-            if not id_regex.match(target_person_id):
-                skipped_count += 1
-                continue
-
-            base = _sll_base_payload(cursor, target_person_id, rel_data)
-            if not base:
-                skipped_count += 1
-                continue
-            merged = _sll_merge_excel_into_payload(base, excel_dict)
-            try:
-                ok, err, _code = apply_person_members_update_core(connection, cursor, target_person_id, merged, None, None)
-                if ok:
-                    updated_count += 1
-                    rel_data = load_relationship_data(cursor)
-                else:
-                    error_count += 1
-                    logger.warning(f'bulk-update-sll row {id_str} ({target_person_id}): {err}')
-                    try:
-                        connection.rollback()
-                    except Exception:
-                        pass
-            except Exception as row_err:
-                try:
-                    connection.rollback()
-                except Exception:
-                    pass
-                error_count += 1
-                logger.warning(f'bulk-update-sll row {id_str} ({target_person_id}) exception: {row_err}', exc_info=True)
-
-        try:
-            from extensions import cache
-            if cache:
-                cache.delete('api_members_data')
-        except Exception as e:
-            logger.warning(f'Cache invalidation error (bulk SLL): {e}')
-
-        log_activity('BULK_UPDATE_SLL', target_type='Members', after_data={'updated_count': updated_count, 'error_count': error_count, 'skipped_count': skipped_count})
+        # Validate cả file trước (đọc theo lô), rồi ghi bằng executemany trong một transaction
+        plan = plan_bulk_update(cursor, rows_to_process)
+        result = apply_bulk_update(connection, cursor, plan)
+        updated_count = len(result['updated'])
+        if updated_count:
+            invalidate_genealogy_snapshot()
+
+        summary = plan.summary()
+        log_activity('BULK_UPDATE_SLL', target_type='Members', after_data={'updated_count': updated_count, 'error_count': summary['error_count'], 'skipped_count': summary['skipped_count'], 'unchanged_count': summary['unchanged_count']})
         return jsonify({
             'success': True,
             'updated_count': updated_count,
-            'error_count': error_count,
-            'skipped_count': skipped_count,
+            'error_count': summary['error_count'],
+            'skipped_count': summary['skipped_count'],
+            'unchanged_count': summary['unchanged_count'],
+            'errors': summary['errors'],
         })
 
     except Exception as e:
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """
 Blueprint Quản lý hồ sơ cá nhân (Person CRUD).
-Routes: /api/person/<id>, /api/persons, /api/persons/batch, /api/search, /api/person/<id>/sync,
+Routes: /api/person/<id>, /api/persons, /api/persons/batch(/undo), /api/search, /api/person/<id>/sync,
         /api/edit-requests, /api/fix/p-1-1-parents, /api/genealogy/update-info, ...
 """
 from flask import Blueprint
@@ -32,6 +32,7 @@ def _call_app(handler_name, *args, **kwargs):
         fix_p1_1_parents,
         update_genealogy_info,
         delete_persons_batch,
+        undo_delete_persons_batch,
     )
     handlers = {
         'get_persons': get_persons,
@@ -46,6 +47,7 @@ def _call_app(handler_name, *args, **kwargs):
         'fix_p1_1_parents': fix_p1_1_parents,
         'update_genealogy_info': update_genealogy_info,
         'delete_persons_batch': delete_persons_batch,
+        'undo_delete_persons_batch': undo_delete_persons_batch,
     }
     fn = handlers[handler_name]
     return fn(*args, **kwargs)
@@ -119,3 +121,9 @@ def update_genealogy_info():
 @rate_limit("20 per hour")
 def delete_persons_batch():
     return _call_app('delete_persons_batch')
+
+
+@persons_bp.route('/api/persons/batch/undo', methods=['POST'])
+@rate_limit("20 per hour")
+def undo_delete_persons_batch():
+    return _call_app('undo_delete_persons_batch')
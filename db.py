@@ -1,4 +1,7 @@
+import logging
+
 import mysql.connector  # type: ignore
+from flask import g, has_request_context
 from mysql.connector import Error  # type: ignore
 
 from folder_py.db_config import (
@@ -16,7 +19,13 @@ def get_db_config():
     return DB_CONFIG if (DB_CONFIG.get("host") and DB_CONFIG.get("host") != "localhost") else _get_db_config_impl()
 
 
-def get_db_connection():
+logger = logging.getLogger(__name__)
+
+# Khoa tren flask.g giu connection dung chung cua request
+_REQUEST_CONNECTION_KEY = "_tbqc_request_connection"
+
+
+def _open_connection():
     """Ket noi DB; neu that bai voi config mac dinh thi thu voi DB_CONFIG (Railway)."""
     conn = _get_db_connection_impl()
     if conn is not None:
@@ -28,3 +37,92 @@ def get_db_connection():
             pass
     return None
 
+
+class _RequestConnectionLease:
+    """
+    Connection dung chung cua request, cho muon tung luot (before_request -> handler -> audit log...).
+
+    close() chi tra luot muon: rollback giao dich dang mo (nhu pool_reset_session khi tra pool,
+    de luot sau khong thay snapshot / thay doi chua commit cua luot truoc) roi de connection lai
+    cho request. Connection that duoc dong o teardown_request.
+    """
+
+    def __init__(self, slot):
+        self._slot = slot
+        self._released = False
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        slot = self._slot
+        connection = slot["connection"]
+        try:
+            if getattr(connection, "in_transaction", False):
+                connection.rollback()
+        except Exception as e:
+            # Connection hong: bo khoi request, luot sau mo connection moi
+            logger.warning("Request connection rollback failed, discarding: %s", e)
+            slot["broken"] = True
+        slot["leased"] = False
+        if slot.get("broken") or slot.get("detached"):
+            _close_quietly(connection)
+
+    def __getattr__(self, name):
+        return getattr(self._slot["connection"], name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.debug("Closing request connection: %s", e)
+
+
+def get_db_connection():
+    """
+    Connection DB cho caller (luon goi close() nhu cu).
+
+    Trong request: cac luot goi noi tiep nhau dung chung mot connection (mot lan checkout pool
+    cho ca request). Neu connection cua request dang duoc muon (goi long nhau, vd. log_activity
+    khi handler chua dong connection) thi tra connection rieng nhu truoc day.
+    Ngoai request (script, thread nen): connection rieng.
+    """
+    if not has_request_context():
+        return _open_connection()
+    slot = g.get(_REQUEST_CONNECTION_KEY)
+    if slot is not None and not slot.get("broken"):
+        if slot["leased"]:
+            return _open_connection()
+        slot["leased"] = True
+        return _RequestConnectionLease(slot)
+    connection = _open_connection()
+    if connection is None:
+        return None
+    slot = {"connection": connection, "leased": True}
+    setattr(g, _REQUEST_CONNECTION_KEY, slot)
+    return _RequestConnectionLease(slot)
+
+
+def close_request_connection(exc=None):
+    """teardown_request: dong connection cua request (luot muon con mo se tu dong khi close())."""
+    slot = g.pop(_REQUEST_CONNECTION_KEY, None)
+    if slot is None or slot.get("broken"):
+        return
+    if slot["leased"]:
+        # Vd. generator cua response streaming van dang dung: de lease dong connection that
+        slot["detached"] = True
+        return
+    _close_quietly(slot["connection"])
+
+
+def init_request_connection(app):
+    """Dang ky dong connection dung chung khi ket thuc request."""
+    app.teardown_request(close_request_connection)
+
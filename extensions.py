@@ -1,5 +1,6 @@
 import logging
 import os
+import tempfile
 
 from flask_limiter import Limiter  # type: ignore
 from flask_limiter.util import get_remote_address  # type: ignore
@@ -44,6 +45,44 @@ def _default_rate_limits():
     return [f"{m} per minute", f"{h} per hour", f"{d} per day"]
 
 
+def _default_cache_dir() -> str:
+    # /dev/shm là RAM dùng chung giữa các worker cùng máy; không có thì dùng thư mục tạm
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "tbqc-cache")
+
+
+def _cache_config() -> dict:
+    """
+    Backend Flask-Caching dùng chung giữa các worker (CACHE_BACKEND=redis|filesystem|simple):
+    - redis: mặc định khi có CACHE_REDIS_URL / REDIS_URL (cùng Redis với rate limiter) và package redis.
+    - filesystem: mặc định khi không có Redis; CACHE_DIR (mặc định /dev/shm/tbqc-cache).
+    - simple: mỗi worker một bản riêng (hành vi cũ; test dùng backend này).
+    Khoá dữ liệu gia phả gắn version (services/shared_cache.py): ghi ở một worker là mọi worker bỏ bản cũ.
+    """
+    config = {
+        "CACHE_DEFAULT_TIMEOUT": 300,
+        # Hien tai chi dung ~1-3 keys ('api_members_data', ...). 50 du
+        # toi gioi han item count cua SimpleCache/FileSystemCache va giam RAM.
+        # Xem docs/operations/runbook.md muc rollback neu can revert.
+        "CACHE_THRESHOLD": 50,
+    }
+    redis_url = (os.environ.get("CACHE_REDIS_URL") or os.environ.get("REDIS_URL") or "").strip()
+    backend = (os.environ.get("CACHE_BACKEND") or "").strip().lower()
+    if not backend:
+        backend = "redis" if redis_url else "filesystem"
+    if backend == "redis":
+        if redis_url and _redis_available():
+            config.update({"CACHE_TYPE": "RedisCache", "CACHE_REDIS_URL": redis_url, "CACHE_KEY_PREFIX": "tbqc:"})
+            return config
+        logger.warning("CACHE_BACKEND=redis nhung thieu REDIS_URL hoac package redis — dung filesystem cache")
+        backend = "filesystem"
+    if backend == "filesystem":
+        config.update({"CACHE_TYPE": "FileSystemCache", "CACHE_DIR": os.environ.get("CACHE_DIR") or _default_cache_dir()})
+        return config
+    config["CACHE_TYPE"] = "SimpleCache"
+    return config
+
+
 # Các dependency optional: nếu thiếu thì disable tính năng, không crash app.
 try:
     from flask_caching import Cache  # type: ignore
@@ -92,17 +131,9 @@ def init_extensions(app):
     # Cache
     if cache:
         try:
-            cache_config = {
-                "CACHE_TYPE": "simple",
-                "CACHE_DEFAULT_TIMEOUT": 300,
-                # Hien tai chi dung ~1-3 keys ('api_members_data', ...). 50 du
-                # toi gioi han item count cua SimpleCache va giam RAM neu sau
-                # nay co them keys nho. KHONG anh huong hanh vi hien tai.
-                # Xem docs/operations/runbook.md muc rollback neu can revert.
-                "CACHE_THRESHOLD": 50,
-            }
+            cache_config = _cache_config()
             cache.init_app(app, config=cache_config)
-            print("OK: Flask-Caching da duoc khoi tao")
+            print("OK: Flask-Caching da duoc khoi tao (backend=%s)" % cache_config["CACHE_TYPE"])
         except Exception as e:
             print(f"WARNING: Loi khi khoi tao cache: {e}")
     else:
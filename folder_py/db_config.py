@@ -10,11 +10,21 @@ Supports Railway production (DB_* or MYSQL* env vars) and local dev (tbqc_db.env
 import os
 import sys
 import logging
+import threading
+import time
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
 # Global connection pool
 _db_pool = None
+# Cau hinh pool da dung khi tao _db_pool (get_pool_settings)
+_pool_settings = None
+DEFAULT_POOL_SIZE = 3
+# Gioi han cua mysql.connector.pooling
+MAX_POOL_SIZE = 32
+DEFAULT_POOL_MAX_OVERFLOW = 2
+DEFAULT_POOL_TIMEOUT = 5.0
 # Override config (app set tu .env khi khoi dong) - uu tien hon os.environ
 _config_override = None
 
@@ -251,12 +261,155 @@ def get_db_config() -> dict:
     return config
 
 
+def env_number(name, default, cast, minimum, maximum=None):
+    """Doc so tu env; gia tri sai / ngoai khoang -> default hoac cat ve bien."""
+    raw_value = os.environ.get(name)
+    if raw_value is None or str(raw_value).strip() == '':
+        return default
+    try:
+        value = cast(str(raw_value).strip())
+    except ValueError:
+        logger.warning(f"Invalid {name}={raw_value!r}, using {default}")
+        return default
+    if value < minimum:
+        value = minimum
+    if maximum is not None and value > maximum:
+        value = maximum
+    return value
+
+
+def get_pool_settings():
+    """
+    Cau hinh pool tu env:
+    - DB_POOL_SIZE: so connection giu san (1..32, mac dinh 3)
+    - DB_POOL_MAX_OVERFLOW: so connection ngoai pool mo them khi pool het (mac dinh 2)
+    - DB_POOL_TIMEOUT: so giay cho connection tra ve pool khi da het overflow (mac dinh 5)
+    """
+    return {
+        'pool_size': env_number('DB_POOL_SIZE', DEFAULT_POOL_SIZE, int, 1, MAX_POOL_SIZE),
+        'max_overflow': env_number('DB_POOL_MAX_OVERFLOW', DEFAULT_POOL_MAX_OVERFLOW, int, 0),
+        'timeout': env_number('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT, float, 0.0),
+    }
+
+
+class _PoolStats:
+    """Dem checkout / in-use / exhaustion cho /admin/api/db-pool (dung chung moi thread trong worker)."""
+
+    LATENCY_WINDOW = 1024
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self.cond:
+            self.in_use = 0
+            self.in_use_peak = 0
+            self.overflow_in_use = 0
+            self.checkouts_total = 0
+            self.waits_total = 0
+            self.exhausted_total = 0
+            self.overflow_total = 0
+            self.fallback_total = 0
+            self.checkout_ms_max = 0.0
+            self.latencies_ms = deque(maxlen=self.LATENCY_WINDOW)
+
+    def acquired(self, started, overflow=False, fallback=False):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self.cond:
+            self.checkouts_total += 1
+            self.in_use += 1
+            self.in_use_peak = max(self.in_use_peak, self.in_use)
+            if overflow:
+                # overflow_in_use da duoc giu cho trong _checkout_from_pool
+                self.overflow_total += 1
+            if fallback:
+                self.fallback_total += 1
+            self.latencies_ms.append(elapsed_ms)
+            self.checkout_ms_max = max(self.checkout_ms_max, elapsed_ms)
+
+    def released(self, overflow=False, counted=True):
+        with self.cond:
+            if counted:
+                self.in_use = max(0, self.in_use - 1)
+            if overflow:
+                self.overflow_in_use = max(0, self.overflow_in_use - 1)
+            self.cond.notify()
+
+    def snapshot(self):
+        with self.cond:
+            latencies = sorted(self.latencies_ms)
+            count = len(latencies)
+            return {
+                'in_use': self.in_use,
+                'in_use_peak': self.in_use_peak,
+                'overflow_in_use': self.overflow_in_use,
+                'checkouts_total': self.checkouts_total,
+                'waits_total': self.waits_total,
+                'exhausted_total': self.exhausted_total,
+                'overflow_connections_total': self.overflow_total,
+                'fallback_connections_total': self.fallback_total,
+                'checkout_ms': {
+                    'window': count,
+                    'avg': round(sum(latencies) / count, 3) if count else 0.0,
+                    'p50': round(latencies[count // 2], 3) if count else 0.0,
+                    'p95': round(latencies[min(count - 1, int(count * 0.95))], 3) if count else 0.0,
+                    'max': round(self.checkout_ms_max, 3),
+                },
+            }
+
+
+_pool_stats = _PoolStats()
+
+
+class _TrackedConnection:
+    """
+    Boc connection de biet khi nao caller close(): giam in_use va danh thuc thread dang cho pool.
+    Moi thuoc tinh / method khac chuyen thang cho connection goc.
+    """
+
+    def __init__(self, connection, overflow=False):
+        self._connection = connection
+        self._overflow = overflow
+        self._released = False
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._connection.close()
+        finally:
+            _pool_stats.released(self._overflow)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_pool_metrics():
+    """So lieu pool cua worker hien tai (cau hinh + bo dem), cho /admin/api/db-pool."""
+    metrics = _pool_stats.snapshot()
+    metrics.update(_pool_settings if _pool_settings else get_pool_settings())
+    metrics['pool_initialized'] = _db_pool is not None
+    return metrics
+
+
+def reset_pool_metrics():
+    _pool_stats.reset()
+
+
 def _init_db_pool():
     """
     Initialize database connection pool.
     Called automatically on first get_db_connection() call.
     """
-    global _db_pool
+    global _db_pool, _pool_settings
     if _db_pool is not None:
         return
     
@@ -265,17 +418,23 @@ def _init_db_pool():
         from mysql.connector import Error
         
         config = get_db_config()
+        settings = get_pool_settings()
         
         # Create connection pool
-        # pool_size: số connections giữ sẵn — traffic thấp/Railway: 3 đủ cho 1 Gunicorn worker + ít thread
+        # pool_size: DB_POOL_SIZE (mac dinh 3 — du cho 1 Gunicorn worker + it thread tren Railway);
+        # khi tang so thread gunicorn thi tang theo, xem in_use_peak / waits_total o /admin/api/db-pool
         # pool_reset_session: reset session state khi trả connection về pool
         _db_pool = mysql.connector.pooling.MySQLConnectionPool(
             pool_name="tbqc_pool",
-            pool_size=3,
+            pool_size=settings['pool_size'],
             pool_reset_session=True,
             **config
         )
-        logger.info("Database connection pool initialized: pool_size=3")
+        _pool_settings = settings
+        logger.info(
+            "Database connection pool initialized: pool_size=%s, max_overflow=%s, timeout=%ss",
+            settings['pool_size'], settings['max_overflow'], settings['timeout'],
+        )
     except Error as e:
         logger.error(f"Failed to initialize connection pool: {e}")
         logger.warning("Falling back to single connection mode")
@@ -286,11 +445,64 @@ def _init_db_pool():
         _db_pool = None
 
 
+def _connect_single(config):
+    import mysql.connector
+    from mysql.connector import Error
+
+    try:
+        return mysql.connector.connect(**config)
+    except Error as e:
+        logger.error(f"Database connection failed: {e}")
+        logger.error(f"Config used: host={config.get('host')}, db={config.get('database')}, user={config.get('user')}")
+        return None
+
+
+def _checkout_from_pool(pool, settings, started):
+    """
+    Lay connection tu pool. Pool het: mo connection overflow (toi da max_overflow), neu het
+    overflow thi cho connection tra ve toi da `timeout` giay. Tra None khi het thoi gian cho.
+    """
+    from mysql.connector.errors import PoolError
+
+    deadline = started + settings['timeout']
+    waited = False  # chi dem waits_total mot lan cho moi checkout
+    while True:
+        try:
+            return _TrackedConnection(pool.get_connection()), False
+        except PoolError:
+            pass
+        with _pool_stats.cond:
+            if _pool_stats.overflow_in_use < settings['max_overflow']:
+                # Giu cho truoc khi mo ket noi (ngoai lock) de cac thread khac khong vuot max_overflow
+                _pool_stats.overflow_in_use += 1
+                reserve_overflow = True
+            else:
+                reserve_overflow = False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    _pool_stats.exhausted_total += 1
+                    return None, False
+                if not waited:
+                    _pool_stats.waits_total += 1
+                    waited = True
+                # Cho theo lat cat ngan: connection bi bo quen (khong close) van duoc pool thu hoi qua GC
+                _pool_stats.cond.wait(min(remaining, 0.1))
+        if reserve_overflow:
+            connection = _connect_single(get_db_config())
+            if connection is None:
+                _pool_stats.released(overflow=True, counted=False)
+                return None, False
+            logger.info("Connection pool exhausted, opened overflow connection")
+            return _TrackedConnection(connection, overflow=True), True
+
+
 def get_db_connection():
     """
     Create and return a database connection using unified config.
     Uses connection pooling for better performance.
     Falls back to single connection if pool initialization fails.
+    Khi pool het: mo toi da DB_POOL_MAX_OVERFLOW connection them, sau do cho toi da DB_POOL_TIMEOUT
+    giay; het thoi gian thi tra None (caller da xu ly nhu mat ket noi DB).
     
     This is the standard function all modules should use.
     """
@@ -300,28 +512,26 @@ def get_db_connection():
     if _db_pool is None:
         _init_db_pool()
     
-    # Try to get connection from pool
-    if _db_pool is not None:
+    started = time.monotonic()
+    pool = _db_pool
+    if pool is not None:
         try:
-            connection = _db_pool.get_connection()
-            logger.debug(f"Got connection from pool")
-            return connection
+            connection, overflow = _checkout_from_pool(pool, _pool_settings or get_pool_settings(), started)
         except Exception as e:
             logger.warning(f"Failed to get connection from pool: {e}, falling back to single connection")
-            # Fall through to single connection mode
-    
-    # Fallback: create single connection (backward compatibility)
-    import mysql.connector
-    from mysql.connector import Error
+        else:
+            if connection is None:
+                logger.error("Connection pool exhausted: no connection within DB_POOL_TIMEOUT")
+                return None
+            _pool_stats.acquired(started, overflow=overflow)
+            logger.debug("Got connection from pool")
+            return connection
     
+    # Fallback: pool khong khoi tao duoc / loi khong phai het pool -> single connection (backward compatibility)
     config = get_db_config()
-    
-    try:
-        connection = mysql.connector.connect(**config)
-        logger.debug(f"Database connection established (single mode) to {config['database']}")
-        return connection
-    except Error as e:
-        logger.error(f"Database connection failed: {e}")
-        logger.error(f"Config used: host={config.get('host')}, db={config.get('database')}, user={config.get('user')}")
+    connection = _connect_single(config)
+    if connection is None:
         return None
-
+    logger.debug(f"Database connection established (single mode) to {config['database']}")
+    _pool_stats.acquired(started, fallback=True)
+    return _TrackedConnection(connection)
@@ -5,6 +5,8 @@ Genealogy Tree Helper Functions
 Updated for new schema: person_id VARCHAR(50), relationships with parent_id/child_id
 """
 
+import json
+from collections import deque
 from typing import Dict, List, Optional, Any
 import logging
 
@@ -38,73 +40,208 @@ def _derive_family_group_key(
     return None
 
 
+_TREE_PAYLOAD_KEYS = (
+    "person_id",
+    "full_name",
+    "alias",
+    "generation_level",
+    "status",
+    "gender",
+    "home_town",
+    "father_id",
+    "mother_id",
+    "father_name",
+    "mother_name",
+    "father_mother_id",
+    "family_group_key",
+    "birth_date_solar",
+    "birth_date_lunar",
+    "death_date_solar",
+    "death_date_lunar",
+)
+_TREE_PAYLOAD_KEY_SET = frozenset(_TREE_PAYLOAD_KEYS)
+
+
+def _tree_node_payload(person_id: str, person: Dict) -> Dict[str, Any]:
+    """Phần dữ liệu cố định của một node (không gồm children)."""
+    return {
+        "person_id": person_id,
+        "full_name": person.get("full_name", ""),
+        "alias": person.get("alias"),
+        "generation_level": person.get("generation_level"),
+        "status": person.get("status"),
+        "gender": person.get("gender"),
+        "home_town": person.get("home_town"),
+        "father_id": person.get("father_id"),
+        "mother_id": person.get("mother_id"),
+        "father_name": person.get("father_name"),
+        "mother_name": person.get("mother_name"),
+        "father_mother_id": person.get("father_mother_id"),
+        "family_group_key": person.get("family_group_key"),
+        "birth_date_solar": _json_date(person.get("birth_date_solar")),
+        "birth_date_lunar": _json_date(person.get("birth_date_lunar")),
+        "death_date_solar": _json_date(person.get("death_date_solar")),
+        "death_date_lunar": _json_date(person.get("death_date_lunar")),
+    }
+
+
+def count_tree_children(
+    person_id: str,
+    persons_by_id: Dict[str, Dict],
+    children_map: Dict[str, List[str]],
+) -> int:
+    """Số con có trong persons_by_id (cùng tiêu chí build_tree dùng để tạo node con)."""
+    return sum(1 for child_id in children_map.get(person_id, []) if child_id in persons_by_id)
+
+
 def build_tree(
     root_id: str,
     persons_by_id: Dict[str, Dict],
     children_map: Dict[str, List[str]],
     current_gen: int,
-    max_gen: int
+    max_gen: int,
+    max_nodes: Optional[int] = None,
+    collapse_depth: Optional[int] = None,
+    payload_cache: Optional[Dict[str, Dict[str, Any]]] = None,
 ) -> Optional[Dict[str, Any]]:
     """
     Build nested descendants tree from root_id up to max_gen.
-    
+
+    Duyệt theo chiều rộng bằng hàng đợi (không đệ quy) nên max_gen lớn không chạm giới hạn
+    recursion của Python. Thứ tự children giữ đúng thứ tự trong children_map.
+
     Args:
         root_id: Person ID (VARCHAR) to start from
         persons_by_id: Dictionary mapping person_id -> person data
         children_map: Dictionary mapping parent_id -> list of child_ids
         current_gen: Current generation level (1 = root)
         max_gen: Maximum generation to include
-    
+        max_nodes: Giới hạn tổng số node; nhóm con nào vượt ngân sách thì node cha được
+            đánh dấu "collapsed": True kèm "child_count" để client tải tiếp qua /api/children/<id>
+        collapse_depth: Node ở đời (tương đối, root = current_gen) >= collapse_depth
+            không mở rộng con, chỉ trả "child_count"
+        payload_cache: Dict dùng chung giữa nhiều lần gọi để tái sử dụng payload của
+            từng người (ngày tháng đã chuẩn hóa) thay vì dựng lại
+
     Returns:
         Tree node dict or None if current_gen > max_gen
     """
     if current_gen > max_gen:
         return None
-    
+
     if root_id not in persons_by_id:
         logger.warning(f"Person {root_id} not found in persons_by_id")
         return None
-    
-    person = persons_by_id[root_id]
-    
-    # Build node structure
-    node = {
-        "person_id": root_id,
-        "full_name": person.get("full_name", ""),
-        "alias": person.get("alias"),
-        "generation_level": person.get("generation_level"),
-        "status": person.get("status"),
-        "gender": person.get("gender"),
-        "home_town": person.get("home_town"),
-        "father_id": person.get("father_id"),
-        "mother_id": person.get("mother_id"),
-        "father_name": person.get("father_name"),
-        "mother_name": person.get("mother_name"),
-        "father_mother_id": person.get("father_mother_id"),
-        "family_group_key": person.get("family_group_key"),
-        "birth_date_solar": _json_date(person.get("birth_date_solar")),
-        "birth_date_lunar": _json_date(person.get("birth_date_lunar")),
-        "death_date_solar": _json_date(person.get("death_date_solar")),
-        "death_date_lunar": _json_date(person.get("death_date_lunar")),
-        "children": []
-    }
-    
-    # Get children
-    child_ids = children_map.get(root_id, [])
-    
-    # Recursively build children
-    for child_id in child_ids:
-        child_node = build_tree(
-            child_id,
-            persons_by_id,
-            children_map,
-            current_gen + 1,
-            max_gen
-        )
-        if child_node:
+
+    if payload_cache is None:
+        payload_cache = {}
+
+    def _make_node(person_id: str) -> Dict[str, Any]:
+        payload = payload_cache.get(person_id)
+        if payload is None:
+            payload = _tree_node_payload(person_id, persons_by_id[person_id])
+            payload_cache[person_id] = payload
+        node = dict(payload)
+        node["children"] = []
+        return node
+
+    def _mark_collapsed(node: Dict[str, Any], person_id: str) -> None:
+        child_count = count_tree_children(person_id, persons_by_id, children_map)
+        if child_count:
+            node["collapsed"] = True
+            node["child_count"] = child_count
+
+    root = _make_node(root_id)
+    node_count = 1
+    queue = deque([(root_id, root, current_gen)])
+    while queue:
+        person_id, node, gen = queue.popleft()
+        if collapse_depth is not None and gen >= collapse_depth:
+            _mark_collapsed(node, person_id)
+            continue
+        if gen + 1 > max_gen:
+            continue
+        child_ids = []
+        for child_id in children_map.get(person_id, []):
+            if child_id in persons_by_id:
+                child_ids.append(child_id)
+            else:
+                logger.warning(f"Person {child_id} not found in persons_by_id")
+        if not child_ids:
+            continue
+        # Mở rộng cả nhóm anh chị em hoặc không mở rộng (client luôn nhận danh sách con đầy đủ)
+        if max_nodes is not None and node_count + len(child_ids) > max_nodes:
+            node["collapsed"] = True
+            node["child_count"] = len(child_ids)
+            continue
+        for child_id in child_ids:
+            child_node = _make_node(child_id)
             node["children"].append(child_node)
-    
-    return node
+            queue.append((child_id, child_node, gen + 1))
+        node_count += len(child_ids)
+
+    return root
+
+
+def iter_tree_json(
+    tree: Dict[str, Any],
+    dumps=None,
+    fragment_cache: Optional[Dict[str, Dict[str, str]]] = None,
+    sort_keys: bool = False,
+):
+    """
+    Encode cây (kết quả build_tree) thành từng mảnh JSON, không đệ quy.
+
+    Từng cặp "key":value trong payload cố định của mỗi người được encode một lần rồi cache
+    theo person_id (fragment_cache có thể dùng chung giữa các request cùng snapshot). Các key
+    khác (collapsed, child_count, marriage_pairs...) được encode riêng cho từng node.
+
+    sort_keys=True: thứ tự key như json.dumps(sort_keys=True) — kể cả vị trí của "children" —
+    để output trùng từng byte với jsonify (provider mặc định của Flask sắp xếp key).
+    """
+    if dumps is None:
+        def dumps(obj):
+            return json.dumps(obj, separators=(",", ":"))
+    if fragment_cache is None:
+        fragment_cache = {}
+
+    def _pair(key: str, value: Any) -> str:
+        return dumps({key: value})[1:-1]
+
+    def _open(node: Dict[str, Any]):
+        """(phần trước mảng children, phần sau mảng children) của một node."""
+        person_id = node.get("person_id")
+        pairs = fragment_cache.get(person_id)
+        if pairs is None:
+            pairs = {key: _pair(key, node.get(key)) for key in _TREE_PAYLOAD_KEYS}
+            fragment_cache[person_id] = pairs
+        encoded = dict(pairs)
+        for key, value in node.items():
+            if key != "children" and key not in _TREE_PAYLOAD_KEY_SET:
+                encoded[key] = _pair(key, value)
+        keys = sorted(encoded) if sort_keys else list(encoded)
+        before = [encoded[key] for key in keys if not sort_keys or key < "children"]
+        after = [encoded[key] for key in keys if sort_keys and key > "children"]
+        head = "{" + "".join(part + "," for part in before) + '"children":['
+        tail = "]" + "".join("," + part for part in after) + "}"
+        return head, tail
+
+    head, tail = _open(tree)
+    yield head
+    stack = [(iter(tree.get("children") or []), tail)]
+    first = [True]
+    while stack:
+        child = next(stack[-1][0], None)
+        if child is None:
+            yield stack.pop()[1]
+            first.pop()
+            continue
+        prefix = "" if first[-1] else ","
+        first[-1] = False
+        head, tail = _open(child)
+        yield prefix + head
+        stack.append((iter(child.get("children") or []), tail))
+        first.append(True)
 
 
 def build_ancestors_chain(
@@ -227,7 +364,8 @@ def build_children_map(cursor) -> Dict[str, List[str]]:
     Returns:
         Dictionary mapping parent_id -> list of child_ids
     """
-    children_map = {}
+    # dict làm ordered set: giữ thứ tự chèn, kiểm tra trùng O(1) thay vì quét list
+    children_sets: Dict[str, Dict[str, None]] = {}
     
     cursor.execute("""
         SELECT parent_id, child_id
@@ -245,12 +383,12 @@ def build_children_map(cursor) -> Dict[str, List[str]]:
             child_id = row[1]
         
         if parent_id and child_id:
-            if parent_id not in children_map:
-                children_map[parent_id] = []
-            if child_id not in children_map[parent_id]:
-                children_map[parent_id].append(child_id)
+            children = children_sets.get(parent_id)
+            if children is None:
+                children = children_sets[parent_id] = {}
+            children[child_id] = None
     
-    return children_map
+    return {parent_id: list(children) for parent_id, children in children_sets.items()}
 
 
 def build_parent_map(cursor) -> Dict[str, Dict[str, Optional[str]]]:
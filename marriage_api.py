@@ -10,6 +10,7 @@ from flask_login import login_required, current_user
 from auth import permission_required
 from folder_py.db_config import get_db_connection
 from audit_log import log_spouse_update, log_activity
+from services.genealogy_graph import invalidate_genealogy_snapshot
 import mysql.connector
 from mysql.connector import Error
 import json
@@ -86,6 +87,7 @@ def register_marriage_routes(app):
                 data.get('note')
             ))
             connection.commit()
+            invalidate_genealogy_snapshot()
             marriage_id = cursor.lastrowid
             
             # Ghi log
@@ -139,6 +141,7 @@ def register_marriage_routes(app):
                 WHERE id = %s
             """, params)
             connection.commit()
+            invalidate_genealogy_snapshot()
             
             # Ghi log
             log_spouse_update(marriage_id, dict(old_data), data)
@@ -169,6 +172,7 @@ def register_marriage_routes(app):
                 WHERE id = %s
             """, (marriage_id,))
             connection.commit()
+            invalidate_genealogy_snapshot()
             
             # Ghi log
             log_activity('DELETE_SPOUSE', target_type='Marriage', target_id=marriage_id)
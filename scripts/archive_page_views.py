@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Bảo trì page_views (chạy bằng cron / tay):
+
+  python scripts/archive_page_views.py                 # archive dòng cũ hơn PAGE_VIEW_RETENTION_DAYS ngày
+  python scripts/archive_page_views.py --days 90
+  python scripts/archive_page_views.py --rebuild-rollup  # chỉ dựng lại page_view_daily từ page_views
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.page_view_archive import PAGE_VIEW_RETENTION_DAYS, archive_page_views
+
+
+def rebuild_rollup():
+    from folder_py.db_config import get_db_connection
+    from services.page_views import _ensure_page_view_daily, rebuild_page_view_daily
+
+    connection = get_db_connection()
+    if not connection:
+        print("ERROR: Không thể kết nối database")
+        return 1
+    try:
+        _ensure_page_view_daily(connection)
+        rebuild_page_view_daily(connection)
+        print("page_view_daily rebuilt from page_views")
+        return 0
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive page_views cũ ra file .sql.gz theo tháng.")
+    parser.add_argument("--days", type=int, default=PAGE_VIEW_RETENTION_DAYS,
+                        help="Giữ lại N ngày gần nhất trong bảng (mặc định PAGE_VIEW_RETENTION_DAYS).")
+    parser.add_argument("--rebuild-rollup", action="store_true",
+                        help="Chỉ dựng lại page_view_daily, không archive.")
+    args = parser.parse_args(argv)
+
+    if args.rebuild_rollup:
+        return rebuild_rollup()
+    result = archive_page_views(args.days)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result.get("success") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
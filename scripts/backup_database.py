@@ -20,14 +20,22 @@ if str(ROOT) not in sys.path:
 
 # Import unified DB config
 try:
-    from folder_py.db_config import get_db_config
+    from folder_py.db_config import env_number, get_db_config
 except ImportError:
     try:
-        from db_config import get_db_config
+        from db_config import env_number, get_db_config
     except ImportError:
         print("❌ ERROR: Cannot import db_config")
         sys.exit(1)
 
+from services.sql_dump import (
+    COMPRESSION_SUFFIXES,
+    SQL_DUMP_EXTENSIONS,
+    dump_database,
+    get_compression,
+    manifest_path,
+)
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,6 +46,9 @@ logger = logging.getLogger(__name__)
 # Backup directory
 BACKUP_DIR = 'backups'
 
+# Số bảng dump song song ở chế độ Python (mỗi bảng một connection); 1 = một snapshot nhất quán
+BACKUP_DUMP_WORKERS = env_number('BACKUP_DUMP_WORKERS', 1, int, 1)
+
 
 def ensure_backup_dir():
     """Tạo thư mục backup nếu chưa có"""
@@ -46,78 +57,25 @@ def ensure_backup_dir():
     return str(backup_path)
 
 
-def create_backup_python(connection, backup_file):
+def create_backup_python(connection, backup_file, compression='none', workers=1, connect=None):
     """
     Tạo backup bằng Python thuần (fallback khi mysqldump không có)
-    Export schema và data của các bảng chính
+    Export schema và data qua engine chung services.sql_dump: đọc từng lô bằng cursor
+    không buffer, extended INSERT, nén theo compression, manifest cạnh file.
+    workers > 1 (cần connect) thì dump song song mỗi bảng một connection.
     """
     try:
-        import mysql.connector
-        
-        cursor = connection.cursor()
-        
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            f.write("-- TBQC Database Backup\n")
-            f.write(f"-- Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write("-- Backup method: Python export\n\n")
-            f.write("SET FOREIGN_KEY_CHECKS=0;\n")
-            f.write("SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n\n")
-            
-            # Lấy danh sách base table + view để export đúng schema.
-            cursor.execute("SHOW FULL TABLES")
-            objects = cursor.fetchall()
-            
-            logger.info(f"Exporting {len(objects)} schema objects...")
-            
-            for obj in objects:
-                name = obj[0]
-                obj_type = str(obj[1]).upper() if len(obj) > 1 else "BASE TABLE"
-
-                if obj_type == "VIEW":
-                    cursor.execute(f"SHOW CREATE VIEW `{name}`")
-                    create_view = cursor.fetchone()
-                    if create_view:
-                        f.write(f"\n-- View: {name}\n")
-                        f.write(f"DROP VIEW IF EXISTS `{name}`;\n")
-                        f.write(f"{create_view[1]};\n\n")
-                    continue
-
-                # Export CREATE TABLE
-                cursor.execute(f"SHOW CREATE TABLE `{name}`")
-                create_table = cursor.fetchone()
-                if create_table:
-                    f.write(f"\n-- Table: {name}\n")
-                    f.write(f"DROP TABLE IF EXISTS `{name}`;\n")
-                    f.write(f"{create_table[1]};\n\n")
-                
-                # Export data
-                cursor.execute(f"SELECT * FROM `{name}`")
-                columns = [desc[0] for desc in cursor.description]
-                
-                rows = cursor.fetchall()
-                if rows:
-                    f.write(f"-- Data for table `{name}`\n")
-                    f.write(f"LOCK TABLES `{name}` WRITE;\n")
-                    
-                    for row in rows:
-                        values = []
-                        for val in row:
-                            if val is None:
-                                values.append('NULL')
-                            elif isinstance(val, (int, float)):
-                                values.append(str(val))
-                            else:
-                                # Escape string
-                                val_str = str(val).replace('\\', '\\\\').replace("'", "\\'")
-                                values.append(f"'{val_str}'")
-                        
-                        f.write(f"INSERT INTO `{name}` (`{'`, `'.join(columns)}`) VALUES ({', '.join(values)});\n")
-                    
-                    f.write("UNLOCK TABLES;\n\n")
-            
-            f.write("SET FOREIGN_KEY_CHECKS=1;\n")
-        
-        cursor.close()
+        manifest = dump_database(
+            connection,
+            backup_file,
+            compression=compression,
+            workers=workers,
+            connect=connect,
+        )
+        logger.info(
+            f"Exported {len(manifest['tables'])} tables, {len(manifest['views'])} views, "
+            f"{manifest['total_rows']} rows"
+        )
         return True
         
     except Exception as e:
@@ -125,12 +83,22 @@ def create_backup_python(connection, backup_file):
         return False
 
 
-def create_backup(backup_dir=None):
+def _remove_backup_files(backup_file):
+    """Xoá file backup dở dang và manifest đi kèm (nếu có)"""
+    for path in (backup_file, manifest_path(backup_file)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create_backup(backup_dir=None, mode='full'):
     """
     Tạo SQL dump backup của database
     
     Args:
         backup_dir: Thư mục lưu backup (mặc định: backups/)
+        mode: 'full' (mysqldump / Python dump đầy đủ) hoặc 'incremental'
+              (chỉ dòng đổi kể từ file trước trong chuỗi base + tăng dần,
+              xem services/incremental_backup.py)
     
     Returns:
         dict: {
@@ -149,6 +117,23 @@ def create_backup(backup_dir=None):
         else:
             Path(backup_dir).mkdir(parents=True, exist_ok=True)
         
+        if mode == 'incremental':
+            # Chuỗi base + tăng dần chỉ có ở engine Python (mysqldump không có mốc theo bảng)
+            from services.incremental_backup import create_incremental_backup
+            from folder_py.db_config import get_db_connection
+            
+            return create_incremental_backup(
+                backup_dir,
+                get_db_connection,
+                compression=get_compression(),
+            )
+        if mode != 'full':
+            return {
+                'success': False,
+                'error': f'Invalid backup mode: {mode}',
+                'backup_file': None
+            }
+        
         # Tạo tên file backup với timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_filename = f'tbqc_backup_{timestamp}.sql'
@@ -234,6 +219,8 @@ def create_backup(backup_dir=None):
             if result.returncode != 0:
                 error_msg = result.stderr if result.stderr else 'Unknown error'
                 logger.warning(f"⚠️ mysqldump failed: {error_msg}")
+                if os.path.exists(backup_file):
+                    os.remove(backup_file)
                 logger.info("Falling back to Python backup method...")
                 use_mysqldump = False
         else:
@@ -245,7 +232,12 @@ def create_backup(backup_dir=None):
                 import mysql.connector
                 from folder_py.db_config import get_db_connection
                 
-                logger.info("Đang tạo backup bằng Python...")
+                # File Python dump được nén theo BACKUP_COMPRESSION (mặc định gzip)
+                compression = get_compression()
+                backup_filename = f'tbqc_backup_{timestamp}.sql{COMPRESSION_SUFFIXES[compression]}'
+                backup_file = os.path.join(backup_dir, backup_filename)
+                
+                logger.info(f"Đang tạo backup bằng Python ({compression})...")
                 connection = get_db_connection()
                 if not connection:
                     return {
@@ -254,12 +246,17 @@ def create_backup(backup_dir=None):
                         'backup_file': None
                     }
                 
-                success = create_backup_python(connection, backup_file)
+                success = create_backup_python(
+                    connection,
+                    backup_file,
+                    compression=compression,
+                    workers=BACKUP_DUMP_WORKERS,
+                    connect=get_db_connection,
+                )
                 connection.close()
                 
                 if not success:
-                    if os.path.exists(backup_file):
-                        os.remove(backup_file)
+                    _remove_backup_files(backup_file)
                     return {
                         'success': False,
                         'error': 'Python backup failed',
@@ -267,8 +264,7 @@ def create_backup(backup_dir=None):
                     }
             except Exception as e:
                 logger.error(f"Python backup error: {e}")
-                if os.path.exists(backup_file):
-                    os.remove(backup_file)
+                _remove_backup_files(backup_file)
                 return {
                     'success': False,
                     'error': f'Backup failed: {str(e)}',
@@ -308,6 +304,7 @@ def create_backup(backup_dir=None):
             'backup_filename': backup_filename,
             'file_size': file_size,
             'timestamp': timestamp,
+            'mode': 'full',
             'error': None
         }
         
@@ -335,7 +332,8 @@ def list_backups(backup_dir=None):
     
     backups = []
     for filename in os.listdir(backup_dir):
-        if filename.startswith('tbqc_backup_') and filename.endswith('.sql'):
+        # tbqc_backup_*_incNNN.sql.gz: file tăng dần, chỉ restore được sau base của chuỗi
+        if filename.startswith('tbqc_backup_') and filename.endswith(SQL_DUMP_EXTENSIONS):
             filepath = os.path.join(backup_dir, filename)
             file_stat = os.stat(filepath)
             backups.append({
@@ -6,11 +6,22 @@ Cleanup Backups Script
 Enforces min 7/max 30 days retention policy for backup files.
 """
 
+import json
 import os
+import sys
 import time
 import logging
 from pathlib import Path
 
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Chuỗi backup tăng dần đang dùng không bị xoá
+from services.incremental_backup import CHAIN_STATE_FILE
+# Dump Python có thể nén; manifest đi kèm xoá cùng file
+from services.sql_dump import MANIFEST_SUFFIX, SQL_DUMP_EXTENSIONS as BACKUP_EXTENSIONS
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,6 +33,15 @@ BACKUP_DIR = 'backups'
 MIN_RETENTION_COUNT = 7   # Giữ ít nhất 7 files mới nhất bất kể tuổi đời
 MAX_RETENTION_DAYS = 30   # Xóa files > 30 ngày nếu đã có đủ MIN_RETENTION_COUNT
 
+
+def _active_chain(backup_path):
+    """File trong chuỗi base + tăng dần hiện tại — xoá một file là cả chuỗi không restore được."""
+    try:
+        with open(backup_path / CHAIN_STATE_FILE, 'r', encoding='utf-8') as f:
+            return set(json.load(f).get('chain') or [])
+    except (OSError, ValueError):
+        return set()
+
 def cleanup_backups(backup_dir=None):
     if backup_dir is None:
         backup_dir = BACKUP_DIR
@@ -36,7 +56,10 @@ def cleanup_backups(backup_dir=None):
 
     # Thu thập tất cả backup files và tính tuổi đời
     backups = []
-    for filepath in backup_path.glob("tbqc_backup_*.sql"):
+    protected = _active_chain(backup_path)
+    for filepath in backup_path.glob("tbqc_backup_*.sql*"):
+        if not filepath.name.endswith(BACKUP_EXTENSIONS) or filepath.name in protected:
+            continue
         try:
             stat = filepath.stat()
             age_days = (now - stat.st_mtime) / (24 * 3600)
@@ -55,6 +78,9 @@ def cleanup_backups(backup_dir=None):
         if age_days > MAX_RETENTION_DAYS:
             try:
                 filepath.unlink()
+                manifest = filepath.with_name(filepath.name + MANIFEST_SUFFIX)
+                if manifest.exists():
+                    manifest.unlink()
                 logger.info(f"Deleted old backup: {filepath} (age: {age_days:.1f} days)")
                 deleted_count += 1
             except Exception as e:
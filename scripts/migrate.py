@@ -70,7 +70,8 @@ def run_migrations():
     
     from services.activities_service import ensure_activities_table
     from services.gallery_helpers import ensure_albums_table, ensure_album_images_table
-    from services.page_views import _ensure_page_views_table
+    from services.page_views import _ensure_page_view_daily, _ensure_page_views_table
+    from services.schema_registry import refresh_schema_registry
     
     # Chạy các bảng định nghĩa tại migrate.py
     ensure_users_table(cursor)
@@ -83,6 +84,7 @@ def run_migrations():
     
     # Table sử dụng conn
     _ensure_page_views_table(conn)
+    _ensure_page_view_daily(conn)
     
     # Fix 3.1 — Thêm is_public column vào albums (C4)
     cursor.execute("""
@@ -114,6 +116,9 @@ def run_migrations():
     """)
 
     conn.commit()
+    # Process đang chạy app (vd. gọi run_migrations() trong release hook) dùng schema mới ngay;
+    # worker khác nhận khi restart hoặc qua /admin/api/schema.
+    refresh_schema_registry(cursor)
     cursor.close()
     conn.close()
     print("Migrations done.")
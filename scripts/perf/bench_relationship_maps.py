@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Micro-benchmark build_children_map / load_relationship_data on synthetic relationships."""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_SIZES = (10_000, 100_000)
+DEFAULT_REPEAT = 3
+# Gia đình (cha, mẹ, các con) như dữ liệu thật; một phần là "đại gia đình" ~50 con
+# để lộ chi phí khử trùng bậc hai.
+NORMAL_FAMILY_SIZE = (1, 6)
+WIDE_FAMILY_SIZE = 50
+WIDE_SHARE = 0.1
+DUPLICATE_SHARE = 0.02
+DEFAULT_WIDE_FAMILY = 5_000
+
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from folder_py.genealogy_tree import build_children_map  # noqa: E402
+from services.person_helpers import load_relationship_data  # noqa: E402
+
+
+class _FakeCursor:
+    """Trả lần lượt các result set cho fetchall(); fetchone() luôn None.
+
+    Truy vấn information_schema của schema registry được trả rỗng (không có bảng
+    ssc) và không tiêu thụ result set nào của bench.
+    """
+
+    def __init__(self, result_sets: list[list[Any]]):
+        self._result_sets = list(result_sets)
+        self._schema_query = False
+
+    def execute(self, sql: str, *args: Any, **kwargs: Any) -> None:
+        self._schema_query = "information_schema" in sql.lower()
+
+    def fetchone(self) -> None:
+        return None
+
+    def fetchall(self) -> list[Any]:
+        if self._schema_query:
+            return []
+        return self._result_sets.pop(0) if self._result_sets else []
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Relationship row counts to test.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per case; the best time is reported.")
+    parser.add_argument("--seed", type=int, default=20240101)
+    parser.add_argument("--with-legacy", action="store_true", help="Also time the old list-membership dedup.")
+    parser.add_argument(
+        "--wide-family",
+        type=int,
+        default=DEFAULT_WIDE_FAMILY,
+        help="Children of one extra parent pair (worst case for list dedup); 0 disables.",
+    )
+    return parser.parse_args()
+
+
+def _synthetic_rows(size: int, rng: random.Random, wide_family: int = 0) -> tuple[list[dict], list[dict], list[dict]]:
+    relationships: list[dict] = []
+    marriages: list[dict] = []
+    next_id = 0
+
+    def _new_person() -> str:
+        nonlocal next_id
+        next_id += 1
+        return f"P-{next_id}"
+
+    def _rel(child_id: str, parent_id: str, relation_type: str) -> dict:
+        return {
+            "child_id": child_id,
+            "parent_id": parent_id,
+            "relation_type": relation_type,
+            "parent_name": f"Ten {parent_id}",
+            "child_name": f"Ten {child_id}",
+        }
+
+    if wide_family:
+        father_id, mother_id = _new_person(), _new_person()
+        for _ in range(wide_family):
+            child_id = _new_person()
+            relationships.append(_rel(child_id, father_id, "father"))
+            relationships.append(_rel(child_id, mother_id, "mother"))
+
+    while len(relationships) < size:
+        father_id, mother_id = _new_person(), _new_person()
+        marriages.append({"person_id": father_id, "spouse_person_id": mother_id, "spouse_name": f"Ten {mother_id}"})
+        marriages.append({"person_id": mother_id, "spouse_person_id": father_id, "spouse_name": f"Ten {father_id}"})
+        if rng.random() < WIDE_SHARE / WIDE_FAMILY_SIZE * 2:
+            child_count = WIDE_FAMILY_SIZE
+        else:
+            child_count = rng.randint(*NORMAL_FAMILY_SIZE)
+        for _ in range(child_count):
+            child_id = _new_person()
+            relationships.append(_rel(child_id, father_id, "father"))
+            relationships.append(_rel(child_id, mother_id, "mother"))
+    # Một ít dòng trùng (import lặp) để đường khử trùng thực sự chạy
+    relationships.extend(rng.sample(relationships, int(len(relationships) * DUPLICATE_SHARE)))
+    rng.shuffle(relationships)
+    relationships = relationships[:size]
+    person_names = [{"person_id": f"P-{i}", "full_name": f"Ten P-{i}"} for i in range(1, next_id + 1)]
+    return relationships, marriages, person_names
+
+
+def _legacy_children_map(rows: list[dict]) -> dict[str, list[str]]:
+    """Thuật toán cũ: kiểm tra trùng bằng `not in list` (để so sánh)."""
+    children_map: dict[str, list[str]] = {}
+    for row in rows:
+        if isinstance(row, dict):
+            parent_id = row["parent_id"]
+            child_id = row["child_id"]
+        else:
+            parent_id = row[0]
+            child_id = row[1]
+        if parent_id and child_id:
+            if parent_id not in children_map:
+                children_map[parent_id] = []
+            if child_id not in children_map[parent_id]:
+                children_map[parent_id].append(child_id)
+    return children_map
+
+
+def _best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main() -> int:
+    args = _parse_args()
+    rng = random.Random(args.seed)
+    print(f"{'case':<34}{'rows':>10}{'best ms':>12}")
+    for size in args.sizes:
+        relationships, marriages, person_names = _synthetic_rows(size, rng, args.wide_family)
+        child_rows = [{"parent_id": r["parent_id"], "child_id": r["child_id"]} for r in relationships]
+
+        cases: list[tuple[str, Callable[[], Any]]] = [
+            ("build_children_map", lambda: build_children_map(_FakeCursor([child_rows]))),
+            (
+                "load_relationship_data",
+                lambda: load_relationship_data(_FakeCursor([marriages, relationships, person_names])),
+            ),
+        ]
+        if args.with_legacy:
+            cases.append(("build_children_map (legacy list)", lambda: _legacy_children_map(child_rows)))
+
+        for label, fn in cases:
+            print(f"{label:<34}{size:>10}{_best_of(args.repeat, fn):>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,14 @@
 """
 Production backup parity restore drill.
-Restores a backup SQL file into a throwaway MySQL testcontainer and verifies row counts.
+Restores a backup SQL file (plain, .sql.gz or .sql.zst) into a throwaway MySQL testcontainer
+and verifies row counts.
+
+Given an incremental file (tbqc_backup_*_incNNN.sql.gz), the base and every earlier
+incremental listed in its manifest are replayed first, in order, on one connection.
 
 Usage:
     python scripts/run_backup_restore_drill.py backups/tbqc_backup_20260522_064546.sql
+    python scripts/run_backup_restore_drill.py backups/tbqc_backup_20260601_090000_inc004.sql.gz
 """
 
 import random
@@ -14,6 +19,12 @@ from pathlib import Path
 import mysql.connector
 from testcontainers.mysql import MySqlContainer
 
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from services.sql_dump import open_dump_reader, read_manifest
+
 BACKUP_FILE = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("backups/tbqc_backup_20260522_064546.sql")
 MYSQL_IMAGE = "mysql:8.4"
 
@@ -37,6 +48,29 @@ def _split_statements(sql_text):
     return statements
 
 
+def _restore_chain(backup_file):
+    """Files to replay, oldest first: base + incrementals up to backup_file (manifest `chain`)."""
+    manifest = read_manifest(backup_file) or {}
+    chain = manifest.get("chain") or [backup_file.name]
+    files = [backup_file.parent / name for name in chain]
+    missing = [str(f) for f in files if not f.exists()]
+    if missing:
+        print(f"ERROR: backup chain incomplete, missing: {', '.join(missing)}")
+        sys.exit(1)
+    return files
+
+
+def _load_statements(path):
+    with open_dump_reader(path) as fh:
+        sql_text = fh.read()
+    # Verify header
+    first_line = sql_text.splitlines()[0].strip()
+    assert "TBQC Database Backup" in first_line, f"Unexpected header: {first_line}"
+    statements = _split_statements(sql_text)
+    print(f"  {path.name}: {first_line} — {len(statements)} statements")
+    return statements
+
+
 def main():
     if not BACKUP_FILE.exists():
         print(f"ERROR: backup file not found: {BACKUP_FILE}")
@@ -45,13 +79,11 @@ def main():
     print(f"Backup file : {BACKUP_FILE}")
     print(f"File size   : {BACKUP_FILE.stat().st_size:,} bytes")
 
-    sql_text = BACKUP_FILE.read_text(encoding="utf-8")
-    # Verify header
-    first_line = sql_text.splitlines()[0].strip()
-    assert "TBQC Database Backup" in first_line, f"Unexpected header: {first_line}"
-    print(f"Header      : {first_line} — OK")
-
-    statements = _split_statements(sql_text)
+    chain = _restore_chain(BACKUP_FILE)
+    print(f"Chain       : {len(chain)} file(s)")
+    statements = []
+    for path in chain:
+        statements.extend(_load_statements(path))
     print(f"Statements  : {len(statements)} parsed")
 
     print(f"\nStarting MySQL {MYSQL_IMAGE} testcontainer...")
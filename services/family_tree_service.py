@@ -69,8 +69,44 @@ def get_relationships():
             connection.close()
 
 
+def _get_children_subtrees(parent_id):
+    """
+    /api/children/<parent_id>?format=tree&depth=N: các node con cùng dạng /api/tree, mở rộng
+    tối đa depth đời (mặc định 1); node sâu hơn trả "collapsed"/"child_count" để client mở tiếp.
+    """
+    from folder_py.genealogy_tree import build_tree
+    from services.genealogy_graph import get_genealogy_snapshot
+    from utils.validation import validate_integer
+
+    depth = validate_integer(request.args.get("depth", 1), min_val=1, max_val=5, default=1)
+    snapshot = get_genealogy_snapshot()
+    if snapshot is None:
+        return (jsonify({"error": "Không thể kết nối database"}), 500)
+    if not snapshot.has_person(parent_id):
+        return (jsonify({"error": "Không tìm thấy người"}), 404)
+    children = []
+    for child_id in snapshot.children_map.get(parent_id, []):
+        node = build_tree(
+            child_id,
+            snapshot.persons_by_id,
+            snapshot.children_map,
+            1,
+            depth,
+            collapse_depth=depth,
+            payload_cache=snapshot.tree_payloads,
+        )
+        if node:
+            children.append(node)
+    return jsonify(children)
+
+
 def get_children(parent_id):
     """Lấy con của một người (schema mới)"""
+    if request.args.get("format") == "tree":
+        try:
+            return _get_children_subtrees(parent_id)
+        except Error as e:
+            return (jsonify({"error": str(e)}), 500)
     connection = get_db_connection()
     if not connection:
         return (jsonify({"error": "Không thể kết nối database"}), 500)
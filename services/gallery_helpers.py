@@ -3,7 +3,9 @@
 import logging
 import os
 
+from services.image_serving import invalidate_image_path
 from services.members_service import get_members_password
+from utils.image_thumbnails import remove_image_derivatives
 from utils.validation import secure_compare
 
 logger = logging.getLogger(__name__)
@@ -148,6 +150,14 @@ def _delete_album_image_file(filepath, thumbnail_filepath=None):
         os.remove(file_path)
         deleted = True
 
+    # Thumbnail / các bậc responsive sinh nền có thể chưa được ghi vào DB → xoá theo đường dẫn ảnh gốc
+    image_root = next((r for r in allowed_roots if file_path.startswith(r + os.sep)), None)
+    if image_root:
+        rel_path = os.path.relpath(file_path, image_root).replace(os.sep, "/")
+        if remove_image_derivatives(rel_path, source_path=file_path):
+            deleted = True
+        invalidate_image_path(rel_path)
+
     if thumbnail_filepath:
         thumb_path = os.path.abspath(thumbnail_filepath)
         if any(thumb_path == root or thumb_path.startswith(root + os.sep) for root in allowed_roots):
@@ -11,6 +11,9 @@ from db import get_db_connection
 from extensions import limiter
 from utils.validation import validate_filename, validate_person_id
 from services.activities_service import is_admin_user
+from services.lineage_engine import collation_key
+from services.schema_registry import has_column
+from services.search_index import find_person_ids
 from services.gallery_helpers import (
     _geoapify_server_key_from_env,
     _geoapify_browser_key_from_env,
@@ -20,41 +23,46 @@ from services.gallery_helpers import (
     ensure_album_images_table,
     _delete_album_image_file,
 )
-from utils.image_thumbnails import ensure_thumbnail_for_image, get_thumbnail_url
+from services.image_serving import invalidate_image_path, record_image_etag, send_image
+from services.thumbnail_jobs import enqueue_image_jobs, image_srcset_or_enqueue, thumbnail_url_or_enqueue
+from utils.image_thumbnails import remove_image_derivatives, thumbnail_target
 
 logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_DECEASED_KEY = collation_key('Đã mất')
 
 
 def _hydrate_album_image_thumbnail(cursor, image_row):
+    """Gắn thumbnail_url + srcset cho ảnh album. Thumbnail / các bậc chưa có thì xếp job nền và tạm
+    trả ảnh gốc (srcset None); khi thumbnail đã có thì lưu metadata vào album_images (một lần)."""
     if not image_row:
         return image_row
 
-    thumb_url = get_thumbnail_url(
+    thumb_url = thumbnail_url_or_enqueue(
         image_row.get("thumbnail_url") or image_row.get("url"),
         source_path=image_row.get("thumbnail_filepath") or image_row.get("filepath"),
-        create_if_missing=not image_row.get("thumbnail_url"),
     )
     if thumb_url and thumb_url != image_row.get("thumbnail_url"):
         image_row["thumbnail_url"] = thumb_url
-        if image_row.get("image_id") and thumb_url.startswith("/static/images/"):
-            _, thumb_filepath = ensure_thumbnail_for_image(image_row.get("url"), source_path=image_row.get("filepath"))
-            if thumb_filepath:
-                image_row["thumbnail_filepath"] = thumb_filepath
-                try:
-                    cursor.execute(
-                        """
-                        UPDATE album_images
-                        SET thumbnail_url = %s, thumbnail_filepath = %s
-                        WHERE image_id = %s
-                        """,
-                        (thumb_url, thumb_filepath, image_row["image_id"]),
-                    )
-                except Exception as exc:
-                    logger.warning("Could not persist album thumbnail metadata for image %s: %s", image_row.get("image_id"), exc)
+        target = thumbnail_target(image_row.get("url"), source_path=image_row.get("filepath"))
+        if image_row.get("image_id") and target and thumb_url == target[2]:
+            thumb_filepath = str(target[3])
+            image_row["thumbnail_filepath"] = thumb_filepath
+            try:
+                cursor.execute(
+                    """
+                    UPDATE album_images
+                    SET thumbnail_url = %s, thumbnail_filepath = %s
+                    WHERE image_id = %s
+                    """,
+                    (thumb_url, thumb_filepath, image_row["image_id"]),
+                )
+            except Exception as exc:
+                logger.warning("Could not persist album thumbnail metadata for image %s: %s", image_row.get("image_id"), exc)
     elif not image_row.get("thumbnail_url"):
         image_row["thumbnail_url"] = image_row.get("url")
 
+    image_row["srcset"] = image_srcset_or_enqueue(image_row.get("url"), source_path=image_row.get("filepath"))
     return image_row
 
 
@@ -243,8 +251,9 @@ def upload_grave_image():
             logger.error(f'Failed to save grave image to {filepath}')
             return (jsonify({'success': False, 'error': 'Không thể lưu file ảnh'}), 500)
         image_url = f'/static/images/graves/{safe_filename}'
-        cursor.execute("SHOW COLUMNS FROM persons LIKE 'grave_image_url'")
-        has_grave_image_url = cursor.fetchone() is not None
+        record_image_etag(image_url, source_path=filepath)
+        enqueue_image_jobs(image_url, source_path=filepath)
+        has_grave_image_url = has_column('persons', 'grave_image_url', cursor=cursor)
         if has_grave_image_url:
             cursor.execute('\n                UPDATE persons \n                SET grave_image_url = %s \n                WHERE person_id = %s\n            ', (image_url, person_id))
         else:
@@ -330,10 +339,11 @@ def delete_grave_image():
             if os.path.exists(filepath):
                 os.remove(filepath)
                 logger.info(f'Deleted grave image file: {filepath}')
+            remove_image_derivatives(f'graves/{filename}', source_path=filepath)
+            invalidate_image_path(f'graves/{filename}')
         except Exception as e:
             logger.warning(f'Could not delete image file: {e}. Continuing with database update.')
-        cursor.execute("SHOW COLUMNS FROM persons LIKE 'grave_image_url'")
-        has_grave_image_url = cursor.fetchone() is not None
+        has_grave_image_url = has_column('persons', 'grave_image_url', cursor=cursor)
         if has_grave_image_url:
             cursor.execute('\n                UPDATE persons \n                SET grave_image_url = NULL \n                WHERE person_id = %s\n            ', (person_id,))
         else:
@@ -385,17 +395,43 @@ def search_grave():
             return (jsonify({'success': False, 'error': 'Không thể kết nối database'}), 500)
         cursor = connection.cursor(dictionary=True)
         search_pattern = f'%{query}%'
-        cursor.execute("SHOW COLUMNS FROM persons LIKE 'grave_image_url'")
-        has_grave_image_url = cursor.fetchone() is not None
+        has_grave_image_url = has_column('persons', 'grave_image_url', cursor=cursor)
         if has_grave_image_url:
             select_fields = '\n                p.person_id,\n                p.full_name,\n                p.alias,\n                p.gender,\n                p.generation_level,\n                p.birth_date_solar,\n                p.death_date_solar,\n                p.grave_info,\n                p.grave_image_url,\n                p.place_of_death,\n                p.home_town\n            '
         else:
             select_fields = '\n                p.person_id,\n                p.full_name,\n                p.alias,\n                p.gender,\n                p.generation_level,\n                p.birth_date_solar,\n                p.death_date_solar,\n                p.grave_info,\n                NULL as grave_image_url,\n                p.place_of_death,\n                p.home_town\n            '
-        if autocomplete_only:
-            cursor.execute(f"\n            SELECT \n                {select_fields}\n            FROM persons p\n            WHERE p.status = 'Đã mất'\n            AND (p.full_name LIKE %s OR p.person_id LIKE %s OR p.alias LIKE %s)\n                ORDER BY \n                    CASE WHEN p.grave_info IS NOT NULL AND p.grave_info != '' THEN 0 ELSE 1 END,\n                    p.full_name ASC\n                LIMIT 20\n            ", (search_pattern, search_pattern, search_pattern))
+        result_limit = 20 if autocomplete_only else 50
+        # Chỉ mục trong bộ nhớ (không dấu, tiền tố, xếp hạng); None → LIKE như trước.
+        # Giữ thứ tự cũ: người đã có grave_info lên trước, trong nhóm theo hạng tìm kiếm.
+        ranked_ids = find_person_ids(
+            cursor,
+            query,
+            predicate=lambda person: collation_key(person.get('status')) == _DECEASED_KEY,
+            prefer=lambda person: 0 if (person.get('grave_info') or '').strip() else 1,
+            limit=result_limit,
+        )
+        if ranked_ids is not None:
+            results = []
+            if ranked_ids:
+                cursor.execute(
+                    f"SELECT {select_fields} FROM persons p WHERE p.status = 'Đã mất' AND p.person_id IN ("
+                    + ', '.join(['%s'] * len(ranked_ids)) + ')',
+                    tuple(ranked_ids),
+                )
+                position = {person_id: i for i, person_id in enumerate(ranked_ids)}
+                results = sorted(
+                    cursor.fetchall(),
+                    key=lambda row: (
+                        0 if (row.get('grave_info') or '').strip() else 1,
+                        position.get(row.get('person_id'), len(position)),
+                    ),
+                )
         else:
-            cursor.execute(f"\n                SELECT \n                    {select_fields}\n                FROM persons p\n                WHERE p.status = 'Đã mất'\n                AND (p.full_name LIKE %s OR p.person_id LIKE %s OR p.alias LIKE %s)\n                ORDER BY \n                    CASE WHEN p.grave_info IS NOT NULL AND p.grave_info != '' THEN 0 ELSE 1 END,\n                    p.full_name ASC\n            LIMIT 50\n        ", (search_pattern, search_pattern, search_pattern))
-        results = cursor.fetchall()
+            if autocomplete_only:
+                cursor.execute(f"\n            SELECT \n                {select_fields}\n            FROM persons p\n            WHERE p.status = 'Đã mất'\n            AND (p.full_name LIKE %s OR p.person_id LIKE %s OR p.alias LIKE %s)\n                ORDER BY \n                    CASE WHEN p.grave_info IS NOT NULL AND p.grave_info != '' THEN 0 ELSE 1 END,\n                    p.full_name ASC\n                LIMIT 20\n            ", (search_pattern, search_pattern, search_pattern))
+            else:
+                cursor.execute(f"\n                SELECT \n                    {select_fields}\n                FROM persons p\n                WHERE p.status = 'Đã mất'\n                AND (p.full_name LIKE %s OR p.person_id LIKE %s OR p.alias LIKE %s)\n                ORDER BY \n                    CASE WHEN p.grave_info IS NOT NULL AND p.grave_info != '' THEN 0 ELSE 1 END,\n                    p.full_name ASC\n            LIMIT 50\n        ", (search_pattern, search_pattern, search_pattern))
+            results = cursor.fetchall()
         graves = []
         for row in results:
             grave_info = row.get('grave_info', '').strip()
@@ -509,7 +545,10 @@ def upload_image():
             image_url = f'/static/images/album_{album_id}/{safe_filename}'
         else:
             image_url = f'/static/images/{safe_filename}'
-        thumbnail_url, thumbnail_filepath = ensure_thumbnail_for_image(image_url, source_path=filepath)
+        # Thumbnail + các bậc responsive tạo nền (services.thumbnail_jobs); listing trả ảnh gốc tới khi xong
+        record_image_etag(image_url, source_path=filepath)
+        enqueue_image_jobs(image_url, source_path=filepath)
+        thumbnail_url = thumbnail_filepath = None
         if album_id:
             conn = get_db_connection()
             cursor = conn.cursor(dictionary=True)
@@ -582,70 +621,20 @@ def serve_image_static(filename):
                   Name of the image file to serve (can be album_X/filename)
     """
     from urllib.parse import unquote
-    import os
+    from flask import abort
     filename = unquote(filename)
     path_parts = filename.split('/')
-    if len(path_parts) > 1:
-        subfolder = path_parts[0]
-        actual_filename = '/'.join(path_parts[1:])
-        try:
-            validate_filename(subfolder)
-            validate_filename(actual_filename)
-        except ValueError as e:
-            logger.warning(f'[Serve Image Static] Invalid filename: {e}')
-            from flask import abort
-            abort(400)
-        try:
-            volume_mount_path = os.environ.get('RAILWAY_VOLUME_MOUNT_PATH')
-            if volume_mount_path and os.path.exists(volume_mount_path):
-                volume_filepath = os.path.join(volume_mount_path, subfolder, actual_filename)
-                if os.path.exists(volume_filepath):
-                    logger.debug(f'[Serve Image] Serving from volume: {filename}')
-                    return send_from_directory(os.path.join(volume_mount_path, subfolder), actual_filename)
-            static_images_path = os.path.join(BASE_DIR, 'static', 'images', subfolder)
-            file_path = os.path.join(static_images_path, actual_filename)
-            if os.path.exists(file_path):
-                logger.debug(f'[Serve Image] Serving from static/images/{subfolder}: {actual_filename}')
-                return send_from_directory(static_images_path, actual_filename)
-            logger.debug(f'[Serve Image] File không tồn tại: {filename}')
-            from flask import abort
-            abort(404)
-        except Exception as e:
-            if '404' in str(e) or 'not found' in str(e).lower():
-                logger.debug(f'[Serve Image] File không tìm thấy: {filename}')
-            else:
-                logger.error(f"[Serve Image] Flask's static serving failed: {e}")
-            from flask import abort
-            abort(404)
-    else:
-        try:
+    try:
+        if len(path_parts) > 1:
+            validate_filename(path_parts[0])
+            validate_filename('/'.join(path_parts[1:]))
+        else:
             filename = validate_filename(filename)
-        except ValueError as e:
-            logger.warning(f'[Serve Image Static] Invalid filename: {e}')
-            from flask import abort
-            abort(400)
-        try:
-            volume_mount_path = os.environ.get('RAILWAY_VOLUME_MOUNT_PATH')
-            if volume_mount_path and os.path.exists(volume_mount_path):
-                volume_filepath = os.path.join(volume_mount_path, filename)
-                if os.path.exists(volume_filepath):
-                    logger.debug(f'[Serve Image] Serving from volume: {filename}')
-                    return send_from_directory(volume_mount_path, filename)
-            static_images_path = os.path.join(BASE_DIR, 'static', 'images')
-            file_path = os.path.join(static_images_path, filename)
-            if os.path.exists(file_path):
-                logger.debug(f'[Serve Image] Serving from static/images: {filename}')
-                return send_from_directory('static/images', filename)
-            logger.debug(f'[Serve Image] File không tồn tại: {filename}')
-            from flask import abort
-            abort(404)
-        except Exception as e:
-            if '404' in str(e) or 'not found' in str(e).lower():
-                logger.debug(f'[Serve Image] File không tìm thấy: {filename}')
-            else:
-                logger.error(f"[Serve Image] Flask's static serving failed: {e}")
-            from flask import abort
-            abort(404)
+    except ValueError as e:
+        logger.warning(f'[Serve Image Static] Invalid filename: {e}')
+        abort(400)
+    # Volume rồi static/images; đường dẫn + ETag cache trong services.image_serving, có 304
+    return send_image(filename)
 
 def api_gallery_anh1():
     """
@@ -1067,17 +1056,4 @@ def serve_image(filename):
     except ValueError as e:
         logger.warning(f'[Serve Image] Invalid filename: {e}')
         abort(400)
-    volume_mount_path = os.environ.get('RAILWAY_VOLUME_MOUNT_PATH')
-    if volume_mount_path and os.path.exists(volume_mount_path):
-        volume_filepath = os.path.join(volume_mount_path, filename)
-        volume_filepath = os.path.normpath(volume_filepath)
-        if volume_filepath.startswith(os.path.normpath(volume_mount_path)) and os.path.exists(volume_filepath):
-            return send_from_directory(volume_mount_path, filename)
-    static_images_path = os.path.join(BASE_DIR, 'static', 'images')
-    if os.path.exists(static_images_path):
-        file_path = os.path.join(static_images_path, filename)
-        file_path = os.path.normpath(file_path)
-        if file_path.startswith(os.path.normpath(static_images_path)):
-            return send_from_directory(static_images_path, filename)
-    logger.debug(f'[Serve Image] File không tìm thấy: {filename}')
-    abort(404)
+    return send_image(filename)
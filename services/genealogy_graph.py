@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot đồ thị gia phả trong bộ nhớ (mỗi worker một bản).
+
+/api/tree, /api/ancestors, /api/members, /api/search, /api/person trước đây mỗi request
+đều quét lại persons + relationships + marriages. Snapshot gom một lần:
+- persons_by_id (load_persons_data), children_map / parent_map (relationships),
+- spouse_map + marriage_rows (marriages),
+- relationship_data (load_relationship_data — cùng cấu trúc /api/members).
+
+Vòng đời:
+- Build lười ở request đầu tiên, giữ tối đa GENEALOGY_SNAPSHOT_TTL giây (mặc định 300,
+  bằng timeout cache 'api_members_data'; 0 = tắt snapshot, luôn đọc DB).
+- Các write path gọi invalidate_genealogy_snapshot(): tăng version trong worker và đổi token
+  version dùng chung (services.shared_cache) — worker khác thấy token đổi thì build lại, khoá
+  cache 'api_members_data' gắn token cũ cũng hết hiệu lực.
+- Version tăng mỗi lần invalidate; bản build dở dang có version cũ sẽ không được cài.
+
+Snapshot là dữ liệu dùng chung giữa các thread: caller CHỈ ĐỌC, không sửa dict/list trả về.
+"""
+import logging
+import os
+import threading
+import time
+
+from db import get_db_connection
+from folder_py.genealogy_tree import build_children_map, build_parent_map, load_persons_data
+from services.lineage_engine import LineageGraph
+from services.person_helpers import load_relationship_data
+from services.shared_cache import bump_data_version, get_data_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_TTL_SECONDS = 300
+# Số lần build lại khi snapshot bị invalidate trong lúc đang build
+_BUILD_ATTEMPTS = 2
+
+_lock = threading.Lock()
+_snapshot = None
+_version = 0
+
+
+def _snapshot_ttl():
+    raw = (os.environ.get('GENEALOGY_SNAPSHOT_TTL') or '').strip()
+    if not raw:
+        return DEFAULT_SNAPSHOT_TTL_SECONDS
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        logger.warning('GENEALOGY_SNAPSHOT_TTL=%r khong hop le, dung mac dinh %s', raw, DEFAULT_SNAPSHOT_TTL_SECONDS)
+        return DEFAULT_SNAPSHOT_TTL_SECONDS
+
+
+def snapshot_enabled():
+    """False khi GENEALOGY_SNAPSHOT_TTL=0 (luôn đọc DB)."""
+    return _snapshot_ttl() > 0
+
+
+class GenealogySnapshot:
+    """Ảnh chụp bất biến của đồ thị gia phả tại một version."""
+
+    __slots__ = (
+        'version',
+        'built_at',
+        'persons_by_id',
+        'children_map',
+        'parent_map',
+        'spouse_map',
+        'marriage_rows',
+        'relationship_data',
+        'tree_payloads',
+        'tree_json_fragments',
+        'lineage',
+        'data_version',
+        'search_index',
+    )
+
+    def __init__(
+        self,
+        version,
+        persons_by_id,
+        children_map,
+        parent_map,
+        marriage_rows,
+        relationship_data,
+        relationship_rows=(),
+        data_version=None,
+    ):
+        self.version = version
+        # Token version dùng chung lúc build (None = không có cache chung)
+        self.data_version = data_version
+        self.built_at = time.monotonic()
+        self.persons_by_id = persons_by_id
+        self.children_map = children_map
+        self.parent_map = parent_map
+        self.marriage_rows = marriage_rows
+        self.relationship_data = relationship_data
+        spouse_map = {}
+        for husband_id, wife_id in marriage_rows:
+            spouse_map.setdefault(husband_id, []).append(wife_id)
+            spouse_map.setdefault(wife_id, []).append(husband_id)
+        self.spouse_map = spouse_map
+        # Cache dùng chung cho build_tree / iter_tree_json (payload + mảnh JSON theo person_id)
+        self.tree_payloads = {}
+        self.tree_json_fragments = {}
+        # Chỉ mục cho /api/ancestors, /api/descendants (services.lineage_engine)
+        self.lineage = LineageGraph(persons_by_id, relationship_rows)
+        # Chỉ mục /api/search, /api/grave-search — build lười (services.search_index)
+        self.search_index = None
+
+    def is_fresh(self, ttl):
+        return ttl > 0 and (time.monotonic() - self.built_at) < ttl
+
+    def has_person(self, person_id):
+        return person_id in self.persons_by_id
+
+    def first_person_id(self):
+        """Tương đương ORDER BY generation_level ASC, person_id ASC LIMIT 1 (NULL đứng đầu như MySQL)."""
+        if not self.persons_by_id:
+            return None
+
+        def _key(pid):
+            gen = self.persons_by_id[pid].get('generation_level')
+            return (gen is not None, gen if gen is not None else 0, pid)
+
+        return min(self.persons_by_id, key=_key)
+
+    def marriage_pairs_in_scope(self, id_set):
+        """Giống genealogy_sync._fetch_marriage_pairs_in_scope nhưng đọc từ snapshot."""
+        if not id_set:
+            return []
+        pairs = []
+        seen = set()
+        for a, b in self.marriage_rows:
+            if a not in id_set or b not in id_set or a == b:
+                continue
+            key = tuple(sorted((a, b)))
+            if key in seen:
+                continue
+            seen.add(key)
+            pairs.append([key[0], key[1]])
+        return pairs
+
+
+def _load_relationship_rows(cursor):
+    """Toàn bộ relationships (mọi relation_type) theo thứ tự đọc, dạng (child_id, parent_id, relation_type)."""
+    cursor.execute('SELECT child_id, parent_id, relation_type FROM relationships')
+    rows = []
+    for row in cursor.fetchall() or []:
+        if isinstance(row, dict):
+            rows.append((row.get('child_id'), row.get('parent_id'), row.get('relation_type')))
+        else:
+            rows.append((row[0], row[1], row[2]))
+    return rows
+
+
+def _load_marriage_rows(cursor):
+    cursor.execute('SELECT husband_id, wife_id FROM marriages')
+    rows = []
+    for row in cursor.fetchall() or []:
+        if isinstance(row, dict):
+            a = row.get('husband_id')
+            b = row.get('wife_id')
+        else:
+            a, b = row[0], row[1]
+        if a and b:
+            rows.append((str(a), str(b)))
+    return rows
+
+
+def build_genealogy_snapshot(cursor, version=0, data_version=None):
+    """Đọc toàn bộ đồ thị bằng cursor (dictionary=True) và trả về GenealogySnapshot."""
+    persons_by_id = load_persons_data(cursor)
+    children_map = build_children_map(cursor)
+    parent_map = build_parent_map(cursor)
+    marriage_rows = _load_marriage_rows(cursor)
+    relationship_rows = _load_relationship_rows(cursor)
+    relationship_data = load_relationship_data(cursor)
+    return GenealogySnapshot(
+        version,
+        persons_by_id,
+        children_map,
+        parent_map,
+        marriage_rows,
+        relationship_data,
+        relationship_rows,
+        data_version,
+    )
+
+
+def _is_current(snapshot, ttl, data_version):
+    return (
+        snapshot is not None
+        and snapshot.version == _version
+        and snapshot.data_version == data_version
+        and snapshot.is_fresh(ttl)
+    )
+
+
+def get_genealogy_snapshot(cursor=None):
+    """
+    Trả về snapshot còn hạn; build lại nếu chưa có / hết hạn / đã bị invalidate.
+
+    cursor: cursor dictionary=True của caller (nếu có) để build không cần mở connection mới.
+    Trả về None khi không kết nối được DB (không có cursor và không mở được connection).
+    Snapshot bị tắt (TTL=0): vẫn build (bằng cursor của caller hoặc connection tự mở) và trả về,
+    nhưng không cài vào cache — mỗi lần gọi build lại.
+    Lỗi SQL (mysql.connector.Error) được ném lại cho caller xử lý như trước.
+    """
+    global _snapshot
+    ttl = _snapshot_ttl()
+    # Đọc token trước khi build: worker khác ghi trong lúc build thì lần sau token đã khác
+    data_version = get_data_version()
+    current = _snapshot
+    if _is_current(current, ttl, data_version):
+        return current
+
+    connection = None
+    own_cursor = None
+    try:
+        if cursor is None:
+            connection = get_db_connection()
+            if not connection:
+                return None
+            own_cursor = connection.cursor(dictionary=True)
+            cursor = own_cursor
+        # Build ngoài _lock: invalidate + reader khác không phải chờ cả lần quét DB.
+        # Lock chỉ giữ khi đọc version và khi cài bản mới.
+        for attempt in range(_BUILD_ATTEMPTS):
+            if attempt:
+                # Lần build trước bị invalidate (token chung cũng đã đổi): đọc lại token
+                data_version = get_data_version()
+            with _lock:
+                current = _snapshot
+                if _is_current(current, ttl, data_version):
+                    return current
+                version = _version
+            started = time.monotonic()
+            snapshot = build_genealogy_snapshot(cursor, version, data_version)
+            with _lock:
+                installed = version == _version
+                if installed and ttl > 0:
+                    _snapshot = snapshot
+            logger.info(
+                'Genealogy snapshot v%s built: %s persons, %s parents, %s marriages (%.0f ms)%s',
+                version,
+                len(snapshot.persons_by_id),
+                len(snapshot.children_map),
+                len(snapshot.marriage_rows),
+                (time.monotonic() - started) * 1000,
+                '' if installed else ' — invalidated while building, discarded',
+            )
+            if installed:
+                return snapshot
+        # Ghi liên tục trong lúc build: trả bản mới nhất vừa build nhưng không cài
+        return snapshot
+    finally:
+        if own_cursor is not None:
+            try:
+                own_cursor.close()
+            except Exception:
+                pass
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+def peek_genealogy_snapshot():
+    """Snapshot còn hạn nếu worker đang giữ sẵn; None thay vì build (TTL=0 luôn None)."""
+    current = _snapshot
+    ttl = _snapshot_ttl()
+    if current is None or ttl <= 0:
+        return None
+    return current if _is_current(current, ttl, get_data_version()) else None
+
+
+def get_relationship_data(cursor, person_ids=None):
+    """
+    load_relationship_data qua snapshot; fallback đọc trực tiếp nếu snapshot không dùng được.
+
+    person_ids: caller chỉ trang trí vài người (search, /api/person, chuỗi tổ tiên) → dùng snapshot
+    nếu đang có sẵn, nếu không thì chỉ đọc quan hệ của những người đó (không build cả snapshot).
+    """
+    if person_ids is not None:
+        snapshot = peek_genealogy_snapshot()
+        if snapshot is not None:
+            return snapshot.relationship_data
+        return load_relationship_data(cursor, person_ids=person_ids)
+    try:
+        snapshot = get_genealogy_snapshot(cursor)
+    except Exception as e:
+        logger.warning('Genealogy snapshot unavailable, loading relationship data directly: %s', e)
+        snapshot = None
+    if snapshot is not None:
+        return snapshot.relationship_data
+    return load_relationship_data(cursor)
+
+
+def invalidate_genealogy_snapshot():
+    """Gọi sau mọi thay đổi persons / relationships / marriages; báo cho mọi worker qua cache chung."""
+    global _snapshot, _version
+    with _lock:
+        _version += 1
+        _snapshot = None
+    bump_data_version()
+    logger.debug('Genealogy snapshot invalidated (next version %s)', _version)
+
+
+def genealogy_snapshot_version():
+    return _version
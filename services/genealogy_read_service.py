@@ -1,16 +1,19 @@
 import logging
 import traceback
 
-from flask import jsonify, request
+from flask import Response, current_app, jsonify, request
 from mysql.connector import Error
 
 from db import get_db_connection
 from services.person_helpers import get_preferred_spouse_names
 from utils.validation import validate_person_id, validate_integer
-from services.person_service import load_relationship_data
-from services.genealogy_sync import (
-    _collect_person_ids_from_tree_node,
-    _fetch_marriage_pairs_in_scope,
+from services.genealogy_sync import _collect_person_ids_from_tree_node
+from services.genealogy_graph import get_genealogy_snapshot, get_relationship_data
+from services.lineage_engine import (
+    children_names_distinct,
+    find_ancestors,
+    find_descendants,
+    resolve_ancestor_target,
 )
 
 logger = logging.getLogger(__name__)
@@ -32,6 +35,7 @@ NGUYEN_PHUOC_LINEAGE_KEYWORDS = (
 try:
     from folder_py.genealogy_tree import (
         build_tree,
+        iter_tree_json,
         build_ancestors_chain,
         build_descendants,
         build_children_map,
@@ -41,6 +45,7 @@ try:
 except ImportError as e:
     logger.warning(f'Cannot import genealogy_tree: {e}')
     build_tree = None
+    iter_tree_json = None
     build_ancestors_chain = None
     build_descendants = None
     build_children_map = None
@@ -48,12 +53,44 @@ except ImportError as e:
     load_persons_data = None
 
 
+# Trần ngân sách node cho /api/tree?max_nodes=...
+MAX_TREE_NODES = 20000
+# Gom các mảnh JSON nhỏ thành khối ~64KB trước khi gửi
+TREE_STREAM_CHUNK_SIZE = 64 * 1024
+
+
 def belongs_to_nguyen_phuoc_lineage(person_name):
     if not person_name:
         return False
     return any(keyword in person_name for keyword in NGUYEN_PHUOC_LINEAGE_KEYWORDS)
 
 
+def _stream_tree_response(tree, fragment_cache=None):
+    """Trả cây dưới dạng JSON stream (iter_tree_json), không dựng cả chuỗi trong RAM."""
+    provider = current_app.json
+
+    def _dumps(obj):
+        return provider.dumps(obj, separators=(',', ':'))
+
+    def _generate():
+        buffer = []
+        size = 0
+        # sort_keys như jsonify: output trùng từng byte với response cũ
+        for piece in iter_tree_json(
+            tree, dumps=_dumps, fragment_cache=fragment_cache, sort_keys=provider.sort_keys
+        ):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= TREE_STREAM_CHUNK_SIZE:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+        buffer.append('\n')
+        yield ''.join(buffer)
+
+    return Response(_generate(), mimetype='application/json')
+
+
 def get_tree():
     """
     Get genealogy tree from root_id up to max_gen (schema mới).
@@ -99,6 +136,32 @@ def get_tree():
             400,
         )
 
+    # max_nodes: ngân sách node; collapse_depth: từ đời này trở xuống chỉ trả child_count.
+    # Nhánh bị thu gọn có "collapsed": true, client mở tiếp qua /api/children/<id>?format=tree
+    try:
+        max_nodes_param = request.args.get('max_nodes')
+        collapse_depth_param = request.args.get('collapse_depth')
+        max_nodes = (
+            validate_integer(max_nodes_param, min_val=1, max_val=MAX_TREE_NODES)
+            if max_nodes_param
+            else None
+        )
+        collapse_depth = (
+            validate_integer(collapse_depth_param, min_val=1, max_val=20)
+            if collapse_depth_param
+            else None
+        )
+    except (ValueError, TypeError) as e:
+        logger.error(f'Invalid max_nodes or collapse_depth parameter: {e}')
+        return (
+            jsonify(
+                {
+                    'error': f'Invalid max_nodes or collapse_depth parameter. max_nodes must be 1-{MAX_TREE_NODES}, collapse_depth 1-20.',
+                }
+            ),
+            400,
+        )
+
     try:
         connection = get_db_connection()
         if not connection:
@@ -114,14 +177,12 @@ def get_tree():
             )
 
         cursor = connection.cursor(dictionary=True)
-        cursor.execute('SELECT person_id FROM persons WHERE person_id = %s', (root_id,))
-        if not cursor.fetchone():
-            cursor.execute(
-                'SELECT person_id FROM persons ORDER BY generation_level ASC, person_id ASC LIMIT 1'
-            )
-            first_row = cursor.fetchone()
-            if first_row:
-                root_id = first_row['person_id']
+        # Snapshot dùng chung trong worker: không quét lại persons/relationships mỗi request
+        snapshot = get_genealogy_snapshot(cursor)
+        if not snapshot.has_person(root_id):
+            first_person_id = snapshot.first_person_id()
+            if first_person_id:
+                root_id = first_person_id
                 logger.info(
                     f'Root {request.args.get("root_id")} not found, using first person: {root_id}'
                 )
@@ -138,15 +199,22 @@ def get_tree():
                     200,
                 )
 
-        persons_by_id = load_persons_data(cursor)
+        persons_by_id = snapshot.persons_by_id
+        children_map = snapshot.children_map
         logger.info(
-            f'Loaded {len(persons_by_id)} persons from database (consistent with /api/members)'
+            f'Using genealogy snapshot v{snapshot.version}: {len(persons_by_id)} persons, '
+            f'{len(children_map)} parents with children'
         )
-        children_map = build_children_map(cursor)
-        logger.info(
-            f'Built children map with {len(children_map)} parent-child relationships'
+        tree = build_tree(
+            root_id,
+            persons_by_id,
+            children_map,
+            1,
+            max_gen,
+            max_nodes=max_nodes,
+            collapse_depth=collapse_depth,
+            payload_cache=snapshot.tree_payloads,
         )
-        tree = build_tree(root_id, persons_by_id, children_map, 1, max_gen)
         if not tree:
             logger.error(f'Could not build tree for root_id={root_id}')
             return (
@@ -160,14 +228,15 @@ def get_tree():
             )
         try:
             tree_ids = _collect_person_ids_from_tree_node(tree)
-            tree["marriage_pairs"] = _fetch_marriage_pairs_in_scope(cursor, tree_ids)
+            tree["marriage_pairs"] = snapshot.marriage_pairs_in_scope(tree_ids)
         except Exception as e:
             logger.warning("Could not attach marriage_pairs to /api/tree: %s", e)
             tree["marriage_pairs"] = []
         logger.info(
-            f'Built tree for root_id={root_id}, max_gen={max_gen}, nodes={len(persons_by_id)}'
+            f'Built tree for root_id={root_id}, max_gen={max_gen}, max_nodes={max_nodes}, '
+            f'collapse_depth={collapse_depth}'
         )
-        return jsonify(tree)
+        return _stream_tree_response(tree, fragment_cache=snapshot.tree_json_fragments)
     except Error as e:
         logger.error(f'Database error in /api/tree: {e}')
         import traceback
@@ -198,8 +267,18 @@ def get_tree():
             connection.close()
 
 
+def _person_fields(lineage, person_id, fields):
+    """Bản sao (caller được sửa) các cột của một người trong snapshot, như SELECT <fields> FROM persons."""
+    person = lineage.persons_by_id.get(person_id)
+    if person is None:
+        return None
+    row = {field: person.get(field) for field in fields}
+    row['person_id'] = person_id
+    return row
+
+
 def get_ancestors(person_id):
-    """Get ancestors chain for a person (schema mới - dùng stored procedure)"""
+    """Get ancestors chain for a person (duyệt trên snapshot gia phả; fallback query / stored procedure)"""
     if not person_id:
         return (jsonify({'error': 'person_id is required'}), 400)
     person_id = str(person_id).strip()
@@ -219,97 +298,117 @@ def get_ancestors(person_id):
         cursor = connection.cursor(dictionary=True)
         father_to_add_to_chain = None
         original_person_id = person_id
+        snapshot = None
         try:
-            cursor.execute('\n                SELECT person_id, full_name, gender, generation_level, father_mother_id\n                FROM persons WHERE person_id = %s\n            ', (person_id,))
-            person_info = cursor.fetchone()
-            if not person_info:
+            snapshot = get_genealogy_snapshot(cursor)
+        except Exception as e:
+            logger.warning(f'[API /api/ancestors/{person_id}] Genealogy snapshot unavailable, falling back to SQL: {e}')
+        lineage = snapshot.lineage if snapshot is not None else None
+        if lineage is not None:
+            # Duyệt trong bộ nhớ: cùng luật chọn cha / ông ngoại và CTE tổ tiên, không query DB
+            if not snapshot.has_person(person_id):
                 logger.warning(f'Person {person_id} not found in database')
                 return (jsonify({'error': f'Person {person_id} not found'}), 404)
-            target_person_id = person_id
-            person_gender = person_info.get('gender', '').strip().upper() if person_info.get('gender') else ''
-            logger.info(f'[API /api/ancestors/{person_id}] Finding father first (gender: {person_gender})')
-            father_id = None
-            cursor.execute("\n                SELECT r.parent_id\n                FROM relationships r\n                WHERE r.child_id = %s AND r.relation_type = 'father'\n                LIMIT 1\n            ", (person_id,))
-            father_rel = cursor.fetchone()
-            if father_rel and father_rel.get('parent_id'):
-                father_id = father_rel.get('parent_id')
-            if not father_id and person_info.get('father_mother_id'):
-                cursor.execute("\n                    SELECT person_id\n                    FROM persons\n                    WHERE father_mother_id = %s\n                        AND generation_level < %s\n                        AND (gender = 'Nam' OR gender IS NULL)\n                    ORDER BY generation_level DESC\n                    LIMIT 1\n                ", (person_info.get('father_mother_id'), person_info.get('generation_level', 999)))
-                father_fm = cursor.fetchone()
-                if father_fm and father_fm.get('person_id'):
-                    father_id = father_fm.get('person_id')
-            if father_id:
-                cursor.execute('\n                    SELECT full_name\n                    FROM persons\n                    WHERE person_id = %s\n                ', (father_id,))
-                father_info = cursor.fetchone()
-                father_name = father_info.get('full_name', '') if father_info else ''
-                is_nguyen_phuoc_lineage = belongs_to_nguyen_phuoc_lineage(father_name)
-                if is_nguyen_phuoc_lineage:
-                    logger.info(f'[API /api/ancestors/{person_id}] Found father: {father_id} ({father_name}), belongs to Nguyen Phuoc lineage, using father for ancestors search')
-                    target_person_id = father_id
+            target_person_id, father_to_add_to_chain = resolve_ancestor_target(
+                lineage, person_id, belongs_to_nguyen_phuoc_lineage
+            )
+            logger.info(
+                f'[API /api/ancestors/{person_id}] In-memory lineage: target_person_id={target_person_id}, '
+                f'father_to_add_to_chain={father_to_add_to_chain}'
+            )
+            ancestors_result = find_ancestors(lineage, target_person_id, max_level)
+        else:
+            try:
+                cursor.execute('\n                SELECT person_id, full_name, gender, generation_level, father_mother_id\n                FROM persons WHERE person_id = %s\n            ', (person_id,))
+                person_info = cursor.fetchone()
+                if not person_info:
+                    logger.warning(f'Person {person_id} not found in database')
+                    return (jsonify({'error': f'Person {person_id} not found'}), 404)
+                target_person_id = person_id
+                person_gender = person_info.get('gender', '').strip().upper() if person_info.get('gender') else ''
+                logger.info(f'[API /api/ancestors/{person_id}] Finding father first (gender: {person_gender})')
+                father_id = None
+                cursor.execute("\n                SELECT r.parent_id\n                FROM relationships r\n                WHERE r.child_id = %s AND r.relation_type = 'father'\n                LIMIT 1\n            ", (person_id,))
+                father_rel = cursor.fetchone()
+                if father_rel and father_rel.get('parent_id'):
+                    father_id = father_rel.get('parent_id')
+                if not father_id and person_info.get('father_mother_id'):
+                    cursor.execute("\n                    SELECT person_id\n                    FROM persons\n                    WHERE father_mother_id = %s\n                        AND generation_level < %s\n                        AND (gender = 'Nam' OR gender IS NULL)\n                    ORDER BY generation_level DESC\n                    LIMIT 1\n                ", (person_info.get('father_mother_id'), person_info.get('generation_level', 999)))
+                    father_fm = cursor.fetchone()
+                    if father_fm and father_fm.get('person_id'):
+                        father_id = father_fm.get('person_id')
+                if father_id:
+                    cursor.execute('\n                    SELECT full_name\n                    FROM persons\n                    WHERE person_id = %s\n                ', (father_id,))
+                    father_info = cursor.fetchone()
+                    father_name = father_info.get('full_name', '') if father_info else ''
+                    is_nguyen_phuoc_lineage = belongs_to_nguyen_phuoc_lineage(father_name)
+                    if is_nguyen_phuoc_lineage:
+                        logger.info(f'[API /api/ancestors/{person_id}] Found father: {father_id} ({father_name}), belongs to Nguyen Phuoc lineage, using father for ancestors search')
+                        target_person_id = father_id
+                    else:
+                        logger.info(f"[API /api/ancestors/{person_id}] Father {father_id} ({father_name}) doesn't belong to Nguyen Phuoc lineage, switching to mother's line")
+                        mother_id = None
+                        cursor.execute("\n                        SELECT r.parent_id\n                        FROM relationships r\n                        WHERE r.child_id = %s AND r.relation_type = 'mother'\n                        LIMIT 1\n                    ", (person_id,))
+                        mother_rel = cursor.fetchone()
+                        if mother_rel and mother_rel.get('parent_id'):
+                            mother_id = mother_rel.get('parent_id')
+                        if mother_id:
+                            cursor.execute("\n                            SELECT r.parent_id\n                            FROM relationships r\n                            WHERE r.child_id = %s AND r.relation_type = 'father'\n                            LIMIT 1\n                        ", (mother_id,))
+                            grandfather_rel = cursor.fetchone()
+                            if grandfather_rel and grandfather_rel.get('parent_id'):
+                                target_person_id = grandfather_rel.get('parent_id')
+                                logger.info(f'[API /api/ancestors/{person_id}] Found maternal grandfather: {target_person_id}, using for ancestors search')
+                            else:
+                                logger.warning(f'[API /api/ancestors/{person_id}] No maternal grandfather found, using person directly')
+                        else:
+                            logger.warning(f'[API /api/ancestors/{person_id}] No mother found, using person directly')
+                        if father_id:
+                            father_to_add_to_chain = father_id
+                            logger.info(f'[API /api/ancestors/{person_id}] Storing father_id {father_id} to add to chain later')
                 else:
-                    logger.info(f"[API /api/ancestors/{person_id}] Father {father_id} ({father_name}) doesn't belong to Nguyen Phuoc lineage, switching to mother's line")
+                    logger.info(f'[API /api/ancestors/{person_id}] No father found, trying to find maternal grandfather')
                     mother_id = None
-                    cursor.execute("\n                        SELECT r.parent_id\n                        FROM relationships r\n                        WHERE r.child_id = %s AND r.relation_type = 'mother'\n                        LIMIT 1\n                    ", (person_id,))
+                    cursor.execute("\n                    SELECT r.parent_id\n                    FROM relationships r\n                    WHERE r.child_id = %s AND r.relation_type = 'mother'\n                    LIMIT 1\n                ", (person_id,))
                     mother_rel = cursor.fetchone()
                     if mother_rel and mother_rel.get('parent_id'):
                         mother_id = mother_rel.get('parent_id')
                     if mother_id:
-                        cursor.execute("\n                            SELECT r.parent_id\n                            FROM relationships r\n                            WHERE r.child_id = %s AND r.relation_type = 'father'\n                            LIMIT 1\n                        ", (mother_id,))
+                        cursor.execute("\n                        SELECT r.parent_id\n                        FROM relationships r\n                        WHERE r.child_id = %s AND r.relation_type = 'father'\n                        LIMIT 1\n                    ", (mother_id,))
                         grandfather_rel = cursor.fetchone()
                         if grandfather_rel and grandfather_rel.get('parent_id'):
                             target_person_id = grandfather_rel.get('parent_id')
                             logger.info(f'[API /api/ancestors/{person_id}] Found maternal grandfather: {target_person_id}, using for ancestors search')
                         else:
-                            logger.warning(f'[API /api/ancestors/{person_id}] No maternal grandfather found, using person directly')
+                            logger.warning(f'[API /api/ancestors/{person_id}] No father or maternal grandfather found, using person directly')
                     else:
-                        logger.warning(f'[API /api/ancestors/{person_id}] No mother found, using person directly')
-                    if father_id:
-                        father_to_add_to_chain = father_id
-                        logger.info(f'[API /api/ancestors/{person_id}] Storing father_id {father_id} to add to chain later')
-            else:
-                logger.info(f'[API /api/ancestors/{person_id}] No father found, trying to find maternal grandfather')
-                mother_id = None
-                cursor.execute("\n                    SELECT r.parent_id\n                    FROM relationships r\n                    WHERE r.child_id = %s AND r.relation_type = 'mother'\n                    LIMIT 1\n                ", (person_id,))
-                mother_rel = cursor.fetchone()
-                if mother_rel and mother_rel.get('parent_id'):
-                    mother_id = mother_rel.get('parent_id')
-                if mother_id:
-                    cursor.execute("\n                        SELECT r.parent_id\n                        FROM relationships r\n                        WHERE r.child_id = %s AND r.relation_type = 'father'\n                        LIMIT 1\n                    ", (mother_id,))
-                    grandfather_rel = cursor.fetchone()
-                    if grandfather_rel and grandfather_rel.get('parent_id'):
-                        target_person_id = grandfather_rel.get('parent_id')
-                        logger.info(f'[API /api/ancestors/{person_id}] Found maternal grandfather: {target_person_id}, using for ancestors search')
-                    else:
-                        logger.warning(f'[API /api/ancestors/{person_id}] No father or maternal grandfather found, using person directly')
-                else:
-                    logger.warning(f'[API /api/ancestors/{person_id}] No father or mother found, using person directly')
-        except Exception as e:
-            logger.error(f'Error checking if person exists: {e}')
-            import traceback
-            logger.error(traceback.format_exc())
-            return (jsonify({'error': f'Database error while checking person: {str(e)}'}), 500)
-        ancestors_result = None
-        try:
-            # sp_get_ancestors còn fallback qua father_mother_id; xem D4 trong plan, không thay đổi cho tới khi có quyết định rõ ở Phase 6/7.
-            cursor.callproc('sp_get_ancestors', [target_person_id, max_level])
-            for result_set in cursor.stored_results():
-                ancestors_result = result_set.fetchall()
-                break
-        except Exception as e:
-            logger.warning(f'Error calling sp_get_ancestors for person_id={target_person_id}: {e}')
-            ancestors_result = None
-        use_direct_query = True
-        if use_direct_query or not ancestors_result or len(ancestors_result) == 0:
-            logger.info(f'[API /api/ancestors/{person_id}] Stored procedure returned empty, using direct query fallback (target_person_id={target_person_id})')
-            try:
-                cursor.execute("\n                    WITH RECURSIVE ancestors AS (\n                        -- Base case: người hiện tại (hoặc cha nếu là con gái)\n                        -- Base case: current person (or father if female)\n                        SELECT \n                            p.person_id,\n                            p.full_name,\n                            p.gender,\n                            p.generation_level,\n                            p.father_mother_id,\n                            0 AS level\n                        FROM persons p\n                        WHERE p.person_id = %s\n                        \n                        UNION ALL\n                        \n                        -- Recursive case: CHA (chỉ theo dòng cha)\n                        SELECT \n                            COALESCE(parent_by_rel.person_id, parent_by_fm.person_id, parent_by_gen.person_id) AS person_id,\n                            COALESCE(parent_by_rel.full_name, parent_by_fm.full_name, parent_by_gen.full_name) AS full_name,\n                            COALESCE(parent_by_rel.gender, parent_by_fm.gender, parent_by_gen.gender) AS gender,\n                            COALESCE(parent_by_rel.generation_level, parent_by_fm.generation_level, parent_by_gen.generation_level) AS generation_level,\n                            COALESCE(parent_by_rel.father_mother_id, parent_by_fm.father_mother_id, parent_by_gen.father_mother_id) AS father_mother_id,\n                            a.level + 1\n                        FROM ancestors a\n                        INNER JOIN persons child ON a.person_id = child.person_id\n                        -- Ưu tiên 1: Tìm cha theo relationships table\n                        LEFT JOIN relationships r ON (\n                            a.person_id = r.child_id\n                            AND r.relation_type = 'father'\n                        )\n                        LEFT JOIN persons parent_by_rel ON (\n                            r.parent_id = parent_by_rel.person_id\n                        )\n                        -- Ưu tiên 2: Tìm cha theo father_mother_id (fallback) - tìm cha gần nhất\n                        LEFT JOIN persons parent_by_fm ON (\n                            parent_by_rel.person_id IS NULL\n                            AND child.father_mother_id IS NOT NULL \n                            AND child.father_mother_id != ''\n                            AND parent_by_fm.father_mother_id = child.father_mother_id\n                            AND parent_by_fm.generation_level < child.generation_level\n                            AND (parent_by_fm.gender = 'Nam' OR parent_by_fm.gender IS NULL)\n                            -- Tìm cha gần nhất (generation_level cao nhất nhưng vẫn < child)\n                            AND parent_by_fm.generation_level = (\n                                SELECT MAX(p2.generation_level)\n                                FROM persons p2\n                                WHERE p2.father_mother_id = child.father_mother_id\n                                    AND p2.generation_level < child.generation_level\n                                    AND (p2.gender = 'Nam' OR p2.gender IS NULL)\n                            )\n                        )\n                        -- Ưu tiên 3: Tìm cha theo generation_level - 1 (suy luận nếu có nhiều người cùng father_mother_id)\n                        -- Đảm bảo tìm được đầy đủ các đời, kể cả khi thiếu thông tin relationships\n                        LEFT JOIN persons parent_by_gen ON (\n                            parent_by_rel.person_id IS NULL\n                            AND parent_by_fm.person_id IS NULL\n                            AND child.father_mother_id IS NOT NULL \n                            AND child.father_mother_id != ''\n                            AND parent_by_gen.father_mother_id = child.father_mother_id\n                            AND parent_by_gen.generation_level = child.generation_level - 1\n                            AND (parent_by_gen.gender = 'Nam' OR parent_by_gen.gender IS NULL)\n                        )\n                        WHERE a.level < %s\n                            AND (parent_by_rel.person_id IS NOT NULL \n                                 OR parent_by_fm.person_id IS NOT NULL \n                                 OR parent_by_gen.person_id IS NOT NULL)\n                    )\n                    SELECT * FROM ancestors \n                    WHERE level > 0 \n                        AND (gender = 'Nam' OR gender IS NULL)\n                    ORDER BY level, generation_level, full_name\n                ", (target_person_id, max_level))
-                ancestors_result = cursor.fetchall()
-                logger.info(f'[API /api/ancestors/{person_id}] Direct query returned {(len(ancestors_result) if ancestors_result else 0)} rows')
-            except Exception as e2:
-                logger.error(f'Error in direct query fallback for person_id={person_id}: {e2}')
+                        logger.warning(f'[API /api/ancestors/{person_id}] No father or mother found, using person directly')
+            except Exception as e:
+                logger.error(f'Error checking if person exists: {e}')
                 import traceback
                 logger.error(traceback.format_exc())
-                ancestors_result = []
+                return (jsonify({'error': f'Database error while checking person: {str(e)}'}), 500)
+            ancestors_result = None
+            try:
+                # sp_get_ancestors còn fallback qua father_mother_id; xem D4 trong plan, không thay đổi cho tới khi có quyết định rõ ở Phase 6/7.
+                cursor.callproc('sp_get_ancestors', [target_person_id, max_level])
+                for result_set in cursor.stored_results():
+                    ancestors_result = result_set.fetchall()
+                    break
+            except Exception as e:
+                logger.warning(f'Error calling sp_get_ancestors for person_id={target_person_id}: {e}')
+                ancestors_result = None
+            use_direct_query = True
+            if use_direct_query or not ancestors_result or len(ancestors_result) == 0:
+                logger.info(f'[API /api/ancestors/{person_id}] Stored procedure returned empty, using direct query fallback (target_person_id={target_person_id})')
+                try:
+                    cursor.execute("\n                    WITH RECURSIVE ancestors AS (\n                        -- Base case: người hiện tại (hoặc cha nếu là con gái)\n                        -- Base case: current person (or father if female)\n                        SELECT \n                            p.person_id,\n                            p.full_name,\n                            p.gender,\n                            p.generation_level,\n                            p.father_mother_id,\n                            0 AS level\n                        FROM persons p\n                        WHERE p.person_id = %s\n                        \n                        UNION ALL\n                        \n                        -- Recursive case: CHA (chỉ theo dòng cha)\n                        SELECT \n                            COALESCE(parent_by_rel.person_id, parent_by_fm.person_id, parent_by_gen.person_id) AS person_id,\n                            COALESCE(parent_by_rel.full_name, parent_by_fm.full_name, parent_by_gen.full_name) AS full_name,\n                            COALESCE(parent_by_rel.gender, parent_by_fm.gender, parent_by_gen.gender) AS gender,\n                            COALESCE(parent_by_rel.generation_level, parent_by_fm.generation_level, parent_by_gen.generation_level) AS generation_level,\n                            COALESCE(parent_by_rel.father_mother_id, parent_by_fm.father_mother_id, parent_by_gen.father_mother_id) AS father_mother_id,\n                            a.level + 1\n                        FROM ancestors a\n                        INNER JOIN persons child ON a.person_id = child.person_id\n                        -- Ưu tiên 1: Tìm cha theo relationships table\n                        LEFT JOIN relationships r ON (\n                            a.person_id = r.child_id\n                            AND r.relation_type = 'father'\n                        )\n                        LEFT JOIN persons parent_by_rel ON (\n                            r.parent_id = parent_by_rel.person_id\n                        )\n                        -- Ưu tiên 2: Tìm cha theo father_mother_id (fallback) - tìm cha gần nhất\n                        LEFT JOIN persons parent_by_fm ON (\n                            parent_by_rel.person_id IS NULL\n                            AND child.father_mother_id IS NOT NULL \n                            AND child.father_mother_id != ''\n                            AND parent_by_fm.father_mother_id = child.father_mother_id\n                            AND parent_by_fm.generation_level < child.generation_level\n                            AND (parent_by_fm.gender = 'Nam' OR parent_by_fm.gender IS NULL)\n                            -- Tìm cha gần nhất (generation_level cao nhất nhưng vẫn < child)\n                            AND parent_by_fm.generation_level = (\n                                SELECT MAX(p2.generation_level)\n                                FROM persons p2\n                                WHERE p2.father_mother_id = child.father_mother_id\n                                    AND p2.generation_level < child.generation_level\n                                    AND (p2.gender = 'Nam' OR p2.gender IS NULL)\n                            )\n                        )\n                        -- Ưu tiên 3: Tìm cha theo generation_level - 1 (suy luận nếu có nhiều người cùng father_mother_id)\n                        -- Đảm bảo tìm được đầy đủ các đời, kể cả khi thiếu thông tin relationships\n                        LEFT JOIN persons parent_by_gen ON (\n                            parent_by_rel.person_id IS NULL\n                            AND parent_by_fm.person_id IS NULL\n                            AND child.father_mother_id IS NOT NULL \n                            AND child.father_mother_id != ''\n                            AND parent_by_gen.father_mother_id = child.father_mother_id\n                            AND parent_by_gen.generation_level = child.generation_level - 1\n                            AND (parent_by_gen.gender = 'Nam' OR parent_by_gen.gender IS NULL)\n                        )\n                        WHERE a.level < %s\n                            AND (parent_by_rel.person_id IS NOT NULL \n                                 OR parent_by_fm.person_id IS NOT NULL \n                                 OR parent_by_gen.person_id IS NOT NULL)\n                    )\n                    SELECT * FROM ancestors \n                    WHERE level > 0 \n                        AND (gender = 'Nam' OR gender IS NULL)\n                    ORDER BY level, generation_level, full_name\n                ", (target_person_id, max_level))
+                    ancestors_result = cursor.fetchall()
+                    logger.info(f'[API /api/ancestors/{person_id}] Direct query returned {(len(ancestors_result) if ancestors_result else 0)} rows')
+                except Exception as e2:
+                    logger.error(f'Error in direct query fallback for person_id={person_id}: {e2}')
+                    import traceback
+                    logger.error(traceback.format_exc())
+                    ancestors_result = []
         ancestors_chain = []
         seen_person_ids = set()
         duplicate_count = 0
@@ -356,7 +455,13 @@ def get_ancestors(person_id):
                 else:
                     ancestors_chain.append({'person_id': person_id_item, 'full_name': row[1] if len(row) > 1 else '', 'gender': row[2] if len(row) > 2 else None, 'generation_level': row[3] if len(row) > 3 else None, 'generation_number': row[3] if len(row) > 3 else None, 'level': row[4] if len(row) > 4 else 0})
         logger.debug(f'Loading relationship data for ancestors chain using shared helper...')
-        relationship_data = load_relationship_data(cursor)
+        if snapshot is not None:
+            relationship_data = snapshot.relationship_data
+        else:
+            # Chỉ đọc quan hệ của chuỗi tổ tiên (và người được thêm vào chuỗi), không cả DB
+            scope_ids = {a.get('person_id') for a in ancestors_chain}
+            scope_ids.update((person_id, original_person_id, father_to_add_to_chain))
+            relationship_data = get_relationship_data(cursor, person_ids=scope_ids)
         parent_data = relationship_data['parent_data']
         children_map = relationship_data['children_map']
         siblings_map = relationship_data['siblings_map']
@@ -380,9 +485,12 @@ def get_ancestors(person_id):
                 ancestor['siblings'] = '; '.join(siblings) if siblings else None
                 ancestor['siblings_infor'] = '; '.join(siblings) if siblings else None
                 try:
-                    cursor.execute("\n                        SELECT GROUP_CONCAT(DISTINCT child.full_name SEPARATOR '; ') AS children_names\n                        FROM relationships r\n                        INNER JOIN persons child ON r.child_id = child.person_id\n                        WHERE r.parent_id = %s\n                            AND r.relation_type IN ('father', 'mother')\n                    ", (ancestor_id,))
-                    children_info = cursor.fetchone()
-                    ancestor['children_infor'] = children_info.get('children_names') if children_info and children_info.get('children_names') else None
+                    if lineage is not None:
+                        ancestor['children_infor'] = children_names_distinct(lineage, ancestor_id)
+                    else:
+                        cursor.execute("\n                        SELECT GROUP_CONCAT(DISTINCT child.full_name SEPARATOR '; ') AS children_names\n                        FROM relationships r\n                        INNER JOIN persons child ON r.child_id = child.person_id\n                        WHERE r.parent_id = %s\n                            AND r.relation_type IN ('father', 'mother')\n                    ", (ancestor_id,))
+                        children_info = cursor.fetchone()
+                        ancestor['children_infor'] = children_info.get('children_names') if children_info and children_info.get('children_names') else None
                 except Exception as e:
                     logger.warning(f'Error fetching children for {ancestor_id}: {e}')
                     ancestor['children_infor'] = None
@@ -394,8 +502,14 @@ def get_ancestors(person_id):
             try:
                 father_already_in_chain = any((a.get('person_id') == father_to_add_to_chain for a in enriched_chain))
                 if not father_already_in_chain:
-                    cursor.execute('\n                        SELECT person_id, full_name, gender, generation_level, status\n                        FROM persons\n                        WHERE person_id = %s\n                    ', (father_to_add_to_chain,))
-                    father_info = cursor.fetchone()
+                    if lineage is not None:
+                        father_info = _person_fields(
+                            lineage, father_to_add_to_chain,
+                            ('person_id', 'full_name', 'gender', 'generation_level', 'status'),
+                        )
+                    else:
+                        cursor.execute('\n                        SELECT person_id, full_name, gender, generation_level, status\n                        FROM persons\n                        WHERE person_id = %s\n                    ', (father_to_add_to_chain,))
+                        father_info = cursor.fetchone()
                     if father_info:
                         rel = parent_data.get(father_to_add_to_chain, {'father_name': None, 'mother_name': None})
                         father_entry = {'person_id': father_info.get('person_id'), 'full_name': father_info.get('full_name', ''), 'gender': father_info.get('gender'), 'generation_level': father_info.get('generation_level'), 'generation_number': father_info.get('generation_level'), 'father_name': rel.get('father_name'), 'mother_name': rel.get('mother_name'), 'level': 999}
@@ -429,8 +543,14 @@ def get_ancestors(person_id):
                 logger.info(f'[API /api/ancestors/{person_id}] All generations present from {min_gen} to {max_gen}')
         person_info = None
         try:
-            cursor.execute('\n                SELECT person_id, full_name, alias, gender, generation_level, status\n                FROM persons\n                WHERE person_id = %s\n            ', (person_id,))
-            person_info = cursor.fetchone()
+            if lineage is not None:
+                person_info = _person_fields(
+                    lineage, person_id,
+                    ('person_id', 'full_name', 'alias', 'gender', 'generation_level', 'status'),
+                )
+            else:
+                cursor.execute('\n                SELECT person_id, full_name, alias, gender, generation_level, status\n                FROM persons\n                WHERE person_id = %s\n            ', (person_id,))
+                person_info = cursor.fetchone()
         except Exception as e:
             logger.error(f'Error fetching person_info for {person_id}: {e}')
             import traceback
@@ -473,7 +593,7 @@ def get_ancestors(person_id):
 
 
 def get_descendants(person_id):
-    """Get descendants of a person (schema mới - dùng stored procedure)"""
+    """Get descendants of a person (duyệt trên snapshot gia phả; fallback sp_get_descendants)"""
     connection = get_db_connection()
     if not connection:
         return (jsonify({'error': 'Không thể kết nối database'}), 500)
@@ -483,14 +603,24 @@ def get_descendants(person_id):
         max_level = 5
     try:
         cursor = connection.cursor(dictionary=True)
-        cursor.execute('SELECT person_id FROM persons WHERE person_id = %s', (person_id,))
-        if not cursor.fetchone():
-            return (jsonify({'error': f'Person {person_id} not found'}), 404)
-        cursor.callproc('sp_get_descendants', [person_id, max_level])
-        descendants_result = None
-        for result_set in cursor.stored_results():
-            descendants_result = result_set.fetchall()
-            break
+        snapshot = None
+        try:
+            snapshot = get_genealogy_snapshot(cursor)
+        except Exception as e:
+            logger.warning(f'[API /api/descendants/{person_id}] Genealogy snapshot unavailable, falling back to sp_get_descendants: {e}')
+        if snapshot is not None and snapshot.lineage is not None:
+            if not snapshot.has_person(person_id):
+                return (jsonify({'error': f'Person {person_id} not found'}), 404)
+            descendants_result = find_descendants(snapshot.lineage, person_id, max_level)
+        else:
+            cursor.execute('SELECT person_id FROM persons WHERE person_id = %s', (person_id,))
+            if not cursor.fetchone():
+                return (jsonify({'error': f'Person {person_id} not found'}), 404)
+            cursor.callproc('sp_get_descendants', [person_id, max_level])
+            descendants_result = None
+            for result_set in cursor.stored_results():
+                descendants_result = result_set.fetchall()
+                break
         descendants = []
         if descendants_result:
             for row in descendants_result:
@@ -1,15 +1,106 @@
+import json
 import logging
 import os
 from datetime import datetime
 
-from flask import jsonify
+from flask import jsonify, request
 from mysql.connector import Error
 
 from audit_log import log_activity
 from db import get_db_connection
+from services.genealogy_graph import invalidate_genealogy_snapshot
+from services.genealogy_sync_plan import SYNC_BATCH_SIZE, SyncPlan, apply_sync_diff, load_local_snapshot
+from utils.json_stream import JSONArrayStream, JSONStreamError
 
 logger = logging.getLogger(__name__)
 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYNC_SOURCE_URL = os.environ.get('GENEALOGY_SYNC_SOURCE_URL', 'https://www.phongtuybienquancong.info/api/members')
+# ETag / Last-Modified của lần sync thành công gần nhất (instance/ đã .gitignore, dùng chung giữa worker)
+SYNC_STATE_FILE = os.environ.get('GENEALOGY_SYNC_STATE_FILE') or os.path.join(BASE_DIR, 'instance', 'genealogy_sync_state.json')
+SYNC_FETCH_CHUNK_SIZE = 64 * 1024
+
+
+def _request_flag(name):
+    """?<name>=1 hoặc body JSON {"<name>": true}."""
+    if (request.args.get(name) or '').strip().lower() in ('1', 'true', 'yes'):
+        return True
+    body = request.get_json(silent=True)
+    return isinstance(body, dict) and body.get(name) is True
+
+
+def _is_dry_run():
+    """?dry_run=1 hoặc body JSON {"dry_run": true}: chỉ trả diff, không ghi database."""
+    return _request_flag('dry_run')
+
+
+def load_sync_state(path=None):
+    try:
+        with open(path or SYNC_STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_sync_state(state, path=None):
+    path = path or SYNC_STATE_FILE
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f'Không lưu được trạng thái sync {path}: {e}')
+
+
+def fetch_remote_members(url, plan, *, verify=True, state=None, batch_size=None):
+    """
+    Đọc /api/members dạng stream: parse từng member khi đủ byte (JSONArrayStream qua iter_content)
+    và đưa vào `plan` theo lô `batch_size` — không giữ cả body lẫn list đã parse trong bộ nhớ.
+
+    `state` ({'url', 'etag', 'last_modified'} của lần sync trước) → gửi If-None-Match /
+    If-Modified-Since; upstream không đổi thì trả 304 và không đọc gì thêm.
+
+    Return {'not_modified', 'fetched', 'etag', 'last_modified'}. Lỗi định dạng → JSONStreamError.
+    """
+    import requests
+    batch_size = batch_size or SYNC_BATCH_SIZE
+    headers = {'Accept': 'application/json'}
+    if state and state.get('url') == url:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+    response = requests.get(url, timeout=60, verify=verify, stream=True, headers=headers)
+    try:
+        if response.status_code == 304:
+            state = state or {}
+            return {'not_modified': True, 'fetched': 0, 'etag': state.get('etag'), 'last_modified': state.get('last_modified')}
+        response.raise_for_status()
+        stream = JSONArrayStream(response.iter_content(chunk_size=SYNC_FETCH_CHUNK_SIZE), array_keys=('data', 'members'))
+        fetched = 0
+        batch = []
+        for member in stream:
+            if isinstance(member, dict):
+                batch.append(member)
+            fetched += 1
+            if len(batch) >= batch_size:
+                plan.add_members(batch)
+                batch = []
+        plan.add_members(batch)
+        if stream.array_key == 'data' and not stream.meta.get('success'):
+            raise JSONStreamError('Payload {success, data} có success = false')
+        return {
+            'not_modified': False,
+            'fetched': fetched,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+    finally:
+        response.close()
+
 
 def sync_genealogy_from_members():
     """
@@ -17,7 +108,9 @@ def sync_genealogy_from_members():
 
     Chức năng:
     - Fetch dữ liệu từ API endpoint /api/members của database chuẩn
-    - Sync dữ liệu vào database hiện tại
+    - Sync dữ liệu vào database hiện tại theo lô (services.genealogy_sync_plan): diff với dữ liệu
+      hiện có rồi ghi bằng executemany trong một transaction
+    - ?dry_run=1 (hoặc {"dry_run": true}): chỉ trả diff, không ghi gì
     - TUYỆT ĐỐI chỉ đọc từ API, KHÔNG sửa đổi database chuẩn
 
     Returns:
@@ -28,7 +121,7 @@ def sync_genealogy_from_members():
     cursor = None
     try:
         import requests
-        standard_db_url = 'https://www.phongtuybienquancong.info/api/members'
+        standard_db_url = SYNC_SOURCE_URL
         logger.info(f'📡 Fetching data from: {standard_db_url}')
 
         # TLS verification: mặc định BẬT (verify=True) — chặn MitM/DNS poisoning
@@ -68,20 +161,26 @@ def sync_genealogy_from_members():
         else:
             verify_arg = True
 
+        dry_run = _is_dry_run()
+        # Dry-run / ?force=1 luôn đọc đủ payload; sync thường hỏi upstream có đổi không trước
+        previous_state = None if dry_run or _request_flag('force') else load_sync_state()
+        plan = SyncPlan()
         try:
-            response = requests.get(standard_db_url, timeout=60, verify=verify_arg)
-            response.raise_for_status()
-            response_data = response.json()
-            if isinstance(response_data, list):
-                members_data = response_data
-            elif isinstance(response_data, dict) and response_data.get('success') and isinstance(response_data.get('data'), list):
-                members_data = response_data['data']
-            elif isinstance(response_data, dict) and isinstance(response_data.get('members'), list):
-                members_data = response_data['members']
-            else:
-                logger.error(f'❌ Unexpected response format from {standard_db_url}: {type(response_data)}')
-                return (jsonify({'success': False, 'error': f'Dữ liệu từ database chuẩn không đúng định dạng. Expected array or {{success, data}}, got {type(response_data)}'}), 500)
-            logger.info(f'📊 Đã fetch {len(members_data)} members từ database chuẩn')
+            fetch = fetch_remote_members(standard_db_url, plan, verify=verify_arg, state=previous_state)
+            if fetch['not_modified']:
+                logger.info('📭 Database chuẩn không đổi kể từ lần sync trước (304) — bỏ qua')
+                return jsonify({
+                    'success': True,
+                    'not_modified': True,
+                    'message': 'Database chuẩn không thay đổi kể từ lần sync trước',
+                    'timestamp': datetime.now().isoformat(),
+                    'source_url': standard_db_url,
+                })
+            members_count = fetch['fetched']
+            logger.info(f'📊 Đã fetch {members_count} members từ database chuẩn')
+        except JSONStreamError as e:
+            logger.error(f'❌ Unexpected response format from {standard_db_url}: {e}')
+            return (jsonify({'success': False, 'error': f'Dữ liệu từ database chuẩn không đúng định dạng. Expected array or {{success, data}}: {e}'}), 500)
         except requests.exceptions.SSLError as e:
             # TLS verify fail → dữ liệu KHÔNG đáng tin; hủy sync trước khi đụng DB.
             logger.error(
@@ -105,115 +204,44 @@ def sync_genealogy_from_members():
             logger.error('❌ Không thể kết nối database')
             return (jsonify({'success': False, 'error': 'Không thể kết nối database'}), 500)
         cursor = connection.cursor(dictionary=True)
-        cursor.execute('SELECT COUNT(*) AS count FROM persons')
-        before_persons_count = cursor.fetchone()['count']
-        cursor.execute('SELECT COUNT(*) AS count FROM relationships')
-        before_relationships_count = cursor.fetchone()['count']
-        cursor.execute('SELECT COUNT(*) AS count FROM marriages')
-        before_marriages_count = cursor.fetchone()['count']
-        inserted_persons = 0
-        updated_persons = 0
-        inserted_relationships = 0
-        inserted_marriages = 0
-        for member in members_data:
-            person_id = member.get('person_id') or member.get('id')
-            if not person_id:
-                continue
-            full_name = member.get('full_name') or member.get('name') or ''
-            alias = member.get('alias') or None
-            gender = member.get('gender') or None
-            generation_level = member.get('generation_level') or member.get('generation') or None
-            birth_date_solar = member.get('birth_date_solar') or member.get('birth_date') or None
-            death_date_solar = member.get('death_date_solar') or member.get('death_date') or None
-            grave_info = member.get('grave_info') or None
-            place_of_death = member.get('place_of_death') or None
-            home_town = member.get('home_town') or None
-            status = member.get('status') or 'Đang sống'
-            cursor.execute('SELECT person_id FROM persons WHERE person_id = %s', (person_id,))
-            exists = cursor.fetchone()
-            if exists:
-                cursor.execute('\n                    UPDATE persons SET\n                        full_name = %s,\n                        alias = %s,\n                        gender = %s,\n                        generation_level = %s,\n                        birth_date_solar = %s,\n                        death_date_solar = %s,\n                        grave_info = %s,\n                        place_of_death = %s,\n                        home_town = %s,\n                        status = %s\n                    WHERE person_id = %s\n                ', (full_name, alias, gender, generation_level, birth_date_solar, death_date_solar, grave_info, place_of_death, home_town, status, person_id))
-                updated_persons += 1
-            else:
-                cursor.execute('\n                    INSERT INTO persons (\n                        person_id, full_name, alias, gender, generation_level,\n                        birth_date_solar, death_date_solar, grave_info,\n                        place_of_death, home_town, status\n                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)\n                ', (person_id, full_name, alias, gender, generation_level, birth_date_solar, death_date_solar, grave_info, place_of_death, home_town, status))
-                inserted_persons += 1
-            father_id = member.get('father_id')
-            mother_id = member.get('mother_id')
-            if father_id:
-                cursor.execute("\n                    SELECT * FROM relationships \n                    WHERE child_id = %s AND parent_id = %s AND relation_type = 'father'\n                ", (person_id, father_id))
-                if not cursor.fetchone():
-                    try:
-                        cursor.execute("\n                            INSERT INTO relationships (parent_id, child_id, relation_type)\n                            VALUES (%s, %s, 'father')\n                        ", (father_id, person_id))
-                        inserted_relationships += 1
-                    except Error:
-                        pass
-            if mother_id:
-                cursor.execute("\n                    SELECT * FROM relationships \n                    WHERE child_id = %s AND parent_id = %s AND relation_type = 'mother'\n                ", (person_id, mother_id))
-                if not cursor.fetchone():
-                    try:
-                        cursor.execute("\n                            INSERT INTO relationships (parent_id, child_id, relation_type)\n                            VALUES (%s, %s, 'mother')\n                        ", (mother_id, person_id))
-                        inserted_relationships += 1
-                    except Error:
-                        pass
-            spouses = member.get('spouses') or member.get('marriages') or []
-            spouse_list = []
-            if isinstance(spouses, str):
-                spouse_names = [s.strip() for s in spouses.split(';') if s.strip() and s.strip().lower() != 'unknown']
-                for spouse_name in spouse_names:
-                    cursor.execute('SELECT person_id FROM persons WHERE (full_name = %s OR alias = %s) AND person_id != %s', (spouse_name, spouse_name, person_id))
-                    spouse_row = cursor.fetchone()
-                    if spouse_row:
-                        spouse_id = spouse_row['person_id']
-                        spouse_list.append({'spouse_id': spouse_id, 'spouse_name': spouse_name})
-                    else:
-                        spouse_list.append({'spouse_name': spouse_name})
-            elif isinstance(spouses, list):
-                spouse_list = spouses
-                for spouse in spouse_list:
-                    if isinstance(spouse, dict):
-                        spouse_id = spouse.get('spouse_id') or spouse.get('person_id') or spouse.get('id')
-                        if spouse_id and spouse_id != person_id:
-                            cursor.execute('\n                                SELECT * FROM marriages \n                                WHERE (husband_id = %s AND wife_id = %s)\n                                OR (husband_id = %s AND wife_id = %s)\n                            ', (person_id, spouse_id, spouse_id, person_id))
-                            if not cursor.fetchone():
-                                try:
-                                    cursor.execute('\n                                        INSERT INTO marriages (husband_id, wife_id)\n                                        VALUES (%s, %s)\n                                    ', (person_id, spouse_id))
-                                    inserted_marriages += 1
-                                except Error:
-                                    pass
-        for member in members_data:
-            person_id = member.get('person_id') or member.get('id')
-            if not person_id:
-                continue
-            spouses = member.get('spouses') or member.get('marriages') or []
-            if isinstance(spouses, str):
-                spouse_names = [s.strip() for s in spouses.split(';') if s.strip() and s.strip().lower() != 'unknown']
-                for spouse_name in spouse_names:
-                    cursor.execute('SELECT person_id FROM persons WHERE (full_name = %s OR alias = %s) AND person_id != %s', (spouse_name, spouse_name, person_id))
-                    spouse_row = cursor.fetchone()
-                    if spouse_row:
-                        spouse_id = spouse_row['person_id']
-                        cursor.execute('\n                            SELECT * FROM marriages \n                            WHERE (husband_id = %s AND wife_id = %s)\n                            OR (husband_id = %s AND wife_id = %s)\n                        ', (person_id, spouse_id, spouse_id, person_id))
-                        if not cursor.fetchone():
-                            try:
-                                cursor.execute('\n                                    INSERT INTO marriages (husband_id, wife_id)\n                                    VALUES (%s, %s)\n                                ', (person_id, spouse_id))
-                                inserted_marriages += 1
-                            except Error:
-                                pass
+        snapshot = load_local_snapshot(cursor)
+        diff = plan.diff(snapshot)
+        summary = diff.summary()
+        logger.info(
+            f'📋 Sync diff: +{summary["persons_insert"]} / ~{summary["persons_update"]} persons, '
+            f'+{summary["relationships_insert"]} relationships, +{summary["marriages_insert"]} marriages'
+        )
+        sync_timestamp = datetime.now().isoformat()
+        if dry_run:
+            return jsonify({
+                'success': True,
+                'dry_run': True,
+                'message': f'Dry-run: {members_count} members từ database chuẩn, chưa ghi gì',
+                'timestamp': sync_timestamp,
+                'source_url': standard_db_url,
+                'diff': summary,
+            })
         try:
+            applied = apply_sync_diff(cursor, diff)
             connection.commit()
+            invalidate_genealogy_snapshot()
             logger.info('✅ Database changes committed successfully')
+            save_sync_state({
+                'url': standard_db_url,
+                'etag': fetch['etag'],
+                'last_modified': fetch['last_modified'],
+                'synced_at': datetime.now().isoformat(),
+            })
         except Error as commit_error:
             connection.rollback()
-            logger.error(f'❌ Error committing changes, rolled back: {commit_error}')
+            logger.error(f'❌ Error applying sync changes, rolled back: {commit_error}')
             raise
-        cursor.execute('SELECT COUNT(*) AS count FROM persons')
-        after_persons_count = cursor.fetchone()['count']
-        cursor.execute('SELECT COUNT(*) AS count FROM relationships')
-        after_relationships_count = cursor.fetchone()['count']
-        cursor.execute('SELECT COUNT(*) AS count FROM marriages')
-        after_marriages_count = cursor.fetchone()['count']
-        sync_timestamp = datetime.now().isoformat()
-        sync_info = {'success': True, 'message': f'Đã sync {len(members_data)} members từ database chuẩn', 'timestamp': sync_timestamp, 'source_url': standard_db_url, 'stats': {'persons_before': before_persons_count, 'persons_after': after_persons_count, 'persons_inserted': inserted_persons, 'persons_updated': updated_persons, 'relationships_before': before_relationships_count, 'relationships_after': after_relationships_count, 'relationships_inserted': inserted_relationships, 'marriages_before': before_marriages_count, 'marriages_after': after_marriages_count, 'marriages_inserted': inserted_marriages}, 'note': f'Đã sync từ {standard_db_url}. Inserted {inserted_persons} persons, updated {updated_persons} persons, inserted {inserted_relationships} relationships, {inserted_marriages} marriages.'}
+        inserted_persons = applied['persons_inserted']
+        updated_persons = applied['persons_updated']
+        inserted_relationships = applied['relationships_inserted']
+        inserted_marriages = applied['marriages_inserted']
+        before = snapshot.counts
+        sync_info = {'success': True, 'message': f'Đã sync {members_count} members từ database chuẩn', 'timestamp': sync_timestamp, 'source_url': standard_db_url, 'stats': {'persons_before': before['persons'], 'persons_after': before['persons'] + inserted_persons, 'persons_inserted': inserted_persons, 'persons_updated': updated_persons, 'persons_unchanged': diff.persons_unchanged, 'relationships_before': before['relationships'], 'relationships_after': before['relationships'] + inserted_relationships, 'relationships_inserted': inserted_relationships, 'marriages_before': before['marriages'], 'marriages_after': before['marriages'] + inserted_marriages, 'marriages_inserted': inserted_marriages}, 'diff': summary, 'note': f'Đã sync từ {standard_db_url}. Inserted {inserted_persons} persons, updated {updated_persons} persons, inserted {inserted_relationships} relationships, {inserted_marriages} marriages.'}
         logger.info(f'✅ Sync thành công: {inserted_persons} inserted, {updated_persons} updated persons, {inserted_relationships} relationships, {inserted_marriages} marriages')
         log_activity('SYNC_GENEALOGY', target_type='Persons', after_data={'inserted_persons': inserted_persons, 'updated_persons': updated_persons, 'inserted_relationships': inserted_relationships, 'inserted_marriages': inserted_marriages})
         return jsonify(sync_info)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Đồng bộ gia phả theo tập (set-based) cho /api/genealogy/sync.
+
+Trước đây mỗi member từ database chuẩn tốn: SELECT tồn tại + UPDATE/INSERT persons, SELECT +
+INSERT cho từng quan hệ cha / mẹ, tra vợ/chồng theo tên (`full_name = %s OR alias = %s`) và
+SELECT kiểm tra marriages — lặp hai vòng qua toàn bộ danh sách.
+
+Giờ chia ba bước:
+1. load_local_snapshot(): đọc persons / relationships / marriages hiện có một lần.
+2. SyncPlan.add_members() gom payload từ xa (theo lô khi đọc stream); diff(snapshot) → SyncDiff
+   (người thêm mới / đổi / không đổi, quan hệ + hôn nhân còn thiếu). Tên vợ/chồng tra qua map
+   tên → person_id dựng sẵn (so khớp kiểu utf8mb4_unicode_ci như MySQL).
+3. apply_sync_diff(): INSERT ... ON DUPLICATE KEY UPDATE / INSERT IGNORE bằng executemany theo lô
+   GENEALOGY_SYNC_BATCH_SIZE; caller commit một lần.
+
+SyncDiff.summary() là báo cáo dry-run (đếm + mẫu id) trả về trước / thay cho khi ghi.
+"""
+import logging
+
+from folder_py.db_config import env_number
+from services.lineage_engine import collation_key
+
+logger = logging.getLogger(__name__)
+
+PERSON_FIELDS = (
+    'full_name', 'alias', 'gender', 'generation_level', 'birth_date_solar', 'death_date_solar',
+    'grave_info', 'place_of_death', 'home_town', 'status',
+)
+SYNC_BATCH_SIZE = env_number('GENEALOGY_SYNC_BATCH_SIZE', 500, int, 1)
+DIFF_SAMPLE_LIMIT = 50
+
+
+def stage_member(member):
+    """Chuẩn hoá một member của /api/members → dict (person_id, values, father_id, mother_id, spouses); None nếu thiếu id."""
+    person_id = member.get('person_id') or member.get('id')
+    if not person_id:
+        return None
+    values = {
+        'full_name': member.get('full_name') or member.get('name') or '',
+        'alias': member.get('alias') or None,
+        'gender': member.get('gender') or None,
+        'generation_level': member.get('generation_level') or member.get('generation') or None,
+        'birth_date_solar': member.get('birth_date_solar') or member.get('birth_date') or None,
+        'death_date_solar': member.get('death_date_solar') or member.get('death_date') or None,
+        'grave_info': member.get('grave_info') or None,
+        'place_of_death': member.get('place_of_death') or None,
+        'home_town': member.get('home_town') or None,
+        'status': member.get('status') or 'Đang sống',
+    }
+    return {
+        'person_id': person_id,
+        'values': values,
+        'father_id': member.get('father_id') or None,
+        'mother_id': member.get('mother_id') or None,
+        'spouses': member.get('spouses') or member.get('marriages') or [],
+    }
+
+
+def _comparable(value):
+    # DATE / INT từ MySQL vs chuỗi JSON: so theo dạng chuỗi
+    return None if value is None else str(value)
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+class LocalSnapshot:
+    """persons / relationships / marriages hiện có trong database (đọc một lần mỗi lần sync)."""
+
+    def __init__(self, persons, relationships, marriages, counts):
+        self.persons = persons
+        self.relationships = relationships
+        self.marriages = marriages
+        self.counts = counts
+
+
+def load_local_snapshot(cursor):
+    cols = ', '.join(PERSON_FIELDS)
+    cursor.execute(f'SELECT person_id, {cols} FROM persons ORDER BY person_id')
+    persons = {}
+    for row in cursor.fetchall():
+        persons[row['person_id']] = {field: row.get(field) for field in PERSON_FIELDS}
+    cursor.execute('SELECT parent_id, child_id, relation_type FROM relationships')
+    rel_rows = cursor.fetchall()
+    relationships = {(r['parent_id'], r['child_id'], r['relation_type']) for r in rel_rows}
+    cursor.execute('SELECT husband_id, wife_id FROM marriages')
+    marriage_rows = cursor.fetchall()
+    marriages = {frozenset((r['husband_id'], r['wife_id'])) for r in marriage_rows}
+    counts = {'persons': len(persons), 'relationships': len(rel_rows), 'marriages': len(marriage_rows)}
+    return LocalSnapshot(persons, relationships, marriages, counts)
+
+
+class SyncDiff:
+    """Những gì cần ghi để database khớp payload từ xa."""
+
+    def __init__(self):
+        self.persons_insert = []
+        self.persons_update = []
+        self.persons_unchanged = 0
+        self.relationships_insert = []
+        self.marriages_insert = []
+        self.skipped_relationships = 0
+        self.unresolved_spouses = []
+
+    def summary(self):
+        return {
+            'persons_insert': len(self.persons_insert),
+            'persons_update': len(self.persons_update),
+            'persons_unchanged': self.persons_unchanged,
+            'relationships_insert': len(self.relationships_insert),
+            'marriages_insert': len(self.marriages_insert),
+            'relationships_skipped': self.skipped_relationships,
+            'spouses_unresolved': len(self.unresolved_spouses),
+            'samples': {
+                'persons_insert': [row['person_id'] for row in self.persons_insert[:DIFF_SAMPLE_LIMIT]],
+                'persons_update': [
+                    {'person_id': row['person_id'], 'changes': row['changes']}
+                    for row in self.persons_update[:DIFF_SAMPLE_LIMIT]
+                ],
+                'relationships_insert': [list(r) for r in self.relationships_insert[:DIFF_SAMPLE_LIMIT]],
+                'marriages_insert': [list(m) for m in self.marriages_insert[:DIFF_SAMPLE_LIMIT]],
+                'spouses_unresolved': self.unresolved_spouses[:DIFF_SAMPLE_LIMIT],
+            },
+        }
+
+
+class SyncPlan:
+    """Gom payload từ xa (có thể theo nhiều lô) rồi diff một lần với LocalSnapshot."""
+
+    def __init__(self):
+        self.members_count = 0
+        self._staged = {}
+        self._parents = []
+        self._spouse_ids = []
+        self._spouse_names = []
+
+    def add_members(self, members):
+        for member in members:
+            staged = stage_member(member)
+            if staged is None:
+                continue
+            self.members_count += 1
+            person_id = staged['person_id']
+            self._staged[person_id] = staged['values']
+            if staged['father_id']:
+                self._parents.append((staged['father_id'], person_id, 'father'))
+            if staged['mother_id']:
+                self._parents.append((staged['mother_id'], person_id, 'mother'))
+            spouses = staged['spouses']
+            if isinstance(spouses, str):
+                for name in spouses.split(';'):
+                    name = name.strip()
+                    if name and name.lower() != 'unknown':
+                        self._spouse_names.append((person_id, name))
+            elif isinstance(spouses, list):
+                for spouse in spouses:
+                    if isinstance(spouse, dict):
+                        spouse_id = spouse.get('spouse_id') or spouse.get('person_id') or spouse.get('id')
+                        if spouse_id:
+                            self._spouse_ids.append((person_id, spouse_id))
+
+    def _name_map(self, merged):
+        """collation_key(tên hoặc tên khác) → [person_id] theo thứ tự ổn định."""
+        names = {}
+        for person_id, values in merged.items():
+            for name in (values.get('full_name'), values.get('alias')):
+                key = collation_key(name)
+                if key:
+                    ids = names.setdefault(key, [])
+                    if person_id not in ids:
+                        ids.append(person_id)
+        return names
+
+    def diff(self, local):
+        diff = SyncDiff()
+        for person_id, values in self._staged.items():
+            current = local.persons.get(person_id)
+            if current is None:
+                diff.persons_insert.append({'person_id': person_id, **values})
+                continue
+            changes = {
+                field: [_comparable(current.get(field)), _comparable(values[field])]
+                for field in PERSON_FIELDS
+                if _comparable(current.get(field)) != _comparable(values[field])
+            }
+            if changes:
+                diff.persons_update.append({'person_id': person_id, 'changes': changes, **values})
+            else:
+                diff.persons_unchanged += 1
+
+        merged = dict(local.persons)
+        merged.update(self._staged)
+        known = merged.keys()
+
+        seen = set(local.relationships)
+        for rel in self._parents:
+            if rel in seen:
+                continue
+            if rel[0] not in known:
+                # Cha / mẹ không có trong database lẫn payload → INSERT sẽ vỡ khoá ngoại
+                diff.skipped_relationships += 1
+                continue
+            seen.add(rel)
+            diff.relationships_insert.append(rel)
+
+        names = self._name_map(merged) if self._spouse_names else {}
+        pairs = list(self._spouse_ids)
+        for person_id, name in self._spouse_names:
+            spouse_id = next((pid for pid in names.get(collation_key(name), ()) if pid != person_id), None)
+            if spouse_id is None:
+                diff.unresolved_spouses.append({'person_id': person_id, 'spouse_name': name})
+            else:
+                pairs.append((person_id, spouse_id))
+
+        married = set(local.marriages)
+        for person_id, spouse_id in pairs:
+            pair = frozenset((person_id, spouse_id))
+            if spouse_id == person_id or pair in married or spouse_id not in known:
+                continue
+            married.add(pair)
+            diff.marriages_insert.append((person_id, spouse_id))
+        return diff
+
+
+def apply_sync_diff(cursor, diff, batch_size=None):
+    """Ghi SyncDiff bằng executemany theo lô (không commit). Return số dòng đã ghi mỗi loại."""
+    batch_size = batch_size or SYNC_BATCH_SIZE
+    applied = {'persons_inserted': 0, 'persons_updated': 0, 'relationships_inserted': 0, 'marriages_inserted': 0}
+
+    columns = ('person_id',) + PERSON_FIELDS
+    upsert_sql = (
+        f"INSERT INTO persons ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{f} = VALUES({f})' for f in PERSON_FIELDS)}"
+    )
+    for key, rows in (('persons_inserted', diff.persons_insert), ('persons_updated', diff.persons_update)):
+        for batch in _chunks(rows, batch_size):
+            cursor.executemany(upsert_sql, [tuple(row[c] for c in columns) for row in batch])
+            applied[key] += len(batch)
+
+    for batch in _chunks(diff.relationships_insert, batch_size):
+        cursor.executemany(
+            'INSERT IGNORE INTO relationships (parent_id, child_id, relation_type) VALUES (%s, %s, %s)',
+            batch,
+        )
+        applied['relationships_inserted'] += max(cursor.rowcount, 0)
+
+    for batch in _chunks(diff.marriages_insert, batch_size):
+        cursor.executemany('INSERT IGNORE INTO marriages (husband_id, wife_id) VALUES (%s, %s)', batch)
+        applied['marriages_inserted'] += max(cursor.rowcount, 0)
+
+    logger.info('Genealogy sync applied: %s', applied)
+    return applied
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Phục vụ file ảnh cho /static/images/<path> và /images/<path> (serve_image_static, serve_image).
+
+Trước đây mỗi request ảnh dò RAILWAY_VOLUME_MOUNT_PATH rồi static/images bằng vài lần
+os.path.exists, sau đó send_from_directory với cache mặc định (ETag mtime-size, không max-age):
+xem lại một ảnh vẫn tốn stat đĩa và thường tải lại cả file.
+
+- Đường dẫn đã resolve giữ trong LRU theo tên file (IMAGE_PATH_CACHE_SIZE mục mỗi worker), kèm
+  ETag. Upload / xoá ảnh gọi invalidate_image_path(); file biến mất ở worker khác → gặp lỗi khi gửi
+  thì tự bỏ mục cache.
+- ETag là hash nội dung (sha256), tính một lần lúc upload (record_image_etag) và lưu cạnh thumbnail
+  (`_thumbs/<ảnh>.etag`); ảnh cũ chưa có thì tính ở lần phục vụ đầu rồi lưu lại.
+- If-None-Match khớp ETag đã cache → 304 ngay, không đụng đĩa.
+- Thumbnail / các bậc responsive (`_thumbs/...`), ảnh upload (tên có timestamp + hash, không bao
+  giờ bị ghi đè) và URL có ?v=<hash> là bất biến: `Cache-Control: public, max-age=31536000,
+  immutable`. Ảnh khác (ảnh trong source): max-age IMAGE_CACHE_MAX_AGE rồi revalidate bằng ETag.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from flask import abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+from folder_py.db_config import env_number
+from utils.image_thumbnails import STATIC_IMAGE_PREFIX, THUMB_ROOT, image_etag_path
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_PATH_CACHE_SIZE = env_number('IMAGE_PATH_CACHE_SIZE', 4096, int, 0)
+IMAGE_CACHE_MAX_AGE = env_number('IMAGE_CACHE_MAX_AGE', 86400, int, 0)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Tên file do upload sinh ra: <prefix>_<YYYYmmdd>_<HHMMSS>_<md5[:8]>.<ext>
+_HASHED_NAME_RE = re.compile(r'_\d{8}_\d{6}_[0-9a-f]{8}\.\w+$')
+
+ResolvedImage = namedtuple('ResolvedImage', 'path etag')
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def _image_roots():
+    """Thư mục gốc theo thứ tự ưu tiên: Railway Volume rồi static/images trong source."""
+    roots = []
+    volume_mount_path = os.environ.get('RAILWAY_VOLUME_MOUNT_PATH')
+    if volume_mount_path and os.path.isdir(volume_mount_path):
+        roots.append(volume_mount_path)
+    roots.append(os.path.join(BASE_DIR, 'static', 'images'))
+    return roots
+
+
+def _cache_key(image_ref):
+    """'album_3/a.jpg' từ '/static/images/album_3/a.jpg', 'static/images/...' hoặc tên file trần."""
+    key = str(image_ref or '').strip().replace('\\', '/')
+    for prefix in (STATIC_IMAGE_PREFIX, STATIC_IMAGE_PREFIX.lstrip('/'), '/images/'):
+        if key.startswith(prefix):
+            return key[len(prefix):]
+    return key.lstrip('/')
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def _write_etag(etag_path, etag):
+    try:
+        etag_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = etag_path.with_name(f'{etag_path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(etag, encoding='ascii')
+        os.replace(tmp_path, etag_path)
+    except OSError as exc:
+        logger.warning('Could not store image ETag %s: %s', etag_path, exc)
+
+
+def _content_etag(filename, path):
+    """ETag đã lưu của ảnh; chưa có thì hash nội dung và lưu lại (ảnh trong _thumbs chỉ hash)."""
+    etag_path = image_etag_path(filename, source_path=path)
+    if etag_path is not None:
+        try:
+            etag = etag_path.read_text(encoding='ascii').strip()
+            if etag:
+                return etag
+        except OSError:
+            pass
+    etag = _hash_file(path)
+    if etag_path is not None:
+        _write_etag(etag_path, etag)
+    return etag
+
+
+def record_image_etag(image_ref, *, source_path):
+    """Gọi ngay sau khi lưu file upload: tính + lưu ETag nội dung, bỏ mục cache cũ cùng tên."""
+    invalidate_image_path(image_ref)
+    etag_path = image_etag_path(image_ref, source_path=source_path)
+    if etag_path is None:
+        return None
+    try:
+        etag = _hash_file(source_path)
+    except OSError as exc:
+        logger.warning('Could not hash uploaded image %s: %s', source_path, exc)
+        return None
+    _write_etag(etag_path, etag)
+    return etag
+
+
+def invalidate_image_path(image_ref):
+    """Bỏ cache của ảnh và mọi thumbnail / bậc responsive của nó (khi upload đè hoặc xoá ảnh)."""
+    key = _cache_key(image_ref)
+    if not key:
+        return
+    stem = os.path.splitext(key)[0]
+    derived = (f'{THUMB_ROOT}/{stem}.', f'{THUMB_ROOT}/{stem}@')
+    with _lock:
+        for cached in [k for k in _cache if k == key or k.startswith(derived)]:
+            del _cache[cached]
+
+
+def clear_image_path_cache():
+    with _lock:
+        _cache.clear()
+
+
+def resolve_image(filename):
+    """ResolvedImage(path, etag) cho tên file tương đối, hoặc None nếu không có ở thư mục nào."""
+    with _lock:
+        entry = _cache.get(filename)
+        if entry is not None:
+            _cache.move_to_end(filename)
+            return entry
+    for root in _image_roots():
+        path = safe_join(root, filename)
+        if path and os.path.isfile(path):
+            break
+    else:
+        return None
+    entry = ResolvedImage(path, _content_etag(filename, path))
+    with _lock:
+        _cache[filename] = entry
+        _cache.move_to_end(filename)
+        while len(_cache) > IMAGE_PATH_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return entry
+
+
+def _is_immutable(filename):
+    return (
+        filename.startswith(f'{THUMB_ROOT}/')
+        or bool(_HASHED_NAME_RE.search(filename))
+        or bool(request.args.get('v'))
+    )
+
+
+def _apply_cache_headers(response, filename, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = None
+    if _is_immutable(filename):
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+    return response
+
+
+def send_image(filename):
+    """Response cho ảnh `filename` (đã validate): 304 nếu client có bản khớp ETag, 404 nếu không có."""
+    entry = resolve_image(filename)
+    if entry is None:
+        logger.debug(f'[Serve Image] File không tìm thấy: {filename}')
+        abort(404)
+    if request.if_none_match.contains(entry.etag):
+        response = current_app.response_class(status=304)
+        return _apply_cache_headers(response, filename, entry.etag)
+    try:
+        response = send_file(entry.path, etag=entry.etag, conditional=True)
+    except (FileNotFoundError, NotADirectoryError):
+        # File bị xoá (worker khác / thao tác tay) sau khi cache → bỏ mục cache
+        invalidate_image_path(filename)
+        logger.debug(f'[Serve Image] File đã bị xoá: {filename}')
+        abort(404)
+    return _apply_cache_headers(response, filename, entry.etag)
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Backup tăng dần (incremental) trên engine services.sql_dump.
+
+Một chuỗi backup = 1 file base (dump đầy đủ) + các file tăng dần, mỗi file chỉ chứa dòng đổi
+kể từ file trước. Trạng thái chuỗi nằm ở `<backup_dir>/tbqc_backup_chain.json`:
+{"chain": [base, inc001, ...], "watermarks": {bảng: mốc}}.
+
+Mốc (high-water mark) theo từng bảng:
+- updated_at: bảng có khoá chính + cột updated_at → REPLACE các dòng updated_at >= mốc
+  (>= vì TIMESTAMP chỉ tới giây; REPLACE nên phát lại không trùng).
+- id: chỉ log chỉ-ghi-thêm (APPEND_ONLY_TABLES) có khoá chính số tự tăng → INSERT IGNORE các
+  dòng id > mốc. Bảng tự tăng khác (albums, album_images) bị UPDATE tại chỗ, id > mốc sẽ bỏ sót.
+- full: còn lại (không khoá chính / không updated_at) → DELETE + dump lại cả bảng.
+Mốc đọc trong cùng START TRANSACTION WITH CONSISTENT SNAPSHOT với phần dump, nên khớp đúng dữ
+liệu trong file; dòng ghi sau snapshot được lấy ở lần sau.
+
+Xoá dòng: với bảng có khoá chính (trừ log chỉ-ghi-thêm activity_logs / page_views, vốn bị xoá
+theo retention), file tăng dần mang danh sách khoá hiện có vào bảng tạm rồi DELETE những dòng
+không còn — vài KB với bảng persons.
+Bảng mới / đổi cấu trúc (sha256 của SHOW CREATE TABLE khác) → DROP + CREATE + dump lại đầy đủ.
+
+Restore: nạp base rồi lần lượt các file tăng dần trên cùng một connection
+(scripts/run_backup_restore_drill.py đọc danh sách từ manifest của file cuối).
+
+Hai lần chạy cùng lúc (cron + admin bấm tay) sẽ cùng đọc một trạng thái, đặt trùng tên file và ghi
+đè chuỗi của nhau, nên create_incremental_backup() giữ `<backup_dir>/tbqc_backup_chain.json.lock`
+(tạo bằng O_EXCL) từ lúc đọc chuỗi tới lúc ghi xong; lần chạy thứ hai trả lỗi ngay.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from folder_py.db_config import env_number
+from services.sql_dump import (
+    COMPRESSION_SUFFIXES,
+    dump_database,
+    dump_table,
+    list_schema_objects,
+    manifest_path,
+    open_dump_writer,
+    primary_key,
+    show_create,
+    write_footer,
+    write_header,
+    write_manifest,
+    write_views,
+)
+
+logger = logging.getLogger(__name__)
+
+CHAIN_STATE_FILE = "tbqc_backup_chain.json"
+CHAIN_LOCK_FILE = CHAIN_STATE_FILE + ".lock"
+# Log chỉ ghi thêm: xoá dòng là retention / reset có chủ đích, không đồng bộ khoá
+APPEND_ONLY_TABLES = ("activity_logs", "page_views")
+# Số file tăng dần tối đa trên một base; vượt thì lần sau tạo base mới
+INCREMENTAL_MAX_CHAIN = env_number("BACKUP_INCREMENTAL_MAX_CHAIN", 24, int, 1)
+# Lock còn lại sau khi process chết giữa chừng: cũ hơn ngần này giây thì coi như bỏ
+INCREMENTAL_LOCK_STALE_SECONDS = env_number("BACKUP_INCREMENTAL_LOCK_STALE_SECONDS", 6 * 3600, int, 60)
+
+_AUTO_INCREMENT_RE = re.compile(r"\s+AUTO_INCREMENT=\d+")
+
+
+def _mark_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def table_plan(connection, table: str) -> Dict[str, Any]:
+    """Cách dump tăng dần cho `table`: {'strategy', 'column', 'key', 'sync_keys', 'schema_sha'}."""
+    cur = connection.cursor(buffered=True)
+    try:
+        cur.execute(f"SHOW COLUMNS FROM `{table}`")
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    fields = {}
+    for row in rows:
+        values = list(row.values()) if isinstance(row, dict) else list(row)
+        fields[str(values[0])] = str(values[5] if len(values) > 5 else "").lower()
+    key = primary_key(connection, table)
+    create_sql = _AUTO_INCREMENT_RE.sub("", show_create(connection, "TABLE", table) or "")
+    if key and "updated_at" in fields:
+        strategy, column = "updated_at", "updated_at"
+    elif table in APPEND_ONLY_TABLES and len(key) == 1 and "auto_increment" in fields.get(key[0], ""):
+        strategy, column = "id", key[0]
+    else:
+        strategy, column = "full", None
+    return {
+        "strategy": strategy,
+        "column": column,
+        "key": key,
+        "sync_keys": bool(key) and strategy != "full" and table not in APPEND_ONLY_TABLES,
+        "schema_sha": hashlib.sha256(create_sql.encode("utf-8")).hexdigest(),
+    }
+
+
+def read_watermarks(connection, plans: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Mốc hiện tại (MAX của cột mốc) cho từng bảng theo plan."""
+    marks = {}
+    cur = connection.cursor(buffered=True)
+    try:
+        for table, plan in plans.items():
+            value = None
+            if plan["column"]:
+                cur.execute(f"SELECT MAX(`{plan['column']}`) FROM `{table}`")
+                row = cur.fetchone()
+                if row:
+                    value = _mark_value(next(iter(row.values())) if isinstance(row, dict) else row[0])
+            marks[table] = dict(plan, value=value)
+    finally:
+        cur.close()
+    return marks
+
+
+def load_chain(backup_dir) -> Optional[Dict[str, Any]]:
+    """Trạng thái chuỗi hiện tại; None nếu chưa có hoặc thiếu file nào trong chuỗi."""
+    try:
+        with open(os.path.join(backup_dir, CHAIN_STATE_FILE), "r", encoding="utf-8") as fh:
+            state = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+    chain = state.get("chain") or []
+    if not chain or not all(os.path.exists(os.path.join(backup_dir, name)) for name in chain):
+        return None
+    return state
+
+
+def _save_chain(backup_dir, state: Dict[str, Any]) -> None:
+    path = os.path.join(backup_dir, CHAIN_STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def _acquire_chain_lock(backup_dir) -> Optional[str]:
+    """Đường dẫn lock nếu giành được; None nếu đang có lần chạy khác giữ chuỗi."""
+    os.makedirs(backup_dir, exist_ok=True)
+    path = os.path.join(backup_dir, CHAIN_LOCK_FILE)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                continue  # vừa được nhả
+            if age < INCREMENTAL_LOCK_STALE_SECONDS:
+                return None
+            logger.warning("Removing stale incremental backup lock %s (%.0f s old)", path, age)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(f"{os.getpid()} {datetime.now().isoformat()}\n")
+        return path
+    return None
+
+
+def _release_chain_lock(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_key_sync(connection, table: str, key: List[str], out) -> int:
+    """Đưa danh sách khoá hiện có vào bảng tạm rồi xoá dòng không còn trong DB nguồn."""
+    tmp = f"_keys_{table}"
+    cols = ", ".join(f"`{c}`" for c in key)
+    out.write(f"\nDROP TEMPORARY TABLE IF EXISTS `{tmp}`;\n")
+    out.write(f"CREATE TEMPORARY TABLE `{tmp}` SELECT {cols} FROM `{table}` LIMIT 0;\n")
+    result = dump_table(connection, table, out, create=False, columns=key, into=tmp)
+    join = " AND ".join(f"t.`{c}` = k.`{c}`" for c in key)
+    out.write(f"DELETE t FROM `{table}` t LEFT JOIN `{tmp}` k ON {join} WHERE k.`{key[0]}` IS NULL;\n")
+    out.write(f"DROP TEMPORARY TABLE `{tmp}`;\n")
+    return result["rows"]
+
+
+def dump_incremental(
+    connection,
+    out_path,
+    since: Dict[str, Dict[str, Any]],
+    plans: Dict[str, Dict[str, Any]],
+    *,
+    compression: str = "none",
+    views: Optional[List[str]] = None,
+    manifest_extra: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Ghi file tăng dần: dòng đổi kể từ `since` (mốc của file trước) cho các bảng trong `plans`.
+    Mốc mới đọc trong snapshot của lần dump. Trả về dict manifest (đã ghi cạnh file, có "watermarks").
+    """
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    results = []
+    cur = connection.cursor()
+    try:
+        cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+    finally:
+        cur.close()
+    try:
+        marks = read_watermarks(connection, plans)
+        with open_dump_writer(out_path, compression) as out:
+            write_header(out, "TBQC Database Backup (incremental)", "Python incremental", created_at, compression)
+            for table in sorted(set(since) - set(marks)):
+                out.write(f"\nDROP TABLE IF EXISTS `{table}`;\n")
+            for table, plan in marks.items():
+                previous = since.get(table)
+                if (
+                    previous is None
+                    or previous.get("schema_sha") != plan["schema_sha"]
+                    or previous.get("strategy") != plan["strategy"]
+                ):
+                    result = dump_table(connection, table, out)
+                    result["strategy"] = "rebuild"
+                    results.append(result)
+                    continue
+                if plan["strategy"] == "full":
+                    out.write(f"\nDELETE FROM `{table}`;\n")
+                    result = dump_table(connection, table, out, create=False)
+                elif previous.get("value") is None:
+                    result = dump_table(connection, table, out, create=False, insert_verb="REPLACE INTO")
+                elif plan["strategy"] == "updated_at":
+                    result = dump_table(
+                        connection, table, out, create=False, insert_verb="REPLACE INTO",
+                        where=f"`{plan['column']}` >= %s", params=(previous["value"],),
+                    )
+                else:
+                    result = dump_table(
+                        connection, table, out, create=False, insert_verb="INSERT IGNORE INTO",
+                        where=f"`{plan['column']}` > %s", params=(previous["value"],),
+                    )
+                result["strategy"] = plan["strategy"]
+                if plan["sync_keys"]:
+                    result["keys"] = _write_key_sync(connection, table, plan["key"], out)
+                results.append(result)
+            write_views(connection, views or [], out)
+            write_footer(out)
+    finally:
+        try:
+            connection.rollback()
+        except Exception:
+            pass
+
+    manifest = {
+        "title": "TBQC Database Backup (incremental)",
+        "created_at": created_at,
+        "method": "Python incremental",
+        "compression": compression,
+        "consistency": "snapshot",
+        "tables": results,
+        "views": views or [],
+        "total_rows": sum(r["rows"] for r in results),
+        "watermarks": marks,
+    }
+    manifest.update(manifest_extra or {})
+    write_manifest(out_path, manifest)
+    return manifest
+
+
+def create_incremental_backup(
+    backup_dir,
+    connect: Callable[[], Any],
+    *,
+    compression: str = "gzip",
+    max_chain: int = INCREMENTAL_MAX_CHAIN,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Tạo file tăng dần tiếp theo trong chuỗi của backup_dir (tạo base nếu chưa có chuỗi hợp lệ
+    hoặc chuỗi đã dài quá max_chain).
+
+    Return dict cùng dạng create_backup(): success, backup_file, backup_filename, file_size,
+    timestamp, error — thêm mode ('base' / 'incremental') và chain. Đang có lần chạy khác giữ
+    chuỗi → success False, không đụng tới file nào.
+    """
+    lock_path = _acquire_chain_lock(backup_dir)
+    if lock_path is None:
+        logger.warning("Incremental backup skipped: another run holds %s", CHAIN_LOCK_FILE)
+        return {"success": False, "error": "Another incremental backup is running", "backup_file": None}
+    try:
+        return _create_incremental_backup(backup_dir, connect, compression, max_chain, now)
+    finally:
+        _release_chain_lock(lock_path)
+
+
+def _create_incremental_backup(backup_dir, connect, compression, max_chain, now) -> Dict[str, Any]:
+    timestamp = (now or datetime.now()).strftime("%Y%m%d_%H%M%S")
+    suffix = COMPRESSION_SUFFIXES[compression]
+    connection = connect()
+    if not connection:
+        return {"success": False, "error": "Cannot connect to database", "backup_file": None}
+    backup_file = None
+    try:
+        state = load_chain(backup_dir)
+        if state is not None and len(state["chain"]) > max_chain:
+            state = None
+        objects = list_schema_objects(connection)
+        views = [name for name, kind in objects if kind == "VIEW"]
+        plans = {name: table_plan(connection, name) for name, kind in objects if kind != "VIEW"}
+
+        if state is None:
+            mode = "base"
+            backup_filename = f"tbqc_backup_{timestamp}.sql{suffix}"
+            chain = [backup_filename]
+            backup_file = os.path.join(backup_dir, backup_filename)
+            manifest = dump_database(
+                connection,
+                backup_file,
+                compression=compression,
+                method="Python base (incremental chain)",
+                manifest_extra={"kind": "base", "chain": chain},
+                snapshot_extra=lambda conn: {"watermarks": read_watermarks(conn, plans)},
+            )
+        else:
+            mode = "incremental"
+            backup_filename = f"tbqc_backup_{timestamp}_inc{len(state['chain']):03d}.sql{suffix}"
+            chain = state["chain"] + [backup_filename]
+            backup_file = os.path.join(backup_dir, backup_filename)
+            manifest = dump_incremental(
+                connection,
+                backup_file,
+                state["watermarks"],
+                plans,
+                compression=compression,
+                views=views,
+                manifest_extra={"kind": "incremental", "chain": chain},
+            )
+        _save_chain(backup_dir, {"chain": chain, "watermarks": manifest["watermarks"], "updated_at": manifest["created_at"]})
+    except Exception as e:
+        logger.error("Incremental backup failed: %s", e, exc_info=True)
+        if backup_file:
+            for path in (backup_file, manifest_path(backup_file)):
+                if os.path.exists(path):
+                    os.remove(path)
+        return {"success": False, "error": f"Incremental backup failed: {e}", "backup_file": None}
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    try:
+        os.chmod(backup_file, 0o600)
+    except Exception:
+        pass
+    file_size = os.path.getsize(backup_file)
+    logger.info(
+        "Backup %s %s: %s rows, %s bytes (chain %s)",
+        mode, backup_filename, manifest["total_rows"], file_size, len(chain),
+    )
+    return {
+        "success": True,
+        "backup_file": backup_file,
+        "backup_filename": backup_filename,
+        "file_size": file_size,
+        "timestamp": timestamp,
+        "mode": mode,
+        "chain": chain,
+        "error": None,
+    }
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Duyệt tổ tiên / hậu duệ trong bộ nhớ, thay cho chuỗi query của /api/ancestors và các stored
+procedure sp_get_ancestors / sp_get_descendants.
+
+Dữ liệu vào là LineageGraph dựng từ snapshot gia phả (services.genealogy_graph). Các hàm bên dưới
+tái hiện đúng các luật trong SQL cũ:
+
+- resolve_ancestor_target: chọn người bắt đầu tra tổ tiên (cha thuộc dòng Nguyễn Phước, nếu không
+  thì ông ngoại), giống khối query trong get_ancestors.
+- find_ancestors: CTE đệ quy theo dòng cha (relationships 'father' → fallback father_mother_id).
+- find_descendants: sp_get_descendants (mọi relation_type, UNION ALL nên giữ cả dòng lặp).
+
+So sánh chuỗi mô phỏng collation utf8mb4_unicode_ci của MySQL (không phân biệt hoa thường / dấu,
+bỏ khoảng trắng cuối); thứ tự trong cùng khóa sắp xếp có thể khác MySQL nhưng MySQL cũng không
+đảm bảo thứ tự đó.
+"""
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+
+def collation_key(value):
+    """Khóa so sánh gần với utf8mb4_unicode_ci: bỏ dấu, không phân biệt hoa thường, bỏ khoảng trắng cuối."""
+    if value is None:
+        return ''
+    text = str(value).rstrip(' ')
+    decomposed = unicodedata.normalize('NFD', text.replace('đ', 'd').replace('Đ', 'D'))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+_MALE_KEY = collation_key('Nam')
+
+
+def _male_or_unknown(gender):
+    """SQL: (gender = 'Nam' OR gender IS NULL)."""
+    return gender is None or collation_key(gender) == _MALE_KEY
+
+
+class LineageGraph:
+    """Chỉ mục phục vụ duyệt dòng họ; dựng một lần cho mỗi snapshot, chỉ đọc sau đó."""
+
+    __slots__ = (
+        'persons_by_id',
+        'fathers_of',
+        'mothers_of',
+        'children_rows_of',
+        'family_children_of',
+        'fm_male_index',
+    )
+
+    def __init__(self, persons_by_id, relationship_rows):
+        """
+        persons_by_id: {person_id: {full_name, gender, generation_level, father_mother_id, ...}}
+        relationship_rows: [(child_id, parent_id, relation_type), ...] theo thứ tự đọc từ DB
+        """
+        self.persons_by_id = persons_by_id
+        fathers_of = {}
+        mothers_of = {}
+        children_rows_of = {}
+        family_children_of = {}
+        for child_id, parent_id, relation_type in relationship_rows:
+            if relation_type == 'father':
+                fathers_of.setdefault(child_id, []).append(parent_id)
+            elif relation_type == 'mother':
+                mothers_of.setdefault(child_id, []).append(parent_id)
+            if relation_type in ('father', 'mother'):
+                family_children_of.setdefault(parent_id, []).append(child_id)
+            children_rows_of.setdefault(parent_id, []).append(child_id)
+        self.fathers_of = fathers_of
+        self.mothers_of = mothers_of
+        # Mọi relation_type (sp_get_descendants không lọc loại quan hệ)
+        self.children_rows_of = children_rows_of
+        # Chỉ father/mother
+        self.family_children_of = family_children_of
+
+        # father_mother_id (đã fold) -> [(generation_level, person_id)] của người Nam / chưa rõ giới tính
+        fm_male_index = {}
+        for person_id, person in persons_by_id.items():
+            fm_id = person.get('father_mother_id')
+            if fm_id is None or person.get('generation_level') is None:
+                continue
+            if not _male_or_unknown(person.get('gender')):
+                continue
+            fm_male_index.setdefault(collation_key(fm_id), []).append((person['generation_level'], person_id))
+        self.fm_male_index = fm_male_index
+
+    def first_father(self, person_id):
+        """SELECT parent_id FROM relationships WHERE child_id = ? AND relation_type = 'father' LIMIT 1."""
+        fathers = self.fathers_of.get(person_id)
+        return fathers[0] if fathers else None
+
+    def first_mother(self, person_id):
+        mothers = self.mothers_of.get(person_id)
+        return mothers[0] if mothers else None
+
+    def fm_candidates_below(self, fm_id, generation_level):
+        """Người Nam/chưa rõ cùng father_mother_id, đời nhỏ hơn generation_level."""
+        if fm_id is None or generation_level is None:
+            return []
+        return [
+            (gen, pid)
+            for gen, pid in self.fm_male_index.get(collation_key(fm_id), ())
+            if gen < generation_level
+        ]
+
+
+def _fallback_father_by_fm(graph, person):
+    """Query dự phòng trong get_ancestors: cùng father_mother_id, ORDER BY generation_level DESC LIMIT 1."""
+    candidates = graph.fm_candidates_below(person.get('father_mother_id'), person.get('generation_level'))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda item: item[0])[1]
+
+
+def resolve_ancestor_target(graph, person_id, lineage_check):
+    """
+    Chọn người bắt đầu tra tổ tiên cho person_id (person_id phải có trong graph).
+
+    - Có cha (relationships hoặc fallback father_mother_id) thuộc dòng Nguyễn Phước → tra từ cha.
+    - Cha không thuộc dòng → tra từ ông ngoại (cha của mẹ) nếu có, và trả kèm cha để nối vào chuỗi.
+    - Không có cha → tra từ ông ngoại nếu có; nếu không thì từ chính người đó.
+
+    Returns:
+        (target_person_id, father_to_add_to_chain)
+    """
+    person = graph.persons_by_id[person_id]
+    father_id = graph.first_father(person_id)
+    if not father_id and person.get('father_mother_id'):
+        father_id = _fallback_father_by_fm(graph, person)
+
+    target_person_id = person_id
+    father_to_add_to_chain = None
+    if father_id:
+        father = graph.persons_by_id.get(father_id)
+        father_name = (father.get('full_name') or '') if father else ''
+        if lineage_check(father_name):
+            return father_id, None
+        father_to_add_to_chain = father_id
+
+    mother_id = graph.first_mother(person_id)
+    if mother_id:
+        grandfather_id = graph.first_father(mother_id)
+        if grandfather_id:
+            target_person_id = grandfather_id
+    return target_person_id, father_to_add_to_chain
+
+
+def _ancestor_row(person_id, person, level):
+    return {
+        'person_id': person_id,
+        'full_name': person.get('full_name'),
+        'gender': person.get('gender'),
+        'generation_level': person.get('generation_level'),
+        'father_mother_id': person.get('father_mother_id'),
+        'level': level,
+    }
+
+
+def _parents_in_cte(graph, person_id, person):
+    """Các dòng cha mà bước đệ quy của CTE tổ tiên sinh ra cho một người (có thể lặp)."""
+    parents = []
+    father_rows = graph.fathers_of.get(person_id) or [None]
+    for father_id in father_rows:
+        if father_id is not None and father_id in graph.persons_by_id:
+            parents.append(father_id)
+            continue
+        # Ưu tiên 2: cùng father_mother_id, đời gần nhất nhỏ hơn con
+        fm_id = person.get('father_mother_id')
+        if fm_id is None or collation_key(fm_id) == '':
+            continue
+        candidates = graph.fm_candidates_below(fm_id, person.get('generation_level'))
+        if not candidates:
+            # Ưu tiên 3 (đời = con - 1) là tập con của ưu tiên 2 nên cũng rỗng
+            continue
+        nearest = max(gen for gen, _pid in candidates)
+        parents.extend(pid for gen, pid in candidates if gen == nearest)
+    return parents
+
+
+def find_ancestors(graph, target_person_id, max_level):
+    """
+    Tương đương CTE đệ quy trong get_ancestors: tổ tiên theo dòng cha tới max_level đời,
+    chỉ giữ người Nam / chưa rõ giới tính, ORDER BY level, generation_level, full_name.
+    """
+    target = graph.persons_by_id.get(target_person_id)
+    if target is None:
+        return []
+    rows = []
+    frontier = [target_person_id]
+    level = 0
+    while frontier and level < max_level:
+        next_frontier = []
+        for person_id in frontier:
+            next_frontier.extend(_parents_in_cte(graph, person_id, graph.persons_by_id[person_id]))
+        # CTE (UNION ALL) nhân bản dòng khi một người có nhiều đường lên; caller chỉ giữ lần
+        # xuất hiện đầu tiên nên gộp trùng trong cùng level để tránh bùng nổ.
+        next_frontier = list(dict.fromkeys(next_frontier))
+        level += 1
+        for parent_id in next_frontier:
+            parent = graph.persons_by_id[parent_id]
+            if _male_or_unknown(parent.get('gender')):
+                rows.append(_ancestor_row(parent_id, parent, level))
+        frontier = next_frontier
+    rows.sort(key=lambda row: (
+        row['level'],
+        row['generation_level'] is not None,
+        row['generation_level'] if row['generation_level'] is not None else 0,
+        collation_key(row['full_name']),
+    ))
+    return rows
+
+
+def find_descendants(graph, person_id, max_level):
+    """
+    Tương đương sp_get_descendants: con cháu qua mọi dòng relationships (UNION ALL, giữ dòng lặp)
+    tới max_level đời, ORDER BY level, full_name.
+    """
+    if person_id not in graph.persons_by_id:
+        return []
+    rows = []
+    frontier = [person_id]
+    level = 0
+    while frontier and level < max_level:
+        level += 1
+        next_frontier = []
+        for parent_id in frontier:
+            for child_id in graph.children_rows_of.get(parent_id, ()):
+                child = graph.persons_by_id.get(child_id)
+                if child is None:
+                    continue
+                next_frontier.append(child_id)
+                rows.append({
+                    'person_id': child_id,
+                    'full_name': child.get('full_name'),
+                    'gender': child.get('gender'),
+                    'generation_level': child.get('generation_level'),
+                    'level': level,
+                })
+        frontier = next_frontier
+    rows.sort(key=lambda row: (row['level'], collation_key(row['full_name'])))
+    return rows
+
+
+def children_names_distinct(graph, parent_id):
+    """
+    GROUP_CONCAT(DISTINCT child.full_name SEPARATOR '; ') trên quan hệ father/mother của parent_id
+    (không cắt theo group_concat_max_len). Trả None nếu không có con.
+    """
+    seen = {}
+    for child_id in graph.family_children_of.get(parent_id, ()):
+        child = graph.persons_by_id.get(child_id)
+        name = child.get('full_name') if child else None
+        if name is None:
+            continue
+        seen.setdefault(collation_key(name), name)
+    if not seen:
+        return None
+    return '; '.join(seen[key] for key in sorted(seen))
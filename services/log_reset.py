@@ -3,14 +3,15 @@
 services/log_reset.py
 
 Reset toàn bộ "bản log" của hệ thống:
-  - Dump 2 bảng `activity_logs` và `page_views` ra `backups/logs-YYYYMMDD-HHMMSS.sql`
-    (CREATE TABLE + INSERT — có thể restore lại được bằng cách nạp file SQL này).
-  - TRUNCATE cả hai bảng.
+  - Dump `activity_logs`, `page_views` và bảng tổng hợp `page_view_daily` ra
+    `backups/logs-YYYYMMDD-HHMMSS.sql` (CREATE TABLE + INSERT — có thể restore lại được
+    bằng cách nạp file SQL này).
+  - TRUNCATE các bảng đó (page_view_daily đi cùng page_views để thống kê về 0).
   - Ghi 1 entry LOG_RESET vào `activity_logs` để trace ai đã thực hiện reset.
 
 Thiết kế an toàn:
-  - KHÔNG dùng binary `mysqldump` (không phải env nào cũng có) — tự implement qua
-    SHOW CREATE TABLE + SELECT *.
+  - KHÔNG dùng binary `mysqldump` (không phải env nào cũng có) — dump qua engine chung
+    services.sql_dump (SHOW CREATE TABLE + SELECT đọc từng lô, extended INSERT).
   - Idempotent với bảng không tồn tại: chỉ dump bảng nào thực sự có.
   - Mọi bước ghi file xong mới thực hiện TRUNCATE. Nếu dump fail → không xóa.
   - Backup file đặt dưới `backups/` (đã được dự án dùng cho các loại backup khác).
@@ -26,10 +27,12 @@ from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
+from services.sql_dump import dump_table
+
 logger = logging.getLogger(__name__)
 
 # Danh sách bảng log được reset. KHÔNG thêm bảng khác vào đây nếu không cân nhắc kỹ.
-LOG_TABLES: Tuple[str, ...] = ("activity_logs", "page_views")
+LOG_TABLES: Tuple[str, ...] = ("activity_logs", "page_views", "page_view_daily")
 
 # Thư mục backup (tương đối so với project root); tạo nếu chưa có.
 BACKUP_DIR_NAME = "backups"
@@ -62,110 +65,6 @@ def _count_rows(cursor, table_name: str) -> int:
         return 0
 
 
-def _get_create_table_sql(cursor, table_name: str) -> Optional[str]:
-    """Trả về statement `CREATE TABLE ...` gốc của MySQL."""
-    cursor.execute(f"SHOW CREATE TABLE `{table_name}`")
-    row = cursor.fetchone()
-    if not row:
-        return None
-    # row có thể là dict hoặc tuple tuỳ cursor
-    if isinstance(row, dict):
-        # key thường là 'Create Table' (có space)
-        for key in row:
-            if key.lower().startswith("create"):
-                return str(row[key])
-        return None
-    if len(row) >= 2:
-        return str(row[1])
-    return None
-
-
-def _mysql_escape_value(val: Any) -> str:
-    """
-    Escape 1 giá trị Python thành literal an toàn để chèn vào INSERT ... VALUES (...).
-    KHÔNG dùng cho input người dùng — chỉ dùng cho dump dữ liệu đã nằm sẵn trong DB.
-    """
-    if val is None:
-        return "NULL"
-    if isinstance(val, bool):
-        return "1" if val else "0"
-    if isinstance(val, (int, float)):
-        return str(val)
-    if isinstance(val, (bytes, bytearray)):
-        # Hex literal — MySQL hiểu 0x...
-        return "0x" + bytes(val).hex() if bytes(val) else "''"
-    if isinstance(val, datetime):
-        return "'" + val.strftime("%Y-%m-%d %H:%M:%S") + "'"
-    if isinstance(val, (dict, list)):
-        s = json.dumps(val, ensure_ascii=False)
-    else:
-        s = str(val)
-    # Escape ký tự đặc biệt cho MySQL string literal
-    s = (
-        s.replace("\\", "\\\\")
-         .replace("'", "\\'")
-         .replace("\r", "\\r")
-         .replace("\n", "\\n")
-         .replace("\x00", "\\0")
-         .replace("\x1a", "\\Z")
-    )
-    return "'" + s + "'"
-
-
-def _dump_table(cursor, table_name: str, out) -> int:
-    """
-    Ghi CREATE TABLE + INSERT cho `table_name` vào file out.
-    Trả về số dòng đã dump.
-    """
-    out.write(f"\n-- ---------------------------------------------------\n")
-    out.write(f"-- Table: `{table_name}`\n")
-    out.write(f"-- ---------------------------------------------------\n")
-
-    create_sql = _get_create_table_sql(cursor, table_name)
-    if create_sql:
-        out.write(f"DROP TABLE IF EXISTS `{table_name}`;\n")
-        out.write(create_sql.rstrip(";") + ";\n\n")
-
-    # Lấy tên cột theo thứ tự đúng
-    cursor.execute(f"SELECT * FROM `{table_name}`")
-    rows = cursor.fetchall()
-    if not rows:
-        out.write(f"-- (no rows)\n")
-        return 0
-
-    # Cursor mysql-connector có `.column_names` nếu không dictionary
-    col_names: List[str]
-    if hasattr(cursor, "column_names") and cursor.column_names:
-        col_names = list(cursor.column_names)
-    elif isinstance(rows[0], dict):
-        col_names = list(rows[0].keys())
-    else:
-        # Fallback: hỏi DESCRIBE
-        cursor.execute(f"DESCRIBE `{table_name}`")
-        desc_rows = cursor.fetchall()
-        col_names = [r[0] if not isinstance(r, dict) else r["Field"] for r in desc_rows]
-
-    cols_sql = ", ".join(f"`{c}`" for c in col_names)
-    count = 0
-    # Batch nhỏ để file dễ đọc; mỗi INSERT tối đa 200 dòng
-    BATCH = 200
-    for i in range(0, len(rows), BATCH):
-        chunk = rows[i:i + BATCH]
-        values_parts: List[str] = []
-        for r in chunk:
-            if isinstance(r, dict):
-                vals = [r.get(c) for c in col_names]
-            else:
-                vals = list(r)
-            values_parts.append("(" + ", ".join(_mysql_escape_value(v) for v in vals) + ")")
-        out.write(f"INSERT INTO `{table_name}` ({cols_sql}) VALUES\n")
-        out.write(",\n".join(values_parts))
-        out.write(";\n")
-        count += len(chunk)
-
-    return count
-
-
 def _project_root() -> Path:
     # services/log_reset.py → project root = parent của services/
     return Path(__file__).resolve().parent.parent
@@ -288,13 +187,9 @@ def perform_log_reset(
             out.write("SET FOREIGN_KEY_CHECKS=0;\n")
             out.write("SET NAMES utf8mb4;\n")
             dumped_counts: Dict[str, int] = {}
-            # Cần dùng cursor mới (dictionary) cho dump để giữ thứ tự cột rõ ràng
-            dump_cur = conn.cursor(dictionary=True, buffered=True)
-            try:
-                for t in present:
-                    dumped_counts[t] = _dump_table(dump_cur, t, out)
-            finally:
-                dump_cur.close()
+            # Engine chung đọc bằng cursor không buffer + fetchmany: không giữ cả bảng trong RAM
+            for t in present:
+                dumped_counts[t] = dump_table(conn, t, out)["rows"]
             out.write("\nSET FOREIGN_KEY_CHECKS=1;\n")
             out.write("-- End of dump\n")
 
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Gán nhánh hàng loạt cho /api/members/bulk-update-branch.
+
+Trước đây mỗi tên nhánh gọi get_or_create_branch (SELECT rồi INSERT từng cái), persons được ghi
+bằng executemany — mỗi người một câu UPDATE ... WHERE person_id = %s — và khi persons có cả
+branch_name lẫn branch_id thì branch_id không được cập nhật.
+
+Giờ theo tập:
+- Người có thật: SELECT person_id IN (...) theo lô.
+- Nhánh: một SELECT branch_name IN (...) cho mọi tên khác nhau trong file, nhánh còn thiếu tạo
+  bằng một câu INSERT IGNORE nhiều dòng (branch_name là UNIQUE) rồi đọc lại id. Collation *_ci trả
+  về cách viết trong DB ('Một' cho 'một'), nên kết quả ghép theo tên đã casefold; tên vẫn không
+  ghép được (khác dấu mà collation coi là một) thì tra riêng từng tên bằng `branch_name = %s`.
+- Ghi: giá trị đích chỉ có vài nhánh, nên gom người theo nhánh và ghi
+  `UPDATE persons SET branch_name = %s, branch_id = %s WHERE person_id IN (...)` — mỗi nhánh một câu
+  cho tối đa BULK_UPDATE_BRANCH_BATCH_SIZE người. Không commit: caller commit một lần (nguyên tử).
+"""
+import logging
+import time
+
+from folder_py.db_config import env_number
+from services.schema_registry import has_table, table_columns
+
+logger = logging.getLogger(__name__)
+
+BULK_UPDATE_BRANCH_BATCH_SIZE = env_number('BULK_UPDATE_BRANCH_BATCH_SIZE', 1000, int, 1)
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def existing_person_ids(cursor, person_ids, batch_size=None):
+    """Tập person_id trong `person_ids` có trong persons (SELECT IN theo lô)."""
+    batch_size = batch_size or BULK_UPDATE_BRANCH_BATCH_SIZE
+    found = set()
+    for batch in _chunks(list(person_ids), batch_size):
+        cursor.execute(f'SELECT person_id FROM persons WHERE person_id IN ({_placeholders(batch)})', tuple(batch))
+        found.update(r['person_id'] for r in cursor.fetchall() if r.get('person_id'))
+    return found
+
+
+def _name_key(name):
+    return str(name).casefold().strip()
+
+
+def _select_branch_ids(cursor, names, ids):
+    """SELECT ... IN (names), ghép id vào `ids` theo tên trong file (so casefold, không so nguyên văn)."""
+    cursor.execute(f'SELECT branch_id, branch_name FROM branches WHERE branch_name IN ({_placeholders(names)})', tuple(names))
+    by_key = {_name_key(r['branch_name']): r['branch_id'] for r in cursor.fetchall() if r.get('branch_name')}
+    for name in names:
+        if _name_key(name) in by_key:
+            ids[name] = by_key[_name_key(name)]
+    return [name for name in names if name not in ids]
+
+
+def resolve_branch_ids(cursor, branch_names):
+    """
+    ({branch_name theo file: branch_id}, số nhánh vừa tạo) — một SELECT, thiếu thì một INSERT nhiều dòng.
+    Tên không tìm / tạo được nhánh → ValueError.
+    """
+    names = sorted({name for name in branch_names if name})
+    if not names:
+        return {}, 0
+    ids = {}
+    missing = _select_branch_ids(cursor, names, ids)
+    if not missing:
+        return ids, 0
+    values = ', '.join(['(%s)'] * len(missing))
+    cursor.execute(f'INSERT IGNORE INTO branches (branch_name) VALUES {values}', tuple(missing))
+    created = max(cursor.rowcount, 0)
+    for name in _select_branch_ids(cursor, missing, ids):
+        # Collation coi là trùng nhưng casefold khác (dấu, khoảng trắng): để MySQL tự so
+        cursor.execute('SELECT branch_id FROM branches WHERE branch_name = %s LIMIT 1', (name,))
+        row = cursor.fetchone()
+        if not row:
+            raise ValueError(f'Không tìm thấy hoặc tạo được nhánh {name!r}')
+        ids[name] = row['branch_id']
+    return ids, created
+
+
+def assign_branches(cursor, assignments, batch_size=None):
+    """
+    Ghi {person_id: branch_name} (không commit). Người không có trong DB bị bỏ qua.
+    Return số liệu: requested / matched / changed / not_found / branches_created / statements + thời gian (ms).
+    persons không có branch_name lẫn branch_id (hoặc bảng branches) → ValueError.
+    """
+    batch_size = batch_size or BULK_UPDATE_BRANCH_BATCH_SIZE
+    started = time.perf_counter()
+    columns = table_columns('persons', ('branch_name', 'branch_id'), cursor=cursor)
+    use_branch_id = 'branch_id' in columns and has_table('branches', cursor=cursor)
+    if 'branch_name' not in columns and not use_branch_id:
+        raise ValueError('Không tìm thấy cột branch_name hoặc branch_id trong persons')
+
+    found = existing_person_ids(cursor, assignments, batch_size)
+    by_branch = {}
+    for person_id, branch_name in assignments.items():
+        if person_id in found:
+            by_branch.setdefault(branch_name, []).append(person_id)
+    branch_ids, created = resolve_branch_ids(cursor, by_branch) if use_branch_id and by_branch else ({}, 0)
+    stats = {
+        'requested': len(assignments),
+        'matched': sum(len(ids) for ids in by_branch.values()),
+        'not_found': len(assignments) - len(found),
+        'branches_created': created,
+        'changed': 0,
+        'statements': 0,
+        'resolve_ms': _elapsed_ms(started),
+    }
+
+    write_started = time.perf_counter()
+    set_parts = []
+    if 'branch_name' in columns:
+        set_parts.append('branch_name = %s')
+    if use_branch_id:
+        set_parts.append('branch_id = %s')
+    for branch_name, person_ids in sorted(by_branch.items()):
+        values = []
+        if 'branch_name' in columns:
+            values.append(branch_name)
+        if use_branch_id:
+            values.append(branch_ids[branch_name])
+        for batch in _chunks(person_ids, batch_size):
+            cursor.execute(
+                f"UPDATE persons SET {', '.join(set_parts)} WHERE person_id IN ({_placeholders(batch)})",
+                tuple(values) + tuple(batch),
+            )
+            stats['changed'] += max(cursor.rowcount, 0)
+            stats['statements'] += 1
+    stats['write_ms'] = _elapsed_ms(write_started)
+    logger.info(f'bulk-update-branch: {stats}')
+    return stats
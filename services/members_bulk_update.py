@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Engine cập nhật hàng loạt cho Update SLL (/api/members/bulk-update-sll).
+
+Trước đây mỗi dòng Excel đi qua apply_person_members_update_core như một lần sửa tay: SELECT tìm
+person, SELECT * dựng base, dò information_schema, tra từng branch / generation, dựng lại quan hệ
+cha mẹ / con / vợ chồng theo tên, UPDATE, commit, SELECT after-image, một kết nối ghi log, xoá cache
+gia phả — rồi load_relationship_data() toàn bộ DB trước dòng kế tiếp.
+
+Giờ chia hai bước:
+1. plan_bulk_update(): validate cả file trước khi ghi. Đọc before-image của mọi dòng bằng
+   `SELECT * ... WHERE person_id IN (...)` (và csv_id IN (...) cho ID hiển thị), quan hệ của đúng các
+   người đó, branch / generation đã có — mỗi thứ một query theo lô. Dòng lỗi (giới tính, email, cha /
+   mẹ không tra được) bị loại kèm lý do; dòng không đổi gì so với DB không ghi.
+2. apply_bulk_update(): UPDATE persons bằng executemany (gom theo tập cột), cha / mẹ bằng executemany
+   DELETE + INSERT; chỉ dòng đổi vợ chồng / con / anh chị em mới đi đường từng người. Một transaction
+   (hoặc commit theo lô BULK_UPDATE_SLL_CHUNK_SIZE dòng), một bộ log UPDATE_PERSON ghi bằng
+   log_activities(). Caller xoá cache gia phả một lần.
+   Schema spouse_sibling_children (có thể ALTER — MySQL tự commit) được chuẩn bị trước transaction,
+   lỗi khi dựng quan hệ theo tên được ném ra để rollback cả lô thay vì chỉ ghi log.
+"""
+import logging
+import re
+
+from folder_py.db_config import env_number
+from services.members_helpers import (
+    MEMBER_UPDATE_COLUMNS,
+    member_update_values,
+    sll_canonical_branch,
+    sll_merge_excel_into_payload,
+    sll_payload_from_row,
+)
+from services.person_helpers import find_person_by_name, load_relationship_data
+from services.schema_registry import has_table, table_columns
+
+logger = logging.getLogger(__name__)
+
+# 0 = cả file trong một transaction; N > 0 = commit sau mỗi N người (lô lỗi chỉ rollback lô đó)
+BULK_UPDATE_SLL_CHUNK_SIZE = env_number('BULK_UPDATE_SLL_CHUNK_SIZE', 0, int, 0)
+IN_QUERY_BATCH = 500
+ERROR_SAMPLE_LIMIT = 50
+
+PERSON_ID_RE = re.compile(r'^P-\d+-\d+$')
+PARENT_KEYS = (('father', 'father_name'), ('mother', 'mother_name'))
+PARENT_NAME_KEYS = ('father_name', 'mother_name')
+RELATION_TEXT_KEYS = ('spouse_info', 'children_info', 'siblings_info')
+# Các cột before / after ghi vào activity_logs (cùng tập với log_person_update của sửa từng người)
+AUDIT_FIELDS = (
+    'full_name', 'gender', 'status', 'generation_level', 'birth_date_solar', 'death_date_solar',
+    'place_of_death', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email', 'occupation',
+)
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _select_in(cursor, sql, keys):
+    """Chạy `sql` (chứa {placeholders}) theo lô IN_QUERY_BATCH khoá; return toàn bộ dòng."""
+    rows = []
+    keys = list(keys)
+    for batch in _chunks(keys, IN_QUERY_BATCH):
+        cursor.execute(sql.format(placeholders=', '.join(['%s'] * len(batch))), tuple(batch))
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def _comparable(value):
+    # DATE / INT từ MySQL vs chuỗi từ Excel: so theo dạng chuỗi, ô rỗng == NULL
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()[:10]
+    return str(value).strip() or None
+
+
+class BulkUpdatePlan:
+    """Kết quả validate một file Update SLL: các người cần ghi + dòng lỗi / bỏ qua."""
+
+    def __init__(self):
+        self.updates = {}
+        self.errors = []
+        self.skipped_count = 0
+        self.unchanged_count = 0
+        self.branch_ids = {}
+        self.generation_ids = {}
+
+    def add_error(self, row_id, message, person_id=None):
+        self.errors.append({'row': row_id, 'person_id': person_id, 'error': message})
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+    def summary(self):
+        return {
+            'to_update': len(self.updates),
+            'unchanged_count': self.unchanged_count,
+            'skipped_count': self.skipped_count,
+            'error_count': self.error_count,
+            'errors': self.errors[:ERROR_SAMPLE_LIMIT],
+        }
+
+
+def _resolve_rows(cursor, rows, has_csv_id):
+    """{person_id: dòng persons} + {id trong file: person_id} bằng tối đa hai lô IN (...)."""
+    persons = {}
+    by_row_id = {}
+    direct = {row_id for row_id, _ in rows if PERSON_ID_RE.match(row_id)}
+    if direct:
+        for p in _select_in(cursor, 'SELECT * FROM persons WHERE person_id IN ({placeholders})', direct):
+            persons[p['person_id']] = p
+            by_row_id[p['person_id']] = p['person_id']
+    missing = {row_id for row_id, _ in rows if row_id not in by_row_id}
+    if missing and has_csv_id:
+        for p in _select_in(cursor, 'SELECT * FROM persons WHERE csv_id IN ({placeholders})', missing):
+            key = str(p.get('csv_id'))
+            if key not in by_row_id:
+                persons.setdefault(p['person_id'], p)
+                by_row_id[key] = p['person_id']
+    return persons, by_row_id
+
+
+def _branch_names(cursor, persons):
+    """branch_name cho các person chỉ có branch_id (dữ liệu cũ) — một query."""
+    ids = {p['branch_id'] for p in persons.values() if not p.get('branch_name') and p.get('branch_id')}
+    if not ids:
+        return {}
+    rows = _select_in(cursor, 'SELECT branch_id, branch_name FROM branches WHERE branch_id IN ({placeholders})', ids)
+    return {r['branch_id']: r['branch_name'] for r in rows}
+
+
+def _relation_changes(base, merged):
+    return {
+        key: merged.get(key)
+        for key in RELATION_TEXT_KEYS + PARENT_NAME_KEYS
+        if _comparable(merged.get(key)) != _comparable(base.get(key))
+    }
+
+
+def _resolve_parents(cursor, person_id, merged, changes):
+    """[(relation_type, parent_id | None)] cho cha / mẹ đổi tên trong file; không tra được → ValueError."""
+    fm_id = (str(merged.get('fm_id') or '')).strip() or None
+    parents = []
+    for relation_type, key in PARENT_KEYS:
+        if key not in changes:
+            continue
+        name = _comparable(changes[key])
+        if not name:
+            parents.append((relation_type, None))
+            continue
+        parent_id = find_person_by_name(cursor, name, fm_id=fm_id)
+        if not parent_id:
+            raise ValueError(f'Khong tim thay hoac ten bi trung {key}: {name}')
+        if parent_id == person_id:
+            raise ValueError(f'{key} không thể là chính người này')
+        parents.append((relation_type, parent_id))
+    return parents
+
+
+def plan_bulk_update(cursor, rows):
+    """
+    Validate + chuẩn bị cập nhật cho `rows` [(id trong file, {key nội bộ: ô Excel})] — chỉ đọc DB.
+    Nhiều dòng cùng một người: gộp theo thứ tự (dòng sau đè ô không rỗng của dòng trước).
+    """
+    plan = BulkUpdatePlan()
+    if not rows:
+        return plan
+    columns = table_columns('persons', MEMBER_UPDATE_COLUMNS, cursor=cursor)
+    has_csv_id = 'csv_id' in columns
+    persons, by_row_id = _resolve_rows(cursor, rows, has_csv_id)
+    branch_names = _branch_names(cursor, persons)
+    rel_data = load_relationship_data(cursor, person_ids=list(persons)) if persons else None
+
+    merged_by_person = {}
+    base_by_person = {}
+    for row_id, excel in rows:
+        person_id = by_row_id.get(row_id)
+        if not person_id:
+            if PERSON_ID_RE.match(row_id) or has_csv_id:
+                plan.skipped_count += 1
+            else:
+                plan.add_error(row_id, 'ID không hợp lệ')
+            continue
+        if not PERSON_ID_RE.match(person_id):
+            plan.skipped_count += 1
+            continue
+        if person_id not in base_by_person:
+            p = persons[person_id]
+            base_by_person[person_id] = sll_payload_from_row(person_id, p, rel_data, branch_names.get(p.get('branch_id')))
+        previous = merged_by_person.get(person_id, base_by_person[person_id])
+        merged = sll_merge_excel_into_payload(previous, excel)
+        try:
+            member_update_values(merged, columns)
+        except ValueError as e:
+            plan.add_error(row_id, str(e), person_id)
+            continue
+        merged_by_person[person_id] = merged
+
+    use_branches = 'branch_id' in columns and has_table('branches', cursor=cursor)
+    use_generations = 'generation_id' in columns
+    wanted_branches = set()
+    wanted_generations = set()
+    for merged in merged_by_person.values():
+        if use_branches and sll_canonical_branch(merged.get('branch_name')):
+            wanted_branches.add(sll_canonical_branch(merged.get('branch_name')))
+        if use_generations and _comparable(merged.get('generation_number')):
+            wanted_generations.add(_comparable(merged.get('generation_number')))
+    if wanted_branches:
+        rows_ = _select_in(cursor, 'SELECT branch_id, branch_name FROM branches WHERE branch_name IN ({placeholders})', wanted_branches)
+        plan.branch_ids = {r['branch_name']: r['branch_id'] for r in rows_}
+    if wanted_generations:
+        rows_ = _select_in(cursor, 'SELECT generation_id, generation_number FROM generations WHERE generation_number IN ({placeholders})', wanted_generations)
+        plan.generation_ids = {_comparable(r['generation_number']): r['generation_id'] for r in rows_}
+
+    for person_id, merged in merged_by_person.items():
+        before = persons[person_id]
+        fields = member_update_values(merged, columns)
+        branch = sll_canonical_branch(merged.get('branch_name')) if use_branches else None
+        generation = _comparable(merged.get('generation_number')) if use_generations else None
+        changes = _relation_changes(base_by_person[person_id], merged)
+        try:
+            parents = _resolve_parents(cursor, person_id, merged, changes)
+        except ValueError as e:
+            plan.add_error(person_id, str(e), person_id)
+            continue
+        dirty = any(_comparable(before.get(col)) != _comparable(val) for col, val in fields.items())
+        if use_branches and 'branch_name' in merged:
+            dirty = dirty or plan.branch_ids.get(branch) != before.get('branch_id')
+        if generation:
+            dirty = dirty or plan.generation_ids.get(generation) != before.get('generation_id')
+        if not dirty and not changes:
+            plan.unchanged_count += 1
+            continue
+        plan.updates[person_id] = {
+            'person_id': person_id,
+            'before': {field: before.get(field) for field in AUDIT_FIELDS if field in before},
+            'fields': fields,
+            'branch': branch if use_branches and 'branch_name' in merged else False,
+            'generation': generation,
+            'parents': parents,
+            # Đổi tên cha / mẹ cũng ghi text fallback (spouse_sibling_children) như sửa từng người
+            'relations': changes,
+        }
+    return plan
+
+
+def _lookup_id(cursor, cache, created, sql_insert, key):
+    """id branch / generation cho `key`; chưa có thì INSERT trong transaction hiện tại."""
+    if key not in cache:
+        cursor.execute(sql_insert, (key,))
+        cache[key] = cursor.lastrowid
+        created.append((cache, key))
+    return cache[key]
+
+
+def _write_chunk(cursor, plan, entries, created, relation_text_columns=None):
+    from services.person_service import _process_children_spouse_siblings
+
+    groups = {}
+    for entry in entries:
+        fields = dict(entry['fields'])
+        if entry['branch'] is not False:
+            fields['branch_id'] = _lookup_id(
+                cursor, plan.branch_ids, created, 'INSERT INTO branches (branch_name) VALUES (%s)', entry['branch'],
+            ) if entry['branch'] else None
+        if entry['generation']:
+            fields['generation_id'] = _lookup_id(
+                cursor, plan.generation_ids, created, 'INSERT INTO generations (generation_number) VALUES (%s)', entry['generation'],
+            )
+        cols = tuple(fields)
+        groups.setdefault(cols, []).append(tuple(fields.values()) + (entry['person_id'],))
+    for cols, params in groups.items():
+        if not cols:
+            continue
+        sql = f"UPDATE persons SET {', '.join(f'{col} = %s' for col in cols)} WHERE person_id = %s"
+        cursor.executemany(sql, params)
+
+    parent_rows = [(e['person_id'], rel, parent_id) for e in entries for rel, parent_id in e['parents']]
+    if parent_rows:
+        cursor.executemany(
+            'DELETE FROM relationships WHERE child_id = %s AND relation_type = %s',
+            [(child_id, rel) for child_id, rel, _ in parent_rows],
+        )
+        inserts = [(child_id, parent_id, rel) for child_id, rel, parent_id in parent_rows if parent_id]
+        if inserts:
+            cursor.executemany(
+                'INSERT INTO relationships (child_id, parent_id, relation_type) VALUES (%s, %s, %s)',
+                inserts,
+            )
+
+    # Vợ chồng / con / anh chị em nhập bằng tên: chỉ dòng thật sự đổi mới dựng lại (đường từng người)
+    for entry in entries:
+        if entry['relations']:
+            _process_children_spouse_siblings(
+                cursor, entry['person_id'], entry['relations'],
+                relation_text_columns=relation_text_columns, raise_errors=True,
+            )
+
+
+def apply_bulk_update(connection, cursor, plan, chunk_size=None):
+    """
+    Ghi `plan` (không xoá cache — caller làm một lần). Return
+    {'updated': [person_id], 'failed': [person_id]}; lô lỗi bị rollback và ghi vào plan.errors.
+    """
+    from audit_log import log_activities
+    from services.person_service import _prepare_relation_text_columns
+
+    chunk_size = BULK_UPDATE_SLL_CHUNK_SIZE if chunk_size is None else chunk_size
+    entries = list(plan.updates.values())
+    size = chunk_size if chunk_size and chunk_size > 0 else max(len(entries), 1)
+    relation_text_columns = None
+    if any(entry['relations'] for entry in entries):
+        # Trước lần ghi đầu tiên: ALTER TABLE giữa transaction sẽ commit ngầm nửa lô
+        wanted = {k for entry in entries for k in ('father_name', 'mother_name') if k in entry['relations']}
+        relation_text_columns = _prepare_relation_text_columns(cursor, wanted)
+    updated, failed, audit = [], [], []
+    for chunk in _chunks(entries, size):
+        created = []
+        try:
+            _write_chunk(cursor, plan, chunk, created, relation_text_columns)
+            connection.commit()
+        except Exception as e:
+            logger.warning(f'bulk-update-sll: rollback {len(chunk)} person(s): {e}', exc_info=True)
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            # id branch / generation vừa INSERT trong lô đã rollback không còn hợp lệ
+            for cache, key in created:
+                cache.pop(key, None)
+            for entry in chunk:
+                failed.append(entry['person_id'])
+                plan.add_error(entry['person_id'], str(e), entry['person_id'])
+            continue
+        for entry in chunk:
+            updated.append(entry['person_id'])
+            after = dict(entry['before'])
+            after.update({k: v for k, v in entry['fields'].items() if k in AUDIT_FIELDS})
+            audit.append({
+                'action': 'UPDATE_PERSON',
+                'target_type': 'Person',
+                'target_id': entry['person_id'],
+                'before_data': entry['before'],
+                'after_data': after,
+            })
+    if audit:
+        log_activities(audit)
+    logger.info(f'bulk-update-sll: {len(updated)} updated, {len(failed)} rolled back')
+    return {'updated': updated, 'failed': failed}
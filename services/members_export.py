@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Xuất danh sách thành viên (/api/members/export, /members/export/excel) không dựng cả file trong RAM.
+
+Trước đây export lấy cả fetch_members_list(), dựng openpyxl Workbook đầy đủ, lưu ra BytesIO rồi
+mới gửi. Giờ dữ liệu đi theo chunk từ iter_members_chunks() (cursor không buffer + fetchmany):
+- CSV: generator gửi header ngay, rồi mỗi chunk một khối bytes → byte đầu tiên đi ngay.
+- XLSX: workbook write-only của openpyxl ghi từng hàng ra file tạm (không giữ cell trong RAM);
+  file zip chỉ hợp lệ khi đã đóng nên gửi sau khi ghi xong, từ file tạm trên đĩa.
+- ?columns=person_id,full_name,... chọn cột (key trong EXPORT_COLUMNS, giữ thứ tự người gọi);
+  bỏ trống = tất cả.
+"""
+import csv
+import io
+import logging
+import tempfile
+
+from folder_py.db_config import env_number
+
+logger = logging.getLogger(__name__)
+
+# Cột xuất: (key trong dict thành viên, tiêu đề tiếng Việt)
+EXPORT_COLUMNS = [
+    ('person_id', 'ID'), ('fm_id', 'FM_ID'), ('branch_name', 'Nhánh'), ('full_name', 'Họ và tên'), ('alias', 'Tên gọi khác'),
+    ('gender', 'Giới tính'), ('status', 'Trạng thái'), ('generation_number', 'Đời'),
+    ('birth_date_solar', 'Ngày sinh (dương lịch)'), ('birth_date_lunar', 'Ngày sinh (âm lịch)'),
+    ('death_date_solar', 'Ngày mất (dương lịch)'), ('death_date_lunar', 'Ngày mất (âm lịch)'),
+    ('grave', 'Mộ'), ('place_of_death', 'Nơi mất'),
+    ('father_name', 'Cha'), ('mother_name', 'Mẹ'),
+    ('spouses', 'Vợ/Chồng'), ('siblings', 'Anh chị em'), ('children', 'Con'),
+    ('occupation', 'Nghề nghiệp'), ('academic_rank', 'Học hàm'), ('academic_degree', 'Học vị'),
+    ('phone', 'Điện thoại'), ('email', 'Email'), ('biography', 'Tiểu sử'), ('personal_image_url', 'URL ảnh'),
+]
+_HEADERS = dict(EXPORT_COLUMNS)
+
+EXPORT_CHUNK_SIZE = env_number('MEMBERS_EXPORT_CHUNK_SIZE', 500, int, 1)
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+
+
+def select_columns(raw):
+    """
+    '?columns=a,b' → [(key, header), ...]; None / rỗng = tất cả.
+    ValueError nếu có key không nằm trong EXPORT_COLUMNS.
+    """
+    if not raw or not str(raw).strip():
+        return list(EXPORT_COLUMNS)
+    keys = [k.strip() for k in str(raw).split(',') if k.strip()]
+    unknown = [k for k in keys if k not in _HEADERS]
+    if unknown:
+        raise ValueError(f"Cột không hợp lệ: {', '.join(unknown)}")
+    return [(key, _HEADERS[key]) for key in dict.fromkeys(keys)]
+
+
+def _cell_value(value):
+    if value is None:
+        return None
+    return value if isinstance(value, (int, float)) else str(value)
+
+
+def _csv_value(value):
+    return '' if value is None else value
+
+
+def iter_csv(chunks, columns):
+    """Sinh bytes CSV (UTF-8 có BOM để Excel đọc đúng tiếng Việt): header trước, sau đó từng chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for _, header in columns])
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        for member in chunk:
+            writer.writerow([_csv_value(member.get(key)) for key, _ in columns])
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_xlsx(chunks, columns, path):
+    """Ghi workbook write-only ra path (hoặc file object); trả về số hàng dữ liệu."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Danh sách thành viên')
+    for col_idx in range(1, len(columns) + 1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = 16
+    header_row = []
+    for _, header in columns:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center', wrap_text=True)
+        header_row.append(cell)
+    ws.append(header_row)
+    rows = 0
+    for chunk in chunks:
+        for member in chunk:
+            ws.append([_cell_value(member.get(key)) for key, _ in columns])
+            rows += 1
+    wb.save(path)
+    return rows
+
+
+def build_xlsx_file(chunks, columns):
+    """Ghi XLSX ra file tạm ẩn danh (tự xoá khi đóng); trả về file object đã seek(0) cho send_file."""
+    tmp = tempfile.TemporaryFile(prefix='members_export_', suffix='.xlsx')
+    try:
+        write_xlsx(chunks, columns, tmp)
+    except Exception:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return tmp
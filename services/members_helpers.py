@@ -6,6 +6,7 @@ import unicodedata
 from datetime import date, datetime
 
 from services.person_helpers import get_preferred_spouse_names
+from utils.validation import sanitize_string
 
 
 def sll_cell_nonempty(val):
@@ -109,6 +110,19 @@ def sll_base_payload(cursor, person_id, rel_data):
     p = cursor.fetchone()
     if not p:
         return None
+    branch_name = p.get("branch_name")
+    if not branch_name and p.get("branch_id"):
+        cursor.execute(
+            "SELECT branch_name FROM branches WHERE branch_id = %s", (p["branch_id"],)
+        )
+        br = cursor.fetchone()
+        if br:
+            branch_name = br.get("branch_name")
+    return sll_payload_from_row(person_id, p, rel_data, branch_name)
+
+
+def sll_payload_from_row(person_id, p, rel_data, branch_name=None):
+    """Base payload từ dòng persons đã đọc sẵn (SELECT *) — bulk Update SLL đọc cả lô bằng IN (...)."""
     pid = person_id
     parent = rel_data["parent_data"].get(pid, {})
     spouse_names = get_preferred_spouse_names(rel_data, pid)
@@ -122,15 +136,6 @@ def sll_base_payload(cursor, person_id, rel_data):
             return "; ".join(xs)
         return str(xs)
 
-    branch_name = p.get("branch_name")
-    if not branch_name and p.get("branch_id"):
-        cursor.execute(
-            "SELECT branch_name FROM branches WHERE branch_id = %s", (p["branch_id"],)
-        )
-        br = cursor.fetchone()
-        if br:
-            branch_name = br.get("branch_name")
-
     def fmt_date(d):
         if d is None:
             return None
@@ -150,7 +155,7 @@ def sll_base_payload(cursor, person_id, rel_data):
         "gender": p.get("gender"),
         "status": p.get("status"),
         "generation_number": p.get("generation_level"),
-        "branch_name": branch_name,
+        "branch_name": branch_name or p.get("branch_name"),
         "birth_date_solar": fmt_date(p.get("birth_date_solar")),
         "birth_date_lunar": fmt_date(p.get("birth_date_lunar")),
         "death_date_solar": fmt_date(p.get("death_date_solar")),
@@ -170,3 +175,86 @@ def sll_base_payload(cursor, person_id, rel_data):
         "biography": p.get("biography"),
         "personal_image_url": p.get("personal_image_url") or p.get("personal_image"),
     }
+
+
+# Cột persons mà cập nhật members (form / Update SLL) có thể ghi.
+MEMBER_UPDATE_COLUMNS = (
+    "full_name", "gender", "status", "csv_id", "generation_level", "generation_id",
+    "branch_name", "branch_id", "birth_date_solar", "death_date_solar", "birth_date_lunar",
+    "death_date_lunar", "place_of_death", "biography", "academic_rank", "academic_degree",
+    "phone", "email", "occupation", "alias", "grave_info", "personal_image_url",
+    "personal_image", "father_mother_id", "fm_id", "family_unit_id",
+)
+MEMBER_GENDERS = ("M", "F", "Male", "Female", "Nam", "Nữ")
+
+
+def _text_or_none(value):
+    if value is None:
+        return None
+    s = str(value).strip()
+    return s or None
+
+
+def _date_or_none(value):
+    # Chỉ có năm ("1950") → ngày đầu năm
+    s = _text_or_none(value)
+    if s and len(s) == 4 and s.isdigit():
+        return f"{s}-01-01"
+    return s
+
+
+def member_update_values(data, columns, has_image_file=False):
+    """
+    Giá trị cần ghi vào persons từ payload cập nhật members: {cột: giá trị}, chỉ với cột có trong
+    `columns` và key có trong `data`. Không gồm csv_id / branch_id / generation_id (cần tra DB).
+    Dữ liệu sai (giới tính, email, họ tên rỗng) → ValueError.
+    """
+    values = {}
+    if "full_name" in columns and "full_name" in data:
+        full_name = data.get("full_name")
+        if full_name:
+            full_name = sanitize_string(str(full_name), max_length=255, allow_empty=False)
+        values["full_name"] = full_name
+    if "gender" in columns and "gender" in data:
+        gender = data.get("gender")
+        if gender and gender not in MEMBER_GENDERS:
+            raise ValueError("Invalid gender value")
+        values["gender"] = gender
+    if "status" in columns and "status" in data:
+        values["status"] = data.get("status")
+    if "generation_level" in columns and "generation_number" in data:
+        gn = data["generation_number"]
+        if gn is not None and (not isinstance(gn, str) or gn.strip() != ""):
+            values["generation_level"] = gn
+    if "branch_name" in columns and "branch_name" in data:
+        values["branch_name"] = sll_canonical_branch(data.get("branch_name"))
+    for column in ("birth_date_solar", "death_date_solar", "birth_date_lunar", "death_date_lunar"):
+        if column in columns and column in data:
+            values[column] = _date_or_none(data.get(column))
+    if "place_of_death" in columns and "place_of_death" in data:
+        values["place_of_death"] = data.get("place_of_death")
+    for column in ("biography", "academic_rank", "academic_degree", "phone", "email", "occupation"):
+        if column in columns and column in data:
+            values[column] = _text_or_none(data.get(column))
+    if values.get("email") and "@" not in values["email"]:
+        raise ValueError("Email không hợp lệ")
+    if "alias" in columns and "alias" in data:
+        alias = data.get("alias")
+        if alias:
+            alias = sanitize_string(str(alias), max_length=255, allow_empty=True)
+        values["alias"] = alias or None
+    if "grave_info" in columns and ("grave_info" in data or "grave" in data):
+        values["grave_info"] = _text_or_none(data.get("grave_info") if "grave_info" in data else data.get("grave"))
+    if data.get("personal_image_url") and not has_image_file:
+        if "personal_image_url" in columns:
+            values["personal_image_url"] = str(data["personal_image_url"]).strip()
+        elif "personal_image" in columns:
+            values["personal_image"] = str(data["personal_image_url"]).strip()
+    if "fm_id" in data:
+        if "father_mother_id" in columns:
+            values["father_mother_id"] = data.get("fm_id")
+        elif "fm_id" in columns:
+            values["fm_id"] = data.get("fm_id")
+    if "family_unit_id" in columns and "family_unit_id" in data:
+        values["family_unit_id"] = data.get("family_unit_id") or None
+    return values
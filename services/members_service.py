@@ -8,6 +8,8 @@ from flask import jsonify, request, send_from_directory
 
 from audit_log import log_activity
 from services.person_helpers import get_preferred_spouse_names
+from services.schema_registry import has_column, has_table, table_columns
+from services.sql_dump import SQL_DUMP_EXTENSIONS
 from utils.validation import secure_compare
 
 logger = logging.getLogger(__name__)
@@ -72,14 +74,17 @@ def create_backup_api():
     try:
         from scripts.backup_database import create_backup
 
+        mode = data.get("mode") or "full"
+        if mode not in ("full", "incremental"):
+            return (jsonify({"success": False, "error": "mode phải là full hoặc incremental"}), 400)
         backup_dir = os.environ.get("BACKUP_DIR", "").strip() or "backups"
-        result = create_backup(backup_dir=backup_dir)
+        result = create_backup(backup_dir=backup_dir, mode=mode)
         if result["success"]:
             log_activity(
                 'BACKUP_CREATE_APP',
                 target_type='Backup',
                 target_id=result['backup_filename'],
-                after_data={'file_size': result['file_size'], 'timestamp': result['timestamp']},
+                after_data={'file_size': result['file_size'], 'timestamp': result['timestamp'], 'mode': result.get('mode')},
             )
             return jsonify(
                 {
@@ -88,6 +93,7 @@ def create_backup_api():
                     "backup_file": result["backup_filename"],
                     "file_size": result["file_size"],
                     "timestamp": result["timestamp"],
+                    "mode": result.get("mode", mode),
                 }
             )
         else:
@@ -120,10 +126,18 @@ def list_backups_api():
         return (jsonify({"success": False, "error": f"Lỗi: {str(e)}"}), 500)
 
 
+def _backup_mimetype(filename):
+    if filename.endswith(".gz"):
+        return "application/gzip"
+    if filename.endswith(".zst"):
+        return "application/zstd"
+    return "application/sql"
+
+
 def download_backup(filename):
     """API download file backup"""
     try:
-        if not filename.startswith("tbqc_backup_") or not filename.endswith(".sql"):
+        if not filename.startswith("tbqc_backup_") or not filename.endswith(SQL_DUMP_EXTENSIONS):
             return (jsonify({"success": False, "error": "Invalid backup filename"}), 400)
         backup_dir = Path(os.environ.get("BACKUP_DIR", "").strip() or "backups")
         backup_file = backup_dir / filename
@@ -142,21 +156,101 @@ def download_backup(filename):
             after_data={'file_size': file_size, 'route': 'members'},
         )
         
-        return send_from_directory(str(backup_dir), filename, as_attachment=True, mimetype="application/sql")
+        return send_from_directory(str(backup_dir), filename, as_attachment=True, mimetype=_backup_mimetype(filename))
     except Exception as e:
         logger.error(f"Error downloading backup: {e}", exc_info=True)
         return (jsonify({"success": False, "error": f"Lỗi: {str(e)}"}), 500)
 
 
+def _members_select_sql(cursor):
+    """SELECT persons cho danh sách thành viên (cột theo schema hiện có), cùng thứ tự /api/members."""
+    available_columns = table_columns(
+        'persons',
+        ('csv_id', 'personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email', 'place_of_death', 'occupation'),
+        cursor=cursor,
+    )
+
+    # Nhánh: ưu tiên persons.branch_name nếu có; nếu không thì join branches qua branch_id
+    has_branch_name_col = False
+    has_branch_id = False
+    has_branches_table = False
+    try:
+        has_branch_name_col = has_column('persons', 'branch_name', cursor=cursor)
+        has_branch_id = has_column('persons', 'branch_id', cursor=cursor)
+        has_branches_table = has_table('branches', cursor=cursor)
+    except Exception as e:
+        logger.warning(f'Could not detect branch schema (members list): {e}')
+        has_branch_name_col = False
+        has_branch_id = False
+        has_branches_table = False
+
+    select_fields = [
+        'p.person_id', 'p.father_mother_id AS fm_id', 'p.full_name', 'p.alias', 'p.gender', 'p.status',
+        'p.generation_level AS generation_number', 'p.birth_date_solar', 'p.birth_date_lunar',
+        'p.death_date_solar', 'p.death_date_lunar', 'p.grave_info AS grave'
+    ]
+    select_fields.append('p.place_of_death' if 'place_of_death' in available_columns else 'NULL AS place_of_death')
+    select_fields.append('p.personal_image_url AS personal_image_url' if 'personal_image_url' in available_columns else 'p.personal_image AS personal_image_url' if 'personal_image' in available_columns else 'NULL AS personal_image_url')
+    select_fields.append('p.biography' if 'biography' in available_columns else 'NULL AS biography')
+    select_fields.append('p.academic_rank' if 'academic_rank' in available_columns else 'NULL AS academic_rank')
+    select_fields.append('p.academic_degree' if 'academic_degree' in available_columns else 'NULL AS academic_degree')
+    select_fields.append('p.phone' if 'phone' in available_columns else 'NULL AS phone')
+    select_fields.append('p.email' if 'email' in available_columns else 'NULL AS email')
+    select_fields.append('p.occupation' if 'occupation' in available_columns else 'NULL AS occupation')
+    select_fields.append('p.csv_id' if 'csv_id' in available_columns else 'NULL AS csv_id')
+    if has_branch_name_col:
+        select_fields.append('p.branch_name AS branch_name')
+    else:
+        select_fields.append('b.branch_name AS branch_name' if (has_branch_id and has_branches_table) else 'NULL AS branch_name')
+    return f"""
+        SELECT {', '.join(select_fields)}
+        FROM persons p
+        {'LEFT JOIN branches b ON p.branch_id = b.branch_id' if (has_branch_id and has_branches_table) else ''}
+        ORDER BY COALESCE(p.generation_level, 999) ASC,
+            CASE WHEN p.person_id LIKE 'P-%' AND SUBSTRING(p.person_id, 3) REGEXP '^[0-9]+-[0-9]+$'
+                THEN CAST(SUBSTRING_INDEX(SUBSTRING_INDEX(p.person_id, '-', 2), '-', -1) AS UNSIGNED) ELSE 999999 END ASC,
+            CASE WHEN p.person_id LIKE 'P-%' AND SUBSTRING(p.person_id, 3) REGEXP '^[0-9]+-[0-9]+$'
+                THEN CAST(SUBSTRING_INDEX(p.person_id, '-', -1) AS UNSIGNED) ELSE 999999 END ASC,
+            p.person_id ASC, p.full_name ASC
+    """
+
+
+def _member_row(person, relationship_data):
+    """Một dòng thành viên (dict) từ row persons + relationship_data."""
+    person_id = person['person_id']
+    rel = relationship_data['parent_data'].get(person_id, {'father_name': None, 'mother_name': None})
+    spouse_names = get_preferred_spouse_names(relationship_data, person_id)
+    siblings = relationship_data['siblings_map'].get(person_id, [])
+    children = relationship_data['children_map'].get(person_id, [])
+    return {
+        'person_id': person_id, 'csv_id': person.get('csv_id') or person_id, 'fm_id': person.get('fm_id'), 'full_name': person.get('full_name'),
+        'alias': person.get('alias'), 'gender': person.get('gender'), 'status': person.get('status'),
+        'generation_number': person.get('generation_number'),
+        'birth_date_solar': str(person['birth_date_solar']) if person.get('birth_date_solar') else None,
+        'birth_date_lunar': str(person['birth_date_lunar']) if person.get('birth_date_lunar') else None,
+        'death_date_solar': str(person['death_date_solar']) if person.get('death_date_solar') else None,
+        'death_date_lunar': str(person['death_date_lunar']) if person.get('death_date_lunar') else None,
+        'grave': person.get('grave'), 'grave_info': person.get('grave'), 'place_of_death': person.get('place_of_death'),
+        'branch_name': person.get('branch_name'),
+        'father_name': rel.get('father_name'), 'mother_name': rel.get('mother_name'),
+        'spouses': '; '.join(spouse_names) if spouse_names else None,
+        'siblings': '; '.join(siblings) if siblings else None,
+        'children': '; '.join(children) if children else None,
+        'personal_image_url': person.get('personal_image_url'), 'biography': person.get('biography'),
+        'academic_rank': person.get('academic_rank'), 'academic_degree': person.get('academic_degree'),
+        'phone': person.get('phone'), 'email': person.get('email'), 'occupation': person.get('occupation')
+    }
+
+
 def fetch_members_list():
     """
     Lấy danh sách thành viên đầy đủ (không cache).
-    Dùng bởi export_members_excel và các caller cần raw list.
+    Dùng bởi các caller cần raw list (export dùng iter_members_chunks).
     Returns (list of member dicts, None) hoặc (None, error_message).
     """
     from db import get_db_connection
     from mysql.connector import Error as MySqlError
-    from services.person_service import load_relationship_data
+    from services.genealogy_graph import get_relationship_data
 
     connection = None
     cursor = None
@@ -165,107 +259,10 @@ def fetch_members_list():
         if not connection:
             return (None, 'Không thể kết nối database')
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT COLUMN_NAME FROM information_schema.COLUMNS
-            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'persons'
-            AND COLUMN_NAME IN ('csv_id', 'personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email', 'place_of_death', 'occupation')
-        """)
-        _col_rows = cursor.fetchall()
-        available_columns = set()
-        for row in _col_rows:
-            col = row.get('COLUMN_NAME') or row.get('column_name') or ''
-            if col:
-                available_columns.add(str(col).strip())
-
-        # Nhánh: ưu tiên persons.branch_name nếu có; nếu không thì join branches qua branch_id
-        has_branch_name_col = False
-        has_branch_id = False
-        has_branches_table = False
-        try:
-            cursor.execute("""
-                SELECT COLUMN_NAME FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'persons' AND COLUMN_NAME = 'branch_name'
-                LIMIT 1
-            """)
-            has_branch_name_col = bool(cursor.fetchone())
-            cursor.execute("""
-                SELECT COLUMN_NAME FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'persons' AND COLUMN_NAME = 'branch_id'
-                LIMIT 1
-            """)
-            has_branch_id = bool(cursor.fetchone())
-            cursor.execute("""
-                SELECT TABLE_NAME FROM information_schema.TABLES
-                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'branches'
-                LIMIT 1
-            """)
-            has_branches_table = bool(cursor.fetchone())
-        except Exception as e:
-            logger.warning(f'Could not detect branch schema (fetch_members_list): {e}')
-            has_branch_name_col = False
-            has_branch_id = False
-            has_branches_table = False
-
-        select_fields = [
-            'p.person_id', 'p.father_mother_id AS fm_id', 'p.full_name', 'p.alias', 'p.gender', 'p.status',
-            'p.generation_level AS generation_number', 'p.birth_date_solar', 'p.birth_date_lunar',
-            'p.death_date_solar', 'p.death_date_lunar', 'p.grave_info AS grave'
-        ]
-        select_fields.append('p.place_of_death' if 'place_of_death' in available_columns else 'NULL AS place_of_death')
-        select_fields.append('p.personal_image_url AS personal_image_url' if 'personal_image_url' in available_columns else 'p.personal_image AS personal_image_url' if 'personal_image' in available_columns else 'NULL AS personal_image_url')
-        select_fields.append('p.biography' if 'biography' in available_columns else 'NULL AS biography')
-        select_fields.append('p.academic_rank' if 'academic_rank' in available_columns else 'NULL AS academic_rank')
-        select_fields.append('p.academic_degree' if 'academic_degree' in available_columns else 'NULL AS academic_degree')
-        select_fields.append('p.phone' if 'phone' in available_columns else 'NULL AS phone')
-        select_fields.append('p.email' if 'email' in available_columns else 'NULL AS email')
-        select_fields.append('p.occupation' if 'occupation' in available_columns else 'NULL AS occupation')
-        select_fields.append('p.csv_id' if 'csv_id' in available_columns else 'NULL AS csv_id')
-        if has_branch_name_col:
-            select_fields.append('p.branch_name AS branch_name')
-        else:
-            select_fields.append('b.branch_name AS branch_name' if (has_branch_id and has_branches_table) else 'NULL AS branch_name')
-        cursor.execute(f"""
-            SELECT {', '.join(select_fields)}
-            FROM persons p
-            {'LEFT JOIN branches b ON p.branch_id = b.branch_id' if (has_branch_id and has_branches_table) else ''}
-            ORDER BY COALESCE(p.generation_level, 999) ASC,
-                CASE WHEN p.person_id LIKE 'P-%' AND SUBSTRING(p.person_id, 3) REGEXP '^[0-9]+-[0-9]+$'
-                    THEN CAST(SUBSTRING_INDEX(SUBSTRING_INDEX(p.person_id, '-', 2), '-', -1) AS UNSIGNED) ELSE 999999 END ASC,
-                CASE WHEN p.person_id LIKE 'P-%' AND SUBSTRING(p.person_id, 3) REGEXP '^[0-9]+-[0-9]+$'
-                    THEN CAST(SUBSTRING_INDEX(p.person_id, '-', -1) AS UNSIGNED) ELSE 999999 END ASC,
-                p.person_id ASC, p.full_name ASC
-        """)
+        cursor.execute(_members_select_sql(cursor))
         persons = cursor.fetchall()
-        relationship_data = load_relationship_data(cursor)
-        parent_data = relationship_data['parent_data']
-        children_map = relationship_data['children_map']
-        siblings_map = relationship_data['siblings_map']
-        members = []
-        for person in persons:
-            person_id = person['person_id']
-            rel = parent_data.get(person_id, {'father_name': None, 'mother_name': None})
-            spouse_names = get_preferred_spouse_names(relationship_data, person_id)
-            siblings = siblings_map.get(person_id, [])
-            children = children_map.get(person_id, [])
-            member = {
-                'person_id': person_id, 'csv_id': person.get('csv_id') or person_id, 'fm_id': person.get('fm_id'), 'full_name': person.get('full_name'),
-                'alias': person.get('alias'), 'gender': person.get('gender'), 'status': person.get('status'),
-                'generation_number': person.get('generation_number'),
-                'birth_date_solar': str(person['birth_date_solar']) if person.get('birth_date_solar') else None,
-                'birth_date_lunar': str(person['birth_date_lunar']) if person.get('birth_date_lunar') else None,
-                'death_date_solar': str(person['death_date_solar']) if person.get('death_date_solar') else None,
-                'death_date_lunar': str(person['death_date_lunar']) if person.get('death_date_lunar') else None,
-                'grave': person.get('grave'), 'grave_info': person.get('grave'), 'place_of_death': person.get('place_of_death'),
-                'branch_name': person.get('branch_name'),
-                'father_name': rel.get('father_name'), 'mother_name': rel.get('mother_name'),
-                'spouses': '; '.join(spouse_names) if spouse_names else None,
-                'siblings': '; '.join(siblings) if siblings else None,
-                'children': '; '.join(children) if children else None,
-                'personal_image_url': person.get('personal_image_url'), 'biography': person.get('biography'),
-                'academic_rank': person.get('academic_rank'), 'academic_degree': person.get('academic_degree'),
-                'phone': person.get('phone'), 'email': person.get('email'), 'occupation': person.get('occupation')
-            }
-            members.append(member)
+        relationship_data = get_relationship_data(cursor)
+        members = [_member_row(person, relationship_data) for person in persons]
         return (members, None)
     except MySqlError as e:
         logger.error(f'Error in fetch_members_list: {e}', exc_info=True)
@@ -284,3 +281,45 @@ def fetch_members_list():
                 connection.close()
             except Exception:
                 pass
+
+
+def iter_members_chunks(chunk_size=500, connection=None):
+    """
+    Danh sách thành viên theo từng chunk (list dict như fetch_members_list), cho export stream.
+
+    Quan hệ (cha mẹ / vợ chồng / con / anh chị em) lấy một lần qua snapshot; persons đọc bằng
+    cursor không buffer + fetchmany(chunk_size) nên bộ nhớ theo chunk, không theo số thành viên.
+    connection: kết nối caller đã mở sẵn (generator đóng khi xong); None thì tự mở ở lần next() đầu.
+    Lỗi kết nối / SQL được ném khi generator chạy.
+    """
+    from services.genealogy_graph import get_relationship_data
+
+    if connection is None:
+        from db import get_db_connection
+
+        connection = get_db_connection()
+        if not connection:
+            raise RuntimeError('Không thể kết nối database')
+    cursor = None
+    try:
+        cursor = connection.cursor(dictionary=True)
+        query = _members_select_sql(cursor)
+        relationship_data = get_relationship_data(cursor)
+        cursor.close()
+        cursor = connection.cursor(dictionary=True, buffered=False)
+        cursor.execute(query)
+        while True:
+            persons = cursor.fetchmany(chunk_size)
+            if not persons:
+                break
+            yield [_member_row(person, relationship_data) for person in persons]
+    finally:
+        if cursor:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot có phạm vi trước khi xoá thành viên hàng loạt (thay cho backup cả database).
+
+- Chỉ chụp các dòng bị ảnh hưởng: `persons` được chọn cùng các dòng `relationships`,
+  `marriages`, `family_units`, `birth_records`, `death_records`, ... trỏ tới họ
+  (xem SNAPSHOT_REFERENCES). Thông tin mộ phần (grave_info, grave_image_url) nằm ngay
+  trên dòng persons nên đi kèm; album ảnh không liên kết theo person_id nên không cần chụp.
+- Bundle là JSON nén gzip: `backups/snapshots/snap-YYYYmmdd-HHMMSS-xxxxxxxx.json.gz`,
+  đọc được bằng `zcat`, vài KB cho một lần xoá thay vì dump toàn bộ database.
+- Chụp trên cùng connection với lệnh DELETE (trước khi commit), nên khớp đúng dữ liệu bị xoá.
+- Hoàn tác một lệnh: restore_snapshot(conn, snapshot_id) upsert lại toàn bộ dòng
+  (INSERT ... ON DUPLICATE KEY UPDATE, tắt FOREIGN_KEY_CHECKS trong phiên) rồi đánh dấu
+  bundle đã dùng để không bị hoàn tác hai lần.
+- Giữ MUTATION_SNAPSHOT_KEEP bundle mới nhất, cũ hơn thì xoá.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import re
+import secrets
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from folder_py.db_config import env_number
+from services.log_reset import _ensure_backup_dir
+from services.schema_registry import has_table, table_columns
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUBDIR = "snapshots"
+SNAPSHOT_SUFFIX = ".json.gz"
+MUTATION_SNAPSHOT_KEEP = env_number("MUTATION_SNAPSHOT_KEEP", 50, int, 1)
+SNAPSHOT_ID_RE = re.compile(r"^snap-\d{8}-\d{6}-[0-9a-f]{8}$")
+
+# (bảng, các cột chứa person_id) — theo thứ tự restore: persons trước
+SNAPSHOT_REFERENCES = (
+    ("persons", ("person_id",)),
+    ("family_units", ("father_id", "mother_id")),
+    ("relationships", ("parent_id", "child_id")),
+    ("marriages", ("husband_id", "wife_id")),
+    ("birth_records", ("person_id",)),
+    ("death_records", ("person_id",)),
+    ("spouse_sibling_children", ("person_id",)),
+    ("edit_requests", ("person_id",)),
+)
+
+
+class SnapshotError(Exception):
+    """Snapshot không dùng được để hoàn tác (đã hoàn tác rồi)."""
+
+
+class SnapshotNotFound(SnapshotError):
+    """snapshot_id sai định dạng hoặc bundle không còn trên đĩa."""
+
+
+def snapshot_dir() -> Path:
+    d = _ensure_backup_dir() / SNAPSHOT_SUBDIR
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def _snapshot_path(directory: Path, snapshot_id: str) -> Path:
+    if not SNAPSHOT_ID_RE.match(snapshot_id or ""):
+        raise SnapshotNotFound(f"snapshot_id không hợp lệ: {snapshot_id!r}")
+    return directory / f"{snapshot_id}{SNAPSHOT_SUFFIX}"
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (Decimal, timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return {"hex": bytes(value).hex()}
+    return value
+
+
+def _from_json(value: Any) -> Any:
+    if isinstance(value, dict) and set(value) == {"hex"}:
+        return bytes.fromhex(value["hex"])
+    return value
+
+
+def _write_bundle(path: Path, bundle: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as out:
+        json.dump(bundle, out, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_snapshot(snapshot_id: str, directory: Optional[Path] = None) -> Dict[str, Any]:
+    path = _snapshot_path(directory or snapshot_dir(), snapshot_id)
+    if not path.is_file():
+        raise SnapshotNotFound(f"Không tìm thấy snapshot {snapshot_id}")
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def prune_snapshots(directory: Path, keep: int = MUTATION_SNAPSHOT_KEEP) -> List[str]:
+    """Xoá bundle cũ, giữ `keep` bundle mới nhất (tên file đã sắp theo thời gian)."""
+    files = sorted(directory.glob(f"snap-*{SNAPSHOT_SUFFIX}"))
+    removed = []
+    for path in files[: max(len(files) - keep, 0)]:
+        try:
+            path.unlink()
+            removed.append(path.name)
+        except OSError as e:
+            logger.warning("Không xoá được snapshot cũ %s: %s", path.name, e)
+    return removed
+
+
+def capture_person_snapshot(
+    connection,
+    person_ids: Sequence[str],
+    *,
+    reason: str,
+    actor: Optional[str] = None,
+    directory: Optional[Path] = None,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Chụp các dòng liên quan tới `person_ids` ra một bundle. Gọi trước DELETE, cùng connection.
+
+    Return: {"snapshot_id", "filename", "person_ids", "rows": {bảng: số dòng}}.
+    Lỗi đọc / ghi được raise nguyên để caller quyết định có tiếp tục xoá hay không.
+    """
+    ids = list(dict.fromkeys(person_ids))
+    now = now or datetime.now()
+    snapshot_id = f"snap-{now.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+    bundle: Dict[str, Any] = {
+        "snapshot_id": snapshot_id,
+        "created_at": now.isoformat(timespec="seconds"),
+        "reason": reason,
+        "actor": actor,
+        "person_ids": ids,
+        "restored_at": None,
+        "tables": {},
+    }
+    cursor = connection.cursor(buffered=True)
+    try:
+        placeholders = ", ".join(["%s"] * len(ids))
+        for table, ref_columns in SNAPSHOT_REFERENCES:
+            if not has_table(table, cursor=cursor):
+                continue
+            present = [c for c in ref_columns if c in table_columns(table, ref_columns, cursor=cursor)]
+            if not present:
+                continue
+            where = " OR ".join(f"`{c}` IN ({placeholders})" for c in present)
+            cursor.execute(f"SELECT * FROM `{table}` WHERE {where}", tuple(ids) * len(present))
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+            bundle["tables"][table] = {
+                "columns": [d[0] for d in cursor.description],
+                "rows": [[_to_json(v) for v in row] for row in rows],
+            }
+    finally:
+        cursor.close()
+
+    d = directory or snapshot_dir()
+    path = _snapshot_path(d, snapshot_id)
+    _write_bundle(path, bundle)
+    prune_snapshots(d)
+    counts = {t: len(data["rows"]) for t, data in bundle["tables"].items()}
+    logger.info("Snapshot %s: %s", snapshot_id, counts)
+    return {"snapshot_id": snapshot_id, "filename": path.name, "person_ids": ids, "rows": counts}
+
+
+def restore_snapshot(connection, snapshot_id: str, *, directory: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Hoàn tác: upsert lại mọi dòng trong bundle rồi commit. Raise SnapshotError nếu
+    bundle không tồn tại hoặc đã được hoàn tác; lỗi DB thì rollback và raise.
+
+    Return: {"snapshot_id", "person_ids", "rows": {bảng: số dòng}}.
+    """
+    d = directory or snapshot_dir()
+    bundle = load_snapshot(snapshot_id, d)
+    if bundle.get("restored_at"):
+        raise SnapshotError(f"Snapshot {snapshot_id} đã được hoàn tác lúc {bundle['restored_at']}")
+
+    order = [t for t, _ in SNAPSHOT_REFERENCES]
+    tables = sorted(bundle["tables"], key=lambda t: order.index(t) if t in order else len(order))
+    counts: Dict[str, int] = {}
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+        for table in tables:
+            data = bundle["tables"][table]
+            columns = data["columns"]
+            cols_sql = ", ".join(f"`{c}`" for c in columns)
+            values_sql = ", ".join(["%s"] * len(columns))
+            update_sql = ", ".join(f"`{c}` = VALUES(`{c}`)" for c in columns)
+            cursor.executemany(
+                f"INSERT INTO `{table}` ({cols_sql}) VALUES ({values_sql}) ON DUPLICATE KEY UPDATE {update_sql}",
+                [tuple(_from_json(v) for v in row) for row in data["rows"]],
+            )
+            counts[table] = len(data["rows"])
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        try:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+        except Exception:
+            pass
+        raise
+    finally:
+        cursor.close()
+
+    bundle["restored_at"] = datetime.now().isoformat(timespec="seconds")
+    _write_bundle(_snapshot_path(d, snapshot_id), bundle)
+    return {"snapshot_id": snapshot_id, "person_ids": bundle.get("person_ids", []), "rows": counts}
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Retention cho page_views: chuyển dòng thô cũ hơn N ngày ra file nén theo tháng
+`backups/page_views/page_views-YYYY-MM.sql.gz` rồi xoá khỏi bảng.
+
+- Số đếm không mất: xoá từng ngày, mỗi ngày một transaction gồm cập nhật page_view_daily
+  của ngày đó rồi DELETE — lỗi giữa chừng không để lại ngày bị xoá dở, nên /admin/logs
+  (đọc rollup) vẫn báo đủ tổng / tháng. Rollup của ngày đang archive chỉ tăng, không giảm.
+- Mốc cắt là 00:00 giờ VN: một ngày luôn nằm trọn trong bảng hoặc trọn trong archive.
+- File .gz ghi nối (mỗi lần chạy thêm một gzip member); zcat đọc liền mạch.
+  Restore: `zcat page_views-2025-01.sql.gz | mysql <db>` — INSERT IGNORE theo id nên nạp lại không trùng.
+- Đọc / xoá theo lô khoá chính: không giữ cả bảng trong bộ nhớ, không khoá bảng lâu.
+- Ghi file xong mới xoá; lỗi giữa chừng thì dòng chưa xoá sẽ được archive lại ở lần chạy sau.
+"""
+from __future__ import annotations
+
+import gzip
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from folder_py.db_config import env_number
+from services.log_reset import BACKUP_DIR_NAME, _ensure_backup_dir
+from services.page_views import (
+    _VN_TZ,
+    _VN_TZ_SQL,
+    _ensure_page_view_daily,
+    _session_timezone_vn,
+)
+from services.sql_dump import escape_value
+
+logger = logging.getLogger(__name__)
+
+PAGE_VIEW_RETENTION_DAYS = env_number("PAGE_VIEW_RETENTION_DAYS", 180, int, 1)
+ARCHIVE_SUBDIR = "page_views"
+ARCHIVE_BATCH = 5000
+
+_ARCHIVE_COLUMNS = ("id", "path", "method", "ip", "user_agent", "referrer", "user_id", "created_at")
+
+# Đếm lại một ngày vào rollup, chạy cùng transaction với DELETE của ngày đó. GREATEST: ngày đã bị
+# xoá dở (lần chạy cũ) chỉ còn một phần dòng thô — không được ghi đè số đếm nhỏ hơn.
+_DAY_ROLLUP_SQL = (
+    "INSERT INTO page_view_daily (view_date, views) "
+    "SELECT DATE(created_at), COUNT(*) FROM page_views "
+    "WHERE created_at >= %s AND created_at < %s GROUP BY DATE(created_at) "
+    "ON DUPLICATE KEY UPDATE views = GREATEST(views, VALUES(views))"
+)
+
+
+def archive_cutoff(retention_days: int, now: Optional[datetime] = None) -> datetime:
+    """00:00 giờ VN (naive) của ngày `retention_days` ngày trước hôm nay."""
+    now_vn = now or datetime.now(_VN_TZ)
+    day = now_vn.date() - timedelta(days=retention_days)
+    return datetime(day.year, day.month, day.day)
+
+
+def _open_month(archive_dir: Path, month: str, written_at: str):
+    out = gzip.open(archive_dir / f"page_views-{month}.sql.gz", "at", encoding="utf-8", newline="\n")
+    out.write(f"-- TBQC page_views archive {month} (ghi lúc {written_at})\n")
+    out.write("SET NAMES utf8mb4;\n")
+    out.write(f"SET time_zone = '{_VN_TZ_SQL}';\n")
+    return out
+
+
+def _write_rows(out, rows) -> None:
+    cols_sql = ", ".join(f"`{c}`" for c in _ARCHIVE_COLUMNS)
+    out.write(f"INSERT IGNORE INTO `page_views` ({cols_sql}) VALUES\n")
+    out.write(",\n".join("(" + ", ".join(escape_value(v) for v in r) + ")" for r in rows))
+    out.write(";\n")
+
+
+def archive_page_views(
+    retention_days: int = PAGE_VIEW_RETENTION_DAYS,
+    *,
+    conn=None,
+    archive_dir: Optional[Path] = None,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Archive + xoá page_views có created_at trước archive_cutoff(retention_days).
+
+    Return dict (luôn có `success`):
+      {
+        "success": True/False,
+        "error": "...",          # khi fail
+        "cutoff": "2025-10-20T00:00:00",
+        "rows_archived": {"2025-09": N, "2025-10": M},
+        "rows_deleted": N + M,
+        "files": ["backups/page_views/page_views-2025-09.sql.gz", ...],
+      }
+    """
+    result: Dict[str, Any] = {"success": False, "rows_archived": {}, "rows_deleted": 0, "files": []}
+    if retention_days < 1:
+        result["error"] = "retention_days must be >= 1"
+        return result
+    cutoff = archive_cutoff(retention_days, now)
+    result["cutoff"] = cutoff.isoformat()
+
+    own_conn = conn is None
+    if own_conn:
+        from db import get_db_connection
+
+        conn = get_db_connection()
+    if not conn:
+        result["error"] = "no_db"
+        return result
+
+    cur = None
+    writers: Dict[str, Any] = {}
+    try:
+        from services.schema_registry import has_table
+
+        cur = conn.cursor(buffered=True)
+        if not has_table("page_views", cursor=cur):
+            result["success"] = True
+            return result
+        if not _ensure_page_view_daily(conn):
+            result["error"] = "page_view_daily unavailable"
+            return result
+
+        # So sánh created_at (TIMESTAMP) theo giờ VN, giống mốc cắt
+        _session_timezone_vn(conn)
+        cur.execute("SELECT MAX(id) FROM page_views WHERE created_at < %s", (cutoff,))
+        row = cur.fetchone()
+        max_id = row[0] if row else None
+        if max_id is None:
+            result["success"] = True
+            return result
+
+        d = archive_dir or (_ensure_backup_dir() / ARCHIVE_SUBDIR)
+        d.mkdir(parents=True, exist_ok=True)
+        written_at = datetime.now(_VN_TZ).isoformat()
+        archived = result["rows_archived"]
+        days = set()
+        last_id = 0
+        while True:
+            cur.execute(
+                f"SELECT {', '.join(_ARCHIVE_COLUMNS)} FROM page_views "
+                "WHERE id > %s AND id <= %s AND created_at < %s ORDER BY id LIMIT %s",
+                (last_id, max_id, cutoff, ARCHIVE_BATCH),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            by_month: Dict[str, list] = {}
+            for r in rows:
+                by_month.setdefault(r[-1].strftime("%Y-%m"), []).append(r)
+                days.add(r[-1].date())
+            for month, month_rows in by_month.items():
+                if month not in writers:
+                    writers[month] = _open_month(d, month, written_at)
+                _write_rows(writers[month], month_rows)
+                archived[month] = archived.get(month, 0) + len(month_rows)
+            last_id = rows[-1][0]
+
+        for out in writers.values():
+            out.close()
+        writers.clear()
+        prefix = f"{BACKUP_DIR_NAME}/{ARCHIVE_SUBDIR}" if archive_dir is None else str(d)
+        result["files"] = [f"{prefix}/page_views-{m}.sql.gz" for m in sorted(archived)]
+
+        # File đã ghi xong → từng ngày: rollup + xoá theo lô, commit một lần / ngày
+        deleted = 0
+        for day in sorted(days):
+            start = datetime(day.year, day.month, day.day)
+            end = start + timedelta(days=1)
+            cur.execute(_DAY_ROLLUP_SQL, (start, end))
+            day_deleted = 0
+            while True:
+                cur.execute(
+                    "DELETE FROM page_views WHERE id <= %s AND created_at >= %s AND created_at < %s "
+                    "ORDER BY id LIMIT %s",
+                    (max_id, start, end, ARCHIVE_BATCH),
+                )
+                n = cur.rowcount or 0
+                day_deleted += n
+                if n < ARCHIVE_BATCH:
+                    break
+            conn.commit()
+            deleted += day_deleted
+        result["rows_deleted"] = deleted
+        result["success"] = True
+        logger.info("page_views archive: %s rows before %s -> %s", deleted, cutoff, result["files"])
+        return result
+    except Exception as e:
+        logger.error("page_views archive failed: %s", e, exc_info=True)
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        result["error"] = str(e)
+        return result
+    finally:
+        for out in writers.values():
+            try:
+                out.close()
+            except Exception:
+                pass
+        try:
+            if cur is not None:
+                cur.close()
+        except Exception:
+            pass
+        if own_conn:
+            try:
+                if conn.is_connected():
+                    conn.close()
+            except Exception:
+                pass
+
@@ -4,16 +4,30 @@ Ghi lượt xem trang (GET) vào bảng page_views + API thống kê cho admin /
 
 Tránh lỗi MySQL «Unread result found»: cursor buffered=True, đọc hết sau SET time_zone,
 đóng cursor trong finally ở get_log_stats_payload. Nếu production vẫn báo lỗi, kiểm tra pool/phiên bản driver.
+
+Thống kê đọc từ bảng tổng hợp page_view_daily (một dòng / ngày giờ VN), cộng dồn cùng transaction
+với mỗi lần flush page_views — /admin/logs không còn COUNT(*) trên bảng thô. Dòng thô cũ được
+chuyển ra file nén theo tháng bằng services/page_view_archive.py.
 """
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from flask import request, jsonify
 from flask_login import login_required, current_user
 from mysql.connector import Error
 
+from folder_py.db_config import env_number
+
 logger = logging.getLogger(__name__)
 
 # Giờ Việt Nam cho CURDATE() / MONTH() trong MySQL (nếu server cho phép SET time_zone)
 _VN_TZ_SQL = "+07:00"
+_VN_OFFSET = timedelta(hours=7)
+_VN_TZ = timezone(_VN_OFFSET)
 
 
 def _session_timezone_vn(conn):
@@ -32,6 +46,7 @@ def _session_timezone_vn(conn):
 
 _page_views_table_ready = False
 _dedup_index_ready = False
+_page_view_daily_ready = False
 
 # Cùng IP + cùng path trong 5 phút = 1 lượt (tránh F5 / refresh tính trùng)
 DEDUP_WINDOW_MINUTES = 5
@@ -52,6 +67,20 @@ CREATE TABLE IF NOT EXISTS page_views (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
+# Số lượt theo ngày (giờ VN). Không xoá khi archive dòng thô — tổng số lượt vẫn đủ.
+CREATE_PAGE_VIEW_DAILY_SQL = """
+CREATE TABLE IF NOT EXISTS page_view_daily (
+  view_date DATE NOT NULL PRIMARY KEY,
+  views BIGINT UNSIGNED NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+UPSERT_PAGE_VIEW_DAILY_SQL = (
+    "INSERT INTO page_view_daily (view_date, views) VALUES (%s, %s) "
+    "ON DUPLICATE KEY UPDATE views = views + VALUES(views)"
+)
+
 
 def _ensure_dedup_index(conn):
     """Bảng cũ có thể thiếu index — thêm để truy vấn gộp lượt nhanh."""
@@ -97,6 +126,69 @@ def _ensure_page_views_table(conn):
         return False
 
 
+def rebuild_page_view_daily(conn, before=None):
+    """
+    Dựng lại page_view_daily từ page_views (job compaction, lần đầu bật rollup).
+    Chỉ ghi đè các ngày còn dòng thô — ngày đã archive giữ nguyên số đếm.
+    before: datetime giờ VN (naive); chỉ dựng các ngày trước mốc này (nên là 00:00).
+    """
+    _session_timezone_vn(conn)
+    sql = (
+        "INSERT INTO page_view_daily (view_date, views) "
+        "SELECT DATE(created_at), COUNT(*) FROM page_views {where}"
+        "GROUP BY DATE(created_at) "
+        "ON DUPLICATE KEY UPDATE views = VALUES(views)"
+    )
+    cur = conn.cursor(buffered=True)
+    try:
+        if before is None:
+            cur.execute(sql.format(where=""))
+        else:
+            cur.execute(sql.format(where="WHERE created_at < %s "), (before,))
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _ensure_page_view_daily(conn):
+    """Tạo page_view_daily nếu chưa có; bảng mới tạo thì dựng từ page_views sẵn có (một lần)."""
+    global _page_view_daily_ready
+    if _page_view_daily_ready:
+        return True
+    from services.schema_registry import has_table, invalidate_schema_registry
+
+    cur = None
+    try:
+        cur = conn.cursor(buffered=True)
+        if not has_table("page_view_daily", cursor=cur):
+            cur.execute(CREATE_PAGE_VIEW_DAILY_SQL)
+            conn.commit()
+            invalidate_schema_registry()
+            if has_table("page_views", cursor=cur):
+                rebuild_page_view_daily(conn)
+                logger.info("page_view_daily created and backfilled from page_views")
+        _page_view_daily_ready = True
+        return True
+    except Error as e:
+        logger.warning("page_view_daily: cannot create/backfill: %s", e)
+        return False
+    finally:
+        try:
+            if cur is not None:
+                cur.close()
+        except Exception:
+            pass
+
+
+def _daily_counts(rows):
+    """Đếm dòng theo ngày giờ VN từ created_at (UTC) của các dòng sắp INSERT."""
+    counts = {}
+    for row in rows:
+        day = (row[6] + _VN_OFFSET).date()
+        counts[day] = counts.get(day, 0) + 1
+    return sorted(counts.items())
+
+
 def _should_skip_page_view():
     if request.method != "GET":
         return True
@@ -117,18 +209,203 @@ def _truncate(s, max_len):
     return s if len(s) <= max_len else s[: max_len - 1] + "…"
 
 
+# Ghi đệm: request chỉ đưa dòng vào hàng đợi, thread nền gộp thành INSERT nhiều dòng
+PAGE_VIEW_FLUSH_ROWS = env_number("PAGE_VIEW_FLUSH_ROWS", 200, int, 1)
+PAGE_VIEW_FLUSH_SECONDS = env_number("PAGE_VIEW_FLUSH_SECONDS", 5.0, float, 0.1)
+PAGE_VIEW_QUEUE_MAX = env_number("PAGE_VIEW_QUEUE_MAX", 10000, int, 1)
+
+INSERT_PAGE_VIEWS_SQL = (
+    "INSERT INTO page_views (path, method, ip, user_agent, referrer, user_id, created_at) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+)
+
+
+# Đánh dấu dừng trong hàng đợi (close())
+_STOP = object()
+
+
+class PageViewRecorder:
+    """
+    Bộ ghi page_views có đệm cho một worker.
+
+    - record(): gộp lượt trùng (cùng IP + path trong DEDUP_WINDOW_MINUTES) trong bộ nhớ rồi đưa
+      vào hàng đợi giới hạn; hàng đợi đầy thì bỏ lượt (không chặn request).
+    - Thread nền flush khi đủ flush_rows dòng hoặc sau flush_seconds giây, bằng một executemany
+      (mysql.connector gộp thành INSERT nhiều dòng) trên connection riêng.
+    - created_at lấy lúc request (UTC, session time_zone +00:00) nên ghi trễ không lệch giờ.
+    - Cùng transaction với INSERT, cộng số lượt vào page_view_daily theo ngày giờ VN.
+    - close() (atexit khi worker tắt) flush nốt các dòng đang chờ.
+
+    Gộp lượt trùng chỉ trong phạm vi một worker (trước đây SELECT trên bảng nên gộp cả các worker).
+    """
+
+    def __init__(self, flush_rows=PAGE_VIEW_FLUSH_ROWS, flush_seconds=PAGE_VIEW_FLUSH_SECONDS,
+                 queue_max=PAGE_VIEW_QUEUE_MAX, dedup_seconds=DEDUP_WINDOW_MINUTES * 60,
+                 connect=None):
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = max(0.05, flush_seconds)
+        self.queue_max = max(1, queue_max)
+        self.dedup_seconds = dedup_seconds
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = None
+        self._last_seen = {}
+        self.dropped = 0
+        self.written = 0
+
+    def _ensure_started(self):
+        """Khởi động thread nền (lười, theo pid: gunicorn --preload fork sau khi import)."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._queue = queue.Queue(maxsize=self.queue_max)
+            self._last_seen = {}
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="page-views-flusher", daemon=True)
+            self._pid = pid
+            self._thread.start()
+
+    def _is_duplicate(self, key, now):
+        with self._lock:
+            last = self._last_seen.get(key)
+            if last is not None and now - last < self.dedup_seconds:
+                return True
+            self._last_seen[key] = now
+            if len(self._last_seen) > self.queue_max:
+                cutoff = now - self.dedup_seconds
+                self._last_seen = {k: t for k, t in self._last_seen.items() if t >= cutoff}
+            return False
+
+    def record(self, path, ip, user_agent, referrer, user_id):
+        self._ensure_started()
+        if self._is_duplicate((ip if ip is not None else "", path), time.monotonic()):
+            return False
+        row = (path, "GET", ip, user_agent, referrer, user_id, datetime.utcnow().replace(microsecond=0))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            logger.debug("page_views queue full, dropping view for %s", path)
+            return False
+        return True
+
+    def _drain(self, limit):
+        rows = []
+        while len(rows) < limit:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                rows.append(row)
+        return rows
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            rows = []
+            stopping = False
+            deadline = time.monotonic() + self.flush_seconds
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                rows.append(item)
+                remaining = deadline - time.monotonic()
+                if len(rows) >= self.flush_rows or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._write(rows)
+            if stopping:
+                return
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self._flush_lock:
+            conn = None
+            cur = None
+            try:
+                if self._connect is not None:
+                    conn = self._connect()
+                else:
+                    from db import get_db_connection
+
+                    conn = get_db_connection()
+                if not conn:
+                    logger.warning("page_views flush: no DB connection, dropped %s rows", len(rows))
+                    return
+                rollup = _ensure_page_view_daily(conn)
+                cur = conn.cursor(buffered=True)
+                cur.execute("SET SESSION time_zone = '+00:00'")
+                cur.executemany(INSERT_PAGE_VIEWS_SQL, rows)
+                if rollup:
+                    cur.executemany(UPSERT_PAGE_VIEW_DAILY_SQL, _daily_counts(rows))
+                conn.commit()
+                self.written += len(rows)
+            except Exception as e:
+                logger.warning("page_views flush failed (%s rows): %s", len(rows), e, exc_info=True)
+            finally:
+                try:
+                    if cur is not None:
+                        cur.close()
+                except Exception:
+                    pass
+                try:
+                    if conn and conn.is_connected():
+                        conn.close()
+                except Exception:
+                    pass
+
+    def flush(self):
+        """Ghi ngay mọi dòng đang chờ (thread hiện tại)."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        while True:
+            rows = self._drain(self.flush_rows)
+            if not rows:
+                return
+            self._write(rows)
+
+    def close(self, timeout=5.0):
+        """Dừng thread nền và flush nốt (atexit khi worker tắt)."""
+        if self._pid != os.getpid() or self._stop is None:
+            return
+        self._stop.set()
+        try:
+            # Đánh thức thread đang chờ hàng đợi; hàng đợi đầy thì thread vẫn đang bận ghi
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+
+_recorder = PageViewRecorder()
+atexit.register(_recorder.close)
+
+
 def _record_page_view():
-    """Gọi từ before_request — lỗi DB không làm hỏng response."""
+    """Gọi từ before_request — chỉ đưa vào hàng đợi, không chạm DB trong request."""
     if _should_skip_page_view():
         return
-    conn = None
     try:
-        from db import get_db_connection
-
-        conn = get_db_connection()
-        if not conn:
-            return
-        _session_timezone_vn(conn)
         uid = None
         try:
             if current_user.is_authenticated:
@@ -138,42 +415,15 @@ def _record_page_view():
         ip = request.headers.get("X-Forwarded-For", request.remote_addr)
         if ip and "," in ip:
             ip = ip.split(",")[0].strip()
-        ip = _truncate(ip, 45)
-        path = _truncate(request.path or "/", 512)
-        ua = _truncate(request.headers.get("User-Agent"), 512)
-        ref = _truncate(request.headers.get("Referer"), 512)
-        ip_key = ip if ip is not None else ""
-        # buffered=True: luôn đọc hết result set — tránh Unread result found khi dùng lại connection từ pool
-        cur = conn.cursor(buffered=True)
-        cur.execute(
-            """
-            SELECT 1 FROM page_views
-            WHERE ip <=> %s AND path = %s
-              AND created_at >= DATE_SUB(NOW(), INTERVAL %s MINUTE)
-            LIMIT 1
-            """,
-            (ip_key, path, DEDUP_WINDOW_MINUTES),
+        _recorder.record(
+            _truncate(request.path or "/", 512),
+            _truncate(ip, 45),
+            _truncate(request.headers.get("User-Agent"), 512),
+            _truncate(request.headers.get("Referer"), 512),
+            uid,
         )
-        if cur.fetchone():
-            cur.close()
-            return
-        cur.execute(
-            """
-            INSERT INTO page_views (path, method, ip, user_agent, referrer, user_id)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """,
-            (path, "GET", ip, ua, ref, uid),
-        )
-        conn.commit()
-        cur.close()
     except Exception as e:
-        logger.warning("page_views insert failed: %s", e, exc_info=True)
-    finally:
-        try:
-            if conn and conn.is_connected():
-                conn.close()
-        except Exception:
-            pass
+        logger.warning("page_views record failed: %s", e, exc_info=True)
 
 
 def _table_bytes(cursor, table_name):
@@ -200,48 +450,29 @@ def _table_bytes(cursor, table_name):
     return None
 
 
-def _scalar_count(cursor):
-    """COUNT(*) — hỗ trợ cursor dict hoặc tuple (mysql.connector)."""
-    r = cursor.fetchone()
-    if r is None:
-        return 0
-    if isinstance(r, dict):
-        v = r.get("c")
-        if v is None:
-            v = next(iter(r.values()), 0)
-    else:
-        v = r[0]
-    try:
-        return int(v)
-    except (TypeError, ValueError):
-        return 0
-
-
-def _count_month(cursor):
-    """Tháng lịch hiện tại (theo timezone session MySQL)."""
+def _rollup_counts(cursor, today):
+    """(tổng, tháng này, hôm nay) từ page_view_daily — một dòng / ngày nên không phụ thuộc lượng traffic."""
     cursor.execute(
         """
-        SELECT COUNT(*) AS c FROM page_views
-        WHERE YEAR(created_at) = YEAR(CURDATE())
-          AND MONTH(created_at) = MONTH(CURDATE())
-        """
+        SELECT COALESCE(SUM(views), 0) AS total,
+               COALESCE(SUM(CASE WHEN view_date >= %s THEN views ELSE 0 END), 0) AS month,
+               COALESCE(SUM(CASE WHEN view_date = %s THEN views ELSE 0 END), 0) AS today
+        FROM page_view_daily
+        """,
+        (today.replace(day=1), today),
     )
-    return _scalar_count(cursor)
-
-
-def _count_today(cursor):
-    cursor.execute(
-        """
-        SELECT COUNT(*) AS c FROM page_views
-        WHERE DATE(created_at) = CURDATE()
-        """
-    )
-    return _scalar_count(cursor)
-
-
-def _count_all(cursor):
-    cursor.execute("SELECT COUNT(*) AS c FROM page_views")
-    return _scalar_count(cursor)
+    r = cursor.fetchone()
+    if r is None:
+        return 0, 0, 0
+    if isinstance(r, dict):
+        r = (r.get("total"), r.get("month"), r.get("today"))
+    out = []
+    for v in r:
+        try:
+            out.append(int(v or 0))
+        except (TypeError, ValueError):
+            out.append(0)
+    return tuple(out)
 
 
 def get_log_stats_payload():
@@ -264,16 +495,17 @@ def get_log_stats_payload():
         return out
     cur = None
     try:
-        _session_timezone_vn(conn)
         cur = conn.cursor(dictionary=True, buffered=True)
         cur.execute("SHOW TABLES LIKE 'page_views'")
         if not cur.fetchone():
             out["page_views_table_exists"] = False
         else:
             out["page_views_table_exists"] = True
-            out["page_views_total"] = _count_all(cur)
-            out["page_views_month"] = _count_month(cur)
-            out["page_views_today"] = _count_today(cur)
+            if _ensure_page_view_daily(conn):
+                total, month, today = _rollup_counts(cur, datetime.now(_VN_TZ).date())
+                out["page_views_total"] = total
+                out["page_views_month"] = month
+                out["page_views_today"] = today
             out["page_views_bytes"] = _table_bytes(cur, "page_views")
         cur.execute("SHOW TABLES LIKE 'activity_logs'")
         if cur.fetchone():
@@ -2,6 +2,9 @@
 """Pure helper functions for person service code."""
 
 import logging
+from bisect import bisect_left
+
+from services.schema_registry import has_table, table_columns
 
 logger = logging.getLogger(__name__)
 
@@ -151,11 +154,20 @@ def get_or_create_branch(cursor, branch_name):
     return cursor.lastrowid
 
 
-def load_relationship_data(cursor):
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def load_relationship_data(cursor, person_ids=None):
     """
     Helper function để load tất cả relationship data (spouse, children, siblings, parents)
     theo cùng logic như /api/members - đây là source of truth.
 
+    person_ids: None = toàn bộ DB. Nếu truyền tập person_id (search, /api/person, chuỗi tổ tiên)
+    thì chỉ đọc quan hệ của những người đó và hàng xóm một bước (cha mẹ, con, vợ chồng, anh chị em)
+    bằng các query IN (...). Kết quả cùng cấu trúc; chỉ các key của person_ids là đầy đủ, key của
+    hàng xóm có thể thiếu.
+
     Returns:
         dict với các keys:
         - spouse_data_from_table: {person_id: [spouse_name1, spouse_name2, ...]}
@@ -180,22 +192,25 @@ def load_relationship_data(cursor):
         'siblings_text_map': {},
         'parent_text_map': {},
     }
+    scope = None
+    if person_ids is not None:
+        scope = sorted({str(pid) for pid in person_ids if pid})
+        if not scope:
+            return result
+    scope_params = tuple(scope) if scope else None
+    # Điều kiện lọc theo person_id cho spouse_sibling_children ('' khi đọc toàn bộ)
+    ssc_filter = f' AND person_id IN ({_placeholders(scope)})' if scope else ''
     try:
-        cursor.execute("\n            SELECT TABLE_NAME \n            FROM information_schema.TABLES \n            WHERE TABLE_SCHEMA = DATABASE() \n            AND TABLE_NAME = 'spouse_sibling_children'\n        ")
-        spouse_table_exists = cursor.fetchone() is not None
+        spouse_table_exists = has_table('spouse_sibling_children', cursor=cursor)
         if spouse_table_exists:
-            cursor.execute(
-                """
-                SELECT COLUMN_NAME
-                FROM information_schema.COLUMNS
-                WHERE TABLE_SCHEMA = DATABASE()
-                  AND TABLE_NAME = 'spouse_sibling_children'
-                """
+            ssc_columns = table_columns(
+                'spouse_sibling_children',
+                ('spouse_name', 'siblings_infor', 'siblings_info', 'children_infor', 'children_info', 'father_name', 'mother_name'),
+                cursor=cursor,
             )
-            ssc_columns = {str((r or {}).get('COLUMN_NAME') or '').strip() for r in (cursor.fetchall() or [])}
 
             if 'spouse_name' in ssc_columns:
-                cursor.execute("\n                    SELECT person_id, spouse_name \n                    FROM spouse_sibling_children \n                    WHERE spouse_name IS NOT NULL AND spouse_name != ''\n                ")
+                cursor.execute("\n                    SELECT person_id, spouse_name \n                    FROM spouse_sibling_children \n                    WHERE spouse_name IS NOT NULL AND spouse_name != ''" + ssc_filter + "\n                ", scope_params)
                 for row in cursor.fetchall():
                     person_id_key = row.get('person_id')
                     spouse_name_str = row.get('spouse_name', '').strip()
@@ -208,8 +223,9 @@ def load_relationship_data(cursor):
                     f"""
                     SELECT person_id, {siblings_col} AS siblings_text
                     FROM spouse_sibling_children
-                    WHERE {siblings_col} IS NOT NULL AND {siblings_col} != ''
-                    """
+                    WHERE {siblings_col} IS NOT NULL AND {siblings_col} != ''{ssc_filter}
+                    """,
+                    scope_params,
                 )
                 for row in cursor.fetchall():
                     person_id_key = row.get('person_id')
@@ -223,8 +239,9 @@ def load_relationship_data(cursor):
                     f"""
                     SELECT person_id, {children_col} AS children_text
                     FROM spouse_sibling_children
-                    WHERE {children_col} IS NOT NULL AND {children_col} != ''
-                    """
+                    WHERE {children_col} IS NOT NULL AND {children_col} != ''{ssc_filter}
+                    """,
+                    scope_params,
                 )
                 for row in cursor.fetchall():
                     person_id_key = row.get('person_id')
@@ -242,7 +259,11 @@ def load_relationship_data(cursor):
                     select_parts.append('mother_name')
                 else:
                     select_parts.append('NULL AS mother_name')
-                cursor.execute(f"SELECT {', '.join(select_parts)} FROM spouse_sibling_children")
+                cursor.execute(
+                    f"SELECT {', '.join(select_parts)} FROM spouse_sibling_children"
+                    + (f' WHERE person_id IN ({_placeholders(scope)})' if scope else ''),
+                    scope_params,
+                )
                 for row in cursor.fetchall():
                     person_id_key = row.get('person_id')
                     if not person_id_key:
@@ -256,21 +277,35 @@ def load_relationship_data(cursor):
                         }
     except Exception as e:
         logger.debug(f'Could not load spouse data from table: {e}')
+    # Các danh sách bên dưới khử trùng bằng dict (ordered set) thay cho "x not in list"
+    # để parent nhiều con / người nhiều vợ chồng vẫn tuyến tính.
     try:
-        cursor.execute('\n            SELECT \n                m.husband_id AS person_id,\n                m.wife_id AS spouse_person_id,\n                sp_spouse.full_name AS spouse_name\n            FROM marriages m\n            LEFT JOIN persons sp_spouse ON sp_spouse.person_id = m.wife_id\n            WHERE sp_spouse.full_name IS NOT NULL\n            \n            UNION\n            \n            SELECT \n                m.wife_id AS person_id,\n                m.husband_id AS spouse_person_id,\n                sp_person.full_name AS spouse_name\n            FROM marriages m\n            LEFT JOIN persons sp_person ON sp_person.person_id = m.husband_id\n            WHERE sp_person.full_name IS NOT NULL\n        ')
+        husband_filter = f' AND m.husband_id IN ({_placeholders(scope)})' if scope else ''
+        wife_filter = f' AND m.wife_id IN ({_placeholders(scope)})' if scope else ''
+        cursor.execute('\n            SELECT \n                m.husband_id AS person_id,\n                m.wife_id AS spouse_person_id,\n                sp_spouse.full_name AS spouse_name\n            FROM marriages m\n            LEFT JOIN persons sp_spouse ON sp_spouse.person_id = m.wife_id\n            WHERE sp_spouse.full_name IS NOT NULL' + husband_filter + '\n            \n            UNION\n            \n            SELECT \n                m.wife_id AS person_id,\n                m.husband_id AS spouse_person_id,\n                sp_person.full_name AS spouse_name\n            FROM marriages m\n            LEFT JOIN persons sp_person ON sp_person.person_id = m.husband_id\n            WHERE sp_person.full_name IS NOT NULL' + wife_filter + '\n        ', scope_params + scope_params if scope else None)
+        spouse_sets = {}
         for row in cursor.fetchall():
             person_id_key = row.get('person_id')
             spouse_name = row.get('spouse_name')
             if person_id_key and spouse_name:
-                if person_id_key not in result['spouse_data_from_marriages']:
-                    result['spouse_data_from_marriages'][person_id_key] = []
-                if spouse_name not in result['spouse_data_from_marriages'][person_id_key]:
-                    result['spouse_data_from_marriages'][person_id_key].append(spouse_name)
+                spouse_sets.setdefault(person_id_key, {})[spouse_name] = None
+        for person_id_key, names in spouse_sets.items():
+            result['spouse_data_from_marriages'][person_id_key] = list(names)
     except Exception as e:
         logger.debug(f'Could not load spouse data from marriages: {e}')
     try:
-        cursor.execute('\n            SELECT \n                r.child_id,\n                r.parent_id,\n                r.relation_type,\n                parent.full_name AS parent_name,\n                child.full_name AS child_name\n            FROM relationships r\n            LEFT JOIN persons parent ON r.parent_id = parent.person_id\n            LEFT JOIN persons child ON r.child_id = child.person_id\n            WHERE parent.full_name IS NOT NULL AND child.full_name IS NOT NULL\n        ')
+        rel_filter = ''
+        rel_params = None
+        if scope:
+            # Con của cha mẹ person_ids = anh chị em → lấy thêm các hàng có parent_id là cha mẹ đó
+            cursor.execute(f'SELECT DISTINCT parent_id FROM relationships WHERE child_id IN ({_placeholders(scope)})', scope_params)
+            parent_scope = sorted(set(scope) | {row.get('parent_id') for row in cursor.fetchall() if row.get('parent_id')})
+            rel_filter = f' AND (r.child_id IN ({_placeholders(scope)}) OR r.parent_id IN ({_placeholders(parent_scope)}))'
+            rel_params = scope_params + tuple(parent_scope)
+        cursor.execute('\n            SELECT \n                r.child_id,\n                r.parent_id,\n                r.relation_type,\n                parent.full_name AS parent_name,\n                child.full_name AS child_name\n            FROM relationships r\n            LEFT JOIN persons parent ON r.parent_id = parent.person_id\n            LEFT JOIN persons child ON r.child_id = child.person_id\n            WHERE parent.full_name IS NOT NULL AND child.full_name IS NOT NULL' + rel_filter + '\n        ', rel_params)
         relationships = cursor.fetchall()
+        parent_id_sets = {}
+        child_name_sets = {}
         for rel in relationships:
             child_id = rel['child_id']
             parent_id = rel['parent_id']
@@ -289,19 +324,32 @@ def load_relationship_data(cursor):
                     result['parent_data'][child_id]['mother_name'] += ', ' + parent_name
                 else:
                     result['parent_data'][child_id]['mother_name'] = parent_name
-            if child_id not in result['parent_ids_map']:
-                result['parent_ids_map'][child_id] = []
-            if parent_id and parent_id not in result['parent_ids_map'][child_id]:
-                result['parent_ids_map'][child_id].append(parent_id)
-            if parent_id not in result['children_map']:
-                result['children_map'][parent_id] = []
-            if child_name and child_name not in result['children_map'][parent_id]:
-                result['children_map'][parent_id].append(child_name)
+            parent_ids = parent_id_sets.setdefault(child_id, {})
+            if parent_id:
+                parent_ids[parent_id] = None
+            child_names = child_name_sets.setdefault(parent_id, {})
+            if child_name:
+                child_names[child_name] = None
+        for child_id, parent_ids in parent_id_sets.items():
+            result['parent_ids_map'][child_id] = list(parent_ids)
+        for parent_id, child_names in child_name_sets.items():
+            result['children_map'][parent_id] = list(child_names)
         logger.debug(f'Loaded {len(relationships)} relationships')
     except Exception as e:
         logger.warning(f'Error loading relationships: {e}')
     try:
-        cursor.execute('SELECT person_id, full_name FROM persons WHERE full_name IS NOT NULL')
+        if scope:
+            name_scope = set(scope)
+            for child_id, parent_ids in result['parent_ids_map'].items():
+                name_scope.add(child_id)
+                name_scope.update(parent_ids)
+            name_scope = sorted(name_scope)
+            cursor.execute(
+                f'SELECT person_id, full_name FROM persons WHERE full_name IS NOT NULL AND person_id IN ({_placeholders(name_scope)})',
+                tuple(name_scope),
+            )
+        else:
+            cursor.execute('SELECT person_id, full_name FROM persons WHERE full_name IS NOT NULL')
         for row in cursor.fetchall():
             result['person_name_map'][row['person_id']] = row['full_name']
     except Exception as e:
@@ -310,24 +358,42 @@ def load_relationship_data(cursor):
         parent_to_children = {}
         for child_id, parent_ids in result['parent_ids_map'].items():
             for parent_id in parent_ids:
-                if parent_id not in parent_to_children:
-                    parent_to_children[parent_id] = []
-                if child_id not in parent_to_children[parent_id]:
-                    parent_to_children[parent_id].append(child_id)
-        for person_id in result['person_name_map'].keys():
+                parent_to_children.setdefault(parent_id, {})[child_id] = None
+        # Anh chị em cùng bộ cha/mẹ dùng chung một danh sách tên đã sắp (tính một lần / bộ cha mẹ);
+        # mỗi người chỉ cần bỏ tên của chính mình nếu không có anh chị em nào trùng tên.
+        sibling_groups = {}
+        if scope:
+            sibling_targets = [(person_id, result['person_name_map'].get(person_id)) for person_id in scope]
+        else:
+            sibling_targets = result['person_name_map'].items()
+        for person_id, own_name in sibling_targets:
             person_parent_ids = result['parent_ids_map'].get(person_id, [])
             if not person_parent_ids:
                 continue
-            sibling_names = set()
-            for parent_id in person_parent_ids:
-                children_of_parent = parent_to_children.get(parent_id, [])
-                for child_id in children_of_parent:
-                    if child_id != person_id:
+            group_key = frozenset(person_parent_ids)
+            group = sibling_groups.get(group_key)
+            if group is None:
+                name_counts = {}
+                members = set()
+                for parent_id in group_key:
+                    for child_id in parent_to_children.get(parent_id, ()):
+                        if child_id in members:
+                            continue
+                        members.add(child_id)
                         child_name = result['person_name_map'].get(child_id)
                         if child_name:
-                            sibling_names.add(child_name)
+                            name_counts[child_name] = name_counts.get(child_name, 0) + 1
+                group = (sorted(name_counts), name_counts, members)
+                sibling_groups[group_key] = group
+            sorted_names, name_counts, members = group
+            if person_id in members and name_counts.get(own_name) == 1:
+                # Tên của chính mình có đúng một lần trong danh sách đã sắp: cắt bỏ bằng bisect
+                own_index = bisect_left(sorted_names, own_name)
+                sibling_names = sorted_names[:own_index] + sorted_names[own_index + 1:]
+            else:
+                sibling_names = list(sorted_names)
             if sibling_names:
-                result['siblings_map'][person_id] = sorted(list(sibling_names))
+                result['siblings_map'][person_id] = sibling_names
         logger.debug(f"Loaded siblings for {len(result['siblings_map'])} persons")
     except Exception as e:
         logger.warning(f'Error loading siblings: {e}')
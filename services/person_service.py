@@ -2,7 +2,6 @@
 """Person CRUD and related API handlers."""
 import os
 import re
-import csv
 import json
 import logging
 import math
@@ -14,15 +13,21 @@ from werkzeug.utils import secure_filename
 
 from audit_log import log_person_update, log_person_create, log_activity
 from db import get_db_connection
-from extensions import cache
 from services.members_service import get_members_password
 from services.activities_service import is_admin_user
+from services.genealogy_graph import get_relationship_data, invalidate_genealogy_snapshot
+from services.schema_registry import has_column, invalidate_schema_registry, table_columns
+from services.mutation_snapshot import SnapshotError, SnapshotNotFound, capture_person_snapshot, restore_snapshot
+from services.search_index import find_person_ids
+from services.sheet_store import get_sheet_store
+from services.image_serving import record_image_etag
+from services.members_helpers import member_update_values, sll_canonical_branch
+from services.thumbnail_jobs import enqueue_image_jobs, image_srcset_or_enqueue
 from services.person_helpers import (
     normalize_search_query,
     split_semicolon_values,
     find_person_by_name,
     get_preferred_spouse_names,
-    load_relationship_data,
     get_or_create_location,
     get_or_create_generation,
     get_or_create_branch,
@@ -105,6 +110,97 @@ def _apply_parent_relationship_mutations(cursor, person_id, data):
             (person_id, parent_id, relation_type),
         )
 
+def _attach_siblings_and_spouses(cursor, persons, scoped=False):
+    """
+    Gắn 'siblings' và 'spouse' cho từng person của /api/persons bằng 3 query bulk
+    (trước đây 3 query cho MỖI người).
+
+    scoped=True (phân trang): chỉ đọc quan hệ của các person_id trong trang qua IN (...).
+    Thứ tự tên anh chị em vẫn do MySQL ORDER BY s.full_name quyết định để giữ đúng collation.
+    """
+    if not persons:
+        return
+    person_ids = [p['person_id'] for p in persons]
+    id_placeholders = ','.join(['%s'] * len(person_ids))
+
+    # 1) Cha/mẹ của các person trong phạm vi
+    parent_sql = "SELECT child_id, parent_id, relation_type FROM relationships WHERE relation_type IN ('father', 'mother')"
+    parent_params = ()
+    if scoped:
+        parent_sql += f' AND child_id IN ({id_placeholders})'
+        parent_params = tuple(person_ids)
+    cursor.execute(parent_sql, parent_params)
+    parents_of = {}
+    for rel in cursor.fetchall():
+        parents_of.setdefault(rel['child_id'], {})[rel['relation_type']] = rel['parent_id']
+
+    # 2) Con của các cha/mẹ đó, sắp theo tên; rank = vị trí trong kết quả đã sắp
+    parent_keys = set()
+    for person_id in person_ids:
+        rels = parents_of.get(person_id) or {}
+        for relation_type in ('father', 'mother'):
+            if rels.get(relation_type):
+                parent_keys.add(rels[relation_type])
+    children_of = {}
+    if parent_keys:
+        sibling_sql = "\n            SELECT r.parent_id, r.relation_type, s.person_id, s.full_name\n            FROM persons s\n            JOIN relationships r ON s.person_id = r.child_id\n            WHERE r.relation_type IN ('father', 'mother')\n        "
+        sibling_params = ()
+        if scoped:
+            parent_list = sorted(parent_keys)
+            sibling_sql += f"  AND r.parent_id IN ({','.join(['%s'] * len(parent_list))})\n        "
+            sibling_params = tuple(parent_list)
+        sibling_sql += '    ORDER BY s.full_name\n        '
+        cursor.execute(sibling_sql, sibling_params)
+        for rank, row in enumerate(cursor.fetchall()):
+            key = (row['parent_id'], row['relation_type'])
+            children_of.setdefault(key, []).append((rank, row['person_id'], row['full_name']))
+
+    # 3) Vợ/chồng (không tính đã ly dị); chỉ nhận người phối ngẫu có trong bảng persons
+    spouse_sql = "\n            SELECT m.husband_id, m.wife_id,\n                   h.person_id AS husband_person_id, h.full_name AS husband_name,\n                   w.person_id AS wife_person_id, w.full_name AS wife_name\n            FROM marriages m\n            LEFT JOIN persons h ON h.person_id = m.husband_id\n            LEFT JOIN persons w ON w.person_id = m.wife_id\n            WHERE m.status != 'Đã ly dị'\n        "
+    spouse_params = ()
+    if scoped:
+        spouse_sql += f'    AND (m.husband_id IN ({id_placeholders}) OR m.wife_id IN ({id_placeholders}))\n        '
+        spouse_params = tuple(person_ids) + tuple(person_ids)
+    cursor.execute(spouse_sql, spouse_params)
+    spouses_of = {}
+    for row in cursor.fetchall():
+        husband_id = row['husband_id']
+        wife_id = row['wife_id']
+        if row.get('wife_person_id') is not None:
+            entries = spouses_of.setdefault(husband_id, [])
+            if (wife_id, row['wife_name']) not in entries:
+                entries.append((wife_id, row['wife_name']))
+        if wife_id != husband_id and row.get('husband_person_id') is not None:
+            entries = spouses_of.setdefault(wife_id, [])
+            if (husband_id, row['husband_name']) not in entries:
+                entries.append((husband_id, row['husband_name']))
+
+    for person in persons:
+        person_id = person['person_id']
+        rels = parents_of.get(person_id) or {}
+        father_id = rels.get('father')
+        mother_id = rels.get('mother')
+        if father_id or mother_id:
+            candidates = []
+            if father_id:
+                candidates.extend(children_of.get((father_id, 'father'), []))
+            if mother_id:
+                candidates.extend(children_of.get((mother_id, 'mother'), []))
+            candidates.sort(key=lambda item: item[0])
+            sibling_names = []
+            seen_names = set()
+            for _rank, sibling_id, sibling_name in candidates:
+                if sibling_id == person_id or sibling_name in seen_names:
+                    continue
+                seen_names.add(sibling_name)
+                sibling_names.append(sibling_name)
+            person['siblings'] = '; '.join(sibling_names) if sibling_names else None
+        else:
+            person['siblings'] = None
+        spouse_names = [name for _spouse_id, name in spouses_of.get(person_id, []) if name]
+        person['spouse'] = '; '.join(spouse_names) if spouse_names else None
+
+
 def get_persons():
     """Lấy danh sách tất cả người từ schema mới (person_id VARCHAR, relationships mới)"""
     logger.debug('API /api/persons duoc goi')
@@ -114,8 +210,7 @@ def get_persons():
         return (jsonify({'error': 'Không thể kết nối database'}), 500)
     try:
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("\n            SELECT COLUMN_NAME \n            FROM information_schema.COLUMNS \n            WHERE TABLE_SCHEMA = DATABASE() \n            AND TABLE_NAME = 'persons'\n            AND COLUMN_NAME IN ('personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email')\n        ")
-        available_columns = {row['COLUMN_NAME'] for row in cursor.fetchall()}
+        available_columns = table_columns('persons', ('personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email'), cursor=cursor)
         select_fields = ['p.person_id', 'p.full_name', 'p.alias', 'p.gender', 'p.status', 'p.generation_level', 'p.home_town', 'p.nationality', 'p.religion', 'p.birth_date_solar', 'p.birth_date_lunar', 'p.death_date_solar', 'p.death_date_lunar', 'p.place_of_death', 'p.grave_info', 'p.contact', 'p.social', 'p.occupation', 'p.education', 'p.events', 'p.titles', 'p.blood_type', 'p.genetic_disease', 'p.note', 'p.father_mother_id', 'p.family_unit_id']
         if 'personal_image_url' in available_columns:
             select_fields.append('p.personal_image_url AS personal_image_url')
@@ -173,39 +268,7 @@ def get_persons():
         else:
             cursor.execute(main_sql)
         persons = cursor.fetchall()
-        for person in persons:
-            person_id = person['person_id']
-            cursor.execute("\n                SELECT parent_id, relation_type\n                FROM relationships\n                WHERE child_id = %s AND relation_type IN ('father', 'mother')\n            ", (person_id,))
-            parent_rels = cursor.fetchall()
-            father_id = None
-            mother_id = None
-            for rel in parent_rels:
-                if rel['relation_type'] == 'father':
-                    father_id = rel['parent_id']
-                elif rel['relation_type'] == 'mother':
-                    mother_id = rel['parent_id']
-            if father_id or mother_id:
-                conditions = []
-                params = [person_id]
-                if father_id:
-                    conditions.append("(r.parent_id = %s AND r.relation_type = 'father')")
-                    params.append(father_id)
-                if mother_id:
-                    conditions.append("(r.parent_id = %s AND r.relation_type = 'mother')")
-                    params.append(mother_id)
-                sibling_query = f"\n                    SELECT DISTINCT s.full_name\n                    FROM persons s\n                    JOIN relationships r ON s.person_id = r.child_id\n                    WHERE s.person_id <> %s\n                      AND ({' OR '.join(conditions)})\n                    ORDER BY s.full_name\n                "
-                cursor.execute(sibling_query, params)
-                siblings = cursor.fetchall()
-                person['siblings'] = '; '.join([s['full_name'] for s in siblings]) if siblings else None
-            else:
-                person['siblings'] = None
-            cursor.execute("\n                SELECT DISTINCT \n                    CASE \n                        WHEN m.husband_id = %s THEN m.wife_id\n                        ELSE m.husband_id\n                    END AS spouse_id,\n                    sp.full_name AS spouse_name\n                FROM marriages m\n                JOIN persons sp ON (\n                    CASE \n                        WHEN m.husband_id = %s THEN sp.person_id = m.wife_id\n                        ELSE sp.person_id = m.husband_id\n                    END\n                )\n                WHERE (m.husband_id = %s OR m.wife_id = %s)\n                AND m.status != 'Đã ly dị'\n            ", (person_id, person_id, person_id, person_id))
-            spouses = cursor.fetchall()
-            if spouses:
-                spouse_names = [s['spouse_name'] for s in spouses if s.get('spouse_name')]
-                person['spouse'] = '; '.join(spouse_names) if spouse_names else None
-            else:
-                person['spouse'] = None
+        _attach_siblings_and_spouses(cursor, persons, scoped=paginated)
         is_admin = current_user.is_authenticated and getattr(current_user, 'role', '') == 'admin'
         for person in persons:
             if not is_admin:
@@ -235,46 +298,40 @@ def get_persons():
         if connection.is_connected():
             cursor.close()
             connection.close()
+def _sheet3_payload(row):
+    return {'sheet3_id': row.get('ID', ''), 'sheet3_number': row.get('Số thứ tự thành viên trong dòng họ', ''), 'sheet3_death_place': row.get('Nơi mất', ''), 'sheet3_grave': row.get('Mộ phần', ''), 'sheet3_parents': row.get('Thông tin Bố Mẹ', ''), 'sheet3_siblings': row.get('Thông tin Anh/Chị/Em', ''), 'sheet3_spouse': row.get('Thông tin Hôn Phối', ''), 'sheet3_children': row.get('Thông tin Con', '')}
+
 def get_sheet3_data_by_name(person_name, csv_id=None, father_name=None, mother_name=None):
-    """Đọc dữ liệu từ Sheet3 CSV theo tên người
+    """Đọc dữ liệu từ Sheet3 CSV theo tên người (tra chỉ mục của SheetStore, không quét file)
     QUAN TRỌNG: Dùng csv_id hoặc tên bố/mẹ để phân biệt khi có nhiều người trùng tên
     """
-    sheet3_file = os.path.join(ROOT_DIR, 'Data_TBQC_Sheet3.csv')
-    if not os.path.exists(sheet3_file):
-        return None
+    store = get_sheet_store(os.path.join(ROOT_DIR, 'Data_TBQC_Sheet3.csv'))
     try:
-        with open(sheet3_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            candidates = []
-            for row in reader:
-                sheet3_name = (row.get('Họ và tên', '') or '').strip()
-                person_name_clean = (person_name or '').strip()
-                if sheet3_name.lower() == person_name_clean.lower():
-                    candidates.append(row)
-            if len(candidates) == 1:
-                row = candidates[0]
-                return {'sheet3_id': row.get('ID', ''), 'sheet3_number': row.get('Số thứ tự thành viên trong dòng họ', ''), 'sheet3_death_place': row.get('Nơi mất', ''), 'sheet3_grave': row.get('Mộ phần', ''), 'sheet3_parents': row.get('Thông tin Bố Mẹ', ''), 'sheet3_siblings': row.get('Thông tin Anh/Chị/Em', ''), 'sheet3_spouse': row.get('Thông tin Hôn Phối', ''), 'sheet3_children': row.get('Thông tin Con', '')}
-            if len(candidates) > 1:
-                if csv_id:
-                    for row in candidates:
-                        sheet3_id = (row.get('ID', '') or '').strip()
-                        if sheet3_id == csv_id:
-                            return {'sheet3_id': row.get('ID', ''), 'sheet3_number': row.get('Số thứ tự thành viên trong dòng họ', ''), 'sheet3_death_place': row.get('Nơi mất', ''), 'sheet3_grave': row.get('Mộ phần', ''), 'sheet3_parents': row.get('Thông tin Bố Mẹ', ''), 'sheet3_siblings': row.get('Thông tin Anh/Chị/Em', ''), 'sheet3_spouse': row.get('Thông tin Hôn Phối', ''), 'sheet3_children': row.get('Thông tin Con', '')}
-                if father_name or mother_name:
-                    for row in candidates:
-                        sheet3_father = (row.get('Tên bố', '') or '').strip().lower()
-                        sheet3_mother = (row.get('Tên mẹ', '') or '').strip().lower()
-                        father_match = True
-                        mother_match = True
-                        if father_name:
-                            father_clean = father_name.replace('Ông', '').replace('Bà', '').strip().lower()
-                            father_match = father_clean in sheet3_father or sheet3_father in father_clean
-                        if mother_name:
-                            mother_clean = mother_name.replace('Ông', '').replace('Bà', '').strip().lower()
-                            mother_match = mother_clean in sheet3_mother or sheet3_mother in mother_clean
-                        if father_match and mother_match:
-                            return {'sheet3_id': row.get('ID', ''), 'sheet3_number': row.get('Số thứ tự thành viên trong dòng họ', ''), 'sheet3_death_place': row.get('Nơi mất', ''), 'sheet3_grave': row.get('Mộ phần', ''), 'sheet3_parents': row.get('Thông tin Bố Mẹ', ''), 'sheet3_siblings': row.get('Thông tin Anh/Chị/Em', ''), 'sheet3_spouse': row.get('Thông tin Hôn Phối', ''), 'sheet3_children': row.get('Thông tin Con', '')}
-                return None
+        if not store.exists():
+            return None
+        candidates = store.lookup('Họ và tên', person_name)
+        if len(candidates) == 1:
+            return _sheet3_payload(candidates[0])
+        if len(candidates) > 1:
+            if csv_id:
+                for row in candidates:
+                    sheet3_id = (row.get('ID', '') or '').strip()
+                    if sheet3_id == csv_id:
+                        return _sheet3_payload(row)
+            if father_name or mother_name:
+                for row in candidates:
+                    sheet3_father = (row.get('Tên bố', '') or '').strip().lower()
+                    sheet3_mother = (row.get('Tên mẹ', '') or '').strip().lower()
+                    father_match = True
+                    mother_match = True
+                    if father_name:
+                        father_clean = father_name.replace('Ông', '').replace('Bà', '').strip().lower()
+                        father_match = father_clean in sheet3_father or sheet3_father in father_clean
+                    if mother_name:
+                        mother_clean = mother_name.replace('Ông', '').replace('Bà', '').strip().lower()
+                        mother_match = mother_clean in sheet3_mother or sheet3_mother in mother_clean
+                    if father_match and mother_match:
+                        return _sheet3_payload(row)
     except Exception as e:
         print(f'Lỗi đọc Sheet3: {e}')
         return None
@@ -291,8 +348,7 @@ def get_person(person_id):
     cursor = None
     try:
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("\n            SELECT COLUMN_NAME \n            FROM information_schema.COLUMNS \n            WHERE TABLE_SCHEMA = DATABASE() \n            AND TABLE_NAME = 'persons'\n            AND COLUMN_NAME IN ('personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email', 'branch_name')\n        ")
-        available_columns = {row['COLUMN_NAME'] for row in cursor.fetchall()}
+        available_columns = table_columns('persons', ('personal_image_url', 'personal_image', 'biography', 'academic_rank', 'academic_degree', 'phone', 'email', 'branch_name'), cursor=cursor)
         select_fields = ['p.person_id', 'p.full_name', 'p.alias', 'p.gender', 'p.status', 'p.generation_level', 'p.birth_date_solar', 'p.birth_date_lunar', 'p.death_date_solar', 'p.death_date_lunar', 'p.home_town', 'p.nationality', 'p.religion', 'p.place_of_death', 'p.grave_info', 'p.contact', 'p.social', 'p.occupation', 'p.education', 'p.events', 'p.titles', 'p.blood_type', 'p.genetic_disease', 'p.note', 'p.father_mother_id', 'p.family_unit_id']
         if 'personal_image_url' in available_columns:
             select_fields.append('p.personal_image_url AS personal_image_url')
@@ -345,8 +401,7 @@ def get_person(person_id):
             if bn_col and str(bn_col).strip():
                 person['branch_name'] = str(bn_col).strip()
             else:
-                cursor.execute("SHOW COLUMNS FROM persons LIKE 'branch_id'")
-                has_branch_id = cursor.fetchone()
+                has_branch_id = has_column('persons', 'branch_id', cursor=cursor)
                 if has_branch_id:
                     cursor.execute('SELECT branch_id FROM persons WHERE person_id = %s', (person_id,))
                     branch_row = cursor.fetchone()
@@ -388,7 +443,7 @@ def get_person(person_id):
             person['mother_name'] = None
         relationship_data = None
         try:
-            relationship_data = load_relationship_data(cursor)
+            relationship_data = get_relationship_data(cursor, person_ids=[person_id])
             siblings_map = relationship_data['siblings_map']
             siblings_list = siblings_map.get(person_id, [])
             person['siblings'] = '; '.join(siblings_list) if siblings_list else None
@@ -735,6 +790,10 @@ def get_person(person_id):
                     else:
                         clean_person[key] = clean_value(value)
 
+                # srcset các bậc ảnh responsive (None tới khi job nền sinh xong)
+                for image_key in ('personal_image_url', 'grave_image_url'):
+                    if clean_person.get(image_key):
+                        clean_person[image_key.replace('_url', '_srcset')] = image_srcset_or_enqueue(clean_person[image_key])
                 is_admin = current_user.is_authenticated and getattr(current_user, 'role', '') == 'admin'
                 if not is_admin:
                     if 'phone' in clean_person:
@@ -774,6 +833,7 @@ def search_persons():
     Hỗ trợ:
     - Case-insensitive search (MySQL COLLATE utf8mb4_unicode_ci)
     - Person_ID variants: P-7-654, p-7-654, 7-654, 654
+    - Gõ không dấu, tiền tố từng chữ, xếp hạng (services.search_index); fallback LIKE nếu không có snapshot
     - Trim khoảng trắng tự động
     - Đồng bộ với /api/members (dùng cùng helper load_relationship_data)
     """
@@ -797,27 +857,40 @@ def search_persons():
         return (jsonify({'error': 'Không thể kết nối database'}), 500)
     try:
         cursor = connection.cursor(dictionary=True)
-        normalized_query, person_id_patterns = normalize_search_query(q)
-        search_pattern = f'%{normalized_query}%'
-        where_conditions = ['p.full_name LIKE %s COLLATE utf8mb4_unicode_ci', 'p.alias LIKE %s COLLATE utf8mb4_unicode_ci']
-        where_params = [search_pattern, search_pattern]
-        if person_id_patterns:
-            person_id_conditions = ' OR '.join(['p.person_id LIKE %s COLLATE utf8mb4_unicode_ci'] * len(person_id_patterns))
-            where_conditions.append(f'({person_id_conditions})')
-            where_params.extend(person_id_patterns)
+        # Chỉ mục trong bộ nhớ (không dấu, tiền tố, xếp hạng) → chỉ đọc chi tiết theo khoá chính.
+        # None = không dùng được snapshot → LIKE như trước.
+        ranked_ids = find_person_ids(cursor, q, generation_level=generation_level, limit=limit)
+        if ranked_ids is not None:
+            if not ranked_ids:
+                logger.info(f"Search query='{q}', generation_level={generation_level}, found=0 (index)")
+                return jsonify([])
+            where_clause = 'p.person_id IN (' + ', '.join(['%s'] * len(ranked_ids)) + ')'
+            where_params = list(ranked_ids)
         else:
-            where_conditions.append('p.person_id LIKE %s COLLATE utf8mb4_unicode_ci')
-            where_params.append(search_pattern)
-        where_clause = '(' + ' OR '.join(where_conditions) + ')'
-        if generation_level:
-            where_clause += ' AND p.generation_level = %s'
-            where_params.append(generation_level)
+            normalized_query, person_id_patterns = normalize_search_query(q)
+            search_pattern = f'%{normalized_query}%'
+            where_conditions = ['p.full_name LIKE %s COLLATE utf8mb4_unicode_ci', 'p.alias LIKE %s COLLATE utf8mb4_unicode_ci']
+            where_params = [search_pattern, search_pattern]
+            if person_id_patterns:
+                person_id_conditions = ' OR '.join(['p.person_id LIKE %s COLLATE utf8mb4_unicode_ci'] * len(person_id_patterns))
+                where_conditions.append(f'({person_id_conditions})')
+                where_params.extend(person_id_patterns)
+            else:
+                where_conditions.append('p.person_id LIKE %s COLLATE utf8mb4_unicode_ci')
+                where_params.append(search_pattern)
+            where_clause = '(' + ' OR '.join(where_conditions) + ')'
+            if generation_level:
+                where_clause += ' AND p.generation_level = %s'
+                where_params.append(generation_level)
         query_sql = f"\n                SELECT\n                    p.person_id,\n                    p.full_name,\n                    p.alias,\n                    p.status,\n                    p.generation_level,\n                    p.home_town,\n                    p.gender,\n                p.father_mother_id AS fm_id,\n                p.birth_date_solar,\n                p.death_date_solar,\n                    -- Cha từ relationships (GROUP_CONCAT để đồng nhất với /api/members)\n                    (SELECT GROUP_CONCAT(DISTINCT parent.full_name SEPARATOR ', ')\n                     FROM relationships r \n                     JOIN persons parent ON r.parent_id = parent.person_id \n                     WHERE r.child_id = p.person_id AND r.relation_type = 'father') AS father_name,\n                    -- Mẹ từ relationships (GROUP_CONCAT để đồng nhất với /api/members)\n                    (SELECT GROUP_CONCAT(DISTINCT parent.full_name SEPARATOR ', ')\n                     FROM relationships r \n                     JOIN persons parent ON r.parent_id = parent.person_id \n                     WHERE r.child_id = p.person_id AND r.relation_type = 'mother') AS mother_name\n                FROM persons p\n            WHERE {where_clause}\n                ORDER BY p.generation_level, p.full_name\n                LIMIT %s\n        "
         where_params.append(limit)
         cursor.execute(query_sql, tuple(where_params))
         results = cursor.fetchall()
-        logger.debug('Loading all relationship data using shared helper for /api/search...')
-        relationship_data = load_relationship_data(cursor)
+        if ranked_ids:
+            position = {person_id: i for i, person_id in enumerate(ranked_ids)}
+            results.sort(key=lambda row: position.get(row.get('person_id'), len(position)))
+        # Chỉ quan hệ của các kết quả (và hàng xóm một bước), không nạp cả đồ thị
+        relationship_data = get_relationship_data(cursor, person_ids=[row.get('person_id') for row in results])
         children_map = relationship_data['children_map']
         siblings_map = relationship_data['siblings_map']
         seen_ids = set()
@@ -922,12 +995,7 @@ def delete_person(person_id):
                 log_activity('DELETE_PERSON', target_type='Person', target_id=person_id, before_data=dict(before_data), after_data=None)
         except Exception as log_error:
             logger.warning(f'Failed to log person delete for {person_id}: {log_error}')
-        if cache:
-            try:
-                cache.delete('api_members_data')
-                logger.debug('Cache invalidated after delete_person')
-            except Exception as e:
-                logger.warning(f'Cache invalidation error (continuing): {e}')
+        invalidate_genealogy_snapshot()
         return jsonify({'success': True, 'message': f"Đã xóa người: {person['full_name']} (Đời {person['generation_level']})", 'person_id': person_id})
     except Error as e:
         connection.rollback()
@@ -1151,6 +1219,7 @@ def sync_person(person_id):
             )
 
         connection.commit()
+        invalidate_genealogy_snapshot()
         message = '\n'.join(sync_messages)
         return jsonify(
             {
@@ -1173,10 +1242,50 @@ def sync_person(person_id):
             connection.close()
 
 
-def _process_children_spouse_siblings(cursor, person_id, data):
+def _prepare_relation_text_columns(cursor, wanted=()):
+    """
+    Cột hiện có của spouse_sibling_children (set rỗng nếu chưa có bảng). Cột text cha/mẹ trong
+    `wanted` mà chưa có thì ALTER TABLE thêm — ALTER tự commit trong MySQL, nên caller cần ghi
+    nguyên tử (bulk Update SLL) phải gọi hàm này trước khi mở transaction.
+    """
+    cursor.execute(
+        """
+        SELECT TABLE_NAME
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'spouse_sibling_children'
+        """
+    )
+    if not cursor.fetchone():
+        return set()
+    cursor.execute(
+        """
+        SELECT COLUMN_NAME
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'spouse_sibling_children'
+        """
+    )
+    ssc_columns = {str((r or {}).get('COLUMN_NAME') or '').strip() for r in (cursor.fetchall() or [])}
+    # Tự mở rộng schema nhẹ để lưu text cha/mẹ khi chưa map được quan hệ theo person_id.
+    for column in ('father_name', 'mother_name'):
+        if column in wanted and column not in ssc_columns:
+            try:
+                cursor.execute(f"ALTER TABLE spouse_sibling_children ADD COLUMN {column} VARCHAR(255) NULL")
+                ssc_columns.add(column)
+                invalidate_schema_registry()
+            except Exception as e:
+                logger.debug(f'Could not add {column} column to spouse_sibling_children: {e}')
+    return ssc_columns
+
+
+def _process_children_spouse_siblings(cursor, person_id, data, relation_text_columns=None, raise_errors=False):
     """
     Helper function để xử lý children, spouse, siblings từ form data
     Parse tên từ textarea (phân cách bằng ;) và tạo relationships/marriages
+
+    relation_text_columns: kết quả _prepare_relation_text_columns() đã gọi trước (không dò / ALTER
+    schema giữa transaction). raise_errors=True: ném lỗi cho caller rollback thay vì chỉ ghi log.
     """
     try:
         # Chuẩn hóa các chuỗi nhập tay để lưu fallback text (khi không map được person_id).
@@ -1214,38 +1323,10 @@ def _process_children_spouse_siblings(cursor, person_id, data):
                         cursor.execute("\n                            INSERT INTO marriages (husband_id, wife_id, status)\n                            VALUES (%s, %s, 'active')\n                        ", (person_id, spouse_id))
         # Lưu text fallback cho các trường quan hệ để không mất dữ liệu nhập tay.
         try:
-            cursor.execute(
-                """
-                SELECT TABLE_NAME
-                FROM information_schema.TABLES
-                WHERE TABLE_SCHEMA = DATABASE()
-                  AND TABLE_NAME = 'spouse_sibling_children'
-                """
-            )
-            table_exists = bool(cursor.fetchone())
-            if table_exists:
-                cursor.execute(
-                    """
-                    SELECT COLUMN_NAME
-                    FROM information_schema.COLUMNS
-                    WHERE TABLE_SCHEMA = DATABASE()
-                      AND TABLE_NAME = 'spouse_sibling_children'
-                    """
-                )
-                ssc_columns = {str((r or {}).get('COLUMN_NAME') or '').strip() for r in (cursor.fetchall() or [])}
-                # Tự mở rộng schema nhẹ để lưu text cha/mẹ khi chưa map được quan hệ theo person_id.
-                if 'father_name' in data and 'father_name' not in ssc_columns:
-                    try:
-                        cursor.execute("ALTER TABLE spouse_sibling_children ADD COLUMN father_name VARCHAR(255) NULL")
-                        ssc_columns.add('father_name')
-                    except Exception as e:
-                        logger.debug(f'Could not add father_name column to spouse_sibling_children: {e}')
-                if 'mother_name' in data and 'mother_name' not in ssc_columns:
-                    try:
-                        cursor.execute("ALTER TABLE spouse_sibling_children ADD COLUMN mother_name VARCHAR(255) NULL")
-                        ssc_columns.add('mother_name')
-                    except Exception as e:
-                        logger.debug(f'Could not add mother_name column to spouse_sibling_children: {e}')
+            ssc_columns = relation_text_columns
+            if ssc_columns is None:
+                ssc_columns = _prepare_relation_text_columns(cursor, [k for k in ('father_name', 'mother_name') if k in data])
+            if ssc_columns:
                 row_payload = {}
                 if 'spouse_name' in ssc_columns and spouse_names is not None:
                     row_payload['spouse_name'] = '; '.join(spouse_names) if spouse_names else None
@@ -1273,9 +1354,13 @@ def _process_children_spouse_siblings(cursor, person_id, data):
                         vals,
                     )
         except Exception as relation_text_error:
+            if raise_errors:
+                raise
             err_code = relation_text_error.errno if hasattr(relation_text_error, 'errno') else None
             logger.warning(f'Error saving relation text fallback for {person_id}: [{err_code}] {relation_text_error}')
     except Exception as e:
+        if raise_errors:
+            raise
         error_code = e.errno if hasattr(e, 'errno') else None
         error_msg = str(e)
         logger.warning(f'Error processing children/spouse/siblings for {person_id}: [{error_code}] {error_msg}')
@@ -1435,6 +1520,8 @@ def create_person():
             file_path = os.path.join(personal_dir, safe_filename)
             personal_image_file.save(file_path)
             image_url = f'/static/images/personal/{safe_filename}'
+            record_image_etag(image_url, source_path=file_path)
+            enqueue_image_jobs(image_url, source_path=file_path)
             if 'personal_image_url' in columns:
                 insert_fields.append('personal_image_url')
                 insert_values.append(image_url)
@@ -1470,12 +1557,7 @@ def create_person():
                 log_person_create(person_id, dict(person_data))
         except Exception as log_error:
             logger.warning(f'Failed to log person create for {person_id}: {log_error}')
-        if cache:
-            try:
-                cache.delete('api_members_data')
-                logger.debug('Cache invalidated after create_person')
-            except Exception as e:
-                logger.warning(f'Cache invalidation error (continuing): {e}')
+        invalidate_genealogy_snapshot()
         return jsonify({'success': True, 'message': 'Thêm thành viên thành công', 'person_id': person_id})
     except Error as e:
         connection.rollback()
@@ -1519,156 +1601,29 @@ def apply_person_members_update_core(connection, cursor, person_id, data, person
             pass
     cursor.execute("\n            SELECT COLUMN_NAME \n            FROM information_schema.COLUMNS \n            WHERE TABLE_SCHEMA = DATABASE() \n            AND TABLE_NAME = 'persons'\n        ")
     columns = [row['COLUMN_NAME'] for row in cursor.fetchall()]
-    update_fields = []
-    update_values = []
-    if 'full_name' in columns and 'full_name' in data:
-        full_name = data.get('full_name')
-        if full_name:
-            full_name = sanitize_string(str(full_name), max_length=255, allow_empty=False)
-        update_fields.append('full_name = %s')
-        update_values.append(full_name)
-    if 'gender' in columns and 'gender' in data:
-        gender = data.get('gender')
-        if gender and gender not in ['M', 'F', 'Male', 'Female', 'Nam', 'Nữ']:
-            return (False, 'Invalid gender value', 400)
-        update_fields.append('gender = %s')
-        update_values.append(gender)
-    if 'status' in columns and 'status' in data:
-        update_fields.append('status = %s')
-        update_values.append(data.get('status'))
+    has_image_file = bool(personal_image_file and getattr(personal_image_file, 'filename', None))
+    try:
+        values = member_update_values(data, columns, has_image_file=has_image_file)
+    except ValueError as e:
+        return (False, str(e), 400)
+    update_fields = [f'{column} = %s' for column in values]
+    update_values = list(values.values())
     # Chỉ cập nhật csv_id khi schema hỗ trợ để tương thích DB cũ.
     if has_csv_id and 'csv_id' in columns and 'csv_id' in data:
         csv_id = str(data.get('csv_id') or '').strip()
         update_fields.append('csv_id = %s')
         update_values.append(csv_id if csv_id else None)
-    if 'generation_level' in columns and 'generation_number' in data:
-        gn = data['generation_number']
-        if gn is not None and (not isinstance(gn, str) or gn.strip() != ''):
-            update_fields.append('generation_level = %s')
-            update_values.append(gn)
-    # Nhánh: nếu persons có cột branch_name thì lưu thẳng, không phụ thuộc bảng branches
-    branch_code_to_name = {
-        '0': 'Tổ tiên',
-        '1': 'Một',
-        '2': 'Hai',
-        '3': 'Ba',
-        '4': 'Bốn',
-        '5': 'Năm',
-        '6': 'Sáu',
-        '7': 'Bảy',
-        '-1': 'Khác',
-    }
-
-    if 'branch_name' in columns and 'branch_name' in data:
-        update_fields.append('branch_name = %s')
-        v = data.get('branch_name')
-        v = str(v).strip() if v is not None else None
-        if v in branch_code_to_name:
-            v = branch_code_to_name[v]
-        update_values.append(v if v else None)
     # Nhánh: map branch_name -> branch_id (tự tạo branch nếu chưa có)
     if 'branch_id' in columns and 'branch_name' in data:
         try:
             cursor.execute("\n                    SELECT TABLE_NAME FROM information_schema.TABLES\n                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'branches'\n                    LIMIT 1\n                ")
             if cursor.fetchone():
-                bn = data.get('branch_name')
-                bn = str(bn).strip() if bn is not None else bn
-                if bn in branch_code_to_name:
-                    bn = branch_code_to_name[bn]
+                bn = sll_canonical_branch(data.get('branch_name'))
                 branch_id = get_or_create_branch(cursor, bn) if bn else None
                 update_fields.append('branch_id = %s')
                 update_values.append(branch_id)
         except Exception as e:
             logger.warning(f'Could not set branch_id on update_person_members: {e}')
-    if 'birth_date_solar' in columns and 'birth_date_solar' in data:
-        update_fields.append('birth_date_solar = %s')
-        birth_date = data.get('birth_date_solar', '').strip() if data.get('birth_date_solar') else ''
-        if birth_date and len(birth_date) == 4 and birth_date.isdigit():
-            birth_date = f'{birth_date}-01-01'
-        update_values.append(birth_date if birth_date else None)
-    if 'death_date_solar' in columns and 'death_date_solar' in data:
-        update_fields.append('death_date_solar = %s')
-        death_date = data.get('death_date_solar', '').strip() if data.get('death_date_solar') else ''
-        if death_date and len(death_date) == 4 and death_date.isdigit():
-            death_date = f'{death_date}-01-01'
-        update_values.append(death_date if death_date else None)
-    if 'place_of_death' in columns and 'place_of_death' in data:
-        update_fields.append('place_of_death = %s')
-        update_values.append(data.get('place_of_death'))
-    if 'biography' in columns and 'biography' in data:
-        update_fields.append('biography = %s')
-        biography = data.get('biography', '').strip() if data.get('biography') else None
-        update_values.append(biography if biography else None)
-    if 'academic_rank' in columns and 'academic_rank' in data:
-        update_fields.append('academic_rank = %s')
-        academic_rank = data.get('academic_rank', '').strip() if data.get('academic_rank') else None
-        update_values.append(academic_rank if academic_rank else None)
-    if 'academic_degree' in columns and 'academic_degree' in data:
-        update_fields.append('academic_degree = %s')
-        academic_degree = data.get('academic_degree', '').strip() if data.get('academic_degree') else None
-        update_values.append(academic_degree if academic_degree else None)
-    if 'phone' in columns and 'phone' in data:
-        update_fields.append('phone = %s')
-        phone = data.get('phone', '').strip() if data.get('phone') else None
-        update_values.append(phone if phone else None)
-    if 'email' in columns and 'email' in data:
-        update_fields.append('email = %s')
-        email = data.get('email', '').strip() if data.get('email') else None
-        if email and '@' not in email:
-            return (False, 'Email không hợp lệ', 400)
-        update_values.append(email if email else None)
-    if 'occupation' in columns and 'occupation' in data:
-        update_fields.append('occupation = %s')
-        occupation = data.get('occupation', '').strip() if data.get('occupation') else None
-        update_values.append(occupation if occupation else None)
-    if 'alias' in columns and 'alias' in data:
-        update_fields.append('alias = %s')
-        av = data.get('alias')
-        if av:
-            av = sanitize_string(str(av), max_length=255, allow_empty=True)
-        update_values.append(av if av else None)
-    if 'birth_date_lunar' in columns and 'birth_date_lunar' in data:
-        update_fields.append('birth_date_lunar = %s')
-        bd = data.get('birth_date_lunar')
-        if bd is not None and not isinstance(bd, str):
-            bd = str(bd).strip()
-        else:
-            bd = (bd or '').strip() if bd else ''
-        if bd and len(bd) == 4 and bd.isdigit():
-            bd = f'{bd}-01-01'
-        update_values.append(bd if bd else None)
-    if 'death_date_lunar' in columns and 'death_date_lunar' in data:
-        update_fields.append('death_date_lunar = %s')
-        dd = data.get('death_date_lunar')
-        if dd is not None and not isinstance(dd, str):
-            dd = str(dd).strip()
-        else:
-            dd = (dd or '').strip() if dd else ''
-        if dd and len(dd) == 4 and dd.isdigit():
-            dd = f'{dd}-01-01'
-        update_values.append(dd if dd else None)
-    if 'grave_info' in columns and ('grave_info' in data or 'grave' in data):
-        update_fields.append('grave_info = %s')
-        gv = data.get('grave_info') if 'grave_info' in data else data.get('grave')
-        if gv is not None:
-            gv = str(gv).strip() if str(gv).strip() else None
-        update_values.append(gv)
-    if (
-        'personal_image_url' in columns
-        and 'personal_image_url' in data
-        and data.get('personal_image_url')
-        and not (personal_image_file and getattr(personal_image_file, 'filename', None))
-    ):
-        update_fields.append('personal_image_url = %s')
-        update_values.append(str(data['personal_image_url']).strip())
-    elif (
-        'personal_image' in columns
-        and 'personal_image_url' in data
-        and data.get('personal_image_url')
-        and not (personal_image_file and getattr(personal_image_file, 'filename', None))
-    ):
-        update_fields.append('personal_image = %s')
-        update_values.append(str(data['personal_image_url']).strip())
     if personal_image_file and personal_image_file.filename:
         personal_image_file.seek(0, os.SEEK_END)
         file_size = personal_image_file.tell()
@@ -1694,6 +1649,8 @@ def apply_person_members_update_core(connection, cursor, person_id, data, person
         file_path = os.path.join(personal_dir, safe_filename)
         personal_image_file.save(file_path)
         image_url = f'/static/images/personal/{safe_filename}'
+        record_image_etag(image_url, source_path=file_path)
+        enqueue_image_jobs(image_url, source_path=file_path)
         if 'personal_image_url' in columns:
             update_fields.append('personal_image_url = %s')
             update_values.append(image_url)
@@ -1712,15 +1669,6 @@ def apply_person_members_update_core(connection, cursor, person_id, data, person
                 generation_id = cursor.lastrowid
             update_fields.append('generation_id = %s')
             update_values.append(generation_id)
-    if 'father_mother_id' in columns and 'fm_id' in data:
-        update_fields.append('father_mother_id = %s')
-        update_values.append(data.get('fm_id'))
-    elif 'fm_id' in columns and 'fm_id' in data:
-        update_fields.append('fm_id = %s')
-        update_values.append(data.get('fm_id'))
-    if 'family_unit_id' in columns and 'family_unit_id' in data:
-        update_fields.append('family_unit_id = %s')
-        update_values.append(data.get('family_unit_id') or None)
     if update_fields:
         update_values.append(person_id)
         update_query = f"UPDATE persons SET {', '.join(update_fields)} WHERE person_id = %s"
@@ -1738,12 +1686,7 @@ def apply_person_members_update_core(connection, cursor, person_id, data, person
             log_person_update(person_id, dict(before_data), dict(after_data))
     except Exception as log_error:
         logger.warning(f'Failed to log person update for {person_id}: {log_error}')
-    if cache:
-        try:
-            cache.delete('api_members_data')
-            logger.debug('Cache invalidated after update_person_members')
-        except Exception as e:
-            logger.warning(f'Cache invalidation error (continuing): {e}')
+    invalidate_genealogy_snapshot()
     return (True, None, None)
 
 
@@ -1843,6 +1786,7 @@ def fix_p1_1_parents():
                 cursor.execute("\n                    INSERT INTO relationships (child_id, parent_id, relation_type)\n                    VALUES ('P-1-1', %s, 'mother')\n                ", (mother_id,))
                 results['relationships_created'].append(f"Mother: {thuan_thien.get('full_name', mother_id)}")
         connection.commit()
+        invalidate_genealogy_snapshot()
         if not results['father_found']:
             results['error'] = 'Không tìm thấy Vua Gia Long trong database'
         if not results['mother_found']:
@@ -1910,6 +1854,7 @@ def update_genealogy_info():
                 cursor.execute("\n                    INSERT INTO relationships (child_id, parent_id, relation_type)\n                    VALUES (%s, %s, 'mother')\n                ", (vua_minh_mang['person_id'], thuan_thien['person_id']))
                 results['relationships_added'].append(f"Mother: {thuan_thien['full_name']}")
         connection.commit()
+        invalidate_genealogy_snapshot()
         return jsonify({'success': True, 'message': 'Đã bổ sung thông tin thành công', 'results': results})
     except Exception as e:
         connection.rollback()
@@ -1921,7 +1866,7 @@ def update_genealogy_info():
             connection.close()
 
 def delete_persons_batch():
-    """API xóa nhiều thành viên - Yêu cầu mật khẩu - Tự động backup trước khi xóa"""
+    """API xóa nhiều thành viên - Yêu cầu mật khẩu - Tự động snapshot các dòng bị xóa (hoàn tác: undo_delete_persons_batch)"""
     data = request.get_json() or {}
     password = data.get('password', '').strip()
     correct_password = get_members_password()
@@ -1964,20 +1909,17 @@ def delete_persons_batch():
         if not validated_ids:
             return (jsonify({'success': False, 'error': 'Không có person_id hợp lệ'}), 400)
         person_ids = validated_ids
-        backup_result = None
+        snapshot = None
+        snapshot_error = None
         if not skip_backup and len(person_ids) > 0:
+            # Chỉ chụp các dòng bị ảnh hưởng (persons + quan hệ) thay vì backup cả database
             try:
-                # Backup module lives in scripts/backup_database.py
-                from scripts.backup_database import create_backup
-                logger.info(f'Tạo backup tự động trước khi xóa {len(person_ids)} thành viên...')
-                backup_dir = os.environ.get('BACKUP_DIR', '').strip() or 'backups'
-                backup_result = create_backup(backup_dir=backup_dir)
-                if backup_result['success']:
-                    logger.info(f"✅ Backup thành công: {backup_result['backup_filename']}")
-                else:
-                    logger.warning(f"⚠️ Backup thất bại: {backup_result.get('error')}")
-            except Exception as backup_error:
-                logger.warning(f'⚠️ Không thể tạo backup: {backup_error}')
+                actor = current_user.username if getattr(current_user, 'is_authenticated', False) else None
+                snapshot = capture_person_snapshot(connection, person_ids, reason='delete_persons_batch', actor=actor)
+                logger.info(f"✅ Snapshot trước khi xóa: {snapshot['snapshot_id']} {snapshot['rows']}")
+            except Exception as snap_error:
+                snapshot_error = str(snap_error)
+                logger.warning(f'⚠️ Không thể tạo snapshot: {snap_error}')
         cursor = connection.cursor(dictionary=True)
         placeholders = ','.join(['%s'] * len(person_ids))
         cursor.execute(f'\n            SELECT person_id, full_name, gender, status, generation_level, birth_date_solar,\n                   death_date_solar, place_of_death, biography, academic_rank,\n                   academic_degree, phone, email, occupation\n            FROM persons \n            WHERE person_id IN ({placeholders})\n        ', tuple(person_ids))
@@ -1985,6 +1927,7 @@ def delete_persons_batch():
         cursor.execute(f'DELETE FROM persons WHERE person_id IN ({placeholders})', tuple(person_ids))
         deleted_count = cursor.rowcount
         connection.commit()
+        invalidate_genealogy_snapshot()
         try:
             for before_data in before_data_list:
                 person_id = before_data['person_id']
@@ -1992,11 +1935,13 @@ def delete_persons_batch():
         except Exception as log_error:
             logger.warning(f'Failed to log batch delete: {log_error}')
         response = {'success': True, 'message': f'Đã xóa {deleted_count} thành viên'}
-        if backup_result and backup_result['success']:
+        if snapshot:
             response['backup_created'] = True
-            response['backup_file'] = backup_result['backup_filename']
-        elif backup_result:
-            response['backup_warning'] = f"Backup thất bại: {backup_result.get('error')}"
+            response['backup_file'] = snapshot['filename']
+            response['snapshot_id'] = snapshot['snapshot_id']
+            response['undo_url'] = '/api/persons/batch/undo'
+        elif snapshot_error:
+            response['backup_warning'] = f'Snapshot thất bại: {snapshot_error}'
         return jsonify(response)
     except Error as e:
         connection.rollback()
@@ -2008,3 +1953,40 @@ def delete_persons_batch():
         if connection.is_connected():
             cursor.close()
             connection.close()
+
+def undo_delete_persons_batch():
+    """API hoàn tác một lần xóa hàng loạt từ snapshot_id - Yêu cầu mật khẩu"""
+    data = request.get_json() or {}
+    password = data.get('password', '').strip()
+    correct_password = get_members_password()
+    if not correct_password:
+        logger.error('MEMBERS_PASSWORD, ADMIN_PASSWORD hoặc BACKUP_PASSWORD chưa được cấu hình')
+        return (jsonify({'success': False, 'error': 'Cấu hình bảo mật chưa được thiết lập'}), 500)
+    if not password or not secure_compare(password, correct_password):
+        return (jsonify({'success': False, 'error': 'Mật khẩu không đúng hoặc chưa được cung cấp'}), 403)
+    snapshot_id = str(data.get('snapshot_id') or '').strip()
+    if not snapshot_id:
+        return (jsonify({'success': False, 'error': 'Thiếu snapshot_id'}), 400)
+    connection = get_db_connection()
+    if not connection:
+        return (jsonify({'success': False, 'error': 'Không thể kết nối database'}), 500)
+    try:
+        result = restore_snapshot(connection, snapshot_id)
+        invalidate_genealogy_snapshot()
+        try:
+            log_activity('RESTORE_PERSONS_SNAPSHOT', target_type='Person', target_id=snapshot_id, before_data=None, after_data=result)
+        except Exception as log_error:
+            logger.warning(f'Failed to log snapshot restore: {log_error}')
+        restored = result['rows'].get('persons', 0)
+        return jsonify({'success': True, 'message': f'Đã khôi phục {restored} thành viên', **result})
+    except SnapshotNotFound as e:
+        return (jsonify({'success': False, 'error': str(e)}), 404)
+    except SnapshotError as e:
+        return (jsonify({'success': False, 'error': str(e)}), 409)
+    except Error as e:
+        return (jsonify({'success': False, 'error': f'Lỗi database: {str(e)}'}), 500)
+    except Exception as e:
+        return (jsonify({'success': False, 'error': f'Lỗi: {str(e)}'}), 500)
+    finally:
+        if connection.is_connected():
+            connection.close()
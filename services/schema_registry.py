@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Registry schema dùng chung trong process: thay các probe information_schema / SHOW TABLES /
+SHOW COLUMNS chạy ở mỗi request (get_persons, fetch_members_list, load_relationship_data,
+search_grave, activity logs, audit_log...).
+
+- Nạp toàn bộ (bảng, cột) của DATABASE() bằng một query ở lần probe đầu tiên của worker.
+- has_table / has_column / table_columns trả lời từ bộ nhớ sau đó.
+- Schema chỉ đổi qua migration: script migration và /admin/api/schema gọi refresh_schema_registry();
+  migration chạy ở process khác thì worker nhận schema mới khi restart (deploy) hoặc khi admin mở
+  /admin/api/schema.
+- Nếu nạp lỗi (mất kết nối, thiếu quyền information_schema) thì không cache gì, probe trực tiếp
+  câu hỏi hiện tại như trước.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_LOAD_SQL = """
+    SELECT TABLE_NAME, COLUMN_NAME
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+_lock = threading.Lock()
+# {table_name (lower): frozenset(column_name lower)}; None = chưa nạp
+_tables = None
+
+
+def _row_values(row):
+    if isinstance(row, dict):
+        table = row.get('TABLE_NAME') or row.get('table_name')
+        column = row.get('COLUMN_NAME') or row.get('column_name')
+        return table, column
+    return row[0], row[1]
+
+
+def _load(cursor):
+    cursor.execute(_LOAD_SQL)
+    columns_by_table = {}
+    for row in cursor.fetchall() or []:
+        table, column = _row_values(row)
+        if not table:
+            continue
+        columns = columns_by_table.setdefault(str(table).strip().lower(), set())
+        if column:
+            columns.add(str(column).strip().lower())
+    return {table: frozenset(columns) for table, columns in columns_by_table.items()}
+
+
+def _with_own_cursor(fn):
+    from db import get_db_connection
+    connection = get_db_connection()
+    if not connection:
+        return None
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        return fn(cursor)
+    finally:
+        if connection.is_connected():
+            if cursor:
+                cursor.close()
+            connection.close()
+
+
+def _ensure_loaded(cursor=None):
+    """Trả registry đã nạp, hoặc None nếu không nạp được (caller probe trực tiếp)."""
+    global _tables
+    tables = _tables
+    if tables is not None:
+        return tables
+    with _lock:
+        if _tables is not None:
+            return _tables
+        try:
+            tables = _load(cursor) if cursor is not None else _with_own_cursor(_load)
+        except Exception as e:
+            logger.warning(f'Schema registry load failed, probing directly: {e}')
+            return None
+        if tables is None:
+            return None
+        _tables = tables
+        logger.info(f'Schema registry loaded: {len(tables)} tables')
+        return tables
+
+
+def _probe_table(cursor, table):
+    cursor.execute('SHOW TABLES LIKE %s', (table,))
+    return cursor.fetchone() is not None
+
+
+def _probe_column(cursor, table, column):
+    # Tên bảng không bind được trong SHOW COLUMNS; information_schema nhận tham số
+    cursor.execute(
+        """
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        LIMIT 1
+        """,
+        (table, column),
+    )
+    return cursor.fetchone() is not None
+
+
+def has_table(table, cursor=None):
+    """Bảng `table` có tồn tại trong DATABASE() hiện tại không."""
+    tables = _ensure_loaded(cursor)
+    if tables is not None:
+        return str(table).lower() in tables
+    if cursor is None:
+        return bool(_with_own_cursor(lambda c: _probe_table(c, table)))
+    return _probe_table(cursor, table)
+
+
+def has_column(table, column, cursor=None):
+    """Bảng `table` có cột `column` không (False nếu bảng không tồn tại)."""
+    tables = _ensure_loaded(cursor)
+    if tables is not None:
+        return str(column).lower() in tables.get(str(table).lower(), ())
+    if cursor is None:
+        return bool(_with_own_cursor(lambda c: _probe_column(c, table, column)))
+    return _probe_column(cursor, table, column)
+
+
+def table_columns(table, names, cursor=None):
+    """Tập con của `names` là cột có thật trong `table` (giữ nguyên chữ hoa/thường như caller truyền)."""
+    tables = _ensure_loaded(cursor)
+    if tables is not None:
+        existing = tables.get(str(table).lower(), ())
+        return {name for name in names if name.lower() in existing}
+    return {name for name in names if has_column(table, name, cursor=cursor)}
+
+
+def refresh_schema_registry(cursor=None):
+    """Nạp lại registry ngay (sau migration / từ /admin/api/schema). Trả True nếu nạp được."""
+    global _tables
+    with _lock:
+        _tables = None
+    return _ensure_loaded(cursor) is not None
+
+
+def invalidate_schema_registry():
+    """Bỏ registry; lần probe sau sẽ nạp lại."""
+    global _tables
+    with _lock:
+        _tables = None
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Chỉ mục tìm kiếm người trong bộ nhớ cho /api/search và /api/grave-search.
+
+Trước đây mỗi lần gõ autocomplete là một query `LIKE '%q%'` trên full_name / alias / person_id
+(wildcard đầu nên không dùng được index → quét cả bảng persons), và gõ không dấu không ra kết quả.
+
+- Token hoá full_name, alias theo collation_key (bỏ dấu, đ→d, không phân biệt hoa thường):
+  "Nguyễn Phước Văn" ~ "nguyen phuoc van". Mỗi token của query khớp tiền tố một token của tên
+  (AND), nên "ng ph" hay "van" đều ra.
+- person_id có khoá riêng: "p-7-654", "7-654", "654", "7"; biến thể query lấy từ
+  normalize_search_query (P-7-654 / 7-654 / 654).
+- Tra bằng bisect trên danh sách khoá đã sắp xếp → vài chục micro giây với vài nghìn người.
+- Xếp hạng: ID khớp đúng > tên trùng khớp > tên bắt đầu bằng query > khớp token tên > khớp bí danh
+  > khớp tiền tố ID; cùng hạng thì ưu tiên đúng dấu như người gõ, rồi đời, rồi tên.
+
+Chỉ mục gắn với snapshot gia phả (services.genealogy_graph): snapshot build lại sau mỗi lần ghi
+persons thì chỉ mục build lại ở lần tìm kiếm đầu tiên, tái dùng token đã tách của những người
+không đổi (chỉ tách lại người mới / đã sửa). Caller chỉ lấy danh sách person_id đã xếp hạng rồi
+đọc chi tiết bằng khoá chính; snapshot không dùng được thì caller quay về query LIKE cũ.
+"""
+import logging
+import re
+import threading
+from bisect import bisect_left
+
+from services.lineage_engine import collation_key
+from services.person_helpers import normalize_search_query
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Hạng khớp (nhỏ = tốt hơn)
+RANK_ID_EXACT = 0
+RANK_NAME_EXACT = 1
+RANK_NAME_PREFIX = 2
+RANK_NAME_TOKENS = 3
+RANK_ALIAS = 4
+RANK_ID_PREFIX = 5
+
+_build_lock = threading.Lock()
+# Chỉ mục build gần nhất — nguồn tái dùng token khi snapshot mới được build
+_last_index = None
+
+
+def _tokens(folded):
+    return tuple(_TOKEN_RE.findall(folded))
+
+
+def _id_keys(person_id):
+    """'P-7-654' → ('p-7-654', '7-654', '654', '7')."""
+    folded = collation_key(person_id)
+    keys = [folded]
+    parts = folded.split('-')
+    if len(parts) >= 3 and parts[0] == 'p':
+        keys.append('-'.join(parts[1:]))
+        keys.append(parts[-1])
+        keys.append(parts[1])
+    return tuple(k for k in dict.fromkeys(keys) if k)
+
+
+class _Doc:
+    __slots__ = ('source', 'name_key', 'name_tokens', 'alias_tokens', 'id_keys', 'name_lower')
+
+    def __init__(self, person_id, full_name, alias):
+        self.source = (person_id, full_name, alias)
+        self.name_key = collation_key(full_name)
+        self.name_tokens = _tokens(self.name_key)
+        self.alias_tokens = _tokens(collation_key(alias))
+        self.id_keys = _id_keys(person_id)
+        self.name_lower = (full_name or '').casefold()
+
+
+def _prefix_range(sorted_keys, prefix):
+    start = bisect_left(sorted_keys, prefix)
+    end = start
+    n = len(sorted_keys)
+    while end < n and sorted_keys[end].startswith(prefix):
+        end += 1
+    return sorted_keys[start:end]
+
+
+def _tokens_match(query_tokens, doc_tokens):
+    return all(any(t.startswith(q) for t in doc_tokens) for q in query_tokens)
+
+
+class SearchIndex:
+    """Chỉ đọc sau khi build; dùng chung giữa các thread."""
+
+    def __init__(self, persons_by_id, previous=None):
+        self.persons_by_id = persons_by_id
+        old_docs = previous.docs if previous is not None else {}
+        docs = {}
+        reused = 0
+        token_postings = {}
+        id_postings = {}
+        for person_id, person in persons_by_id.items():
+            source = (person_id, person.get('full_name'), person.get('alias'))
+            doc = old_docs.get(person_id)
+            if doc is not None and doc.source == source:
+                reused += 1
+            else:
+                doc = _Doc(*source)
+            docs[person_id] = doc
+            for token in doc.name_tokens + doc.alias_tokens:
+                token_postings.setdefault(token, set()).add(person_id)
+            for key in doc.id_keys:
+                id_postings.setdefault(key, set()).add(person_id)
+        self.docs = docs
+        self.token_postings = token_postings
+        self.token_keys = sorted(token_postings)
+        self.id_postings = id_postings
+        self.id_keys = sorted(id_postings)
+        self.reused = reused
+
+    def _token_candidates(self, query_tokens):
+        result = None
+        for q in query_tokens:
+            matched = set()
+            for token in _prefix_range(self.token_keys, q):
+                matched |= self.token_postings[token]
+            result = matched if result is None else result & matched
+            if not result:
+                return set()
+        return result or set()
+
+    def _id_candidates(self, variants):
+        matched = set()
+        for variant in variants:
+            for key in _prefix_range(self.id_keys, variant):
+                matched |= self.id_postings[key]
+        return matched
+
+    def _rank(self, doc, query_key, query_tokens, id_variants):
+        # Khớp đúng cả ID ('p-7-654') hoặc 'đời-số' ('7-654'); chỉ khớp số thứ tự / đời là tiền tố
+        if any(key in id_variants for key in doc.id_keys[:2]):
+            return RANK_ID_EXACT
+        if query_tokens:
+            if doc.name_key == query_key:
+                return RANK_NAME_EXACT
+            if doc.name_key.startswith(query_key):
+                return RANK_NAME_PREFIX
+            if _tokens_match(query_tokens, doc.name_tokens):
+                return RANK_NAME_TOKENS
+            if _tokens_match(query_tokens, doc.name_tokens + doc.alias_tokens):
+                return RANK_ALIAS
+        return RANK_ID_PREFIX
+
+    def search(self, query, generation_level=None, predicate=None, limit=50, prefer=None):
+        """
+        Danh sách person_id đã xếp hạng.
+
+        generation_level: lọc đúng đời (None / 0 = không lọc, như query cũ).
+        predicate: hàm nhận dict person trong snapshot, trả False để loại.
+        limit: None = không giới hạn.
+        prefer: hàm nhận dict person, trả khoá sắp xếp đặt trước hạng khớp (nhỏ lên trước).
+        """
+        normalized, id_patterns = normalize_search_query(query)
+        query_key = collation_key(normalized)
+        query_tokens = _tokens(query_key)
+        id_variants = {query_key}
+        for pattern in id_patterns:
+            variant = collation_key(pattern.strip('%')).lstrip('-')
+            if variant:
+                id_variants.add(variant)
+        id_variants.discard('')
+
+        candidates = self._token_candidates(query_tokens) if query_tokens else set()
+        candidates |= self._id_candidates(id_variants)
+        if not candidates:
+            return []
+
+        query_lower = normalized.casefold()
+        ranked = []
+        for person_id in candidates:
+            person = self.persons_by_id.get(person_id) or {}
+            if generation_level and person.get('generation_level') != generation_level:
+                continue
+            if predicate is not None and not predicate(person):
+                continue
+            doc = self.docs[person_id]
+            rank = self._rank(doc, query_key, query_tokens, id_variants)
+            generation = person.get('generation_level')
+            ranked.append((
+                prefer(person) if prefer is not None else 0,
+                rank,
+                0 if query_lower and query_lower in doc.name_lower else 1,
+                generation if generation is not None else 999,
+                doc.name_key,
+                person_id,
+            ))
+        ranked.sort()
+        ids = [item[-1] for item in ranked]
+        return ids if limit is None else ids[:limit]
+
+
+def get_search_index(snapshot):
+    """Chỉ mục của snapshot; build lười lần đầu, tái dùng token của chỉ mục trước."""
+    global _last_index
+    index = snapshot.search_index
+    if index is not None:
+        return index
+    with _build_lock:
+        if snapshot.search_index is not None:
+            return snapshot.search_index
+        index = SearchIndex(snapshot.persons_by_id, previous=_last_index)
+        snapshot.search_index = index
+        _last_index = index
+        logger.debug(
+            'Search index v%s built: %s persons (%s reused), %s tokens',
+            snapshot.version, len(index.docs), index.reused, len(index.token_keys),
+        )
+        return index
+
+
+def find_person_ids(cursor, query, generation_level=None, predicate=None, limit=50, prefer=None):
+    """
+    person_id xếp hạng cho query qua snapshot gia phả; None nếu không dùng được chỉ mục
+    (snapshot tắt / lỗi) — caller chạy query SQL cũ.
+    """
+    from services.genealogy_graph import get_genealogy_snapshot, snapshot_enabled
+
+    if not snapshot_enabled():
+        return None
+    try:
+        snapshot = get_genealogy_snapshot(cursor)
+    except Exception as e:
+        logger.warning('Search index unavailable, falling back to SQL: %s', e)
+        return None
+    if snapshot is None:
+        return None
+    return get_search_index(snapshot).search(query, generation_level, predicate, limit, prefer)
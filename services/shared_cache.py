@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Khoá cache gắn version, dùng chung giữa các worker Gunicorn.
+
+Backend Flask-Caching chọn ở extensions._cache_config(): Redis (REDIS_URL) hoặc FileSystemCache
+trong /dev/shm — cả hai đều chung cho mọi worker trên máy. Xoá từng khoá ('api_members_data')
+không đủ khi payload có nhiều biến thể / worker còn giữ bản trong bộ nhớ, nên:
+
+- Mỗi namespace có một token version lưu ngay trong backend ('data_version:<namespace>').
+- Khoá dữ liệu = '<base>:v<token>' (versioned_key). bump_data_version() ở bất kỳ worker nào đổi
+  token → mọi worker đọc token mới, khoá cũ bị bỏ qua và tự hết hạn theo timeout.
+- Token ngẫu nhiên (không phải bộ đếm): backend bị xoá / evict thì sinh token mới, không bao giờ
+  quay lại token cũ còn dữ liệu cũ.
+- Snapshot gia phả trong bộ nhớ mỗi worker (services.genealogy_graph) so token này để build lại
+  khi worker khác ghi.
+
+Backend lỗi hoặc chưa init (ngoài app context, script) → get_data_version() trả None; caller
+chạy như không có cache chung.
+"""
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+GENEALOGY_NAMESPACE = 'genealogy'
+
+
+def _cache():
+    try:
+        from extensions import cache
+    except Exception:
+        return None
+    return cache
+
+
+def _version_key(namespace):
+    return f'data_version:{namespace}'
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def get_data_version(namespace=GENEALOGY_NAMESPACE):
+    """Token version hiện tại của namespace (tạo nếu chưa có); None nếu backend không dùng được."""
+    cache = _cache()
+    if cache is None:
+        return None
+    key = _version_key(namespace)
+    try:
+        token = cache.get(key)
+        if token is None:
+            # add = chỉ ghi nếu chưa có: worker khác vừa tạo thì dùng token của worker đó
+            cache.add(key, _new_token(), timeout=0)
+            token = cache.get(key)
+        return token
+    except Exception as e:
+        logger.debug('shared cache version %s unavailable: %s', namespace, e)
+        return None
+
+
+def bump_data_version(namespace=GENEALOGY_NAMESPACE):
+    """Đổi token version → mọi khoá versioned_key(namespace) ở mọi worker hết hiệu lực."""
+    cache = _cache()
+    if cache is None:
+        return None
+    token = _new_token()
+    try:
+        cache.set(_version_key(namespace), token, timeout=0)
+        return token
+    except Exception as e:
+        logger.warning('shared cache version bump failed (%s): %s', namespace, e)
+        return None
+
+
+def versioned_key(base, namespace=GENEALOGY_NAMESPACE):
+    """'<base>:v<token>'; backend không dùng được thì trả base (get/set của caller cũng sẽ lỗi như trước)."""
+    token = get_data_version(namespace)
+    if token is None:
+        return base
+    return f'{base}:v{token}'
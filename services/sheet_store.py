@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Kho đọc / ghi chung cho các sheet CSV (Data_TBQC_Sheet1/2/3.csv).
+
+Trước đây get_sheet3_data_by_name() mở và quét cả Sheet3 mỗi lần gọi, còn /admin/api/csv-data
+parse lại cả file cho mỗi GET/POST/PUT/DELETE và mỗi lần ghi đều viết lại toàn bộ file.
+
+- Mỗi file parse một lần, giữ trong bộ nhớ worker; chỉ đọc lại khi (mtime_ns, size) của file đổi
+  (sửa tay, worker khác ghi).
+- Chỉ mục theo giá trị đã strip + lower của các cột INDEX_FIELDS (tên, ID, tên bố / mẹ):
+  lookup() là một lần tra dict thay vì quét file.
+- rows() trả bản sao từng dòng: caller sửa thoải mái không làm bẩn cache.
+- write_rows(): nếu danh sách mới chỉ là các dòng hiện có + dòng mới ở cuối thì append đúng các
+  dòng đó (một lần write, O_APPEND); còn lại ghi file tạm rồi os.replace — không bao giờ để file
+  ghi dở.
+"""
+import csv
+import io
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+INDEX_FIELDS = ('Họ và tên', 'ID', 'Tên bố', 'Tên mẹ')
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _key(value):
+    return (value or '').strip().lower()
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class SheetStore:
+    """Một file CSV đã parse + chỉ mục; an toàn giữa các thread trong cùng worker."""
+
+    def __init__(self, path, index_fields=INDEX_FIELDS):
+        self.path = str(path)
+        self.index_fields = tuple(index_fields)
+        self._lock = threading.RLock()
+        self._signature = None
+        self._headers = []
+        self._rows = []
+        self._index = {}
+
+    # ------------------------------------------------------------------ đọc
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+            headers = list(reader.fieldnames or [])
+        self._headers = headers
+        self._rows = rows
+        self._reindex()
+        logger.debug('sheet_store: nạp %s (%d dòng)', self.path, len(rows))
+
+    def _reindex(self):
+        index = {field: {} for field in self.index_fields}
+        for row in self._rows:
+            self._index_row(index, row)
+        self._index = index
+
+    def _index_row(self, index, row):
+        for field in self.index_fields:
+            value = _key(row.get(field))
+            if value:
+                index[field].setdefault(value, []).append(row)
+
+    def _fresh(self):
+        """Nạp lại nếu file đổi; False nếu file không tồn tại."""
+        sig = _signature(self.path)
+        if sig is None:
+            self._signature = None
+            self._headers, self._rows, self._index = [], [], {}
+            return False
+        if sig != self._signature:
+            self._load()
+            self._signature = sig
+        return True
+
+    def exists(self):
+        with self._lock:
+            return self._fresh()
+
+    @property
+    def headers(self):
+        with self._lock:
+            self._fresh()
+            return list(self._headers)
+
+    def rows(self):
+        with self._lock:
+            self._fresh()
+            return [dict(row) for row in self._rows]
+
+    def lookup(self, field, value):
+        """Các dòng có `field` (strip, không phân biệt hoa thường) bằng `value`."""
+        with self._lock:
+            self._fresh()
+            return [dict(row) for row in self._index.get(field, {}).get(_key(value), ())]
+
+    # ------------------------------------------------------------------ ghi
+
+    def write_rows(self, rows):
+        """Thay nội dung sheet bằng `rows`: append nếu chỉ thêm dòng ở cuối, ngược lại ghi lại cả file."""
+        rows = [dict(row) for row in rows]
+        with self._lock:
+            self._fresh()
+            n = len(self._rows)
+            if self._signature is not None and self._headers and len(rows) > n and rows[:n] == self._rows:
+                self._append(rows[n:])
+            else:
+                self._rewrite(rows)
+            self._signature = _signature(self.path)
+
+    def _encode(self, headers, rows, header=False):
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=headers)
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+        return buf.getvalue().encode('utf-8')
+
+    def _append(self, new_rows):
+        data = self._encode(self._headers, new_rows)
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        try:
+            # File sửa tay có thể thiếu xuống dòng cuối → thêm trước để dòng mới không dính vào
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                data = b'\r\n' + data
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._rows.extend(new_rows)
+        for row in new_rows:
+            self._index_row(self._index, row)
+
+    def _rewrite(self, rows):
+        headers = list(rows[0].keys()) if rows else list(self._headers)
+        data = self._encode(headers, rows, header=True)
+        tmp = f'{self.path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._headers = headers
+        self._rows = rows
+        self._reindex()
+
+
+def get_sheet_store(path):
+    """SheetStore dùng chung cho `path` (một instance mỗi file mỗi worker)."""
+    path = os.path.abspath(str(path))
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = SheetStore(path)
+        return store
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+Engine dump SQL dùng chung cho backup Python (scripts/backup_database.py) và log reset
+(services/log_reset.py).
+
+Trước đây mỗi nơi tự `SELECT *` + `fetchall()` (cả bảng page_views / activity_logs nằm trong RAM)
+rồi ghi một INSERT mỗi dòng ra file .sql không nén.
+
+- Đọc bằng cursor không buffer (server-side) + fetchmany(fetch_rows): bộ nhớ phẳng theo số dòng.
+- Ghi INSERT nhiều dòng (extended INSERT), tách câu khi vượt max_insert_bytes để không chạm
+  max_allowed_packet lúc restore.
+- Luồng ghi nén được: none / gzip / zstd (zstd cần package `zstandard`, tuỳ chọn).
+- workers > 1: mỗi bảng dump trên một connection riêng ra file phần (cùng kiểu nén) rồi nối lại
+  theo thứ tự — gzip member / zstd frame nối nhau vẫn là một file hợp lệ. Khi đó mỗi bảng nhất quán
+  riêng; workers = 1 thì cả file nằm trong một transaction CONSISTENT SNAPSHOT.
+- Mỗi bảng kết thúc bằng dòng `-- Rows: N, sha256: ...`; file cạnh bên `<dump>.manifest.json` ghi
+  số dòng + sha256 từng bảng. sha256 tính trên các tuple VALUES theo thứ tự khoá chính, nên dump lại
+  DB đã restore bằng engine này phải ra đúng checksum.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+# Đuôi file dump hợp lệ (list / download / cleanup backup)
+SQL_DUMP_EXTENSIONS = (".sql", ".sql.gz", ".sql.zst")
+MANIFEST_SUFFIX = ".manifest.json"
+
+DEFAULT_FETCH_ROWS = 1000
+DEFAULT_MAX_INSERT_BYTES = 1024 * 1024
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def escape_value(val: Any) -> str:
+    """
+    Escape 1 giá trị Python thành literal an toàn để chèn vào INSERT ... VALUES (...).
+    KHÔNG dùng cho input người dùng — chỉ dùng cho dump dữ liệu đã nằm sẵn trong DB.
+    """
+    if val is None:
+        return "NULL"
+    if isinstance(val, bool):
+        return "1" if val else "0"
+    if isinstance(val, (int, float)):
+        return str(val)
+    if isinstance(val, (bytes, bytearray)):
+        # Hex literal — MySQL hiểu 0x...
+        return "0x" + bytes(val).hex() if bytes(val) else "''"
+    if isinstance(val, datetime):
+        return "'" + val.strftime("%Y-%m-%d %H:%M:%S") + "'"
+    if isinstance(val, (dict, list)):
+        s = json.dumps(val, ensure_ascii=False)
+    else:
+        s = str(val)
+    # Escape ký tự đặc biệt cho MySQL string literal
+    s = (
+        s.replace("\\", "\\\\")
+         .replace("'", "\\'")
+         .replace("\r", "\\r")
+         .replace("\n", "\\n")
+         .replace("\x00", "\\0")
+         .replace("\x1a", "\\Z")
+    )
+    return "'" + s + "'"
+
+
+# ---------------------------------------------------------------------------
+# Nén
+# ---------------------------------------------------------------------------
+
+def get_compression(value: Optional[str] = None) -> str:
+    """BACKUP_COMPRESSION (none / gzip / zstd), mặc định gzip. ValueError nếu không hỗ trợ."""
+    raw = value if value is not None else os.environ.get("BACKUP_COMPRESSION", "gzip")
+    compression = (raw or "none").strip().lower()
+    if compression in ("", "0", "off", "false"):
+        compression = "none"
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"BACKUP_COMPRESSION không hợp lệ: {raw}")
+    if compression == "zstd":
+        _zstandard()
+    return compression
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ValueError("BACKUP_COMPRESSION=zstd cần cài package zstandard") from e
+    return zstandard
+
+
+def open_dump_writer(path, compression: str = "none"):
+    """Text stream UTF-8 (newline '\\n') ghi ra path theo kiểu nén; caller đóng."""
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="\n", compresslevel=6)
+    if compression == "zstd":
+        raw = open(path, "wb")
+        try:
+            writer = _zstandard().ZstdCompressor(level=3).stream_writer(raw)
+        except Exception:
+            raw.close()
+            raise
+        return io.TextIOWrapper(writer, encoding="utf-8", newline="\n")
+    return open(path, "w", encoding="utf-8", newline="\n")
+
+
+def open_dump_reader(path):
+    """Text stream đọc file dump; nhận dạng nén theo magic bytes (không theo đuôi file)."""
+    with open(path, "rb") as fh:
+        magic = fh.read(4)
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if magic.startswith(_ZSTD_MAGIC):
+        raw = open(path, "rb")
+        try:
+            reader = _zstandard().ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        except Exception:
+            raw.close()
+            raise
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def manifest_path(dump_path) -> str:
+    return str(dump_path) + MANIFEST_SUFFIX
+
+
+def write_manifest(dump_path, manifest: Dict[str, Any]) -> None:
+    with open(manifest_path(dump_path), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2, default=str)
+
+
+def read_manifest(dump_path) -> Optional[Dict[str, Any]]:
+    """Manifest cạnh file dump; None nếu không có (dump cũ / mysqldump)."""
+    try:
+        with open(manifest_path(dump_path), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Dump từng bảng
+# ---------------------------------------------------------------------------
+
+def show_create(connection, kind: str, name: str) -> Optional[str]:
+    cur = connection.cursor(buffered=True)
+    try:
+        cur.execute(f"SHOW CREATE {kind} `{name}`")
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if not row:
+        return None
+    if isinstance(row, dict):
+        for key in row:
+            if key.lower().startswith("create"):
+                return str(row[key])
+        return None
+    return str(row[1]) if len(row) >= 2 else None
+
+
+def primary_key(connection, table: str) -> List[str]:
+    """Cột khoá chính theo thứ tự index — ORDER BY theo đó để checksum ổn định (và đọc theo clustered index)."""
+    cur = connection.cursor(buffered=True)
+    try:
+        cur.execute(f"SHOW KEYS FROM `{table}` WHERE Key_name = 'PRIMARY'")
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    keyed = []
+    for row in rows:
+        if isinstance(row, dict):
+            keyed.append((int(row.get("Seq_in_index") or 0), row.get("Column_name")))
+        elif len(row) > 4:
+            keyed.append((int(row[3] or 0), row[4]))
+    return [name for _, name in sorted(keyed) if name]
+
+
+def dump_table(
+    connection,
+    table: str,
+    out,
+    *,
+    create: bool = True,
+    where: Optional[str] = None,
+    params: Optional[Iterable[Any]] = None,
+    insert_verb: str = "INSERT INTO",
+    columns: Optional[List[str]] = None,
+    into: Optional[str] = None,
+    fetch_rows: int = DEFAULT_FETCH_ROWS,
+    max_insert_bytes: int = DEFAULT_MAX_INSERT_BYTES,
+) -> Dict[str, Any]:
+    """
+    Ghi (DROP + CREATE TABLE nếu create) và dữ liệu `table` ra text stream out.
+
+    where / params: lọc dòng (vd. dump tăng dần theo mốc); insert_verb: 'INSERT INTO' /
+    'INSERT IGNORE INTO' / 'REPLACE INTO'.
+    columns / into: chỉ đọc các cột này và INSERT vào bảng khác (vd. bảng tạm chứa khoá).
+    Trả về {'table', 'rows', 'sha256', 'bytes'} — bytes là độ dài (UTF-8) phần INSERT đã ghi.
+    """
+    target = into or table
+    out.write("\n-- ---------------------------------------------------\n")
+    out.write(f"-- Table: `{target}`\n")
+    out.write("-- ---------------------------------------------------\n")
+    if create:
+        create_sql = show_create(connection, "TABLE", table)
+        if create_sql:
+            out.write(f"DROP TABLE IF EXISTS `{table}`;\n")
+            out.write(create_sql.rstrip().rstrip(";") + ";\n\n")
+
+    select_list = ", ".join(f"`{c}`" for c in columns) if columns else "*"
+    sql = f"SELECT {select_list} FROM `{table}`"
+    if where:
+        sql += f" WHERE {where}"
+    order_by = primary_key(connection, table)
+    if order_by:
+        sql += " ORDER BY " + ", ".join(f"`{c}`" for c in order_by)
+
+    digest = hashlib.sha256()
+    rows = 0
+    written = 0
+    statement_bytes = 0
+    # Cursor không buffer: server đẩy dòng theo fetchmany, client không giữ cả result set
+    cur = connection.cursor(buffered=False)
+    try:
+        cur.execute(sql, tuple(params) if params else ())
+        names = [desc[0] for desc in cur.description]
+        head = f"{insert_verb} `{target}` (" + ", ".join(f"`{c}`" for c in names) + ") VALUES\n"
+        while True:
+            batch = cur.fetchmany(fetch_rows)
+            if not batch:
+                break
+            for row in batch:
+                values = row.values() if isinstance(row, dict) else row
+                tuple_sql = "(" + ", ".join(escape_value(v) for v in values) + ")"
+                encoded = tuple_sql.encode("utf-8")
+                digest.update(encoded)
+                digest.update(b"\n")
+                if statement_bytes and statement_bytes + len(encoded) > max_insert_bytes:
+                    out.write(";\n")
+                    written += 2
+                    statement_bytes = 0
+                if statement_bytes:
+                    chunk = ",\n" + tuple_sql
+                else:
+                    chunk = head + tuple_sql
+                    statement_bytes = len(head.encode("utf-8"))
+                out.write(chunk)
+                statement_bytes += len(encoded) + 2
+                written += len(chunk.encode("utf-8"))
+                rows += 1
+    finally:
+        cur.close()
+
+    if statement_bytes:
+        out.write(";\n")
+        written += 2
+    checksum = digest.hexdigest()
+    out.write(f"-- Rows: {rows}, sha256: {checksum}\n" if rows else "-- (no rows)\n")
+    return {"table": table, "rows": rows, "sha256": checksum, "bytes": written}
+
+
+# ---------------------------------------------------------------------------
+# Dump cả database
+# ---------------------------------------------------------------------------
+
+def list_schema_objects(connection) -> List[tuple]:
+    """[(tên, 'BASE TABLE' | 'VIEW'), ...] theo SHOW FULL TABLES."""
+    cur = connection.cursor(buffered=True)
+    try:
+        cur.execute("SHOW FULL TABLES")
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    objects = []
+    for row in rows:
+        values = list(row.values()) if isinstance(row, dict) else list(row)
+        kind = str(values[1]).upper() if len(values) > 1 else "BASE TABLE"
+        objects.append((str(values[0]), kind))
+    return objects
+
+
+def write_header(out, title: str, method: str, created_at: str, compression: str) -> None:
+    out.write(f"-- {title}\n")
+    out.write(f"-- Generated: {created_at}\n")
+    out.write(f"-- Backup method: {method}\n")
+    out.write(f"-- Compression: {compression}\n\n")
+    out.write("SET NAMES utf8mb4;\n")
+    out.write("SET FOREIGN_KEY_CHECKS=0;\n")
+    out.write("SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n")
+
+
+def write_views(connection, views: List[str], out) -> None:
+    # View để cuối: các bảng mà view tham chiếu đã được tạo
+    for name in views:
+        create_view = show_create(connection, "VIEW", name)
+        if create_view:
+            out.write(f"\n-- View: {name}\n")
+            out.write(f"DROP VIEW IF EXISTS `{name}`;\n")
+            out.write(create_view.rstrip().rstrip(";") + ";\n")
+
+
+def write_footer(out) -> None:
+    out.write("\nSET FOREIGN_KEY_CHECKS=1;\n")
+    out.write("-- End of dump\n")
+
+
+def _dump_part(connect: Callable[[], Any], table: str, part_path: str, compression: str, options: Dict[str, Any]):
+    connection = connect()
+    if not connection:
+        raise RuntimeError("Không thể kết nối database")
+    try:
+        with open_dump_writer(part_path, compression) as out:
+            return dump_table(connection, table, out, **options)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def dump_database(
+    connection,
+    out_path,
+    *,
+    tables: Optional[List[str]] = None,
+    compression: str = "none",
+    workers: int = 1,
+    connect: Optional[Callable[[], Any]] = None,
+    title: str = "TBQC Database Backup",
+    method: str = "Python export",
+    table_options: Optional[Dict[str, Dict[str, Any]]] = None,
+    manifest_extra: Optional[Dict[str, Any]] = None,
+    snapshot_extra: Optional[Callable[[Any], Dict[str, Any]]] = None,
+    fetch_rows: int = DEFAULT_FETCH_ROWS,
+    max_insert_bytes: int = DEFAULT_MAX_INSERT_BYTES,
+) -> Dict[str, Any]:
+    """
+    Dump các bảng (mặc định: mọi BASE TABLE + VIEW) ra out_path và ghi manifest cạnh bên.
+
+    connection: dùng để liệt kê bảng, dump view và dump bảng khi workers = 1.
+    connect: hàm mở connection mới — bắt buộc khi workers > 1 (mỗi bảng một connection).
+    table_options: {bảng: kwargs cho dump_table} (vd. where / params / create / insert_verb).
+    manifest_extra: trường thêm vào manifest (vd. thông tin chuỗi backup tăng dần).
+    snapshot_extra: hàm(connection) gọi ngay sau START TRANSACTION WITH CONSISTENT SNAPSHOT, kết quả
+    thêm vào manifest — đọc trong cùng snapshot với dữ liệu dump (vd. mốc backup tăng dần).
+    Chỉ dùng với workers = 1 (dump song song không có snapshot chung).
+    Trả về dict manifest.
+    """
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    objects = list_schema_objects(connection)
+    views = [name for name, kind in objects if kind == "VIEW"]
+    if tables is None:
+        table_names = [name for name, kind in objects if kind != "VIEW"]
+    else:
+        existing = {name for name, kind in objects if kind != "VIEW"}
+        table_names = [t for t in tables if t in existing]
+        views = []
+    base_options = {"fetch_rows": fetch_rows, "max_insert_bytes": max_insert_bytes}
+    table_options = table_options or {}
+
+    def options_for(table):
+        return dict(base_options, **table_options.get(table, {}))
+
+    parallel = workers > 1 and connect is not None and len(table_names) > 1
+    if parallel and snapshot_extra is not None:
+        raise ValueError("snapshot_extra cần dump trong một snapshot (workers = 1)")
+    results: List[Dict[str, Any]] = []
+    extra: Dict[str, Any] = {}
+    if not parallel:
+        cur = connection.cursor()
+        try:
+            cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        finally:
+            cur.close()
+        try:
+            if snapshot_extra is not None:
+                extra = snapshot_extra(connection)
+            with open_dump_writer(out_path, compression) as out:
+                write_header(out, title, method, created_at, compression)
+                for table in table_names:
+                    results.append(dump_table(connection, table, out, **options_for(table)))
+                write_views(connection, views, out)
+                write_footer(out)
+        finally:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+    else:
+        out_dir = os.path.dirname(os.path.abspath(str(out_path)))
+        with tempfile.TemporaryDirectory(prefix=".dump-", dir=out_dir) as tmp_dir:
+            head_path = os.path.join(tmp_dir, "head")
+            tail_path = os.path.join(tmp_dir, "tail")
+            part_paths = [os.path.join(tmp_dir, f"{i:04d}") for i in range(len(table_names))]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(_dump_part, connect, table, part, compression, options_for(table))
+                    for table, part in zip(table_names, part_paths)
+                ]
+                with open_dump_writer(head_path, compression) as out:
+                    write_header(out, title, method, created_at, compression)
+                with open_dump_writer(tail_path, compression) as out:
+                    write_views(connection, views, out)
+                    write_footer(out)
+                results = [future.result() for future in futures]
+            with open(out_path, "wb") as final:
+                for path in [head_path] + part_paths + [tail_path]:
+                    with open(path, "rb") as part:
+                        shutil.copyfileobj(part, final)
+
+    manifest = {
+        "title": title,
+        "created_at": created_at,
+        "method": method,
+        "compression": compression,
+        "consistency": "per-table" if parallel else "snapshot",
+        "tables": results,
+        "views": views,
+        "total_rows": sum(r["rows"] for r in results),
+    }
+    manifest.update(extra)
+    manifest.update(manifest_extra or {})
+    write_manifest(out_path, manifest)
+    logger.info(
+        "SQL dump %s: %s tables, %s rows (%s, workers=%s)",
+        os.path.basename(str(out_path)), len(results), manifest["total_rows"], compression, workers if parallel else 1,
+    )
+    return manifest
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Tạo thumbnail ngoài request: pool process nền cho Pillow (decode + EXIF transpose + WebP method=6).
+
+Trước đây thumbnail thiếu được tạo đồng bộ ngay trong request liệt kê ảnh album / hoạt động, nên
+người xem đầu tiên phải chờ encode toàn bộ ảnh thiếu thumbnail.
+
+- enqueue_thumbnail(): gọi khi upload (và khi listing gặp ảnh chưa có thumbnail). Job trùng đích
+  đang chạy thì dùng lại Future cũ, không encode hai lần.
+- thumbnail_url_or_enqueue(): cho endpoint liệt kê — thumbnail có rồi thì trả URL thumbnail,
+  chưa có thì xếp job và trả URL ảnh gốc làm placeholder (lần xem sau sẽ có thumbnail).
+- enqueue_derivatives() / image_srcset_or_enqueue(): các bậc ảnh responsive (160/480/1024/2048 px,
+  webp + avif tuỳ chọn) cho srcset; listing nhận None tới khi manifest sinh xong.
+- backfill_thumbnails(): job admin quét toàn bộ thư mục ảnh, xếp job cho mọi ảnh thiếu thumbnail
+  hoặc thiếu các bậc.
+- Pool là ProcessPoolExecutor (Pillow chiếm CPU, thread bị GIL giới hạn), context "spawn" để
+  không fork tiến trình Flask đang có thread. THUMBNAIL_WORKERS=0 → chạy inline như cũ (script,
+  môi trường không tạo được process).
+- Job lỗi (ảnh hỏng, Pillow không decode được) được nhớ theo (đích, mtime ảnh gốc): listing không
+  xếp lại job cho tới khi ảnh gốc đổi, thay vì decode lại ảnh hỏng ở mỗi lần xem.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from folder_py.db_config import env_number
+from utils.image_thumbnails import (
+    THUMB_ROOT,
+    THUMB_SUPPORTED_EXTENSIONS,
+    derivative_target,
+    ensure_derivatives_file,
+    ensure_thumbnail_file,
+    get_image_srcset,
+    get_images_base_dir,
+    normalize_public_image_url,
+    thumbnail_target,
+)
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WORKERS = env_number('THUMBNAIL_WORKERS', min(2, os.cpu_count() or 1), int, 0)
+
+_lock = threading.Lock()
+_executor = None
+_pending = {}
+# Khoá job (đường dẫn đích) -> mtime ảnh gốc lúc job lỗi
+_failed = {}
+_stats = {'queued': 0, 'done': 0, 'failed': 0}
+
+
+def _get_executor():
+    global _executor
+    if THUMBNAIL_WORKERS <= 0:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def _source_mtime(original_path):
+    try:
+        return original_path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _failed_before(key, source_mtime):
+    """True nếu job cho đích này đã lỗi với đúng phiên bản ảnh gốc hiện tại."""
+    with _lock:
+        return key in _failed and _failed[key] == source_mtime
+
+
+def _finished(key, future, source_mtime=None):
+    with _lock:
+        _pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None or not future.result():
+            _stats['failed'] += 1
+            if not future.cancelled():
+                # Pool bị huỷ (shutdown) không phải lỗi của ảnh: chỉ nhớ job lỗi thật
+                _failed[key] = source_mtime
+                if future.exception() is not None:
+                    logger.warning('Thumbnail job %s failed: %s', key, future.exception())
+        else:
+            _failed.pop(key, None)
+            _stats['done'] += 1
+
+
+def _submit(key, fn, original_path, rel_path, source_mtime=None):
+    global _executor
+    future = None
+    with _lock:
+        existing = _pending.get(key)
+        if existing is not None:
+            return existing
+        try:
+            executor = _get_executor()
+            if executor is not None:
+                future = executor.submit(fn, str(original_path), relative_path=rel_path)
+                _pending[key] = future
+        except Exception as exc:
+            # Pool hỏng (process con chết, không spawn được) → tạo lại ở job sau, job này chạy inline
+            logger.warning('Thumbnail pool unavailable, generating inline: %s', exc)
+            _executor = None
+        _stats['queued'] += 1
+    if future is None:
+        future = Future()
+        future.set_result(fn(original_path, relative_path=rel_path))
+    future.add_done_callback(lambda f: _finished(key, f, source_mtime))
+    return future
+
+
+def enqueue_thumbnail(image_ref, *, source_path=None):
+    """
+    Xếp job tạo thumbnail cho ảnh. Return (thumbnail_url, future) — future None nếu thumbnail
+    đã có; (None, None) nếu ảnh không tạo thumbnail được (URL ngoài, định dạng không hỗ trợ,
+    job trước đã lỗi với đúng bản ảnh gốc này, ...).
+    """
+    target = thumbnail_target(image_ref, source_path=source_path)
+    if target is None:
+        return None, None
+    original_path, rel_path, thumb_url, thumb_path = target
+    if thumb_path.exists():
+        return thumb_url, None
+    if not original_path.is_file():
+        return None, None
+    key = str(thumb_path)
+    source_mtime = _source_mtime(original_path)
+    if _failed_before(key, source_mtime):
+        return None, None
+    return thumb_url, _submit(key, ensure_thumbnail_file, original_path, rel_path, source_mtime)
+
+
+def thumbnail_url_or_enqueue(image_ref, *, source_path=None):
+    """URL thumbnail nếu đã có; chưa có thì xếp job nền và trả URL ảnh gốc (placeholder)."""
+    target = thumbnail_target(image_ref, source_path=source_path)
+    if target is not None and target[3].exists():
+        return target[2]
+    if target is not None:
+        enqueue_thumbnail(image_ref, source_path=source_path)
+    return normalize_public_image_url(image_ref)
+
+
+def enqueue_derivatives(image_ref, *, source_path=None):
+    """
+    Xếp job sinh các bậc ảnh responsive (DERIVATIVE_WIDTHS) cho ảnh. Return future, hoặc None
+    nếu manifest đã có / ảnh không xử lý được.
+    """
+    target = derivative_target(image_ref, source_path=source_path)
+    if target is None:
+        return None
+    original_path, rel_path, manifest_path = target
+    if manifest_path.exists() or not original_path.is_file():
+        return None
+    key = str(manifest_path)
+    source_mtime = _source_mtime(original_path)
+    if _failed_before(key, source_mtime):
+        return None
+    return _submit(key, ensure_derivatives_file, original_path, rel_path, source_mtime)
+
+
+def image_srcset_or_enqueue(image_ref, *, source_path=None):
+    """Dữ liệu srcset (get_image_srcset) nếu các bậc đã có; chưa có thì xếp job nền và trả None."""
+    srcset = get_image_srcset(image_ref, source_path=source_path)
+    if srcset is None:
+        enqueue_derivatives(image_ref, source_path=source_path)
+    return srcset
+
+
+def enqueue_image_jobs(image_ref, *, source_path=None):
+    """Gọi khi upload: thumbnail + các bậc responsive."""
+    enqueue_thumbnail(image_ref, source_path=source_path)
+    enqueue_derivatives(image_ref, source_path=source_path)
+
+
+def backfill_thumbnails(base_dir=None):
+    """Quét thư mục ảnh, xếp job cho mọi ảnh chưa có thumbnail / các bậc. Return số liệu quét."""
+    base_dir = base_dir or get_images_base_dir()
+    result = {'scanned': 0, 'existing': 0, 'queued': 0, 'skipped': 0, 'derivatives_queued': 0}
+    for root, dirs, files in os.walk(base_dir):
+        if os.path.abspath(root) == os.path.abspath(base_dir):
+            dirs[:] = [d for d in dirs if d != THUMB_ROOT]
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in THUMB_SUPPORTED_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, base_dir).replace(os.sep, '/')
+            result['scanned'] += 1
+            thumb_url, future = enqueue_thumbnail(rel_path, source_path=path)
+            if thumb_url is None:
+                result['skipped'] += 1
+            elif future is None:
+                result['existing'] += 1
+            else:
+                result['queued'] += 1
+            if thumb_url is not None and enqueue_derivatives(rel_path, source_path=path) is not None:
+                result['derivatives_queued'] += 1
+    logger.info('Thumbnail backfill %s: %s', base_dir, result)
+    return result
+
+
+def thumbnail_status():
+    with _lock:
+        return {
+            'workers': THUMBNAIL_WORKERS,
+            'mode': 'process' if THUMBNAIL_WORKERS > 0 else 'inline',
+            'pending': len(_pending),
+            'known_failures': len(_failed),
+            **_stats,
+        }
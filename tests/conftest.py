@@ -18,6 +18,8 @@ if _folder_py not in sys.path:
     sys.path.insert(0, _folder_py)
 
 os.chdir(ROOT)
+# Cache riêng trong process test (không ghi /dev/shm, không cần Redis)
+os.environ.setdefault("CACHE_BACKEND", "simple")
 
 import pytest
 
@@ -29,6 +31,7 @@ SQL_BOOTSTRAP_FILES = (
 )
 DB_TRUNCATE_TABLES = (
     "page_views",
+    "page_view_daily",
     "activity_logs",
     "edit_requests",
     "album_images",
@@ -85,6 +88,14 @@ def _reset_db_side_channels():
         cfg._config_override = None
     except Exception:
         pass
+    try:
+        from services.genealogy_graph import invalidate_genealogy_snapshot
+        from services.schema_registry import invalidate_schema_registry
+
+        invalidate_genealogy_snapshot()
+        invalidate_schema_registry()
+    except Exception:
+        pass
 
 
 def _apply_test_db_env(env_map):
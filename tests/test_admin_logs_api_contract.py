@@ -13,12 +13,11 @@ class _FakeActivityLogsCursor:
     def execute(self, query, params=None):
         normalized = " ".join(str(query).split()).lower()
 
-        if "show tables like 'activity_logs'" in normalized:
-            self._result = {"Tables_in_test (activity_logs)": "activity_logs"}
-        elif "show columns from activity_logs like 'log_id'" in normalized:
-            self._result = {"Field": "log_id"}
-        elif "show columns from activity_logs like 'created_at'" in normalized:
-            self._result = {"Field": "created_at"}
+        if "from information_schema.columns" in normalized:
+            self._result = [
+                {"TABLE_NAME": "activity_logs", "COLUMN_NAME": column}
+                for column in ("log_id", "action", "created_at")
+            ]
         elif "select count(*) as total" in normalized and "from activity_logs" in normalized:
             self._result = {"total": 1}
         elif "select al.log_id as log_id" in normalized and "from activity_logs al" in normalized:
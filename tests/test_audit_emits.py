@@ -298,14 +298,18 @@ def test_bulk_update_sll_emits_audit(db_client, test_db_cursor, monkeypatch):
 
 
 @pytest.mark.db_integration
-def test_sync_genealogy_emits_audit(db_client, test_db_cursor, monkeypatch):
+def test_sync_genealogy_emits_audit(db_client, test_db_cursor, monkeypatch, tmp_path):
     import requests as _requests
     from unittest.mock import MagicMock
 
+    from services import genealogy_sync
+
     mock_response = MagicMock()
-    mock_response.json.return_value = []
+    mock_response.status_code = 200
+    mock_response.iter_content.return_value = [b"[]"]
     mock_response.raise_for_status.return_value = None
     monkeypatch.setattr(_requests, "get", lambda *a, **kw: mock_response)
+    monkeypatch.setattr(genealogy_sync, "SYNC_STATE_FILE", str(tmp_path / "sync_state.json"))
 
     resp = db_client.post("/api/genealogy/sync")
     assert resp.status_code == 200
@@ -22,6 +22,8 @@ from utils.backup_safety import resolve_safe_backup_path
 VALID_NAMES = [
     "tbqc_backup_20250101_120000.sql",
     "tbqc_backup_20991231_235959.sql",
+    "tbqc_backup_20250101_120000.sql.gz",
+    "tbqc_backup_20250101_120000_inc003.sql.zst",
 ]
 
 INVALID_NAMES = [
@@ -40,7 +42,10 @@ INVALID_NAMES = [
     ".env",
     "..",
     ".",
-    "tbqc_backup_20250101_120000.sql.gz",
+    "tbqc_backup_20250101_120000.sql.bz2",
+    "tbqc_backup_20250101_120000.sql.gz.manifest.json",
+    "tbqc_backup_20250101_120000_inc.sql",
+    "tbqc_chain.json",
     " tbqc_backup_20250101_120000.sql",
     "tbqc_backup_20250101_120000.sql ",
 ]
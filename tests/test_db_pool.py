@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+from mysql.connector.errors import PoolError
+
+import folder_py.db_config as cfg
+from auth import User
+
+
+class _FakePooledConnection:
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.pool.available.append(self.name)
+
+
+class _FakePool:
+    def __init__(self, size):
+        self.available = [f'pooled-{i}' for i in range(size)]
+
+    def get_connection(self):
+        if not self.available:
+            raise PoolError('Failed getting connection; pool exhausted')
+        return _FakePooledConnection(self, self.available.pop())
+
+
+class _FakeSingleConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    def _install(size=1, max_overflow=0, timeout=0.05):
+        pool = _FakePool(size)
+        monkeypatch.setattr(cfg, '_db_pool', pool)
+        monkeypatch.setattr(cfg, '_pool_settings', {'pool_size': size, 'max_overflow': max_overflow, 'timeout': timeout})
+        monkeypatch.setattr(cfg, '_connect_single', lambda config: _FakeSingleConnection())
+        monkeypatch.setattr(cfg, 'get_db_config', lambda: {'database': 'tbqc_test'})
+        cfg.reset_pool_metrics()
+        return pool
+    yield _install
+    cfg.reset_pool_metrics()
+
+
+def test_pool_settings_from_env(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '100')
+    monkeypatch.setenv('DB_POOL_MAX_OVERFLOW', 'abc')
+    monkeypatch.setenv('DB_POOL_TIMEOUT', '-1')
+
+    assert cfg.get_pool_settings() == {'pool_size': 32, 'max_overflow': 2, 'timeout': 0.0}
+
+
+def test_exhausted_pool_uses_bounded_overflow_then_times_out(fake_pool):
+    fake_pool(size=1, max_overflow=1)
+
+    pooled = cfg.get_db_connection()
+    overflow = cfg.get_db_connection()
+    assert cfg.get_db_connection() is None
+
+    metrics = cfg.get_pool_metrics()
+    assert metrics['in_use'] == 2
+    assert metrics['overflow_in_use'] == 1
+    assert metrics['overflow_connections_total'] == 1
+    assert metrics['exhausted_total'] == 1
+    assert metrics['waits_total'] == 1
+
+    overflow.close()
+    overflow.close()
+    pooled.close()
+    metrics = cfg.get_pool_metrics()
+    assert metrics['in_use'] == 0
+    assert metrics['overflow_in_use'] == 0
+    assert metrics['checkouts_total'] == 2
+
+
+def test_waiting_checkout_gets_connection_released_by_other_thread(fake_pool):
+    fake_pool(size=1, timeout=2)
+    held = cfg.get_db_connection()
+
+    def _release_later():
+        time.sleep(0.05)
+        held.close()
+
+    releaser = threading.Thread(target=_release_later)
+    releaser.start()
+    connection = cfg.get_db_connection()
+    releaser.join()
+
+    assert connection is not None
+    assert connection.name == 'pooled-0'
+    metrics = cfg.get_pool_metrics()
+    assert metrics['waits_total'] == 1
+    assert metrics['exhausted_total'] == 0
+    assert metrics['checkout_ms']['max'] >= 40
+    connection.close()
+
+
+def test_db_pool_endpoint_reports_metrics_for_admin(flask_app, monkeypatch, fake_pool):
+    import auth
+
+    fake_pool(size=2)
+    monkeypatch.setattr(
+        auth,
+        'get_user_by_id',
+        lambda user_id: User(int(user_id), 'admin.seed', 'admin', full_name='Admin Seed'),
+    )
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+
+    response = client.get('/admin/api/db-pool', headers={'Accept': 'application/json'})
+
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['success'] is True
+    assert payload['pool']['pool_size'] == 2
+    assert payload['pool']['pool_initialized'] is True
+    assert {'in_use', 'exhausted_total', 'fallback_connections_total', 'checkout_ms'} <= set(payload['pool'])
@@ -0,0 +1,175 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from services import genealogy_graph
+from services.genealogy_graph import (
+    GenealogySnapshot,
+    get_genealogy_snapshot,
+    get_relationship_data,
+    invalidate_genealogy_snapshot,
+)
+
+
+@pytest.fixture
+def loader_calls(monkeypatch):
+    calls = {"persons": 0, "relationship_data": 0}
+
+    def fake_load_persons_data(cursor):
+        calls["persons"] += 1
+        return {
+            "P-2-1": {"person_id": "P-2-1", "generation_level": 2},
+            "P-1-1": {"person_id": "P-1-1", "generation_level": 1},
+        }
+
+    def fake_load_relationship_data(cursor):
+        calls["relationship_data"] += 1
+        return {"children_map": {"P-1-1": ["Con"]}}
+
+    monkeypatch.setattr(genealogy_graph, "load_persons_data", fake_load_persons_data)
+    monkeypatch.setattr(genealogy_graph, "build_children_map", lambda cursor: {"P-1-1": ["P-2-1"]})
+    monkeypatch.setattr(genealogy_graph, "build_parent_map", lambda cursor: {"P-2-1": {"father_id": "P-1-1", "mother_id": None}})
+    monkeypatch.setattr(genealogy_graph, "load_relationship_data", fake_load_relationship_data)
+    monkeypatch.delenv("GENEALOGY_SNAPSHOT_TTL", raising=False)
+    return calls
+
+
+def _cursor_with_marriages(rows):
+    cursor = MagicMock()
+    cursor.fetchall.return_value = rows
+    return cursor
+
+
+def test_snapshot_is_built_once_until_invalidated(loader_calls):
+    cursor = _cursor_with_marriages([{"husband_id": "P-1-1", "wife_id": "P-1-2"}])
+
+    first = get_genealogy_snapshot(cursor)
+    second = get_genealogy_snapshot(cursor)
+
+    assert first is second
+    assert loader_calls["persons"] == 1
+    assert first.children_map == {"P-1-1": ["P-2-1"]}
+    assert first.spouse_map == {"P-1-1": ["P-1-2"], "P-1-2": ["P-1-1"]}
+
+    invalidate_genealogy_snapshot()
+    third = get_genealogy_snapshot(cursor)
+
+    assert third is not first
+    assert third.version > first.version
+    assert loader_calls["persons"] == 2
+
+
+def test_invalidate_during_build_does_not_wait_and_stale_build_is_not_installed(loader_calls, monkeypatch):
+    cursor = _cursor_with_marriages([])
+    # Cache chung bật: invalidate đổi cả token
+    token = {"value": "t0"}
+    monkeypatch.setattr(genealogy_graph, "get_data_version", lambda: token["value"])
+    monkeypatch.setattr(genealogy_graph, "bump_data_version", lambda: token.update(value=token["value"] + "+"))
+    real_load = genealogy_graph.load_persons_data
+    lock_free_during_build = []
+
+    def load_and_invalidate(cur):
+        if loader_calls["persons"] == 0:
+            # Ghi trong lúc đang build: invalidate phải lấy được lock ngay
+            lock_free_during_build.append(genealogy_graph._lock.acquire(blocking=False))
+            genealogy_graph._lock.release()
+            invalidate_genealogy_snapshot()
+        return real_load(cur)
+
+    monkeypatch.setattr(genealogy_graph, "load_persons_data", load_and_invalidate)
+
+    snapshot = get_genealogy_snapshot(cursor)
+
+    assert lock_free_during_build == [True]
+    assert loader_calls["persons"] == 2
+    assert snapshot.version == genealogy_graph._version
+    assert snapshot.data_version == "t0+"
+    assert get_genealogy_snapshot(cursor) is snapshot
+
+
+def test_ttl_zero_disables_caching(loader_calls, monkeypatch):
+    monkeypatch.setenv("GENEALOGY_SNAPSHOT_TTL", "0")
+    cursor = _cursor_with_marriages([])
+
+    get_genealogy_snapshot(cursor)
+    get_genealogy_snapshot(cursor)
+
+    assert loader_calls["persons"] == 2
+
+
+def test_get_relationship_data_reads_from_snapshot(loader_calls):
+    cursor = _cursor_with_marriages([])
+
+    assert get_relationship_data(cursor) == {"children_map": {"P-1-1": ["Con"]}}
+    assert get_relationship_data(cursor) == {"children_map": {"P-1-1": ["Con"]}}
+    assert loader_calls["relationship_data"] == 1
+
+
+def test_get_relationship_data_falls_back_when_snapshot_fails(monkeypatch):
+    def boom(cursor):
+        raise RuntimeError("persons query failed")
+
+    monkeypatch.setattr(genealogy_graph, "load_persons_data", boom)
+    monkeypatch.setattr(genealogy_graph, "load_relationship_data", lambda cursor: {"direct": True})
+
+    assert get_relationship_data(MagicMock()) == {"direct": True}
+
+
+def test_scoped_relationship_data_does_not_build_snapshot(loader_calls, monkeypatch):
+    scoped_calls = []
+
+    def fake_load_relationship_data(cursor, person_ids=None):
+        if person_ids is None:
+            loader_calls["relationship_data"] += 1
+            return {"children_map": {"P-1-1": ["Con"]}}
+        scoped_calls.append(sorted(person_ids))
+        return {"scoped": True}
+
+    monkeypatch.setattr(genealogy_graph, "load_relationship_data", fake_load_relationship_data)
+    invalidate_genealogy_snapshot()
+    cursor = _cursor_with_marriages([])
+
+    assert get_relationship_data(cursor, person_ids=["P-2-1"]) == {"scoped": True}
+    assert loader_calls["persons"] == 0
+    assert scoped_calls == [["P-2-1"]]
+
+    # Snapshot đã có sẵn trong worker → dùng luôn, không query thêm
+    get_genealogy_snapshot(cursor)
+    assert get_relationship_data(cursor, person_ids=["P-2-1"]) == {"children_map": {"P-1-1": ["Con"]}}
+    assert scoped_calls == [["P-2-1"]]
+
+
+def test_first_person_id_matches_mysql_ordering():
+    snapshot = GenealogySnapshot(
+        0,
+        {
+            "P-2-1": {"generation_level": 2},
+            "P-1-2": {"generation_level": 1},
+            "P-1-1": {"generation_level": 1},
+        },
+        {},
+        {},
+        [],
+        {},
+    )
+    assert snapshot.first_person_id() == "P-1-1"
+
+    snapshot.persons_by_id["X-0"] = {"generation_level": None}
+    assert snapshot.first_person_id() == "X-0"
+
+    empty = GenealogySnapshot(0, {}, {}, {}, [], {})
+    assert empty.first_person_id() is None
+
+
+def test_marriage_pairs_in_scope_dedupes_and_sorts():
+    snapshot = GenealogySnapshot(
+        0,
+        {},
+        {},
+        {},
+        [("P-2", "P-1"), ("P-1", "P-2"), ("P-3", "P-3"), ("P-1", "P-9")],
+        {},
+    )
+
+    assert snapshot.marriage_pairs_in_scope({"P-1", "P-2", "P-3"}) == [["P-1", "P-2"]]
+    assert snapshot.marriage_pairs_in_scope(set()) == []
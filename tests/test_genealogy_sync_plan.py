@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+from services.genealogy_sync_plan import SyncPlan, apply_sync_diff, load_local_snapshot
+
+
+class FakeCursor:
+    def __init__(self):
+        self.tables = {
+            'persons': [
+                {'person_id': 'P-1-1', 'full_name': 'Nguyễn Phước Tộc', 'alias': None, 'gender': 'Nam',
+                 'generation_level': 1, 'birth_date_solar': date(1900, 1, 1), 'death_date_solar': None,
+                 'grave_info': None, 'place_of_death': None, 'home_town': None, 'status': 'Đã mất'},
+                {'person_id': 'P-2-1', 'full_name': 'Tôn Nữ Hoa', 'alias': 'Hoa', 'gender': 'Nữ',
+                 'generation_level': 2, 'birth_date_solar': None, 'death_date_solar': None,
+                 'grave_info': None, 'place_of_death': None, 'home_town': None, 'status': 'Đang sống'},
+            ],
+            'relationships': [{'parent_id': 'P-1-1', 'child_id': 'P-2-1', 'relation_type': 'father'}],
+            'marriages': [],
+        }
+        self.executed = []
+        self.many = []
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        self.executed.append(sql)
+        self._rows = self.tables[sql.split(' FROM ')[1].split()[0]]
+
+    def fetchall(self):
+        return self._rows
+
+    def executemany(self, sql, seq):
+        self.many.append((sql, list(seq)))
+        self.rowcount = len(seq)
+
+
+def _member(person_id, name, **extra):
+    return {'person_id': person_id, 'full_name': name, **extra}
+
+
+REMOTE = [
+    _member('P-1-1', 'Nguyễn Phước Tộc', gender='Nam', generation_level='1', birth_date_solar='1900-01-01',
+            status='Đã mất'),
+    _member('P-2-1', 'Tôn Nữ Hoa', alias='Hoa', gender='Nữ', generation_level=2, father_id='P-1-1',
+            spouses='le van an; unknown'),
+    _member('P-2-2', 'Lê Văn An', gender='Nam', generation_level=2, spouses=[{'spouse_id': 'P-2-1'}]),
+    _member('P-3-1', 'Út', generation_level=3, father_id='P-2-2', mother_id='P-2-1', spouses='Không Ai'),
+    _member('P-3-2', 'Mồ côi', father_id='P-9-9'),
+    {'full_name': 'thiếu id'},
+]
+
+
+def test_diff_against_local_snapshot_with_name_map():
+    cursor = FakeCursor()
+    plan = SyncPlan()
+    plan.add_members(REMOTE[:3])
+    plan.add_members(REMOTE[3:])
+
+    diff = plan.diff(load_local_snapshot(cursor))
+
+    assert plan.members_count == 5
+    assert [r['person_id'] for r in diff.persons_insert] == ['P-2-2', 'P-3-1', 'P-3-2']
+    # P-1-1 chỉ khác kiểu dữ liệu (int / date vs chuỗi) → không đổi
+    assert diff.persons_unchanged == 2 and diff.persons_update == []
+    assert diff.relationships_insert == [('P-2-2', 'P-3-1', 'father'), ('P-2-1', 'P-3-1', 'mother')]
+    assert diff.skipped_relationships == 1
+    # "le van an" khớp "Lê Văn An" (không dấu, không phân biệt hoa thường) — cặp trùng chỉ ghi một lần
+    assert diff.marriages_insert == [('P-2-2', 'P-2-1')]
+    assert diff.unresolved_spouses == [{'person_id': 'P-3-1', 'spouse_name': 'Không Ai'}]
+    assert len(cursor.executed) == 3
+
+
+def test_apply_uses_batched_executemany():
+    cursor = FakeCursor()
+    plan = SyncPlan()
+    plan.add_members([_member('P-1-1', 'Tộc', status='Đã mất')] + [_member(f'N-{i}', f'Người {i}') for i in range(5)])
+    diff = plan.diff(load_local_snapshot(cursor))
+
+    assert diff.summary()['samples']['persons_update'][0]['changes']['full_name'] == ['Nguyễn Phước Tộc', 'Tộc']
+    applied = apply_sync_diff(cursor, diff, batch_size=2)
+
+    assert applied == {'persons_inserted': 5, 'persons_updated': 1, 'relationships_inserted': 0, 'marriages_inserted': 0}
+    assert [len(rows) for _, rows in cursor.many] == [2, 2, 1, 1]
+    assert all('ON DUPLICATE KEY UPDATE' in sql for sql, _ in cursor.many)
+
+
+def test_dry_run_reports_diff_without_writing(client, monkeypatch, tmp_path):
+    from services import genealogy_sync
+
+    cursor = FakeCursor()
+    connection = MagicMock()
+    connection.cursor.return_value = cursor
+    monkeypatch.setattr(genealogy_sync, 'get_db_connection', lambda: connection)
+    monkeypatch.setattr(genealogy_sync, 'log_activity', lambda *a, **kw: None)
+    monkeypatch.setattr(genealogy_sync, 'invalidate_genealogy_snapshot', lambda: None)
+    monkeypatch.setattr(genealogy_sync, 'SYNC_STATE_FILE', str(tmp_path / 'sync_state.json'))
+    response = MagicMock(status_code=200, headers={})
+    response.iter_content.side_effect = lambda chunk_size: iter([json.dumps(REMOTE).encode()])
+
+    with patch('requests.get', return_value=response):
+        dry = client.post('/api/genealogy/sync?dry_run=1')
+        assert dry.status_code == 200
+        assert dry.get_json()['dry_run'] is True
+        assert dry.get_json()['diff']['persons_insert'] == 3
+        assert cursor.many == [] and not connection.commit.called
+
+        real = client.post('/api/genealogy/sync')
+
+    stats = real.get_json()['stats']
+    assert real.status_code == 200 and connection.commit.called
+    assert stats['persons_inserted'] == 3 and stats['persons_after'] == 5
+    assert stats['relationships_inserted'] == 2 and stats['marriages_inserted'] == 1
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import pytest
+
+from services import genealogy_sync
+from services.genealogy_sync import fetch_remote_members, load_sync_state
+from services.genealogy_sync_plan import SyncPlan
+from utils.json_stream import JSONArrayStream, JSONStreamError
+
+MEMBERS = [
+    {'person_id': f'P-2-{i}', 'full_name': f'Nguyễn Phước Ưng {i}', 'generation_level': 2, 'father_id': 'P-1-1'}
+    for i in range(1, 8)
+] + [{'person_id': 'P-1-1', 'full_name': 'Nguyễn Phước Tộc', 'generation_level': 1}]
+
+
+def _bytes_one_by_one(text):
+    return (bytes([b]) for b in text.encode('utf-8'))
+
+
+def test_array_stream_parses_items_across_chunk_boundaries():
+    body = json.dumps({'count': 12345, 'members': MEMBERS, 'success': True}, ensure_ascii=False)
+    stream = JSONArrayStream(_bytes_one_by_one(body), array_keys=('data', 'members'))
+
+    assert list(stream) == MEMBERS
+    assert stream.array_key == 'members'
+    assert stream.meta == {'count': 12345, 'success': True}
+    assert list(JSONArrayStream(_bytes_one_by_one(' [ 1 , 20 ,3] '))) == [1, 20, 3]
+
+
+@pytest.mark.parametrize('body', ['', '{"data": 1}', '[{"a": 1},', '[{"a": 1} {"b": 2}]', '"x"'])
+def test_array_stream_rejects_malformed_payloads(body):
+    with pytest.raises(JSONStreamError):
+        list(JSONArrayStream([body.encode()], array_keys=('data',)))
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    etag = '"members-v1"'
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps({'success': True, 'data': MEMBERS}, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', self.etag)
+        self.send_header('Last-Modified', 'Sun, 01 Mar 2026 09:30:00 GMT')
+        self.end_headers()
+        # Gửi từng mẩu nhỏ để client phải parse tăng dần
+        for start in range(0, len(body), 97):
+            self.wfile.write(body[start:start + 97])
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    _Upstream.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Upstream)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}/api/members'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class CountingPlan(SyncPlan):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def add_members(self, members):
+        self.batches.append(len(members))
+        super().add_members(members)
+
+
+def test_fetch_streams_in_batches_and_revalidates_with_etag(upstream):
+    plan = CountingPlan()
+
+    first = fetch_remote_members(upstream, plan, batch_size=3)
+
+    assert first == {'not_modified': False, 'fetched': 8, 'etag': '"members-v1"',
+                     'last_modified': 'Sun, 01 Mar 2026 09:30:00 GMT'}
+    assert plan.batches == [3, 3, 2] and plan.members_count == 8
+
+    state = {'url': upstream, 'etag': first['etag'], 'last_modified': first['last_modified']}
+    again = fetch_remote_members(upstream, CountingPlan(), state=state)
+
+    assert again['not_modified'] is True
+    assert _Upstream.requests[-1]['If-None-Match'] == '"members-v1"'
+    assert _Upstream.requests[-1]['If-Modified-Since'] == 'Sun, 01 Mar 2026 09:30:00 GMT'
+    assert 'If-None-Match' not in _Upstream.requests[0]
+
+
+def test_sync_route_skips_database_when_upstream_unchanged(client, upstream, monkeypatch, tmp_path):
+    cursor = MagicMock(rowcount=0)
+    cursor.fetchall.return_value = []
+    connection = MagicMock()
+    connection.cursor.return_value = cursor
+    connect = MagicMock(return_value=connection)
+    state_file = tmp_path / 'sync_state.json'
+    monkeypatch.setattr(genealogy_sync, 'SYNC_SOURCE_URL', upstream)
+    monkeypatch.setattr(genealogy_sync, 'SYNC_STATE_FILE', str(state_file))
+    monkeypatch.setattr(genealogy_sync, 'get_db_connection', connect)
+    monkeypatch.setattr(genealogy_sync, 'log_activity', lambda *a, **kw: None)
+    monkeypatch.setattr(genealogy_sync, 'invalidate_genealogy_snapshot', lambda: None)
+
+    first = client.post('/api/genealogy/sync')
+    assert first.status_code == 200
+    assert first.get_json()['stats']['persons_inserted'] == 8
+    assert load_sync_state(str(state_file))['etag'] == '"members-v1"'
+
+    second = client.post('/api/genealogy/sync')
+    assert second.get_json()['not_modified'] is True
+    assert connect.call_count == 1
+
+    forced = client.post('/api/genealogy/sync?dry_run=1')
+    assert forced.get_json()['diff']['persons_insert'] == 8
+    assert 'If-None-Match' not in _Upstream.requests[-1]
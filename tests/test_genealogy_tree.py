@@ -0,0 +1,126 @@
+import json
+from unittest.mock import MagicMock
+
+from folder_py.genealogy_tree import build_tree, count_tree_children, iter_tree_json
+from services import genealogy_read_service
+from services.genealogy_graph import GenealogySnapshot
+
+
+def _persons(*ids):
+    return {pid: {"full_name": f"Ten {pid}", "generation_level": 1} for pid in ids}
+
+
+def _count_nodes(node):
+    total = 0
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        total += 1
+        stack.extend(current["children"])
+    return total
+
+
+def test_build_tree_keeps_children_order_and_max_gen():
+    persons = _persons("R", "A", "B", "A1")
+    children_map = {"R": ["B", "A", "MISSING"], "A": ["A1"]}
+
+    tree = build_tree("R", persons, children_map, 1, 2)
+
+    assert [c["person_id"] for c in tree["children"]] == ["B", "A"]
+    assert tree["children"][1]["children"] == []
+    assert "collapsed" not in tree["children"][1]
+    assert build_tree("R", persons, children_map, 3, 2) is None
+    assert build_tree("NOPE", persons, children_map, 1, 2) is None
+
+
+def test_build_tree_handles_chains_deeper_than_recursion_limit():
+    depth = 3000
+    ids = [f"P-{i}" for i in range(depth)]
+    persons = _persons(*ids)
+    children_map = {ids[i]: [ids[i + 1]] for i in range(depth - 1)}
+
+    tree = build_tree(ids[0], persons, children_map, 1, depth)
+
+    assert _count_nodes(tree) == depth
+    encoded = "".join(iter_tree_json(tree))
+    assert encoded.startswith('{"person_id":"P-0"')
+    assert encoded.count('"person_id"') == depth
+    assert encoded.endswith("]}" * depth)
+
+
+def test_build_tree_max_nodes_collapses_whole_sibling_groups():
+    persons = _persons("R", "A", "B", "A1", "A2", "B1")
+    children_map = {"R": ["A", "B"], "A": ["A1", "A2"], "B": ["B1"]}
+
+    tree = build_tree("R", persons, children_map, 1, 5, max_nodes=4)
+
+    a, b = tree["children"]
+    assert a["children"] == []
+    assert a["collapsed"] is True and a["child_count"] == 2
+    assert [c["person_id"] for c in b["children"]] == ["B1"]
+    assert _count_nodes(tree) == 4
+
+
+def test_build_tree_collapse_depth_returns_child_counts_only():
+    persons = _persons("R", "A", "A1", "A2")
+    children_map = {"R": ["A"], "A": ["A1", "A2", "MISSING"]}
+
+    tree = build_tree("R", persons, children_map, 1, 10, collapse_depth=2)
+
+    child = tree["children"][0]
+    assert child["children"] == []
+    assert child["child_count"] == 2
+    assert count_tree_children("A", persons, children_map) == 2
+
+
+def test_build_tree_reuses_payload_cache():
+    persons = _persons("R", "A")
+    cache = {}
+
+    first = build_tree("R", persons, {"R": ["A"]}, 1, 2, payload_cache=cache)
+    second = build_tree("R", persons, {"R": ["A"]}, 1, 2, payload_cache=cache)
+
+    assert set(cache) == {"R", "A"}
+    assert first == second
+    assert first is not second
+
+
+def test_api_tree_streams_json_with_collapsed_nodes(flask_app, monkeypatch):
+    persons = _persons("P-1-1", "P-2-1", "P-3-1")
+    snapshot = GenealogySnapshot(
+        1,
+        persons,
+        {"P-1-1": ["P-2-1"], "P-2-1": ["P-3-1"]},
+        {},
+        [],
+        {},
+    )
+    connection = MagicMock()
+    monkeypatch.setattr(genealogy_read_service, "get_db_connection", lambda: connection)
+    monkeypatch.setattr(genealogy_read_service, "get_genealogy_snapshot", lambda cursor=None: snapshot)
+
+    with flask_app.test_request_context("/api/tree?max_gen=5&collapse_depth=2"):
+        resp = genealogy_read_service.get_tree()
+        assert resp.is_streamed
+        body = json.loads(resp.get_data(as_text=True))
+
+    assert body["person_id"] == "P-1-1"
+    assert body["children"][0]["child_count"] == 1
+    assert body["children"][0]["children"] == []
+    assert body["marriage_pairs"] == []
+    assert set(snapshot.tree_json_fragments) == {"P-1-1", "P-2-1"}
+
+
+def test_streamed_tree_matches_jsonify_byte_for_byte(flask_app):
+    from flask import jsonify
+
+    persons = _persons("R", "A", "B", "A1")
+    persons["A"]["alias"] = "Tên khác"
+    tree = build_tree("R", persons, {"R": ["A", "B"], "A": ["A1"], "B": ["B1"]}, 1, 5, max_nodes=3)
+    tree["marriage_pairs"] = [{"husband_id": "R", "wife_id": None}]
+
+    with flask_app.test_request_context():
+        streamed = genealogy_read_service._stream_tree_response(tree, fragment_cache={}).get_data()
+        expected = jsonify(tree).get_data()
+
+    assert streamed == expected
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from pathlib import Path
+
+import pytest
+from werkzeug.exceptions import NotFound
+
+from services import image_serving
+
+
+@pytest.fixture
+def image_root(tmp_path, monkeypatch):
+    monkeypatch.delenv("RAILWAY_VOLUME_MOUNT_PATH", raising=False)
+    monkeypatch.setattr(image_serving, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr("utils.image_thumbnails.BASE_DIR", tmp_path)
+    image_serving.clear_image_path_cache()
+    root = tmp_path / "static" / "images"
+    root.mkdir(parents=True)
+    yield root
+    image_serving.clear_image_path_cache()
+
+
+def _write(path: Path, data=b"\x89PNG-fake"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def test_repeat_view_is_304_without_touching_disk(client, image_root, monkeypatch):
+    original = _write(image_root / "album_1" / "a.jpg", b"jpeg-bytes")
+    etag = image_serving.record_image_etag("/static/images/album_1/a.jpg", source_path=str(original))
+    assert (image_root / "_thumbs" / "album_1" / "a.jpg.etag").read_text() == etag
+
+    first = client.get("/static/images/album_1/a.jpg")
+    assert first.status_code == 200 and first.data == b"jpeg-bytes"
+    assert first.headers["ETag"] == f'"{etag}"'
+    assert first.headers["Cache-Control"] == "public, max-age=86400"
+
+    monkeypatch.setattr(image_serving.os.path, "isfile", lambda p: pytest.fail("không được stat lại"))
+    monkeypatch.setattr(image_serving, "send_file", lambda *a, **kw: pytest.fail("không được gửi lại file"))
+    again = client.get("/images/album_1/a.jpg", headers={"If-None-Match": f'"{etag}"'})
+
+    assert again.status_code == 304 and again.data == b""
+    assert again.headers["ETag"] == f'"{etag}"'
+
+
+def test_derivatives_and_uploaded_names_are_immutable(client, image_root):
+    _write(image_root / "_thumbs" / "album_1" / "a@480w.webp")
+    _write(image_root / "graves" / "grave_P-1-1_20260301_093000_0badcafe.jpg")
+
+    for url in ("/static/images/_thumbs/album_1/a@480w.webp",
+                "/static/images/graves/grave_P-1-1_20260301_093000_0badcafe.jpg"):
+        resp = client.get(url)
+        assert resp.status_code == 200
+        assert resp.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert not (image_root / "_thumbs" / "_thumbs").exists()
+
+
+def test_legacy_image_gets_etag_on_first_view_and_delete_invalidates(flask_app, client, image_root):
+    original = _write(image_root / "anh1" / "b.png")
+
+    assert client.get("/static/images/anh1/b.png").status_code == 200
+    assert (image_root / "_thumbs" / "anh1" / "b.png.etag").exists()
+
+    original.unlink()
+    with flask_app.test_request_context("/static/images/anh1/b.png"), pytest.raises(NotFound):
+        image_serving.send_image("anh1/b.png")
+    assert "anh1/b.png" not in image_serving._cache
+
+    _write(original, b"new")
+    assert client.get("/static/images/anh1/b.png").status_code == 200
+    image_serving.invalidate_image_path("/static/images/anh1/b.png")
+    assert "anh1/b.png" not in image_serving._cache
+
+
+def test_missing_or_invalid_paths(flask_app, client, image_root):
+    with flask_app.test_request_context("/static/images/album_1/nope.jpg"), pytest.raises(NotFound):
+        image_serving.send_image("album_1/nope.jpg")
+    assert image_serving.resolve_image("../static/images/x.jpg") is None
+    assert client.get("/images/..%2Fsecret.txt").status_code == 400
@@ -31,3 +31,35 @@ def test_get_thumbnail_url_falls_back_to_original_for_external_url():
 
     url = "https://example.com/image.jpg"
     assert get_thumbnail_url(url, create_if_missing=True) == url
+
+
+def test_srcset_manifest_is_parsed_once_until_it_changes(tmp_path, monkeypatch):
+    import os
+
+    from utils import image_thumbnails
+
+    base = tmp_path / "static" / "images"
+    monkeypatch.setattr(image_thumbnails, "get_images_base_dir", lambda: base)
+    monkeypatch.setattr(image_thumbnails, "_manifest_cache", image_thumbnails.OrderedDict())
+    original = base / "album_4" / "a.jpg"
+    _make_image(original, size=(600, 400))
+    manifest_path = image_thumbnails.derivative_target("album_4/a.jpg")[2]
+    image_thumbnails.ensure_derivatives_file(original, relative_path="album_4/a.jpg")
+
+    reads = []
+    real_read = image_thumbnails.read_derivative_manifest
+    monkeypatch.setattr(image_thumbnails, "read_derivative_manifest", lambda p: reads.append(p) or real_read(p))
+
+    first = image_thumbnails.get_image_srcset("album_4/a.jpg")
+    assert image_thumbnails.get_image_srcset("album_4/a.jpg") == first
+    assert len(reads) == 1
+
+    manifest_path.write_text(manifest_path.read_text(encoding="utf-8").replace('"width": 600', '"width": 601'), encoding="utf-8")
+    stat = manifest_path.stat()
+    os.utime(manifest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert image_thumbnails.get_image_srcset("album_4/a.jpg")["width"] == 601
+    assert len(reads) == 2
+
+    manifest_path.unlink()
+    assert image_thumbnails.get_image_srcset("album_4/a.jpg") is None
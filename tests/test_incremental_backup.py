@@ -0,0 +1,275 @@
+import json
+import os
+import re
+from datetime import datetime
+
+import pytest
+
+from services import incremental_backup
+from services.incremental_backup import CHAIN_STATE_FILE, create_incremental_backup, table_plan
+from services.sql_dump import open_dump_reader, read_manifest
+
+
+def _db():
+    return {
+        'persons': {
+            'columns': [('person_id', ''), ('full_name', ''), ('updated_at', 'on update current_timestamp')],
+            'key': ['person_id'],
+            'rows': [
+                {'person_id': 'P-1-1', 'full_name': 'Tộc', 'updated_at': datetime(2026, 1, 1, 7, 0)},
+                {'person_id': 'P-2-1', 'full_name': 'Hoa', 'updated_at': datetime(2026, 1, 1, 7, 0)},
+                {'person_id': 'P-2-2', 'full_name': 'Út', 'updated_at': datetime(2026, 1, 1, 8, 0)},
+            ],
+        },
+        'page_views': {
+            'columns': [('id', 'auto_increment'), ('path', '')],
+            'key': ['id'],
+            'rows': [{'id': i, 'path': f'/p/{i}'} for i in range(1, 4)],
+        },
+        'settings': {
+            'columns': [('name', ''), ('value', '')],
+            'key': [],
+            'rows': [{'name': 'theme', 'value': 'dark'}],
+        },
+        # Tự tăng nhưng bị UPDATE tại chỗ (gallery_service): không được dùng mốc id
+        'albums': {
+            'columns': [('id', 'auto_increment'), ('title', '')],
+            'key': ['id'],
+            'rows': [{'id': 1, 'title': 'Giỗ tổ'}],
+        },
+    }
+
+
+_SELECT_RE = re.compile(r"SELECT (.+?) FROM `(\w+)`(?: WHERE `(\w+)` (>=|>) %s)?")
+
+
+class FakeCursor:
+    def __init__(self, db, log=None):
+        self.db = db
+        self.log = log if log is not None else []
+        self.rows = []
+        self.description = None
+
+    def execute(self, sql, params=()):
+        self.log.append(sql)
+        self.rows = []
+        name = sql.split('`')[1] if '`' in sql else None
+        if sql == 'SHOW FULL TABLES':
+            self.rows = [(t, 'BASE TABLE') for t in self.db]
+        elif sql.startswith('SHOW COLUMNS'):
+            self.rows = [(f, 'varchar', 'YES', '', None, extra) for f, extra in self.db[name]['columns']]
+        elif sql.startswith('SHOW KEYS'):
+            self.rows = [(name, 0, 'PRIMARY', i + 1, c) for i, c in enumerate(self.db[name]['key'])]
+        elif sql.startswith('SHOW CREATE TABLE'):
+            cols = ', '.join(f for f, _ in self.db[name]['columns'])
+            self.rows = [(name, f'CREATE TABLE `{name}` ({cols}) AUTO_INCREMENT=99')]
+        elif sql.startswith('SELECT MAX'):
+            column = name
+            table = sql.split('`')[3]
+            values = [r[column] for r in self.db[table]['rows']]
+            self.rows = [(max(values) if values else None,)]
+        elif sql.startswith('SELECT'):
+            select, table, column, op = _SELECT_RE.match(sql).groups()
+            rows = self.db[table]['rows']
+            if column:
+                bound = params[0]
+                value = (lambda r: str(r[column])) if isinstance(bound, str) else (lambda r: r[column])
+                rows = [r for r in rows if value(r) > bound or (op == '>=' and value(r) == bound)]
+            names = [f for f, _ in self.db[table]['columns']] if select == '*' else [c.strip('`') for c in select.split(', ')]
+            self.description = [(n,) for n in names]
+            self.rows = [tuple(r[n] for n in names) for r in rows]
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.log = []
+
+    def cursor(self, buffered=False, dictionary=False):
+        return FakeCursor(self.db, self.log)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _read(path):
+    with open_dump_reader(path) as fh:
+        return fh.read()
+
+
+def test_table_plan_picks_watermark_per_table():
+    conn = FakeConnection(_db())
+
+    persons = table_plan(conn, 'persons')
+    page_views = table_plan(conn, 'page_views')
+    settings = table_plan(conn, 'settings')
+    albums = table_plan(conn, 'albums')
+
+    assert (persons['strategy'], persons['column'], persons['sync_keys']) == ('updated_at', 'updated_at', True)
+    assert (page_views['strategy'], page_views['column'], page_views['sync_keys']) == ('id', 'id', False)
+    assert (settings['strategy'], settings['sync_keys']) == ('full', False)
+    assert (albums['strategy'], albums['column'], albums['sync_keys']) == ('full', None, False)
+    # AUTO_INCREMENT=N không làm đổi chữ ký cấu trúc
+    assert 'AUTO_INCREMENT' not in str(persons)
+
+
+def test_second_run_dumps_only_changed_rows_and_syncs_deletes(tmp_path):
+    db = _db()
+    base = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='gzip', now=datetime(2026, 1, 2, 0, 0))
+    assert base['success'] and base['mode'] == 'base'
+    assert base['backup_filename'] == 'tbqc_backup_20260102_000000.sql.gz'
+
+    db['persons']['rows'][1].update(full_name='Hoa (sửa)', updated_at=datetime(2026, 1, 3, 9, 0))
+    del db['persons']['rows'][2]
+    db['page_views']['rows'].append({'id': 4, 'path': '/p/4'})
+
+    inc = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='gzip', now=datetime(2026, 1, 3, 10, 0))
+
+    assert inc['success'] and inc['mode'] == 'incremental'
+    assert inc['backup_filename'] == 'tbqc_backup_20260103_100000_inc001.sql.gz'
+    text = _read(tmp_path / inc['backup_filename'])
+    assert text.splitlines()[0] == '-- TBQC Database Backup (incremental)'
+    assert "REPLACE INTO `persons` (`person_id`, `full_name`, `updated_at`) VALUES\n('P-2-1', 'Hoa (sửa)'" in text
+    assert "'P-1-1', 'Tộc'" not in text
+    assert "INSERT IGNORE INTO `page_views` (`id`, `path`) VALUES\n(4, '/p/4');" in text
+    assert "INSERT INTO `_keys_persons` (`person_id`) VALUES\n('P-1-1'),\n('P-2-1');" in text
+    assert 'DELETE t FROM `persons` t LEFT JOIN `_keys_persons` k' in text
+    assert "DELETE FROM `settings`;" in text
+    assert 'DROP TABLE' not in text
+
+    manifest = read_manifest(tmp_path / inc['backup_filename'])
+    assert manifest['kind'] == 'incremental'
+    assert manifest['chain'] == [base['backup_filename'], inc['backup_filename']]
+    state = json.loads((tmp_path / CHAIN_STATE_FILE).read_text(encoding='utf-8'))
+    assert state['chain'] == manifest['chain']
+    assert state['watermarks']['page_views']['value'] == 4
+
+
+def test_missing_base_or_schema_change_restarts_or_rebuilds(tmp_path):
+    db = _db()
+    first = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 0, 0))
+
+    db['settings']['columns'].append(('scope', ''))
+    for row in db['settings']['rows']:
+        row['scope'] = 'site'
+    inc = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 1, 0))
+    text = _read(tmp_path / inc['backup_filename'])
+    assert 'DROP TABLE IF EXISTS `settings`;' in text
+    assert "('theme', 'dark', 'site')" in text
+
+    (tmp_path / first['backup_filename']).unlink()
+    again = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 2, 0))
+    assert again['mode'] == 'base' and again['chain'] == ['tbqc_backup_20260102_020000.sql']
+
+
+def test_failed_incremental_leaves_chain_untouched(tmp_path, monkeypatch):
+    db = _db()
+    create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 0, 0))
+    before = (tmp_path / CHAIN_STATE_FILE).read_text(encoding='utf-8')
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('mất kết nối')
+
+    monkeypatch.setattr(incremental_backup, 'dump_incremental', broken)
+    result = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 1, 0))
+
+    assert result['success'] is False
+    assert (tmp_path / CHAIN_STATE_FILE).read_text(encoding='utf-8') == before
+    assert sorted(p.name for p in tmp_path.glob('tbqc_backup_2026*')) == [
+        'tbqc_backup_20260102_000000.sql',
+        'tbqc_backup_20260102_000000.sql.manifest.json',
+    ]
+
+
+@pytest.mark.parametrize('mode, status', [('incremental', 200), ('weekly', 400)])
+def test_admin_backup_route_accepts_incremental_mode(flask_app, monkeypatch, tmp_path, mode, status):
+    import auth
+    import scripts.backup_database as bdb
+    from admin import backup_routes
+    from auth import User
+
+    calls = []
+    monkeypatch.setattr(auth, 'get_user_by_id', lambda uid: User(int(uid), 'admin.seed', 'admin', full_name='Admin Seed'))
+    monkeypatch.setattr(backup_routes, '_BACKUPS_DIR', tmp_path)
+    monkeypatch.setattr(backup_routes, 'log_activity', lambda *a, **kw: None)
+    monkeypatch.setattr(bdb, 'create_backup', lambda backup_dir=None, mode='full': calls.append(mode) or {
+        'success': True, 'backup_filename': 'tbqc_backup_20260103_100000_inc001.sql.gz',
+        'file_size': 512, 'mode': 'incremental', 'chain': ['a', 'b'],
+    })
+    client = flask_app.test_client()
+    with client.session_transaction() as s:
+        s['_user_id'] = '1'
+        s['_fresh'] = True
+
+    resp = client.post('/admin/api/backup', json={'mode': mode})
+
+    assert resp.status_code == status
+    if status == 200:
+        assert calls == ['incremental']
+        assert resp.get_json()['download_url'].endswith('_inc001.sql.gz')
+
+
+def test_concurrent_run_is_refused_until_the_lock_is_released_or_stale(tmp_path):
+    db = _db()
+    lock = tmp_path / incremental_backup.CHAIN_LOCK_FILE
+    lock.write_text('4242 2026-01-02T00:00:00\n', encoding='utf-8')
+
+    busy = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 0, 0))
+
+    assert busy['success'] is False and 'running' in busy['error']
+    assert not list(tmp_path.glob('tbqc_backup_2026*')) and not (tmp_path / CHAIN_STATE_FILE).exists()
+    assert lock.exists()
+
+    # Process giữ lock đã chết từ lâu: lock cũ bị bỏ, lần chạy mới nhả lock khi xong
+    old = lock.stat().st_mtime - incremental_backup.INCREMENTAL_LOCK_STALE_SECONDS - 1
+    os.utime(lock, (old, old))
+    result = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 0, 0))
+
+    assert result['success'] is True and result['mode'] == 'base'
+    assert not lock.exists()
+
+
+def test_in_place_update_of_auto_increment_table_reaches_the_next_incremental(tmp_path):
+    db = _db()
+    create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 0, 0))
+
+    db['albums']['rows'][0]['title'] = 'Giỗ tổ 2026'
+    inc = create_incremental_backup(tmp_path, lambda: FakeConnection(db), compression='none', now=datetime(2026, 1, 2, 1, 0))
+
+    text = _read(tmp_path / inc['backup_filename'])
+    assert 'DELETE FROM `albums`;' in text
+    assert "(1, 'Giỗ tổ 2026')" in text
+
+
+def test_watermarks_are_read_inside_the_dump_snapshot(tmp_path):
+    db = _db()
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection(db))
+        return connections[-1]
+
+    for hour in (0, 1):
+        create_incremental_backup(tmp_path, connect, compression='none', now=datetime(2026, 1, 2, hour, 0))
+
+    for conn in connections:
+        start = conn.log.index('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+        assert all(i > start for i, sql in enumerate(conn.log) if sql.startswith('SELECT MAX'))
+    assert [read_manifest(p)['watermarks']['page_views']['value'] for p in sorted(tmp_path.glob('*.sql'))] == [3, 3]
@@ -0,0 +1,121 @@
+from unittest.mock import MagicMock
+
+from services import genealogy_read_service
+from services.genealogy_graph import GenealogySnapshot
+from services.lineage_engine import (
+    LineageGraph,
+    children_names_distinct,
+    collation_key,
+    find_ancestors,
+    find_descendants,
+    resolve_ancestor_target,
+)
+
+
+def _person(name, gender, gen, fm=None):
+    return {'full_name': name, 'gender': gender, 'generation_level': gen, 'father_mother_id': fm,
+            'alias': None, 'status': 'Đã mất'}
+
+
+def _is_nguyen_phuoc(name):
+    return name.startswith('Nguyễn Phước')
+
+
+def _graph():
+    persons = {
+        'P-1-1': _person('Nguyễn Phước Tổ', 'Nam', 1),
+        'P-2-1': _person('Nguyễn Phước Ông', 'Nam', 2),
+        'P-2-2': _person('Bà Nội', 'Nữ', 2),
+        'P-3-1': _person('Nguyễn Phước Cha', 'Nam', 3),
+        'P-3-2': _person('Nguyễn Phước Cô', 'Nữ', 3),
+        'P-4-1': _person('Nguyễn Phước Con', 'Nam', 4),
+        'X-3-1': _person('Trần Rể', 'Nam', 3),
+        'P-4-2': _person('Trần Cháu Ngoại', 'Nữ', 4),
+    }
+    rows = [
+        ('P-2-1', 'P-1-1', 'father'),
+        ('P-3-1', 'P-2-1', 'father'),
+        ('P-3-1', 'P-2-2', 'mother'),
+        ('P-3-2', 'P-2-1', 'father'),
+        ('P-4-1', 'P-3-1', 'father'),
+        ('P-4-2', 'X-3-1', 'father'),
+        ('P-4-2', 'P-3-2', 'mother'),
+    ]
+    return LineageGraph(persons, rows)
+
+
+def test_collation_key_ignores_case_accents_and_trailing_spaces():
+    assert collation_key('Nguyễn Phước ') == collation_key('nguyen phuoc')
+    assert collation_key('Đặng') == collation_key('dang')
+    assert collation_key(None) == ''
+
+
+def test_resolve_target_uses_father_in_lineage():
+    graph = _graph()
+    assert resolve_ancestor_target(graph, 'P-4-1', _is_nguyen_phuoc) == ('P-3-1', None)
+
+
+def test_resolve_target_switches_to_maternal_grandfather():
+    graph = _graph()
+    # Cha không thuộc dòng → tra từ ông ngoại, cha được nối vào chuỗi sau
+    assert resolve_ancestor_target(graph, 'P-4-2', _is_nguyen_phuoc) == ('P-2-1', 'X-3-1')
+
+
+def test_resolve_target_falls_back_to_father_mother_id():
+    persons = {
+        'A': _person('Nguyễn Phước A', 'Nam', 1, fm='FM-1'),
+        'B': _person('Nguyễn Phước B', 'Nam', 2, fm='fm-1'),
+        'B2': _person('Nguyễn Phước B2', 'Nữ', 2, fm='FM-1'),
+        'C': _person('Nguyễn Phước C', 'Nam', 3, fm='FM-1'),
+    }
+    graph = LineageGraph(persons, [])
+
+    assert resolve_ancestor_target(graph, 'C', _is_nguyen_phuoc) == ('B', None)
+    assert [(r['person_id'], r['level']) for r in find_ancestors(graph, 'C', 5)] == [('B', 1), ('A', 2)]
+
+
+def test_find_ancestors_follows_father_line_and_respects_max_level():
+    graph = _graph()
+
+    rows = find_ancestors(graph, 'P-4-1', 10)
+    assert [(r['person_id'], r['level']) for r in rows] == [('P-3-1', 1), ('P-2-1', 2), ('P-1-1', 3)]
+    assert [r['person_id'] for r in find_ancestors(graph, 'P-4-1', 2)] == ['P-3-1', 'P-2-1']
+    assert find_ancestors(graph, 'MISSING', 5) == []
+
+
+def test_find_descendants_keeps_union_all_duplicates_and_sorts_by_name():
+    graph = _graph()
+    graph_dup = LineageGraph(graph.persons_by_id, [
+        ('P-3-2', 'P-2-1', 'father'), ('P-3-2', 'P-2-1', 'in_law'), ('P-3-1', 'P-2-1', 'father'),
+    ])
+
+    rows = find_descendants(graph_dup, 'P-2-1', 3)
+    assert [r['person_id'] for r in rows] == ['P-3-1', 'P-3-2', 'P-3-2']
+    assert [r['person_id'] for r in find_descendants(graph, 'P-2-1', 1)] == ['P-3-1', 'P-3-2']
+    levels = {r['person_id']: r['level'] for r in find_descendants(graph, 'P-1-1', 5)}
+    assert levels == {'P-2-1': 1, 'P-3-1': 2, 'P-3-2': 2, 'P-4-1': 3, 'P-4-2': 3}
+
+
+def test_children_names_distinct_matches_group_concat():
+    graph = _graph()
+    assert children_names_distinct(graph, 'P-2-1') == 'Nguyễn Phước Cha; Nguyễn Phước Cô'
+    assert children_names_distinct(graph, 'P-4-1') is None
+
+
+def test_api_descendants_uses_snapshot_without_stored_procedure(flask_app, monkeypatch):
+    graph = _graph()
+    snapshot = GenealogySnapshot(1, graph.persons_by_id, {}, {}, [], {}, relationship_rows=[
+        ('P-3-1', 'P-2-1', 'father'), ('P-3-2', 'P-2-1', 'father'),
+    ])
+    connection = MagicMock()
+    cursor = connection.cursor.return_value
+    monkeypatch.setattr(genealogy_read_service, 'get_db_connection', lambda: connection)
+    monkeypatch.setattr(genealogy_read_service, 'get_genealogy_snapshot', lambda cursor=None: snapshot)
+
+    with flask_app.test_request_context('/api/descendants/P-2-1?max_level=3'):
+        data = genealogy_read_service.get_descendants('P-2-1').get_json()
+        missing = genealogy_read_service.get_descendants('NOPE')
+
+    assert [d['person_id'] for d in data['descendants']] == ['P-3-1', 'P-3-2']
+    assert missing[1] == 404
+    cursor.callproc.assert_not_called()
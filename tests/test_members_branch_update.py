@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import unicodedata
+
+import pytest
+
+from services import members_branch_update as branch_update
+
+
+def _ci(name):
+    """Giống utf8mb4_unicode_ci: không phân biệt hoa thường lẫn dấu."""
+    return "".join(c for c in unicodedata.normalize("NFD", name.casefold()) if not unicodedata.combining(c))
+
+
+class FakeCursor:
+    def __init__(self, persons, branches):
+        self.persons = set(persons)
+        self.branches = dict(branches)
+        self.executed = []
+        self._rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+        self._rows = []
+        self.rowcount = 0
+        if sql.startswith("SELECT person_id FROM persons"):
+            self._rows = [{"person_id": pid} for pid in params if pid in self.persons]
+        elif sql.startswith("SELECT branch_id, branch_name FROM branches"):
+            wanted = {_ci(n) for n in params}
+            # Trả cách viết trong DB, không phải cách viết của tham số
+            self._rows = [{"branch_id": i, "branch_name": n} for n, i in self.branches.items() if _ci(n) in wanted]
+        elif sql.startswith("SELECT branch_id FROM branches WHERE branch_name = %s"):
+            self._rows = [{"branch_id": i} for n, i in self.branches.items() if _ci(n) == _ci(params[0])][:1]
+        elif sql.startswith("INSERT IGNORE INTO branches"):
+            for name in params:
+                if not any(_ci(n) == _ci(name) for n in self.branches):
+                    self.branches[name] = len(self.branches) + 100
+                    self.rowcount += 1
+        elif sql.startswith("UPDATE persons"):
+            self.rowcount = len([p for p in params if p in self.persons])
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+@pytest.fixture
+def schema(monkeypatch):
+    columns = {"branch_name", "branch_id"}
+    monkeypatch.setattr(branch_update, "table_columns", lambda table, names, cursor=None: set(names) & columns)
+    monkeypatch.setattr(branch_update, "has_table", lambda table, cursor=None: True)
+    return columns
+
+
+def test_assign_branches_resolves_names_once_and_updates_per_branch(schema):
+    cursor = FakeCursor(["P-2-1", "P-2-2", "P-2-3"], {"Một": 1})
+    assignments = {"P-2-1": "Một", "P-2-2": "Hai", "P-2-3": "Một", "P-9-9": "Ba"}
+
+    stats = branch_update.assign_branches(cursor, assignments)
+
+    assert {k: stats[k] for k in ("requested", "matched", "not_found", "branches_created", "changed", "statements")} == {
+        "requested": 4, "matched": 3, "not_found": 1, "branches_created": 1, "changed": 3, "statements": 2,
+    }
+    assert "resolve_ms" in stats and "write_ms" in stats
+    inserts = [e for e in cursor.executed if e[0].startswith("INSERT")]
+    # Chỉ tạo nhánh của người có thật ("Ba" thuộc P-9-9 không có trong DB)
+    assert inserts == [("INSERT IGNORE INTO branches (branch_name) VALUES (%s)", ("Hai",))]
+    updates = [e for e in cursor.executed if e[0].startswith("UPDATE")]
+    assert updates == [
+        ("UPDATE persons SET branch_name = %s, branch_id = %s WHERE person_id IN (%s)", ("Hai", 101, "P-2-2")),
+        ("UPDATE persons SET branch_name = %s, branch_id = %s WHERE person_id IN (%s, %s)", ("Một", 1, "P-2-1", "P-2-3")),
+    ]
+
+
+def test_assign_branches_batches_large_sets_and_handles_branch_name_only(schema):
+    schema.discard("branch_id")
+    people = [f"P-5-{i}" for i in range(5)]
+    cursor = FakeCursor(people, {})
+
+    stats = branch_update.assign_branches(cursor, {pid: "Bốn" for pid in people}, batch_size=2)
+
+    assert stats["statements"] == 3
+    assert stats["changed"] == 5
+    assert not [e for e in cursor.executed if "branches" in e[0]]
+    assert cursor.executed[-1] == ("UPDATE persons SET branch_name = %s WHERE person_id IN (%s)", ("Bốn", "P-5-4"))
+
+
+def test_assign_branches_requires_branch_columns(schema):
+    schema.clear()
+    with pytest.raises(ValueError):
+        branch_update.assign_branches(FakeCursor([], {}), {"P-1-1": "Một"})
+
+
+def test_assign_branches_matches_db_spelling_under_case_and_accent_insensitive_collation(schema):
+    cursor = FakeCursor(["P-3-1", "P-3-2"], {"Một": 1, "Hai": 2})
+
+    stats = branch_update.assign_branches(cursor, {"P-3-1": "một", "P-3-2": "Hài"})
+
+    assert stats["branches_created"] == 0
+    assert cursor.branches == {"Một": 1, "Hai": 2}
+    updates = [e for e in cursor.executed if e[0].startswith("UPDATE")]
+    assert updates == [
+        ("UPDATE persons SET branch_name = %s, branch_id = %s WHERE person_id IN (%s)", ("Hài", 2, "P-3-2")),
+        ("UPDATE persons SET branch_name = %s, branch_id = %s WHERE person_id IN (%s)", ("một", 1, "P-3-1")),
+    ]
+    # "một" ghép theo casefold; "Hài" chỉ collation coi là "Hai" → tra riêng một lần
+    lookups = [e for e in cursor.executed if e[0].startswith("SELECT branch_id FROM branches WHERE branch_name = %s")]
+    assert [e[1] for e in lookups] == [("Hài",)]
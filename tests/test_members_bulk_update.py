@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+import pytest
+
+from services import members_bulk_update as bulk
+from services.members_helpers import member_update_values
+
+COLUMNS = {"full_name", "gender", "status", "generation_level", "birth_date_solar", "phone", "email", "branch_name"}
+
+
+def _person(person_id, full_name, **extra):
+    row = {
+        "person_id": person_id, "full_name": full_name, "gender": "Nam", "status": "Đã mất",
+        "generation_level": 3, "birth_date_solar": date(1950, 1, 1), "phone": None, "email": None,
+        "branch_name": "Một", "father_mother_id": None,
+    }
+    row.update(extra)
+    return row
+
+
+class FakeCursor:
+    def __init__(self, persons, names=None):
+        self.persons = {p["person_id"]: p for p in persons}
+        self.names = names or {}
+        self.executed = []
+        self.many = []
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+        if "FROM persons WHERE person_id IN" in sql:
+            self._rows = [self.persons[pid] for pid in params if pid in self.persons]
+        elif "FROM persons WHERE full_name = %s" in sql:
+            pid = self.names.get(params[0])
+            self._rows = [{"person_id": pid}] if pid else []
+        else:
+            self._rows = []
+
+    def executemany(self, sql, rows):
+        self.many.append((sql, list(rows)))
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def audit(monkeypatch):
+    logged = []
+    monkeypatch.setattr(bulk, "table_columns", lambda table, names, cursor=None: set(names) & COLUMNS)
+    monkeypatch.setattr(bulk, "has_table", lambda table, cursor=None: False)
+    monkeypatch.setattr(
+        bulk, "load_relationship_data",
+        lambda cursor, person_ids=None: {
+            "parent_data": {"P-3-1": {"father_name": "Cha Cũ"}}, "children_map": {}, "siblings_map": {},
+            "spouse_data_from_table": {}, "spouse_data_from_marriages": {}, "spouse_data_from_csv": {},
+        },
+    )
+    monkeypatch.setattr("audit_log.log_activities", logged.append)
+    return logged
+
+
+def test_plan_validates_whole_file_with_batched_reads(audit):
+    cursor = FakeCursor([_person("P-3-1", "An"), _person("P-3-2", "Bình"), _person("P-3-3", "Chi")])
+    rows = [
+        ("P-3-1", {"full_name": "An Mới", "birth_date_solar": "1950"}),
+        ("P-3-2", {"gender": "X"}),
+        ("P-3-3", {"full_name": "Chi", "birth_date_solar": date(1950, 1, 1)}),
+        ("P-9-9", {"full_name": "Không có"}),
+        ("abc", {"full_name": "Sai ID"}),
+    ]
+
+    plan = bulk.plan_bulk_update(cursor, rows)
+
+    assert list(plan.updates) == ["P-3-1"]
+    assert plan.updates["P-3-1"]["fields"]["full_name"] == "An Mới"
+    assert plan.summary()["unchanged_count"] == 1
+    assert plan.skipped_count == 1
+    assert [(e["row"], e["error"]) for e in plan.errors] == [("P-3-2", "Invalid gender value"), ("abc", "ID không hợp lệ")]
+    # Một SELECT IN (...) cho cả file, không SELECT từng dòng, không ghi gì
+    assert len(cursor.executed) == 1
+    assert sorted(cursor.executed[0][1]) == ["P-3-1", "P-3-2", "P-3-3", "P-9-9"]
+    assert cursor.many == []
+
+
+def test_apply_uses_executemany_one_commit_and_one_audit_batch(audit):
+    cursor = FakeCursor(
+        [_person("P-3-1", "An"), _person("P-3-2", "Bình")],
+        names={"Cha Mới": "P-2-7"},
+    )
+    rows = [
+        ("P-3-1", {"phone": 912345678, "father_name": "Cha Mới"}),
+        ("P-3-2", {"phone": "0987", "email": "b@x.vn"}),
+    ]
+    conn = FakeConnection()
+
+    plan = bulk.plan_bulk_update(cursor, rows)
+    result = bulk.apply_bulk_update(conn, cursor, plan, chunk_size=0)
+
+    assert result == {"updated": ["P-3-1", "P-3-2"], "failed": []}
+    assert conn.commits == 1
+    updates = [m for m in cursor.many if m[0].startswith("UPDATE persons")]
+    assert len(updates) == 1 and len(updates[0][1]) == 2
+    assert updates[0][1][0][-1] == "P-3-1" and "912345678" in updates[0][1][0]
+    assert [m[0].split()[0] for m in cursor.many[1:]] == ["DELETE", "INSERT"]
+    assert cursor.many[2][1] == [("P-3-1", "P-2-7", "father")]
+    assert len(audit) == 1
+    assert [e["target_id"] for e in audit[0]] == ["P-3-1", "P-3-2"]
+    assert audit[0][1]["after_data"]["email"] == "b@x.vn"
+
+
+def test_chunked_commit_rolls_back_only_the_failing_chunk(audit, monkeypatch):
+    cursor = FakeCursor([_person("P-3-1", "An"), _person("P-3-2", "Bình")])
+    plan = bulk.plan_bulk_update(cursor, [("P-3-1", {"full_name": "A2"}), ("P-3-2", {"full_name": "B2"})])
+    conn = FakeConnection()
+    real_executemany = cursor.executemany
+
+    def executemany(sql, rows):
+        if rows and rows[0][-1] == "P-3-2":
+            raise RuntimeError("deadlock")
+        real_executemany(sql, rows)
+
+    monkeypatch.setattr(cursor, "executemany", executemany)
+
+    result = bulk.apply_bulk_update(conn, cursor, plan, chunk_size=1)
+
+    assert result == {"updated": ["P-3-1"], "failed": ["P-3-2"]}
+    assert (conn.commits, conn.rollbacks) == (1, 1)
+    assert plan.errors[-1]["person_id"] == "P-3-2"
+    assert [e["target_id"] for e in audit[0]] == ["P-3-1"]
+
+
+def test_member_update_values_normalizes_excel_cells():
+    values = member_update_values(
+        {"birth_date_solar": 1950, "phone": 912345678, "branch_name": "2", "alias": ""},
+        {"birth_date_solar", "phone", "branch_name", "alias"},
+    )
+    assert values == {"birth_date_solar": "1950-01-01", "phone": "912345678", "branch_name": "Hai", "alias": None}
+    with pytest.raises(ValueError):
+        member_update_values({"email": "khong-hop-le"}, {"email"})
+
+
+def test_relation_text_schema_is_prepared_before_writes_and_errors_roll_back(audit, monkeypatch):
+    from services import person_service
+
+    cursor = FakeCursor([_person("P-3-1", "An"), _person("P-3-2", "Bình")], names={"Cha Mới": "P-2-7"})
+    plan = bulk.plan_bulk_update(cursor, [
+        ("P-3-1", {"father_name": "Cha Mới"}),
+        ("P-3-2", {"full_name": "Bình Mới"}),
+    ])
+    conn = FakeConnection()
+    prepared = []
+
+    def prepare(cur, wanted):
+        # ALTER TABLE (commit ngầm) phải chạy khi chưa có câu ghi nào
+        prepared.append((set(wanted), len(cursor.many)))
+        return {"person_id", "father_name"}
+
+    real_execute = cursor.execute
+
+    def execute(sql, params=()):
+        if sql.startswith("INSERT INTO spouse_sibling_children"):
+            raise RuntimeError("lock wait timeout")
+        real_execute(sql, params)
+
+    monkeypatch.setattr(person_service, "_prepare_relation_text_columns", prepare)
+    monkeypatch.setattr(cursor, "execute", execute)
+
+    result = bulk.apply_bulk_update(conn, cursor, plan, chunk_size=0)
+
+    assert prepared == [({"father_name"}, 0)]
+    assert not [sql for sql, _ in cursor.executed if "information_schema" in sql or sql.startswith("ALTER")]
+    # Lỗi ghi text quan hệ không bị nuốt: cả transaction rollback, không dòng nào báo thành công
+    assert result == {"updated": [], "failed": ["P-3-1", "P-3-2"]}
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+    assert audit == []
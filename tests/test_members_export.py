@@ -0,0 +1,112 @@
+import csv
+import io
+
+import pytest
+from openpyxl import load_workbook
+
+import db
+from blueprints import members_portal
+from services.members_export import EXPORT_COLUMNS, iter_csv, select_columns, write_xlsx
+
+MEMBERS = [
+    {'person_id': 'P-1-1', 'full_name': 'Nguyễn Phước Tộc', 'generation_number': 1, 'spouses': None},
+    {'person_id': 'P-2-1', 'full_name': 'Tôn Nữ Hoa', 'generation_number': 2, 'spouses': 'Lê Văn A'},
+    {'person_id': 'P-2-2', 'full_name': 'Nguyễn Văn "Út"', 'generation_number': 2, 'spouses': None},
+]
+
+
+@pytest.fixture
+def fake_chunks(monkeypatch):
+    consumed = []
+
+    def fake_iter_members_chunks(chunk_size, connection=None):
+        for start in range(0, len(MEMBERS), 2):
+            consumed.append(start)
+            yield MEMBERS[start:start + 2]
+
+    monkeypatch.setattr(db, 'get_db_connection', lambda: object())
+    monkeypatch.setattr(members_portal, 'iter_members_chunks', fake_iter_members_chunks)
+    return consumed
+
+
+def test_select_columns_defaults_to_all_and_keeps_requested_order():
+    assert select_columns(None) == EXPORT_COLUMNS
+    assert select_columns(' full_name, person_id,full_name ') == [('full_name', 'Họ và tên'), ('person_id', 'ID')]
+    with pytest.raises(ValueError):
+        select_columns('person_id,password')
+
+
+def test_csv_header_is_sent_before_any_chunk_is_read():
+    pulled = []
+
+    def chunks():
+        pulled.append(1)
+        yield MEMBERS
+
+    stream = iter_csv(chunks(), [('person_id', 'ID'), ('full_name', 'Họ và tên')])
+
+    assert next(stream) == '\ufeffID,Họ và tên\r\n'.encode('utf-8')
+    assert pulled == []
+    rows = list(csv.reader(io.StringIO(b''.join(stream).decode('utf-8'))))
+    assert rows[2] == ['P-2-2', 'Nguyễn Văn "Út"']
+
+
+def test_write_only_xlsx_has_styled_header_and_rows():
+    buf = io.BytesIO()
+
+    assert write_xlsx(iter([MEMBERS[:2], MEMBERS[2:]]), [('person_id', 'ID'), ('generation_number', 'Đời')], buf) == 3
+
+    ws = load_workbook(io.BytesIO(buf.getvalue())).active
+    assert ws.title == 'Danh sách thành viên'
+    assert ws['A1'].value == 'ID' and ws['A1'].font.bold
+    assert [c.value for c in ws['B']] == ['Đời', 1, 2, 2]
+
+
+def test_api_export_csv_streams_selected_columns(members_session_client, fake_chunks):
+    resp = members_session_client.get('/api/members/export?format=csv&columns=person_id,spouses')
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/csv'
+    assert resp.headers['Content-Disposition'].endswith('.csv')
+    rows = list(csv.reader(io.StringIO(resp.get_data().decode('utf-8-sig'))))
+    assert rows == [['ID', 'Vợ/Chồng'], ['P-1-1', ''], ['P-2-1', 'Lê Văn A'], ['P-2-2', '']]
+    assert fake_chunks == [0, 2]
+
+
+def test_api_export_csv_sends_header_before_reading_members(members_session_client, fake_chunks):
+    resp = members_session_client.get('/api/members/export?format=csv', buffered=False)
+
+    stream = iter(resp.response)
+    assert next(stream).decode('utf-8').startswith('\ufeffID,')
+    assert fake_chunks == []
+    assert len(b''.join(stream).decode('utf-8').splitlines()) == len(MEMBERS)
+    assert fake_chunks == [0, 2]
+    resp.close()
+
+
+def test_excel_export_route_keeps_full_column_set(members_session_client, fake_chunks):
+    resp = members_session_client.get('/members/export/excel')
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    ws = load_workbook(io.BytesIO(resp.data)).active
+    assert [c.value for c in ws[1]] == [header for _, header in EXPORT_COLUMNS]
+    assert ws.max_row == 4
+
+
+def test_api_export_validates_request(client, members_session_client, fake_chunks):
+    assert client.get('/api/members/export').status_code == 401
+    assert members_session_client.get('/api/members/export?format=pdf').status_code == 400
+    resp = members_session_client.get('/api/members/export?columns=person_id,password_hash')
+    assert resp.status_code == 400
+    assert 'password_hash' in resp.get_json()['error']
+    assert fake_chunks == []
+
+
+def test_api_export_returns_500_when_database_is_unavailable(members_session_client, monkeypatch):
+    monkeypatch.setattr(db, 'get_db_connection', lambda: None)
+
+    resp = members_session_client.get('/api/members/export?format=csv')
+
+    assert resp.status_code == 500
+    assert resp.get_json()['success'] is False
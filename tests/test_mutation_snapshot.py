@@ -0,0 +1,221 @@
+import gzip
+import json
+import re
+from datetime import date, datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from services import mutation_snapshot
+from services.mutation_snapshot import (
+    SnapshotError,
+    SnapshotNotFound,
+    capture_person_snapshot,
+    prune_snapshots,
+    restore_snapshot,
+)
+
+
+def _db():
+    return {
+        'persons': {
+            'columns': ['person_id', 'full_name', 'birth_date_solar', 'grave_info'],
+            'key': 'person_id',
+            'rows': [
+                ['P-1-1', 'Tộc', date(1900, 1, 1), None],
+                ['P-2-1', 'Hoa', date(1930, 5, 2), 'Nghĩa trang Vỹ Dạ'],
+                ['P-2-2', 'Út', None, None],
+            ],
+        },
+        'relationships': {
+            'columns': ['id', 'parent_id', 'child_id', 'created_at'],
+            'key': 'id',
+            'rows': [
+                [1, 'P-1-1', 'P-2-1', datetime(2026, 1, 1, 7, 0)],
+                [2, 'P-1-1', 'P-2-2', datetime(2026, 1, 1, 7, 0)],
+            ],
+        },
+        'marriages': {
+            'columns': ['id', 'husband_id', 'wife_id'],
+            'key': 'id',
+            'rows': [[1, 'P-1-1', 'P-0-9']],
+        },
+        'family_units': {
+            'columns': ['id', 'father_id', 'mother_id'],
+            'key': 'id',
+            'rows': [[7, 'P-1-1', None]],
+        },
+    }
+
+
+_IN_RE = re.compile(r'`(\w+)` IN \(')
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.description = None
+
+    def execute(self, sql, params=()):
+        self.conn.executed.append(sql)
+        self.rows = []
+        if sql.startswith('SELECT * FROM'):
+            table = self.conn.db[sql.split('`')[1]]
+            ids = set(params)
+            idx = [table['columns'].index(c) for c in _IN_RE.findall(sql)]
+            self.description = [(c,) for c in table['columns']]
+            self.rows = [tuple(r) for r in table['rows'] if any(r[i] in ids for i in idx)]
+
+    def executemany(self, sql, seq):
+        table = self.conn.db[sql.split('`')[1]]
+        key = table['columns'].index(table['key'])
+        assert 'ON DUPLICATE KEY UPDATE' in sql
+        for values in seq:
+            table['rows'] = [r for r in table['rows'] if r[key] != values[key]] + [list(values)]
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.executed = []
+        self.committed = False
+
+    def cursor(self, buffered=False, dictionary=False):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_schema(monkeypatch):
+    monkeypatch.setattr(mutation_snapshot, 'has_table', lambda table, cursor=None: table in _db())
+    monkeypatch.setattr(
+        mutation_snapshot, 'table_columns',
+        lambda table, names, cursor=None: {n for n in names if n in _db()[table]['columns']},
+    )
+
+
+def _delete(db, person_ids):
+    db['persons']['rows'] = [r for r in db['persons']['rows'] if r[0] not in person_ids]
+    for table in ('relationships', 'marriages'):
+        db[table]['rows'] = [r for r in db[table]['rows'] if not set(r[1:3]) & set(person_ids)]
+    db['family_units']['rows'] = [[r[0], None if r[1] in person_ids else r[1], r[2]] for r in db['family_units']['rows']]
+
+
+def test_capture_only_reads_rows_that_reference_the_deleted_people(tmp_path):
+    conn = FakeConnection(_db())
+
+    snap = capture_person_snapshot(
+        conn, ['P-2-1', 'P-2-1'], reason='delete_persons_batch', actor='admin',
+        directory=tmp_path, now=datetime(2026, 3, 1, 9, 30),
+    )
+
+    assert re.match(r'^snap-20260301-093000-[0-9a-f]{8}$', snap['snapshot_id'])
+    assert snap['rows'] == {'persons': 1, 'relationships': 1}
+    bundle = json.loads(gzip.decompress((tmp_path / snap['filename']).read_bytes()))
+    assert bundle['person_ids'] == ['P-2-1'] and bundle['actor'] == 'admin'
+    assert bundle['tables']['persons']['rows'] == [['P-2-1', 'Hoa', '1930-05-02', 'Nghĩa trang Vỹ Dạ']]
+    assert bundle['tables']['relationships']['rows'][0][3] == '2026-01-01 07:00:00'
+    assert 'SELECT * FROM `relationships` WHERE `parent_id` IN (%s) OR `child_id` IN (%s)' in conn.executed
+    assert not any('SELECT * FROM `persons` ' in sql and 'OR' in sql for sql in conn.executed)
+
+
+def test_restore_undoes_batch_delete_once(tmp_path):
+    db = _db()
+    original = json.loads(json.dumps(db, default=str))
+    snap = capture_person_snapshot(FakeConnection(db), ['P-1-1', 'P-2-2'], reason='t', directory=tmp_path)
+    _delete(db, ['P-1-1', 'P-2-2'])
+
+    conn = FakeConnection(db)
+    result = restore_snapshot(conn, snap['snapshot_id'], directory=tmp_path)
+
+    assert conn.committed
+    assert conn.executed[0] == 'SET FOREIGN_KEY_CHECKS = 0' and conn.executed[-1] == 'SET FOREIGN_KEY_CHECKS = 1'
+    assert result['rows'] == {'persons': 2, 'family_units': 1, 'relationships': 2, 'marriages': 1}
+    restored = json.loads(json.dumps(db, default=str))
+    for table, data in original.items():
+        assert sorted(data['rows'], key=str) == sorted(restored[table]['rows'], key=str)
+    with pytest.raises(SnapshotError):
+        restore_snapshot(FakeConnection(db), snap['snapshot_id'], directory=tmp_path)
+
+
+def test_unknown_or_malformed_snapshot_ids_are_not_found(tmp_path):
+    for snapshot_id in ('snap-20260101-000000-deadbeef', '../tbqc_backup_chain', ''):
+        with pytest.raises(SnapshotNotFound):
+            restore_snapshot(FakeConnection(_db()), snapshot_id, directory=tmp_path)
+
+
+def test_prune_keeps_newest_bundles(tmp_path):
+    names = [f'snap-2026010{i}-000000-0000000{i}.json.gz' for i in range(1, 5)]
+    for name in names:
+        (tmp_path / name).write_bytes(b'')
+
+    assert prune_snapshots(tmp_path, keep=2) == names[:2]
+    assert sorted(p.name for p in tmp_path.iterdir()) == names[2:]
+
+
+@pytest.mark.parametrize('error, status', [(None, 200), (SnapshotNotFound('x'), 404), (SnapshotError('y'), 409)])
+def test_undo_route_restores_and_invalidates_genealogy(client, monkeypatch, error, status):
+    from services import person_service
+
+    calls = []
+    monkeypatch.setattr(person_service, 'get_members_password', lambda: 'pw')
+    monkeypatch.setattr(person_service, 'get_db_connection', MagicMock)
+    monkeypatch.setattr(person_service, 'invalidate_genealogy_snapshot', lambda: calls.append('invalidate'))
+    monkeypatch.setattr(person_service, 'log_activity', lambda *a, **kw: calls.append(a[0]))
+
+    def fake_restore(connection, snapshot_id):
+        if error:
+            raise error
+        return {'snapshot_id': snapshot_id, 'person_ids': ['P-2-1'], 'rows': {'persons': 1}}
+
+    monkeypatch.setattr(person_service, 'restore_snapshot', fake_restore)
+
+    assert client.post('/api/persons/batch/undo', json={'snapshot_id': 's', 'password': 'nope'}).status_code == 403
+    resp = client.post('/api/persons/batch/undo', json={'snapshot_id': 'snap-1', 'password': 'pw'})
+
+    assert resp.status_code == status
+    if status == 200:
+        assert resp.get_json()['message'] == 'Đã khôi phục 1 thành viên'
+        assert calls == ['invalidate', 'RESTORE_PERSONS_SNAPSHOT']
+    else:
+        assert calls == []
+
+
+def test_batch_delete_snapshots_affected_rows_instead_of_full_backup(client, monkeypatch):
+    import scripts.backup_database as bdb
+    from services import person_service
+
+    captured = []
+    monkeypatch.setattr(person_service, 'get_members_password', lambda: 'pw')
+    monkeypatch.setattr(person_service, 'get_db_connection', MagicMock)
+    monkeypatch.setattr(person_service, 'invalidate_genealogy_snapshot', lambda: None)
+    monkeypatch.setattr(person_service, 'log_activity', lambda *a, **kw: None)
+    monkeypatch.setattr(bdb, 'create_backup', lambda **kw: pytest.fail('không được backup cả database'))
+    monkeypatch.setattr(
+        person_service, 'capture_person_snapshot',
+        lambda conn, ids, reason, actor=None: captured.append(ids) or {
+            'snapshot_id': 'snap-20260301-093000-0badcafe',
+            'filename': 'snap-20260301-093000-0badcafe.json.gz', 'rows': {'persons': 2},
+        },
+    )
+
+    resp = client.delete('/api/persons/batch', json={'person_ids': ['P-2-1', 'x', 'P-2-2'], 'password': 'pw'})
+
+    body = resp.get_json()
+    assert resp.status_code == 200 and body['backup_created']
+    assert captured == [['P-2-1', 'P-2-2']]
+    assert body['snapshot_id'] == 'snap-20260301-093000-0badcafe'
+    assert body['undo_url'] == '/api/persons/batch/undo'
@@ -0,0 +1,240 @@
+import gzip
+from datetime import date, datetime
+from decimal import Decimal
+
+import db
+from services import page_view_archive, page_views, schema_registry
+
+
+class _StatsCursor:
+    def __init__(self, log):
+        self.log = log
+        self.result = None
+
+    def execute(self, sql, params=None):
+        self.log.append((sql, params))
+        if "SHOW TABLES LIKE 'page_views'" in sql:
+            self.result = {'Tables_in_db': 'page_views'}
+        elif 'FROM page_view_daily' in sql:
+            self.result = {'total': Decimal(44), 'month': Decimal(11), 'today': 2}
+        elif 'information_schema.TABLES' in sql:
+            self.result = {'b': 256}
+        else:
+            self.result = None
+
+    def fetchone(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class _StatsConnection:
+    def __init__(self, log):
+        self.log = log
+
+    def cursor(self, dictionary=False, buffered=False):
+        return _StatsCursor(self.log)
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def test_log_stats_read_daily_rollup_instead_of_counting_raw_rows(monkeypatch):
+    log = []
+    monkeypatch.setattr(page_views, '_page_view_daily_ready', True)
+    monkeypatch.setattr(db, 'get_db_connection', lambda: _StatsConnection(log))
+
+    payload = page_views.get_log_stats_payload()
+
+    assert payload['success'] is True
+    assert (payload['page_views_total'], payload['page_views_month'], payload['page_views_today']) == (44, 11, 2)
+    assert payload['page_views_bytes'] == 256
+    assert not any('COUNT(' in sql for sql, _ in log)
+    rollup_params = next(params for sql, params in log if 'FROM page_view_daily' in sql)
+    assert rollup_params[0] == rollup_params[1].replace(day=1)
+
+
+class _ArchiveCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.table = conn.table
+        self.result = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        if sql.startswith('SELECT MAX(id)'):
+            ids = [r[0] for r in self.table if r[-1] < params[0]]
+            self.result = [(max(ids) if ids else None,)]
+        elif sql.startswith('SELECT id,'):
+            last_id, max_id, cutoff, limit = params
+            rows = [r for r in self.table if last_id < r[0] <= max_id and r[-1] < cutoff]
+            self.result = rows[:limit]
+        elif sql.startswith('INSERT INTO page_view_daily'):
+            assert 'GREATEST(views, VALUES(views))' in sql
+            start, end = params
+            count = sum(1 for r in self.table if start <= r[-1] < end)
+            if count:
+                day = start.date()
+                self.conn.daily[day] = max(self.conn.daily.get(day, 0), count)
+        elif sql.startswith('DELETE'):
+            if self.conn.fail_deletes is not None:
+                if self.conn.fail_deletes == 0:
+                    raise RuntimeError('connection lost')
+                self.conn.fail_deletes -= 1
+            max_id, start, end, limit = params
+            doomed = [r for r in self.table if r[0] <= max_id and start <= r[-1] < end][:limit]
+            self.table[:] = [r for r in self.table if r not in doomed]
+            self.rowcount = len(doomed)
+        else:
+            self.result = []
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class _ArchiveConnection:
+    """Giả lập transaction: rollback trả bảng và rollup về lần commit gần nhất."""
+
+    def __init__(self, table, daily=None, fail_deletes=None):
+        self.table = table
+        self.daily = daily if daily is not None else {}
+        self.fail_deletes = fail_deletes
+        self.commits = 0
+        self._committed = (list(table), dict(self.daily))
+
+    def cursor(self, dictionary=False, buffered=False):
+        return _ArchiveCursor(self)
+
+    def commit(self):
+        self.commits += 1
+        self._committed = (list(self.table), dict(self.daily))
+
+    def rollback(self):
+        self.table[:] = self._committed[0]
+        self.daily.clear()
+        self.daily.update(self._committed[1])
+
+
+def _row(row_id, created_at):
+    return (row_id, f'/p{row_id}', 'GET', '1.1.1.1', "UA 'quoted'", None, None, created_at)
+
+
+def test_archive_moves_old_rows_to_monthly_gzip_and_keeps_rollup(monkeypatch, tmp_path):
+    table = [
+        _row(1, datetime(2026, 3, 30, 23, 0)),
+        _row(2, datetime(2026, 4, 2, 8, 0)),
+        _row(3, datetime(2026, 4, 17, 23, 59)),
+        _row(4, datetime(2026, 4, 18, 0, 0)),
+    ]
+    monkeypatch.setattr(page_view_archive, 'ARCHIVE_BATCH', 2)
+    monkeypatch.setattr(page_view_archive, '_ensure_page_view_daily', lambda conn: True)
+    monkeypatch.setattr(schema_registry, 'has_table', lambda table_name, cursor=None: True)
+    conn = _ArchiveConnection(table)
+
+    result = page_view_archive.archive_page_views(
+        30, conn=conn, archive_dir=tmp_path, now=datetime(2026, 5, 18, 9, 0),
+    )
+
+    assert result['success'] is True
+    assert result['cutoff'] == '2026-04-18T00:00:00'
+    assert conn.daily == {date(2026, 3, 30): 1, date(2026, 4, 2): 1, date(2026, 4, 17): 1}
+    assert result['rows_archived'] == {'2026-03': 1, '2026-04': 2}
+    assert result['rows_deleted'] == 3
+    assert [r[0] for r in table] == [4]
+
+    with gzip.open(tmp_path / 'page_views-2026-04.sql.gz', 'rt', encoding='utf-8') as f:
+        april = f.read()
+    assert "SET time_zone = '+07:00';" in april
+    assert 'INSERT IGNORE INTO `page_views`' in april
+    assert "(2, '/p2', 'GET', '1.1.1.1', 'UA \\'quoted\\'', NULL, NULL, '2026-04-02 08:00:00')" in april
+    assert '/p4' not in april
+
+
+def test_archive_appends_to_existing_month_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(page_view_archive, '_ensure_page_view_daily', lambda conn: True)
+    monkeypatch.setattr(schema_registry, 'has_table', lambda table_name, cursor=None: True)
+
+    for row_id, day in ((1, 2), (2, 3)):
+        page_view_archive.archive_page_views(
+            1, conn=_ArchiveConnection([_row(row_id, datetime(2026, 4, day, 10, 0))]),
+            archive_dir=tmp_path, now=datetime(2026, 4, day + 2, 12, 0),
+        )
+
+    with gzip.open(tmp_path / 'page_views-2026-04.sql.gz', 'rt', encoding='utf-8') as f:
+        content = f.read()
+    assert "'/p1'" in content and "'/p2'" in content
+
+
+def test_archive_after_a_crashed_delete_never_shrinks_daily_counts(monkeypatch, tmp_path):
+    # 2/4 đã bị một lần chạy cũ xoá dở: rollup 4 lượt, chỉ còn 1 dòng thô
+    table = [_row(1, datetime(2026, 4, 2, 9, 0))]
+    table += [_row(row_id, datetime(2026, 4, 3, 10, row_id)) for row_id in range(2, 5)]
+    table += [_row(row_id, datetime(2026, 4, 4, 11, row_id)) for row_id in range(5, 7)]
+    daily = {date(2026, 4, 2): 4, date(2026, 4, 3): 3, date(2026, 4, 4): 2}
+    monkeypatch.setattr(page_view_archive, 'ARCHIVE_BATCH', 2)
+    monkeypatch.setattr(page_view_archive, '_ensure_page_view_daily', lambda conn: True)
+    monkeypatch.setattr(schema_registry, 'has_table', lambda table_name, cursor=None: True)
+    now = datetime(2026, 4, 20, 12, 0)
+
+    # Mất kết nối ở lô DELETE thứ hai của ngày 3/4
+    crashed = page_view_archive.archive_page_views(
+        1, conn=_ArchiveConnection(table, daily, fail_deletes=2), archive_dir=tmp_path, now=now,
+    )
+
+    assert crashed['success'] is False
+    assert [r[0] for r in table] == [2, 3, 4, 5, 6]
+    assert daily == {date(2026, 4, 2): 4, date(2026, 4, 3): 3, date(2026, 4, 4): 2}
+
+    result = page_view_archive.archive_page_views(
+        1, conn=_ArchiveConnection(table, daily), archive_dir=tmp_path, now=now,
+    )
+
+    assert result['success'] is True
+    assert result['rows_deleted'] == 5
+    assert table == []
+    assert daily == {date(2026, 4, 2): 4, date(2026, 4, 3): 3, date(2026, 4, 4): 2}
+
+
+def test_archive_rejects_non_positive_retention():
+    result = page_view_archive.archive_page_views(0, conn=_ArchiveConnection([]))
+
+    assert result['success'] is False
+    assert not result['rows_deleted']
+
+
+def test_rebuild_only_touches_days_before_cutoff():
+    executed = []
+
+    class _Cursor:
+        def execute(self, sql, params=None):
+            executed.append((sql, params))
+
+        def fetchall(self):
+            return []
+
+        def close(self):
+            pass
+
+    class _Connection:
+        def cursor(self, buffered=False):
+            return _Cursor()
+
+        def commit(self):
+            executed.append(('commit', None))
+
+    page_views.rebuild_page_view_daily(_Connection(), before=datetime(2026, 4, 18))
+
+    sql, params = executed[-2]
+    assert 'WHERE created_at < %s' in sql and 'ON DUPLICATE KEY UPDATE views = VALUES(views)' in sql
+    assert params == (datetime(2026, 4, 18),)
+    assert executed[-1] == ('commit', None)
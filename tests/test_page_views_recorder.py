@@ -0,0 +1,118 @@
+import time
+from datetime import date, datetime
+
+import pytest
+
+from services import page_views
+from services.page_views import PageViewRecorder
+
+
+class _FakeCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, sql, params=None):
+        self.log.append(('execute', sql))
+
+    def executemany(self, sql, rows):
+        kind = 'daily' if 'page_view_daily' in sql else 'executemany'
+        self.log.append((kind, list(rows)))
+
+    def close(self):
+        pass
+
+
+class _FakeConnection:
+    def __init__(self, log):
+        self.log = log
+
+    def cursor(self, buffered=False, dictionary=False):
+        return _FakeCursor(self.log)
+
+    def commit(self):
+        self.log.append(('commit', None))
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def _batches(log, kind='executemany'):
+    return [rows for entry, rows in log if entry == kind]
+
+
+@pytest.fixture(autouse=True)
+def _rollup_table_ready(monkeypatch):
+    monkeypatch.setattr(page_views, '_page_view_daily_ready', True)
+
+
+def test_record_dedups_same_ip_and_path_within_window():
+    log = []
+    recorder = PageViewRecorder(flush_rows=100, flush_seconds=60, connect=lambda: _FakeConnection(log))
+
+    assert recorder.record('/a', '1.1.1.1', 'ua', None, None)
+    assert not recorder.record('/a', '1.1.1.1', 'ua', None, None)
+    assert recorder.record('/b', '1.1.1.1', 'ua', None, None)
+    assert recorder.record('/a', None, 'ua', None, 7)
+    recorder.close(timeout=1)
+
+    rows = [row for batch in _batches(log) for row in batch]
+    assert [(r[0], r[2], r[5]) for r in rows] == [('/a', '1.1.1.1', None), ('/b', '1.1.1.1', None), ('/a', None, 7)]
+    assert ('execute', "SET SESSION time_zone = '+00:00'") in log
+    assert recorder.written == 3
+
+
+def test_background_thread_flushes_multi_row_batches():
+    log = []
+    recorder = PageViewRecorder(flush_rows=2, flush_seconds=0.05, connect=lambda: _FakeConnection(log))
+
+    for i in range(5):
+        recorder.record(f'/p{i}', '1.1.1.1', None, None, None)
+    deadline = time.monotonic() + 2
+    while recorder.written < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    recorder.close(timeout=1)
+
+    assert recorder.written == 5
+    assert all(len(batch) <= 2 for batch in _batches(log))
+
+
+def test_flush_adds_views_to_daily_rollup_by_vietnam_date():
+    log = []
+    recorder = PageViewRecorder(flush_rows=100, flush_seconds=60, connect=lambda: _FakeConnection(log))
+    rows = [
+        ('/a', 'GET', 'ip', None, None, None, datetime(2026, 1, 31, 16, 59, 59)),
+        ('/b', 'GET', 'ip', None, None, None, datetime(2026, 1, 31, 17, 0, 0)),
+        ('/c', 'GET', 'ip', None, None, None, datetime(2026, 2, 1, 3, 0, 0)),
+    ]
+
+    recorder._write(rows)
+
+    assert _batches(log, 'daily') == [[(date(2026, 1, 31), 1), (date(2026, 2, 1), 2)]]
+    assert [entry for entry, _ in log][-1] == 'commit'
+
+
+def test_full_queue_drops_instead_of_blocking():
+    recorder = PageViewRecorder(flush_rows=100, flush_seconds=60, queue_max=1, connect=lambda: None)
+
+    assert recorder.record('/a', 'ip', None, None, None)
+    assert not recorder.record('/b', 'ip', None, None, None)
+    assert recorder.dropped == 1
+
+
+def test_before_request_only_enqueues_html_gets(flask_app, monkeypatch):
+    calls = []
+
+    class _Recorder:
+        def record(self, *args):
+            calls.append(args)
+
+    monkeypatch.setattr(page_views, '_recorder', _Recorder())
+    with flask_app.test_request_context('/genealogy', headers={'X-Forwarded-For': '9.9.9.9, 10.0.0.1'}):
+        page_views._record_page_view()
+    with flask_app.test_request_context('/api/persons'):
+        page_views._record_page_view()
+
+    assert calls == [('/genealogy', '9.9.9.9', None, None, None)]
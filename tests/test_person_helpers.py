@@ -163,10 +163,6 @@ def test_get_preferred_spouse_names_prefers_marriages():
     assert get_preferred_spouse_names(relationship_data, "P-1") == ["Normalized Spouse"]
 
 
-def test_person_service_keeps_load_relationship_data_alias():
-    assert person_service.load_relationship_data is load_relationship_data
-
-
 # ---------------------------------------------------------------------------
 # load_relationship_data
 # ---------------------------------------------------------------------------
@@ -195,8 +191,9 @@ def test_load_relationship_data_empty_db_returns_empty_dicts(mock_cursor):
 
 
 def test_load_relationship_data_populates_parent_data_from_relationships(mock_cursor):
-    # fetchone=None: ssc absent; fetchall order: marriages, relationships, person_name_map
+    # fetchall order: schema registry (rỗng → ssc absent), marriages, relationships, person_name_map
     fetch_seq = [
+        [],
         [],
         [
             {'child_id': 'p-1-1', 'parent_id': 'p-0-1', 'relation_type': 'father',
@@ -212,8 +209,9 @@ def test_load_relationship_data_populates_parent_data_from_relationships(mock_cu
 
 
 def test_load_relationship_data_builds_children_map_from_relationships(mock_cursor):
-    # fetchall order: marriages, relationships, person_name_map
+    # fetchall order: schema registry, marriages, relationships, person_name_map
     fetch_seq = [
+        [],
         [],
         [
             {'child_id': 'p-1-1', 'parent_id': 'p-0-1', 'relation_type': 'father',
@@ -229,9 +227,10 @@ def test_load_relationship_data_builds_children_map_from_relationships(mock_curs
 
 
 def test_load_relationship_data_deduplicates_spouse_from_marriages(mock_cursor):
-    # fetchone=None means ssc table absent → no ssc fetchall calls
-    # fetchall call order: marriages, relationships, person_name_map
+    # Schema registry rỗng → ssc table absent → no ssc fetchall calls
+    # fetchall call order: schema registry, marriages, relationships, person_name_map
     fetch_seq = [
+        [],
         [
             {'person_id': 'p-1-1', 'spouse_person_id': 'p-1-2', 'spouse_name': 'Vợ A'},
             {'person_id': 'p-1-1', 'spouse_person_id': 'p-1-2', 'spouse_name': 'Vợ A'},
@@ -246,6 +245,54 @@ def test_load_relationship_data_deduplicates_spouse_from_marriages(mock_cursor):
     assert result['spouse_data_from_marriages'].get('p-1-1') == ['Vợ A']
 
 
+def test_load_relationship_data_scoped_reads_only_requested_people_and_neighbors(monkeypatch):
+    import services.person_helpers as person_helpers
+
+    monkeypatch.setattr(person_helpers, 'has_table', lambda table_name, cursor=None: False)
+    relationships = [
+        {'child_id': 'P-2-1', 'parent_id': 'P-1-1', 'relation_type': 'father', 'parent_name': 'Cha', 'child_name': 'Con A'},
+        {'child_id': 'P-2-2', 'parent_id': 'P-1-1', 'relation_type': 'father', 'parent_name': 'Cha', 'child_name': 'Con B'},
+        {'child_id': 'P-3-1', 'parent_id': 'P-2-1', 'relation_type': 'father', 'parent_name': 'Con A', 'child_name': 'Cháu'},
+    ]
+    executed = []
+
+    class _Cursor:
+        def execute(self, sql, params=None):
+            executed.append((sql, params))
+            if 'SELECT DISTINCT parent_id' in sql:
+                self.rows = [{'parent_id': 'P-1-1'}]
+            elif 'FROM relationships r' in sql:
+                self.rows = relationships
+            elif 'FROM marriages m' in sql:
+                self.rows = [{'person_id': 'P-2-1', 'spouse_person_id': 'P-2-9', 'spouse_name': 'Vợ A'}]
+            elif 'FROM persons' in sql:
+                names = {'P-1-1': 'Cha', 'P-2-1': 'Con A', 'P-2-2': 'Con B', 'P-3-1': 'Cháu'}
+                self.rows = [{'person_id': pid, 'full_name': names[pid]} for pid in params]
+            else:
+                self.rows = []
+
+        def fetchall(self):
+            return self.rows
+
+    result = load_relationship_data(_Cursor(), person_ids=['P-2-1'])
+
+    assert result['parent_data']['P-2-1']['father_name'] == 'Cha'
+    assert result['children_map']['P-2-1'] == ['Cháu']
+    assert result['siblings_map'] == {'P-2-1': ['Con B']}
+    assert result['spouse_data_from_marriages'] == {'P-2-1': ['Vợ A']}
+    assert all(params for sql, params in executed), 'mọi query đều phải lọc theo IN (...)'
+    rel_sql, rel_params = next((sql, params) for sql, params in executed if 'FROM relationships r' in sql)
+    assert 'r.child_id IN (%s) OR r.parent_id IN (%s, %s)' in rel_sql
+    assert rel_params == ('P-2-1', 'P-1-1', 'P-2-1')
+
+
+def test_load_relationship_data_empty_scope_skips_queries(mock_cursor):
+    result = load_relationship_data(mock_cursor, person_ids=[None, ''])
+
+    assert result['children_map'] == {}
+    mock_cursor.execute.assert_not_called()
+
+
 # ---------------------------------------------------------------------------
 # get_or_create_location / generation / branch
 # ---------------------------------------------------------------------------
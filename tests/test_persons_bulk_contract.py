@@ -0,0 +1,166 @@
+"""Contract /api/persons: siblings/spouse nạp bulk — số query không phụ thuộc số người."""
+import pytest
+
+from services import person_service
+
+DIVORCED = 'Đã ly dị'
+
+
+class _FakeGenealogyCursor:
+    """Cursor giả trả lời các query của get_persons() từ dữ liệu trong bộ nhớ."""
+
+    def __init__(self, persons, relationships, marriages):
+        self.persons = persons
+        self.relationships = relationships
+        self.marriages = marriages
+        self.queries = []
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        self.queries.append(sql)
+        params = list(params or ())
+        by_id = {p['person_id']: p for p in self.persons}
+        if 'information_schema.COLUMNS' in sql:
+            self._rows = []
+        elif 'COUNT(*)' in sql:
+            self._rows = [{'c': len(self.persons)}]
+        elif 'GROUP_CONCAT' in sql:
+            rows = sorted(self.persons, key=lambda p: (p['generation_level'], p['full_name']))
+            if 'LIMIT' in sql:
+                limit, offset = params
+                rows = rows[offset:offset + limit]
+            self._rows = [dict(p) for p in rows]
+        elif sql.startswith('SELECT child_id, parent_id, relation_type FROM relationships'):
+            self._rows = [
+                dict(r) for r in self.relationships
+                if not params or r['child_id'] in params
+            ]
+        elif 'JOIN relationships r ON s.person_id = r.child_id' in sql:
+            rows = [
+                {
+                    'parent_id': r['parent_id'],
+                    'relation_type': r['relation_type'],
+                    'person_id': r['child_id'],
+                    'full_name': by_id[r['child_id']]['full_name'],
+                }
+                for r in self.relationships
+                if r['child_id'] in by_id and (not params or r['parent_id'] in params)
+            ]
+            self._rows = sorted(rows, key=lambda r: r['full_name'])
+        elif 'FROM marriages m' in sql:
+            rows = []
+            for m in self.marriages:
+                if m['status'] == DIVORCED:
+                    continue
+                if params and m['husband_id'] not in params and m['wife_id'] not in params:
+                    continue
+                husband = by_id.get(m['husband_id'])
+                wife = by_id.get(m['wife_id'])
+                rows.append({
+                    'husband_id': m['husband_id'],
+                    'wife_id': m['wife_id'],
+                    'husband_person_id': husband and husband['person_id'],
+                    'husband_name': husband and husband['full_name'],
+                    'wife_person_id': wife and wife['person_id'],
+                    'wife_name': wife and wife['full_name'],
+                })
+            self._rows = rows
+        else:
+            raise AssertionError(f'Unexpected query: {sql}')
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
+
+
+class _FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self, dictionary=False):
+        return self._cursor
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def _person(person_id, full_name, generation_level):
+    return {'person_id': person_id, 'full_name': full_name, 'generation_level': generation_level}
+
+
+def _family(extra_children=0):
+    persons = [
+        _person('P-1-1', 'Cha A', 1),
+        _person('P-1-2', 'Me B', 1),
+        _person('P-1-3', 'Vo Cu C', 1),
+        _person('P-2-1', 'Con Hai', 2),
+        _person('P-2-2', 'Con Ba', 2),
+        _person('P-2-3', 'Con Mot', 2),
+        _person('P-2-4', 'Con Bon', 2),
+    ]
+    relationships = []
+    for child_id in ('P-2-1', 'P-2-2', 'P-2-3'):
+        relationships.append({'child_id': child_id, 'parent_id': 'P-1-1', 'relation_type': 'father'})
+        relationships.append({'child_id': child_id, 'parent_id': 'P-1-2', 'relation_type': 'mother'})
+    relationships.append({'child_id': 'P-2-4', 'parent_id': 'P-1-1', 'relation_type': 'father'})
+    for i in range(extra_children):
+        child_id = f'P-3-{i + 1}'
+        persons.append(_person(child_id, f'Chau {i + 1:03d}', 3))
+        relationships.append({'child_id': child_id, 'parent_id': 'P-2-1', 'relation_type': 'father'})
+    marriages = [
+        {'husband_id': 'P-1-1', 'wife_id': 'P-1-2', 'status': 'Đang kết hôn'},
+        {'husband_id': 'P-1-1', 'wife_id': 'P-1-3', 'status': DIVORCED},
+        {'husband_id': 'P-1-1', 'wife_id': 'P-9-9', 'status': 'Đang kết hôn'},
+    ]
+    return persons, relationships, marriages
+
+
+def _call_get_persons(flask_app, monkeypatch, cursor, query_string=''):
+    monkeypatch.setattr(person_service, 'get_db_connection', lambda: _FakeConnection(cursor))
+    with flask_app.test_request_context(f'/api/persons{query_string}'):
+        resp = person_service.get_persons()
+        return resp.get_json()
+
+
+def test_get_persons_siblings_and_spouses_match_per_person_semantics(flask_app, monkeypatch):
+    cursor = _FakeGenealogyCursor(*_family())
+    data = _call_get_persons(flask_app, monkeypatch, cursor)
+    by_id = {p['person_id']: p for p in data}
+
+    assert by_id['P-2-1']['siblings'] == 'Con Ba; Con Bon; Con Mot'
+    assert by_id['P-2-4']['siblings'] == 'Con Ba; Con Hai; Con Mot'
+    assert by_id['P-1-1']['siblings'] is None
+    assert by_id['P-1-1']['spouse'] == 'Me B'
+    assert by_id['P-1-2']['spouse'] == 'Cha A'
+    assert by_id['P-1-3']['spouse'] is None
+    assert by_id['P-2-1']['spouse'] is None
+
+
+@pytest.mark.parametrize('extra_children', [0, 25])
+def test_get_persons_query_count_is_constant(flask_app, monkeypatch, extra_children):
+    cursor = _FakeGenealogyCursor(*_family(extra_children))
+    data = _call_get_persons(flask_app, monkeypatch, cursor)
+
+    assert len(data) == 7 + extra_children
+    # schema registry (nạp lần đầu) + main + parents + siblings + spouses
+    assert len(cursor.queries) == 5
+
+
+def test_get_persons_paginated_scopes_bulk_queries_to_page(flask_app, monkeypatch):
+    cursor = _FakeGenealogyCursor(*_family(extra_children=10))
+    data = _call_get_persons(flask_app, monkeypatch, cursor, '?paginated=1&per_page=3&page=2')
+
+    assert data['total'] == 17
+    assert [p['person_id'] for p in data['items']] == ['P-2-2', 'P-2-4', 'P-2-1']
+    assert data['items'][2]['siblings'] == 'Con Ba; Con Bon; Con Mot'
+    # schema registry (nạp lần đầu) + COUNT + main + parents + siblings + spouses
+    assert len(cursor.queries) == 6
+    assert 'IN (%s,%s,%s)' in cursor.queries[3]
@@ -0,0 +1,78 @@
+import pytest
+
+import db
+
+
+class _FakeConnection:
+    def __init__(self, name):
+        self.name = name
+        self.in_transaction = False
+        self.rollbacks = 0
+        self.closed = False
+
+    def is_connected(self):
+        return not self.closed
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    connections = []
+
+    def _open():
+        connection = _FakeConnection(f'conn-{len(connections)}')
+        connections.append(connection)
+        return connection
+
+    monkeypatch.setattr(db, '_open_connection', _open)
+    return connections
+
+
+def test_sequential_callers_share_one_connection_per_request(flask_app, opened):
+    with flask_app.test_request_context('/'):
+        first = db.get_db_connection()
+        opened[0].in_transaction = True
+        first.close()
+        second = db.get_db_connection()
+        assert second.name == 'conn-0'
+        assert opened[0].rollbacks == 1
+        assert not opened[0].closed
+        second.close()
+        second.close()
+        db.close_request_connection()
+
+    assert len(opened) == 1
+    assert opened[0].closed
+
+
+def test_nested_caller_gets_its_own_connection(flask_app, opened):
+    with flask_app.test_request_context('/'):
+        handler_conn = db.get_db_connection()
+        audit_conn = db.get_db_connection()
+        assert audit_conn is opened[1]
+        audit_conn.close()
+        handler_conn.close()
+        db.close_request_connection()
+
+    assert [c.closed for c in opened] == [True, True]
+
+
+def test_teardown_leaves_leased_connection_to_its_holder(flask_app, opened):
+    with flask_app.test_request_context('/'):
+        streaming = db.get_db_connection()
+        db.close_request_connection()
+        assert not opened[0].closed
+        streaming.close()
+
+    assert opened[0].closed
+
+
+def test_outside_request_returns_plain_connection(opened):
+    connection = db.get_db_connection()
+    assert connection is opened[0]
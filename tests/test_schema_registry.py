@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+
+from services import schema_registry
+from services.schema_registry import (
+    has_column,
+    has_table,
+    invalidate_schema_registry,
+    refresh_schema_registry,
+    table_columns,
+)
+
+
+def _cursor(rows):
+    cursor = MagicMock()
+    cursor.fetchall.return_value = rows
+    return cursor
+
+
+def test_registry_loads_once_and_answers_from_memory():
+    cursor = _cursor([
+        {'TABLE_NAME': 'persons', 'COLUMN_NAME': 'person_id'},
+        {'TABLE_NAME': 'persons', 'COLUMN_NAME': 'branch_name'},
+        ('activity_logs', 'log_id'),
+    ])
+
+    assert has_table('persons', cursor=cursor)
+    assert has_table('activity_logs', cursor=cursor)
+    assert not has_table('branches', cursor=cursor)
+    assert has_column('persons', 'BRANCH_NAME', cursor=cursor)
+    assert not has_column('persons', 'branch_id', cursor=cursor)
+    assert not has_column('branches', 'branch_id', cursor=cursor)
+    assert table_columns('persons', ('branch_name', 'email'), cursor=cursor) == {'branch_name'}
+    assert cursor.execute.call_count == 1
+
+
+def test_refresh_reloads_and_invalidate_forces_reload():
+    assert not has_table('branches', cursor=_cursor([]))
+
+    cursor = _cursor([{'TABLE_NAME': 'branches', 'COLUMN_NAME': 'branch_id'}])
+    assert refresh_schema_registry(cursor)
+    assert has_table('branches')
+
+    invalidate_schema_registry()
+    assert not has_table('branches', cursor=_cursor([]))
+
+
+def test_load_failure_probes_directly_without_caching():
+    cursor = MagicMock()
+    cursor.execute.side_effect = [RuntimeError('no information_schema access'), None]
+    cursor.fetchone.return_value = {'Tables_in_db': 'activity_logs'}
+
+    assert has_table('activity_logs', cursor=cursor)
+    assert schema_registry._tables is None
@@ -0,0 +1,94 @@
+from unittest.mock import MagicMock
+
+from services import person_service
+from services.genealogy_graph import GenealogySnapshot
+from services.search_index import SearchIndex, find_person_ids, get_search_index
+
+
+PERSONS = {
+    'P-7-654': {'person_id': 'P-7-654', 'full_name': 'Nguyễn Phước Văn', 'alias': 'Mệ Văn', 'generation_level': 7},
+    'P-7-65': {'person_id': 'P-7-65', 'full_name': 'Văn Thị Đào', 'alias': None, 'generation_level': 7},
+    'P-3-1': {'person_id': 'P-3-1', 'full_name': 'Nguyễn Văn', 'alias': None, 'generation_level': 3},
+    'P-5-2': {'person_id': 'P-5-2', 'full_name': 'Tôn Nữ Hoa', 'alias': 'Vân', 'generation_level': 5},
+}
+
+
+def test_search_folds_diacritics_and_matches_token_prefixes():
+    index = SearchIndex(PERSONS)
+
+    assert index.search('nguyen van') == ['P-3-1', 'P-7-654']
+    assert index.search('NG PH') == ['P-7-654']
+    assert index.search('dao') == ['P-7-65']
+    assert index.search('xyz') == []
+
+
+def test_ranking_prefers_exact_name_then_diacritics_then_alias():
+    index = SearchIndex(PERSONS)
+
+    # 'Văn' đúng dấu lên trước 'Vân' (bí danh, cùng dạng không dấu)
+    assert index.search('Văn') == ['P-7-65', 'P-3-1', 'P-7-654', 'P-5-2']
+    assert index.search('Nguyễn Văn')[0] == 'P-3-1'
+
+
+def test_person_id_variants_and_generation_filter():
+    index = SearchIndex(PERSONS)
+
+    assert index.search('p-7-654')[0] == 'P-7-654'
+    assert index.search('7-654') == ['P-7-654']
+    assert index.search('654') == ['P-7-654']
+    assert set(index.search('65')) == {'P-7-654', 'P-7-65'}
+    assert index.search('van', generation_level=3) == ['P-3-1']
+    assert index.search('van', predicate=lambda p: p['generation_level'] > 4, limit=1) == ['P-7-65']
+
+
+def test_rebuild_only_retokenizes_changed_persons():
+    first = SearchIndex(PERSONS)
+    changed = dict(PERSONS)
+    changed['P-3-1'] = dict(PERSONS['P-3-1'], full_name='Nguyễn Văn Bình')
+    changed['P-9-1'] = {'person_id': 'P-9-1', 'full_name': 'Lê Bình', 'alias': None, 'generation_level': 9}
+
+    second = SearchIndex(changed, previous=first)
+
+    assert second.reused == 3
+    assert second.docs['P-7-654'] is first.docs['P-7-654']
+    assert second.search('binh') == ['P-3-1', 'P-9-1']
+
+
+def test_index_is_built_once_per_snapshot():
+    snapshot = GenealogySnapshot(1, PERSONS, {}, {}, [], {})
+
+    first = get_search_index(snapshot)
+    assert get_search_index(snapshot) is first
+    assert snapshot.search_index is first
+
+
+def test_find_person_ids_defers_to_sql_when_snapshot_disabled(monkeypatch):
+    monkeypatch.setenv('GENEALOGY_SNAPSHOT_TTL', '0')
+
+    assert find_person_ids(MagicMock(), 'van') is None
+
+
+def test_search_endpoint_reads_ranked_ids_by_primary_key(flask_app, monkeypatch):
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [
+        {'person_id': 'P-3-1', 'full_name': 'Nguyễn Văn', 'generation_level': 3},
+        {'person_id': 'P-7-654', 'full_name': 'Nguyễn Phước Văn', 'generation_level': 7},
+    ]
+    connection = MagicMock()
+    connection.cursor.return_value = cursor
+    monkeypatch.setattr(person_service, 'get_db_connection', lambda: connection)
+    monkeypatch.setattr(person_service, 'find_person_ids', lambda cursor, q, generation_level=None, limit=50: ['P-7-654', 'P-3-1'])
+    monkeypatch.setattr(
+        person_service,
+        'get_relationship_data',
+        lambda cursor, person_ids=None: {'children_map': {}, 'siblings_map': {}, 'spouse_data_from_table': {}, 'spouse_data_from_marriages': {}, 'spouse_data_from_csv': {}},
+    )
+
+    with flask_app.test_request_context('/api/search?q=nguyen%20van'):
+        response = person_service.search_persons()
+
+    sql, params = cursor.execute.call_args[0]
+    assert 'p.person_id IN (%s, %s)' in sql
+    assert 'LIKE' not in sql
+    assert params == ('P-7-654', 'P-3-1', 50)
+    assert [row['person_id'] for row in response.get_json()] == ['P-7-654', 'P-3-1']
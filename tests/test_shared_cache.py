@@ -0,0 +1,152 @@
+from unittest.mock import MagicMock
+
+import pytest
+import redis
+from flask import Flask
+from flask_caching import Cache
+
+import extensions
+from services import genealogy_graph
+from services.genealogy_graph import get_genealogy_snapshot, invalidate_genealogy_snapshot
+from services.shared_cache import bump_data_version, get_data_version, versioned_key
+
+
+class FakeRedis:
+    """Đủ lệnh cho cachelib.RedisCache; dữ liệu dùng chung giữa các 'worker' trong test."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value):
+        self.data[name] = value
+        return True
+
+    def setex(self, name, time, value):
+        self.data[name] = value
+        return True
+
+    def setnx(self, name, value):
+        if name in self.data:
+            return False
+        self.data[name] = value
+        return True
+
+    def expire(self, name, time):
+        return name in self.data
+
+    def delete(self, *names):
+        return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+    def exists(self, name):
+        return int(name in self.data)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = FakeRedis()
+    monkeypatch.setattr(redis, 'from_url', lambda url, db=None: server)
+    monkeypatch.setenv('REDIS_URL', 'redis://cache.internal:6379/0')
+    monkeypatch.delenv('CACHE_BACKEND', raising=False)
+    monkeypatch.delenv('CACHE_REDIS_URL', raising=False)
+    return server
+
+
+def _worker_cache():
+    """Một worker Gunicorn: app + Cache riêng, backend theo _cache_config()."""
+    app = Flask(__name__)
+    return Cache(app, config=extensions._cache_config())
+
+
+def test_cache_backend_selection(monkeypatch, tmp_path):
+    monkeypatch.delenv('CACHE_REDIS_URL', raising=False)
+    monkeypatch.delenv('REDIS_URL', raising=False)
+    monkeypatch.delenv('CACHE_BACKEND', raising=False)
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path))
+    assert extensions._cache_config()['CACHE_TYPE'] == 'FileSystemCache'
+    assert extensions._cache_config()['CACHE_DIR'] == str(tmp_path)
+
+    monkeypatch.setenv('REDIS_URL', 'redis://cache.internal:6379/0')
+    config = extensions._cache_config()
+    assert config['CACHE_TYPE'] == 'RedisCache'
+    assert config['CACHE_REDIS_URL'] == 'redis://cache.internal:6379/0'
+
+    monkeypatch.setenv('CACHE_BACKEND', 'simple')
+    assert extensions._cache_config()['CACHE_TYPE'] == 'SimpleCache'
+
+
+def test_write_in_one_worker_invalidates_members_payload_in_all(monkeypatch, fake_redis):
+    worker_a, worker_b = _worker_cache(), _worker_cache()
+
+    monkeypatch.setattr(extensions, 'cache', worker_a)
+    key_a = versioned_key('api_members_data')
+    worker_a.set(key_a, {'success': True, 'data': ['old']}, timeout=300)
+
+    monkeypatch.setattr(extensions, 'cache', worker_b)
+    assert versioned_key('api_members_data') == key_a
+    assert worker_b.get(key_a) == {'success': True, 'data': ['old']}
+    bump_data_version()
+
+    monkeypatch.setattr(extensions, 'cache', worker_a)
+    key_after = versioned_key('api_members_data')
+    assert key_after != key_a
+    assert worker_a.get(key_after) is None
+    assert all(key.startswith('tbqc:') for key in fake_redis.data)
+
+
+def test_filesystem_backend_is_shared_between_workers(monkeypatch, tmp_path):
+    monkeypatch.setenv('CACHE_BACKEND', 'filesystem')
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path))
+    worker_a, worker_b = _worker_cache(), _worker_cache()
+
+    monkeypatch.setattr(extensions, 'cache', worker_a)
+    token = get_data_version()
+    monkeypatch.setattr(extensions, 'cache', worker_b)
+
+    assert get_data_version() == token
+    assert bump_data_version() != token
+    monkeypatch.setattr(extensions, 'cache', worker_a)
+    assert get_data_version() != token
+
+
+def test_snapshot_rebuilds_after_write_in_another_worker(monkeypatch, fake_redis):
+    builds = []
+
+    def fake_load_persons_data(cursor):
+        builds.append(1)
+        return {'P-1-1': {'person_id': 'P-1-1', 'generation_level': 1}}
+
+    monkeypatch.setattr(genealogy_graph, 'load_persons_data', fake_load_persons_data)
+    monkeypatch.setattr(genealogy_graph, 'build_children_map', lambda cursor: {})
+    monkeypatch.setattr(genealogy_graph, 'build_parent_map', lambda cursor: {})
+    monkeypatch.setattr(genealogy_graph, 'load_relationship_data', lambda cursor: {})
+    monkeypatch.delenv('GENEALOGY_SNAPSHOT_TTL', raising=False)
+    cursor = MagicMock()
+    cursor.fetchall.return_value = []
+    this_worker, other_worker = _worker_cache(), _worker_cache()
+    monkeypatch.setattr(extensions, 'cache', this_worker)
+
+    first = get_genealogy_snapshot(cursor)
+    assert get_genealogy_snapshot(cursor) is first
+
+    monkeypatch.setattr(extensions, 'cache', other_worker)
+    invalidate_genealogy_snapshot()
+    monkeypatch.setattr(extensions, 'cache', this_worker)
+    # Mô phỏng worker khác: bỏ tăng version cục bộ, chỉ token dùng chung đổi
+    monkeypatch.setattr(genealogy_graph, '_version', first.version)
+    genealogy_graph._snapshot = first
+
+    second = get_genealogy_snapshot(cursor)
+    assert second is not first
+    assert len(builds) == 2
+
+
+def test_unavailable_backend_falls_back_to_plain_key(monkeypatch):
+    broken = MagicMock()
+    broken.get.side_effect = redis.ConnectionError('down')
+    monkeypatch.setattr(extensions, 'cache', broken)
+
+    assert get_data_version() is None
+    assert versioned_key('api_members_data') == 'api_members_data'
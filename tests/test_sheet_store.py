@@ -0,0 +1,118 @@
+import csv
+import os
+
+import pytest
+
+from services import sheet_store
+from services.sheet_store import SheetStore, get_sheet_store
+
+HEADERS = ['ID', 'Họ và tên', 'Tên bố', 'Tên mẹ', 'Mộ phần']
+ROWS = [
+    ['1', 'Nguyễn Phước Tộc', '', '', 'Vỹ Dạ'],
+    ['2', 'Tôn Nữ Hoa', 'Nguyễn Phước Tộc', 'Trần Thị Lan', ''],
+    ['3', 'Tôn Nữ Hoa', 'Lê Văn A', 'Hồ Thị B', 'An Cựu'],
+]
+
+
+@pytest.fixture
+def sheet(tmp_path):
+    path = tmp_path / 'Data_TBQC_Sheet3.csv'
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        writer.writerows(ROWS)
+    return path
+
+
+@pytest.fixture
+def count_loads(monkeypatch):
+    loads = []
+    original = SheetStore._load
+
+    def counting(self):
+        loads.append(self.path)
+        original(self)
+
+    monkeypatch.setattr(SheetStore, '_load', counting)
+    return loads
+
+
+def _bump(path, text):
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        f.write(text)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+
+def test_lookup_is_indexed_and_parses_once_until_file_changes(sheet, count_loads):
+    store = SheetStore(sheet)
+
+    assert [r['ID'] for r in store.lookup('Họ và tên', '  tôn nữ hoa ')] == ['2', '3']
+    assert [r['ID'] for r in store.lookup('Tên bố', 'nguyễn phước tộc')] == ['2']
+    assert store.lookup('ID', '3')[0]['Mộ phần'] == 'An Cựu'
+    assert len(store.rows()) == 3
+    assert len(count_loads) == 1
+
+    _bump(sheet, '4,Nguyễn Văn Út,Lê Văn A,,\r\n')
+
+    assert store.lookup('Họ và tên', 'nguyễn văn út')[0]['ID'] == '4'
+    assert len(count_loads) == 2
+
+
+def test_returned_rows_are_copies(sheet):
+    store = SheetStore(sheet)
+
+    store.rows()[0]['Họ và tên'] = 'đã sửa'
+    store.lookup('ID', '1')[0]['ID'] = '99'
+
+    assert store.lookup('ID', '1')[0]['Họ và tên'] == 'Nguyễn Phước Tộc'
+
+
+def test_write_rows_appends_new_tail_and_rewrites_edits_atomically(sheet, count_loads, monkeypatch):
+    store = SheetStore(sheet)
+    rows = store.rows()
+    before = sheet.read_bytes()
+
+    rows.append({'ID': '4', 'Họ và tên': 'Út', 'Tên bố': '', 'Tên mẹ': '', 'Mộ phần': ''})
+    store.write_rows(rows)
+
+    assert sheet.read_bytes() == before + '4,Út,,,\r\n'.encode('utf-8')
+    assert store.lookup('Họ và tên', 'út')[0]['ID'] == '4'
+
+    replaced = []
+    monkeypatch.setattr(sheet_store.os, 'replace', lambda src, dst: replaced.append(dst) or os.rename(src, dst))
+    rows = store.rows()
+    rows.pop(0)
+    store.write_rows(rows)
+
+    assert replaced == [str(sheet)]
+    with open(sheet, encoding='utf-8', newline='') as f:
+        assert [r['ID'] for r in csv.DictReader(f)] == ['2', '3', '4']
+    assert store.lookup('ID', '1') == []
+    # Ghi từ chính store không làm parse lại file
+    assert len(count_loads) == 1
+    assert not [p for p in sheet.parent.iterdir() if '.tmp-' in p.name]
+
+
+def test_append_adds_missing_final_newline(tmp_path):
+    path = tmp_path / 'sheet1.csv'
+    path.write_bytes('STT,HoTen\r\n1,A'.encode('utf-8'))
+    store = SheetStore(path)
+
+    store.write_rows(store.rows() + [{'STT': '2', 'HoTen': 'B'}])
+
+    assert path.read_bytes() == b'STT,HoTen\r\n1,A\r\n2,B\r\n'
+
+
+def test_get_sheet3_data_by_name_uses_shared_store(sheet, monkeypatch, count_loads):
+    from services import person_service
+
+    monkeypatch.setattr(person_service, 'ROOT_DIR', str(sheet.parent))
+    monkeypatch.setattr(sheet_store, '_stores', {})
+
+    assert person_service.get_sheet3_data_by_name('Nguyễn Phước Tộc')['sheet3_grave'] == 'Vỹ Dạ'
+    assert person_service.get_sheet3_data_by_name('Tôn Nữ Hoa', csv_id='3')['sheet3_id'] == '3'
+    assert person_service.get_sheet3_data_by_name('Tôn Nữ Hoa', father_name='Ông Lê Văn A')['sheet3_id'] == '3'
+    assert person_service.get_sheet3_data_by_name('Không Có') is None
+    assert get_sheet_store(sheet) is get_sheet_store(str(sheet))
+    assert len(count_loads) == 1
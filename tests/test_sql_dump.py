@@ -0,0 +1,174 @@
+import gzip
+import hashlib
+import json
+import sys
+
+import pytest
+
+from services.sql_dump import (
+    dump_database,
+    dump_table,
+    escape_value,
+    get_compression,
+    manifest_path,
+    open_dump_reader,
+)
+
+TABLES = {
+    'persons': (['person_id', 'full_name'], [('P-1-1', "Nguyễn Phước Tộc"), ('P-2-1', "O'Brien\nLê")]),
+    'page_views': (['id', 'path'], [(i, f'/p/{i}') for i in range(1, 8)]),
+}
+
+
+class FakeCursor:
+    def __init__(self, conn, buffered):
+        self.conn = conn
+        self.buffered = buffered
+        self.rows = []
+        self.description = None
+
+    def execute(self, sql, params=()):
+        self.conn.executed.append(sql)
+        self.rows = []
+        if sql == 'SHOW FULL TABLES':
+            self.rows = [(name, 'BASE TABLE') for name in TABLES] + [('v_family_tree', 'VIEW')]
+        elif sql.startswith('SHOW CREATE TABLE'):
+            name = sql.split('`')[1]
+            self.rows = [(name, f'CREATE TABLE `{name}` (id int)')]
+        elif sql.startswith('SHOW CREATE VIEW'):
+            self.rows = [('v_family_tree', 'CREATE VIEW `v_family_tree` AS select 1')]
+        elif sql.startswith('SHOW KEYS'):
+            name = sql.split('`')[1]
+            self.rows = [(name, 0, 'PRIMARY', 1, TABLES[name][0][0])]
+        elif sql.startswith('SELECT * FROM'):
+            assert not self.buffered
+            columns, rows = TABLES[sql.split('`')[1]]
+            self.description = [(c,) for c in columns]
+            self.rows = list(rows)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        assert self.buffered, 'dữ liệu bảng phải đọc bằng fetchmany'
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        self.conn.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+        self.fetch_sizes = []
+        self.closed = False
+
+    def cursor(self, buffered=False, dictionary=False):
+        return FakeCursor(self, buffered)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class Collector:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+def test_escape_value_covers_quotes_newlines_and_binary():
+    assert escape_value(None) == 'NULL'
+    assert escape_value(True) == '1'
+    assert escape_value("O'Brien\nLê\\") == "'O\\'Brien\\nLê\\\\'"
+    assert escape_value(b'\x00\xff') == '0x00ff'
+
+
+def test_dump_table_streams_extended_inserts_split_by_size():
+    conn = FakeConnection()
+    out = Collector()
+
+    result = dump_table(conn, 'page_views', out, fetch_rows=3, max_insert_bytes=40)
+
+    text = out.text()
+    assert 'SELECT * FROM `page_views` ORDER BY `id`' in conn.executed
+    assert conn.fetch_sizes == [3, 3, 3, 3]
+    assert text.count('INSERT INTO `page_views` (`id`, `path`) VALUES\n') > 1
+    assert [line for line in text.splitlines() if line.startswith('(')][-1] == "(7, '/p/7');"
+    assert result['rows'] == 7
+    expected = hashlib.sha256(''.join(f"({i}, '/p/{i}')\n" for i in range(1, 8)).encode()).hexdigest()
+    assert result['sha256'] == expected
+    assert f'-- Rows: 7, sha256: {expected}' in text
+
+
+def test_dump_database_writes_gzip_and_manifest(tmp_path):
+    path = tmp_path / 'tbqc_backup_20260101_000000.sql.gz'
+
+    manifest = dump_database(FakeConnection(), path, compression='gzip')
+
+    with open_dump_reader(path) as fh:
+        text = fh.read()
+    assert text.splitlines()[0] == '-- TBQC Database Backup'
+    assert "('P-2-1', 'O\\'Brien\\nLê')" in text
+    assert text.index('DROP VIEW IF EXISTS `v_family_tree`;') > text.index('`page_views`')
+    assert json.loads((tmp_path / (path.name + '.manifest.json')).read_text(encoding='utf-8')) == manifest
+    assert [(t['table'], t['rows']) for t in manifest['tables']] == [('persons', 2), ('page_views', 7)]
+    assert manifest['views'] == ['v_family_tree'] and manifest['consistency'] == 'snapshot'
+
+
+def test_parallel_dump_uses_one_connection_per_table_and_concatenates_gzip(tmp_path):
+    opened = []
+
+    def connect():
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    serial = dump_database(FakeConnection(), tmp_path / 'serial.sql.gz', compression='gzip')
+    parallel = dump_database(FakeConnection(), tmp_path / 'parallel.sql.gz', compression='gzip', workers=2, connect=connect)
+
+    assert len(opened) == 2 and all(conn.closed for conn in opened)
+    assert parallel['consistency'] == 'per-table'
+    assert [t['sha256'] for t in parallel['tables']] == [t['sha256'] for t in serial['tables']]
+    text = gzip.decompress((tmp_path / 'parallel.sql.gz').read_bytes()).decode('utf-8')
+    assert text.startswith('-- TBQC Database Backup\n')
+    assert text.index('`persons`') < text.index('`page_views`') < text.index('-- View: v_family_tree')
+    assert text.rstrip().endswith('-- End of dump')
+    assert not [p for p in tmp_path.iterdir() if p.name.startswith('.dump-')]
+
+
+def test_get_compression_validates_setting(monkeypatch):
+    monkeypatch.delenv('BACKUP_COMPRESSION', raising=False)
+    assert get_compression() == 'gzip'
+    assert get_compression('off') == 'none'
+    with pytest.raises(ValueError):
+        get_compression('bzip2')
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+    with pytest.raises(ValueError):
+        get_compression('zstd')
+
+
+def test_list_backups_includes_compressed_dumps_but_not_manifests(tmp_path):
+    from scripts.backup_database import list_backups
+
+    for name in ('tbqc_backup_20260101_000000.sql', 'tbqc_backup_20260102_000000.sql.gz', 'notes.txt'):
+        (tmp_path / name).write_text('x')
+    (tmp_path / 'tbqc_backup_20260102_000000.sql.gz.manifest.json').write_text('{}')
+
+    names = {b['filename'] for b in list_backups(backup_dir=str(tmp_path))}
+
+    assert names == {'tbqc_backup_20260101_000000.sql', 'tbqc_backup_20260102_000000.sql.gz'}
+    assert manifest_path('a.sql.gz') == 'a.sql.gz.manifest.json'
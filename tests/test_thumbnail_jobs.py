@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import Future
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import os
+
+import pytest
+from PIL import Image
+
+from services import thumbnail_jobs
+
+
+def _make_image(path: Path, size=(1200, 900)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size, color=(200, 120, 80)).save(path, format="JPEG", quality=90)
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted.append((fn, args, kwargs))
+        return Future()
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    base = tmp_path / "static" / "images"
+    monkeypatch.setattr("utils.image_thumbnails.get_images_base_dir", lambda: base)
+    monkeypatch.setattr(thumbnail_jobs, "get_images_base_dir", lambda: base)
+    monkeypatch.setattr(thumbnail_jobs, "_pending", {})
+    monkeypatch.setattr(thumbnail_jobs, "_failed", {})
+    monkeypatch.setattr(thumbnail_jobs, "_stats", {"queued": 0, "done": 0, "failed": 0})
+    monkeypatch.setattr(thumbnail_jobs, "_executor", None)
+    return base
+
+
+def test_listing_returns_original_until_background_job_finishes(images, monkeypatch):
+    fake = FakeExecutor()
+    monkeypatch.setattr(thumbnail_jobs, "_get_executor", lambda: fake)
+    original = images / "album_7" / "sample.jpg"
+    _make_image(original)
+
+    first = thumbnail_jobs.thumbnail_url_or_enqueue("/static/images/album_7/sample.jpg", source_path=str(original))
+    again = thumbnail_jobs.thumbnail_url_or_enqueue("/static/images/album_7/sample.jpg", source_path=str(original))
+
+    assert first == again == "/static/images/album_7/sample.jpg"
+    assert len(fake.submitted) == 1
+    fn, args, kwargs = fake.submitted[0]
+    assert fn(*args, **kwargs) is True
+    assert thumbnail_jobs.thumbnail_url_or_enqueue("/static/images/album_7/sample.jpg", source_path=str(original)) == (
+        "/static/images/_thumbs/album_7/sample.webp"
+    )
+
+
+def test_process_pool_generates_thumbnail(images, monkeypatch):
+    monkeypatch.setattr(thumbnail_jobs, "THUMBNAIL_WORKERS", 1)
+    original = images / "graves" / "mo.png"
+    _make_image(original, size=(2000, 1000))
+
+    try:
+        url, future = thumbnail_jobs.enqueue_thumbnail("/static/images/graves/mo.png", source_path=str(original))
+        assert future.result(timeout=60) is True
+    finally:
+        if thumbnail_jobs._executor is not None:
+            thumbnail_jobs._executor.shutdown(wait=True)
+
+    thumb = images / "_thumbs" / "graves" / "mo.webp"
+    assert url == "/static/images/_thumbs/graves/mo.webp"
+    with Image.open(thumb) as img:
+        assert img.size == (640, 320)
+    assert not list(thumb.parent.glob("*.tmp"))
+    assert thumbnail_jobs.thumbnail_status()["done"] == 1
+
+
+def test_backfill_queues_only_missing_thumbnails(images, monkeypatch):
+    monkeypatch.setattr(thumbnail_jobs, "THUMBNAIL_WORKERS", 0)
+    _make_image(images / "a.jpg")
+    _make_image(images / "album_1" / "b.jpeg")
+    (images / "notes.txt").write_text("x")
+    assert thumbnail_jobs.backfill_thumbnails() == {
+        "scanned": 2, "existing": 0, "queued": 2, "skipped": 0, "derivatives_queued": 2,
+    }
+
+    _make_image(images / "album_1" / "c.webp")
+    result = thumbnail_jobs.backfill_thumbnails()
+
+    assert result == {"scanned": 3, "existing": 2, "queued": 1, "skipped": 0, "derivatives_queued": 1}
+    assert (images / "_thumbs" / "album_1" / "c.webp").exists()
+    assert (images / "_thumbs" / "album_1" / "c.srcset.json").exists()
+    assert thumbnail_jobs.thumbnail_status()["pending"] == 0
+
+
+def test_album_listing_persists_thumbnail_metadata_only_once_ready(images, monkeypatch):
+    from services.gallery_service import _hydrate_album_image_thumbnail
+
+    fake = FakeExecutor()
+    monkeypatch.setattr(thumbnail_jobs, "_get_executor", lambda: fake)
+    original = images / "album_3" / "x.jpg"
+    _make_image(original)
+    row = {"image_id": 9, "url": "/static/images/album_3/x.jpg", "filepath": str(original),
+           "thumbnail_url": None, "thumbnail_filepath": None}
+    cursor = MagicMock()
+
+    pending = _hydrate_album_image_thumbnail(cursor, dict(row))
+
+    assert pending["thumbnail_url"] == row["url"]
+    cursor.execute.assert_not_called()
+
+    fn, args, kwargs = fake.submitted[0]
+    fn(*args, **kwargs)
+    ready = _hydrate_album_image_thumbnail(cursor, dict(row))
+
+    assert ready["thumbnail_url"] == "/static/images/_thumbs/album_3/x.webp"
+    assert cursor.execute.call_args[0][1] == (
+        ready["thumbnail_url"], str(images / "_thumbs" / "album_3" / "x.webp"), 9,
+    )
+
+
+def test_derivative_ladder_never_upscales_and_builds_srcset(images):
+    from utils.image_thumbnails import ensure_derivatives_file, get_image_srcset
+    from utils.validation import validate_filename
+
+    original = images / "album_2" / "wide.jpg"
+    _make_image(original, size=(1200, 600))
+
+    manifest = ensure_derivatives_file(original, relative_path="album_2/wide.jpg")
+
+    thumbs = images / "_thumbs" / "album_2"
+    assert sorted(p.name for p in thumbs.iterdir()) == [
+        "wide.srcset.json", "wide@1024w.webp", "wide@160w.webp", "wide@480w.webp",
+    ]
+    with Image.open(thumbs / "wide@480w.webp") as img:
+        assert img.size == (480, 240)
+    assert (manifest["width"], manifest["height"]) == (1200, 600)
+
+    data = get_image_srcset("/static/images/album_2/wide.jpg")
+    assert data["src"] == "/static/images/_thumbs/album_2/wide@1024w.webp"
+    assert data["srcset"] == (
+        "/static/images/_thumbs/album_2/wide@160w.webp 160w, "
+        "/static/images/_thumbs/album_2/wide@480w.webp 480w, "
+        "/static/images/_thumbs/album_2/wide@1024w.webp 1024w, "
+        "/static/images/album_2/wide.jpg 1200w"
+    )
+    assert [s["type"] for s in data["sources"]] == ["image/webp"]
+    # URL các bậc phải qua được validate_filename của route /static/images/<path>
+    assert validate_filename("_thumbs/album_2/wide@480w.webp") == "_thumbs/album_2/wide@480w.webp"
+
+
+def test_srcset_is_none_until_generated_and_removed_with_the_image(images, monkeypatch):
+    from utils.image_thumbnails import remove_image_derivatives
+
+    fake = FakeExecutor()
+    monkeypatch.setattr(thumbnail_jobs, "_get_executor", lambda: fake)
+    original = images / "graves" / "m.jpg"
+    _make_image(original)
+
+    assert thumbnail_jobs.image_srcset_or_enqueue("/static/images/graves/m.jpg") is None
+    assert thumbnail_jobs.image_srcset_or_enqueue("/static/images/graves/m.jpg") is None
+    assert len(fake.submitted) == 1
+    fn, args, kwargs = fake.submitted[0]
+    fn(*args, **kwargs)
+    thumbnail_jobs.enqueue_thumbnail("/static/images/graves/m.jpg")
+    fn, args, kwargs = fake.submitted[1]
+    fn(*args, **kwargs)
+
+    assert thumbnail_jobs.image_srcset_or_enqueue("/static/images/graves/m.jpg")["width"] == 1200
+
+    # thumbnail + 3 bậc (160/480/1024, ảnh gốc 1200px) + manifest
+    assert remove_image_derivatives("graves/m.jpg", source_path=str(original)) == 5
+    assert not list((images / "_thumbs" / "graves").iterdir())
+
+
+def test_failed_job_is_not_requeued_until_source_changes(images, monkeypatch):
+    monkeypatch.setattr(thumbnail_jobs, "THUMBNAIL_WORKERS", 0)
+    original = images / "album_5" / "hong.jpg"
+    original.parent.mkdir(parents=True)
+    original.write_bytes(b"khong phai anh")
+
+    url, future = thumbnail_jobs.enqueue_thumbnail("album_5/hong.jpg", source_path=str(original))
+    assert url is not None and future.result() is False
+    assert thumbnail_jobs.enqueue_derivatives("album_5/hong.jpg", source_path=str(original)).result() is None
+
+    # Ảnh gốc chưa đổi: không decode lại ở mỗi lần listing
+    assert thumbnail_jobs.enqueue_thumbnail("album_5/hong.jpg", source_path=str(original)) == (None, None)
+    assert thumbnail_jobs.enqueue_derivatives("album_5/hong.jpg", source_path=str(original)) is None
+    status = thumbnail_jobs.thumbnail_status()
+    assert (status["queued"], status["failed"], status["known_failures"]) == (2, 2, 2)
+
+    _make_image(original)
+    os.utime(original, ns=(original.stat().st_atime_ns, original.stat().st_mtime_ns + 10**9))
+    url, future = thumbnail_jobs.enqueue_thumbnail("album_5/hong.jpg", source_path=str(original))
+
+    assert future.result() is True
+    assert thumbnail_jobs.thumbnail_status()["known_failures"] == 1
+
+
+def test_failed_save_leaves_no_partial_file(images, monkeypatch):
+    from utils.image_thumbnails import ensure_derivatives_file, ensure_thumbnail_file
+
+    original = images / "album_6" / "a.jpg"
+    _make_image(original)
+
+    def partial_save(self, fp, *args, **kwargs):
+        Path(fp).write_bytes(b"RIFF")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Image.Image, "save", partial_save)
+
+    assert ensure_thumbnail_file(original, relative_path="album_6/a.jpg") is False
+    assert ensure_derivatives_file(original, relative_path="album_6/a.jpg") is None
+    assert [p.name for p in (images / "_thumbs").rglob("*") if p.is_file()] == []
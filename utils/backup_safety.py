@@ -12,8 +12,9 @@ from typing import Optional
 from werkzeug.utils import secure_filename
 
 
-# Đúng định dạng mà `create_backup()` sinh ra: tbqc_backup_YYYYMMDD_HHMMSS.sql
-BACKUP_NAME_RE = re.compile(r"^tbqc_backup_\d{8}_\d{6}\.sql$")
+# Đúng định dạng mà `create_backup()` sinh ra: tbqc_backup_YYYYMMDD_HHMMSS.sql,
+# file tăng dần thêm `_incNNN`, dump Python nén thêm `.gz` / `.zst`
+BACKUP_NAME_RE = re.compile(r"^tbqc_backup_\d{8}_\d{6}(_inc\d{3})?\.sql(\.gz|\.zst)?$")
 
 
 def resolve_safe_backup_path(filename, backups_dir: str) -> Optional[str]:
@@ -23,7 +24,7 @@ def resolve_safe_backup_path(filename, backups_dir: str) -> Optional[str]:
 
     Các lớp bảo vệ:
       1. Type check: phải là chuỗi không rỗng.
-      2. Allowlist regex: chỉ tên backup chuẩn `tbqc_backup_*.sql`.
+      2. Allowlist regex: chỉ tên backup chuẩn `tbqc_backup_*.sql[.gz|.zst]`.
       3. `secure_filename` tương đương (phòng homoglyph / ký tự đặc biệt).
       4. `os.path.realpath` + `os.path.commonpath` để chặn symlink / absolute-path
          injection / `..` dù đã bị loại bởi regex.
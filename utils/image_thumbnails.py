@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import json
 import logging
 import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 from utils.validation import validate_filename
@@ -16,6 +19,25 @@ THUMB_QUALITY = 80
 THUMB_SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
 
 
+def _env_list(name: str, default: str) -> list[str]:
+    return [item.strip().lower() for item in os.environ.get(name, default).split(",") if item.strip()]
+
+
+# Bậc ảnh responsive (bề rộng px) cho srcset; không bao giờ phóng to quá ảnh gốc
+DERIVATIVE_WIDTHS = tuple(sorted({int(w) for w in _env_list("IMAGE_DERIVATIVE_WIDTHS", "160,480,1024,2048") if w.isdigit()}))
+# webp luôn có; avif chỉ sinh khi Pillow build có codec AVIF
+DERIVATIVE_FORMATS = tuple(f for f in _env_list("IMAGE_DERIVATIVE_FORMATS", "webp") if f in ("webp", "avif")) or ("webp",)
+DERIVATIVE_QUALITY = {"webp": 80, "avif": 55}
+DERIVATIVE_MIME = {"webp": "image/webp", "avif": "image/avif"}
+# Bậc dùng làm `src` mặc định (trình duyệt không hiểu srcset / chưa biết kích thước hiển thị)
+DERIVATIVE_DEFAULT_WIDTH = 1024
+# Manifest đã parse cho get_image_srcset, LRU theo đường dẫn manifest (kèm mtime để biết file đổi)
+SRCSET_MANIFEST_CACHE_SIZE = 4096
+
+_manifest_lock = threading.Lock()
+_manifest_cache: OrderedDict[str, tuple[int, dict]] = OrderedDict()
+
+
 def get_images_base_dir() -> Path:
     volume_mount_path = os.environ.get("RAILWAY_VOLUME_MOUNT_PATH")
     if volume_mount_path and os.path.exists(volume_mount_path):
@@ -92,6 +114,19 @@ def ensure_thumbnail_for_image(image_ref: str | None, *, source_path: str | None
     return None, None
 
 
+def thumbnail_target(image_ref: str | None, *, source_path: str | None = None) -> tuple[Path, str, str, Path] | None:
+    """(ảnh gốc, đường dẫn tương đối, URL thumbnail, file thumbnail) hoặc None nếu ảnh không tạo được thumbnail."""
+    rel_path = _normalize_relative_path(image_ref)
+    if not rel_path or rel_path.startswith(f"{THUMB_ROOT}/"):
+        return None
+    if Path(rel_path).suffix.lower() not in THUMB_SUPPORTED_EXTENSIONS:
+        return None
+    base_dir = _resolve_base_dir(source_path=source_path, relative_path=rel_path)
+    thumb_rel_path = _thumbnail_relative_path(rel_path)
+    original_path = Path(source_path) if source_path else base_dir / Path(rel_path)
+    return original_path, rel_path, f"{STATIC_IMAGE_PREFIX}{thumb_rel_path}", base_dir / Path(thumb_rel_path)
+
+
 def ensure_thumbnail_file(original_path: str | Path, *, relative_path: str | None = None) -> bool:
     original_path = Path(original_path)
     if not original_path.exists() or not original_path.is_file():
@@ -121,18 +156,218 @@ def ensure_thumbnail_file(original_path: str | Path, *, relative_path: str | Non
             elif img.mode == "L":
                 img = img.convert("RGB")
             img.thumbnail((THUMB_MAX_EDGE, THUMB_MAX_EDGE))
-            img.save(thumb_path, format="WEBP", quality=THUMB_QUALITY, method=6)
+            # Ghi file tạm rồi rename: request khác thấy thumbnail là thấy file hoàn chỉnh
+            _write_atomic(thumb_path, lambda tmp: img.save(tmp, format="WEBP", quality=THUMB_QUALITY, method=6))
         return True
     except Exception as exc:
         logger.warning("Could not generate thumbnail for %s: %s", original_path, exc)
         return False
 
 
+def derivative_target(image_ref: str | None, *, source_path: str | None = None) -> tuple[Path, str, Path] | None:
+    """(ảnh gốc, đường dẫn tương đối, file manifest các bậc) hoặc None nếu ảnh không tạo bậc được."""
+    target = thumbnail_target(image_ref, source_path=source_path)
+    if target is None:
+        return None
+    original_path, rel_path = target[:2]
+    base_dir = _resolve_base_dir(source_path=source_path, relative_path=rel_path)
+    return original_path, rel_path, base_dir / Path(_manifest_relative_path(rel_path))
+
+
+def image_etag_path(image_ref: str | None, *, source_path: str | None = None) -> Path | None:
+    """File lưu ETag (hash nội dung) của ảnh gốc: `_thumbs/<ảnh>.etag`; None nếu ảnh không hỗ trợ."""
+    target = thumbnail_target(image_ref, source_path=source_path)
+    if target is None:
+        return None
+    rel_path = target[1]
+    base_dir = _resolve_base_dir(source_path=source_path, relative_path=rel_path)
+    return base_dir / Path(_etag_relative_path(rel_path))
+
+
+def read_derivative_manifest(manifest_path: str | Path) -> dict | None:
+    try:
+        return json.loads(Path(manifest_path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_derivatives_file(
+    original_path: str | Path,
+    *,
+    relative_path: str | None = None,
+    widths: tuple[int, ...] | None = None,
+    formats: tuple[str, ...] | None = None,
+) -> dict | None:
+    """
+    Sinh các bậc DERIVATIVE_WIDTHS x DERIVATIVE_FORMATS cho một ảnh (decode một lần, thu nhỏ dần
+    từ bậc lớn xuống) rồi ghi manifest `_thumbs/<ảnh>.srcset.json`. Manifest ghi sau cùng, nên có
+    manifest là có đủ file. Trả manifest, hoặc None nếu ảnh không xử lý được.
+    """
+    original_path = Path(original_path)
+    if not original_path.is_file() or original_path.suffix.lower() not in THUMB_SUPPORTED_EXTENSIONS:
+        return None
+
+    try:
+        rel_path = relative_path or str(original_path.relative_to(get_images_base_dir())).replace("\\", "/")
+        rel_path = _normalize_relative_path(rel_path)
+        if not rel_path or rel_path.startswith(f"{THUMB_ROOT}/"):
+            return None
+        base_dir = _resolve_base_dir(source_path=str(original_path), relative_path=rel_path)
+        manifest_path = base_dir / Path(_manifest_relative_path(rel_path))
+        source_mtime = int(original_path.stat().st_mtime)
+        existing = read_derivative_manifest(manifest_path)
+        if existing and existing.get("source_mtime") == source_mtime:
+            return existing
+
+        from PIL import Image, ImageOps, features
+
+        formats = [f for f in (formats or DERIVATIVE_FORMATS) if f == "webp" or features.check(f)]
+        derivatives = []
+        with Image.open(original_path) as img:
+            img = ImageOps.exif_transpose(img)
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            img = img.convert("RGBA" if has_alpha else "RGB")
+            width, height = img.size
+            current = img
+            for w in sorted({w for w in (widths or DERIVATIVE_WIDTHS) if w < width}, reverse=True):
+                h = max(1, round(height * w / width))
+                current = current.resize((w, h), Image.LANCZOS)
+                for fmt in formats:
+                    rel = _derivative_relative_path(rel_path, w, fmt)
+                    out_path = base_dir / Path(rel)
+                    out_path.parent.mkdir(parents=True, exist_ok=True)
+                    options = {"method": 4} if fmt == "webp" else {}
+                    _write_atomic(
+                        out_path,
+                        lambda tmp: current.save(tmp, format=fmt.upper(), quality=DERIVATIVE_QUALITY[fmt], **options),
+                    )
+                    derivatives.append({"width": w, "height": h, "format": fmt, "url": f"{STATIC_IMAGE_PREFIX}{rel}"})
+
+        manifest = {
+            "source": f"{STATIC_IMAGE_PREFIX}{rel_path}",
+            "source_mtime": source_mtime,
+            "width": width,
+            "height": height,
+            "formats": formats,
+            "derivatives": sorted(derivatives, key=lambda d: (d["format"], d["width"])),
+        }
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomic(manifest_path, lambda tmp: tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8"))
+        return manifest
+    except Exception as exc:
+        logger.warning("Could not generate derivatives for %s: %s", original_path, exc)
+        return None
+
+
+def _cached_manifest(manifest_path: Path) -> dict | None:
+    """read_derivative_manifest có cache theo (đường dẫn, mtime): listing không đọc + parse JSON mỗi ảnh mỗi request."""
+    key = str(manifest_path)
+    try:
+        mtime = manifest_path.stat().st_mtime_ns
+    except OSError:
+        with _manifest_lock:
+            _manifest_cache.pop(key, None)
+        return None
+    with _manifest_lock:
+        entry = _manifest_cache.get(key)
+        if entry is not None and entry[0] == mtime:
+            _manifest_cache.move_to_end(key)
+            return entry[1]
+    manifest = read_derivative_manifest(manifest_path)
+    if manifest is None:
+        return None
+    with _manifest_lock:
+        _manifest_cache[key] = (mtime, manifest)
+        _manifest_cache.move_to_end(key)
+        while len(_manifest_cache) > SRCSET_MANIFEST_CACHE_SIZE:
+            _manifest_cache.popitem(last=False)
+    return manifest
+
+
+def get_image_srcset(image_ref: str | None, *, source_path: str | None = None, manifest: dict | None = None) -> dict | None:
+    """
+    Dữ liệu responsive image cho template / JSON, đọc từ manifest các bậc:
+      {"src": bậc ~1024px, "srcset": "<url> 160w, ..., <gốc> <W>w", "width", "height",
+       "sources": [{"type": "image/avif", "srcset": ...}, {"type": "image/webp", "srcset": ...}]}
+    None nếu ảnh chưa có manifest (chưa sinh xong / ảnh ngoài) — caller dùng URL gốc.
+    """
+    if manifest is None:
+        target = derivative_target(image_ref, source_path=source_path)
+        if target is None:
+            return None
+        manifest = _cached_manifest(target[2])
+        if manifest is None:
+            return None
+
+    original = f"{manifest['source']} {manifest['width']}w"
+    sources = []
+    for fmt in sorted(manifest.get("formats") or [], key=lambda f: f != "avif"):
+        entries = [f"{d['url']} {d['width']}w" for d in manifest["derivatives"] if d["format"] == fmt]
+        sources.append({"type": DERIVATIVE_MIME.get(fmt, f"image/{fmt}"), "srcset": ", ".join(entries + [original])})
+    webp = [d for d in manifest["derivatives"] if d["format"] == "webp"]
+    default = max((d for d in webp if d["width"] <= DERIVATIVE_DEFAULT_WIDTH), key=lambda d: d["width"], default=None)
+    return {
+        "src": default["url"] if default else manifest["source"],
+        "srcset": ", ".join([f"{d['url']} {d['width']}w" for d in webp] + [original]),
+        "sources": sources,
+        "width": manifest["width"],
+        "height": manifest["height"],
+    }
+
+
+def remove_image_derivatives(image_ref: str | None, *, source_path: str | None = None) -> int:
+    """Xoá thumbnail, các bậc, manifest và ETag của một ảnh (khi xoá ảnh gốc). Trả số file đã xoá."""
+    target = derivative_target(image_ref, source_path=source_path)
+    if target is None:
+        return 0
+    _, rel_path, manifest_path = target
+    base_dir = _resolve_base_dir(source_path=source_path, relative_path=rel_path)
+    manifest = read_derivative_manifest(manifest_path) or {"derivatives": []}
+    paths = [base_dir / Path(_thumbnail_relative_path(rel_path)), manifest_path, base_dir / Path(_etag_relative_path(rel_path))]
+    paths += [base_dir / Path(d["url"][len(STATIC_IMAGE_PREFIX):]) for d in manifest["derivatives"]]
+    removed = 0
+    for path in paths:
+        try:
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.warning("Could not remove image derivative %s: %s", path, exc)
+    return removed
+
+
+def _derivative_relative_path(relative_path: str, width: int, fmt: str) -> str:
+    path = Path(relative_path)
+    return f"{THUMB_ROOT}/{path.with_name(f'{path.stem}@{width}w.{fmt}').as_posix()}"
+
+
+def _manifest_relative_path(relative_path: str) -> str:
+    path = Path(relative_path)
+    return f"{THUMB_ROOT}/{path.with_name(f'{path.stem}.srcset.json').as_posix()}"
+
+
+def _etag_relative_path(relative_path: str) -> str:
+    path = Path(relative_path)
+    return f"{THUMB_ROOT}/{path.with_name(f'{path.name}.etag').as_posix()}"
+
+
 def _thumbnail_relative_path(relative_path: str) -> str:
     path = Path(relative_path)
     return f"{THUMB_ROOT}/{path.with_suffix('.webp').as_posix()}"
 
 
+def _write_atomic(target: Path, write) -> None:
+    """Ghi qua file tạm rồi rename; ghi lỗi giữa chừng thì xoá file tạm, không để rác `.tmp` trong _thumbs."""
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, target)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
 def _resolve_base_dir(*, source_path: str | None, relative_path: str) -> Path:
     if source_path:
         source = Path(source_path).resolve()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Parse JSON tăng dần: lấy từng phần tử của một mảng mà không cần giữ cả body trong bộ nhớ.
+
+Dùng cho payload lớn đọc qua requests `iter_content()`: mỗi phần tử được decode ngay khi đủ byte,
+buffer chỉ giữ phần chưa parse. Hỗ trợ mảng top-level (`[...]`) hoặc mảng nằm trong một key của
+object top-level (`{"success": true, "data": [...]}`); các key khác của object được giữ ở `meta`.
+"""
+from __future__ import annotations
+
+import codecs
+import json
+from typing import Iterable, Iterator
+
+_WHITESPACE = " \t\r\n"
+# Buffer được cắt bỏ phần đã parse khi vượt ngưỡng này (ký tự)
+_COMPACT_AT = 1 << 16
+
+
+class JSONStreamError(ValueError):
+    """Payload không phải JSON hợp lệ / không có mảng mong đợi."""
+
+
+class _Reader:
+    def __init__(self, chunks: Iterable[bytes | str]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Đọc thêm một chunk vào buffer; False nếu đã hết dữ liệu."""
+        if self.eof:
+            return False
+        try:
+            for chunk in self._chunks:
+                if isinstance(chunk, bytes):
+                    chunk = self._utf8.decode(chunk)
+                if not chunk:
+                    continue
+                if self.pos > _COMPACT_AT:
+                    self.buf = self.buf[self.pos:]
+                    self.pos = 0
+                self.buf += chunk
+                return True
+            tail = self._utf8.decode(b"", final=True)
+        except UnicodeDecodeError as exc:
+            raise JSONStreamError(f"Payload không phải UTF-8: {exc}") from exc
+        self.eof = True
+        self.buf += tail
+        return bool(tail)
+
+    def peek(self) -> str | None:
+        """Ký tự kế tiếp khác khoảng trắng (không tiêu thụ); None khi hết dữ liệu."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def take(self, expected: str) -> None:
+        if self.peek() != expected:
+            raise JSONStreamError(f"Cần '{expected}' tại vị trí {self.pos}, gặp {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode một giá trị JSON hoàn chỉnh bắt đầu tại vị trí hiện tại."""
+        if self.peek() is None:
+            raise JSONStreamError("Payload kết thúc giữa chừng")
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as exc:
+                if self._fill():
+                    continue
+                raise JSONStreamError(f"JSON không hợp lệ: {exc}") from exc
+            # Số / literal sát cuối buffer có thể còn tiếp ở chunk sau ("12" | "3")
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+class JSONArrayStream:
+    """
+    Iterator qua các phần tử của mảng JSON trong `chunks`.
+
+        stream = JSONArrayStream(response.iter_content(65536), array_keys=("data", "members"))
+        for item in stream: ...
+        stream.array_key  # None nếu mảng ở top-level, ngược lại là key chứa mảng
+        stream.meta       # các key khác của object top-level (đủ sau khi duyệt hết)
+    """
+
+    def __init__(self, chunks: Iterable[bytes | str], array_keys: tuple[str, ...] = ()):
+        self._reader = _Reader(chunks)
+        self.array_keys = tuple(array_keys)
+        self.array_key: str | None = None
+        self.meta: dict = {}
+
+    def __iter__(self) -> Iterator:
+        reader = self._reader
+        first = reader.peek()
+        if first == "[":
+            yield from self._array()
+            return
+        if first != "{":
+            raise JSONStreamError(f"Cần mảng hoặc object JSON, gặp {first!r}")
+        reader.take("{")
+        found = False
+        if reader.peek() == "}":
+            reader.take("}")
+        else:
+            while True:
+                key = reader.value()
+                if not isinstance(key, str):
+                    raise JSONStreamError("Key của object phải là chuỗi")
+                reader.take(":")
+                if not found and key in self.array_keys and reader.peek() == "[":
+                    found = True
+                    self.array_key = key
+                    yield from self._array()
+                else:
+                    self.meta[key] = reader.value()
+                sep = reader.peek()
+                reader.take(sep if sep in (",", "}") else ",")
+                if sep == "}":
+                    break
+        if not found:
+            raise JSONStreamError(f"Object không có mảng ở key nào trong {list(self.array_keys)}")
+
+    def _array(self) -> Iterator:
+        reader = self._reader
+        reader.take("[")
+        if reader.peek() == "]":
+            reader.take("]")
+            return
+        while True:
+            yield reader.value()
+            sep = reader.peek()
+            reader.take(sep if sep in (",", "]") else ",")
+            if sep == "]":
+                return
@@ -21,7 +21,8 @@ def validate_filename(filename: str) -> str:
     for component in path_components:
         if not component or component == "." or component == "..":
             raise ValueError("Invalid filename: invalid path component")
-        if not re.match(r"^[\w\s.-]+$", component, re.UNICODE):
+        # "@" cho tên các bậc ảnh responsive (_thumbs/<ảnh>@<w>w.webp)
+        if not re.match(r"^[\w\s.@-]+$", component, re.UNICODE):
             raise ValueError(
                 f"Invalid filename: contains invalid characters in component '{component}'"
             )